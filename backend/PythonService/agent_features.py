@@ -1,5 +1,4 @@
 ﻿import re
-import requests
 from typing import Dict, List, Optional
 from datetime import datetime, timedelta
 try:
@@ -8,6 +7,15 @@ except ImportError:
     from school_scraper import get_scraper
     TVUScraper = None
 from school_credentials_encryption import decrypt_credentials
+from tvu_session_pool import create_session_pool, TVULoginError
+from timetable_cache import create_timetable_cache, SemesterTimetable
+from credential_cache import create_credential_cache
+from schedule_sync import ScheduleSyncClient, diff_schedules
+from calendar_sync import build_class_series, sync_summary, time_range
+from token_cache import get_token_cache
+from intent_router import route as route_intents
+from http_client import http
+import hashlib
 import logging
 
 logging.basicConfig(level=logging.INFO)
@@ -35,6 +43,58 @@ except ImportError:
 class AgentFeatures:
     def __init__(self, spring_boot_url: str = "http://localhost:8080"):
         self.spring_boot_url = spring_boot_url
+        # Session TVU đã đăng nhập, dùng lại giữa các request
+        self.tvu_sessions = create_session_pool(self._new_tvu_scraper)
+        # TKB cả học kỳ theo (username, hoc_ky), chia theo tuần / thứ
+        self.timetables = create_timetable_cache()
+        # Credentials theo user: purpose -> credential id, bản giải mã giữ dạng ciphertext
+        self.credentials = create_credential_cache({"tvu": self._is_tvu_credential})
+        # Ghi TKB vào Spring Boot theo diff (bulk, song song có giới hạn)
+        self.schedule_sync = ScheduleSyncClient(spring_boot_url)
+    
+    @staticmethod
+    def _new_tvu_scraper():
+        if TVUScraper:
+            return TVUScraper()
+        return get_scraper("https://ttsv.tvu.edu.vn")
+    
+    def _timetable_loader(self, school_username: str, school_password: str, hoc_ky: str = None):
+        """Hàm load TKB cả học kỳ từ portal (qua session pool) cho TimetableCache"""
+        def load() -> Optional[SemesterTimetable]:
+            weeks = self.tvu_sessions.run(
+                school_username, school_password,
+                lambda scraper: scraper.get_semester_schedule(hoc_ky=hoc_ky) if hasattr(scraper, 'get_semester_schedule') else None
+            )
+            return SemesterTimetable(hoc_ky, weeks) if weeks is not None else None
+        return load
+    
+    def _get_timetable(self, school_username: str, school_password: str, hoc_ky: str = None, force_sync: bool = False) -> Optional[SemesterTimetable]:
+        """
+        TKB cả học kỳ từ cache (load từ portal khi chưa có / force_sync)
+        
+        Returns None nếu portal không trả về dạng chia theo tuần - caller lấy theo tuần như cũ
+        
+        Raises:
+            TVULoginError: không đăng nhập được portal
+        """
+        if force_sync:
+            self.timetables.invalidate(school_username)
+        
+        return self.timetables.get((school_username, hoc_ky), self._timetable_loader(school_username, school_password, hoc_ky))
+    
+    def refresh_timetable(self, school_username: str, school_password: str, hoc_ky: str = None) -> tuple:
+        """
+        Load lại TKB cả học kỳ từ portal vào cache (dùng cho prefetch nền)
+        
+        Returns:
+            (TKB trước đó trong cache hoặc None, TKB mới hoặc None nếu portal không trả dạng chia tuần)
+        
+        Raises:
+            TVULoginError: không đăng nhập được portal
+        """
+        key = (school_username, hoc_ky)
+        previous = self.timetables.peek(key)
+        return previous, self.timetables.refresh(key, self._timetable_loader(school_username, school_password, hoc_ky))
     
     def extract_specific_date(self, message: str) -> Optional[datetime]:
         """
@@ -105,6 +165,53 @@ class AgentFeatures:
         
         return None
     
+    def _semester_start(self, target_date: datetime, hoc_ky: str = None) -> tuple:
+        """(ngày bắt đầu học kỳ, số tuần của ngày đó) - theo hoc_ky nếu có, không thì theo target_date"""
+        # Determine semester start date
+        target_month = target_date.month
+        target_year = target_date.year
+        
+        if hoc_ky:
+            # Parse hoc_ky format: "20251" = năm 2025, HK1
+            year = int(hoc_ky[:4])
+            hk = int(hoc_ky[4])
+            
+            if hk == 1:
+                # HK1: bắt đầu từ tháng 9
+                hk_start = datetime(year, 9, 1)
+                base_week = 5
+            elif hk == 2:
+                # HK2: bắt đầu từ tháng 2 (năm sau)
+                hk_start = datetime(year + 1, 2, 1)
+                base_week = 1
+            else:
+                # HK3 (hè): bắt đầu từ tháng 6
+                hk_start = datetime(year + 1, 6, 1)
+                base_week = 1
+        else:
+            # Auto-detect based on target date
+            if 8 <= target_month <= 12:
+                # HK1: bắt đầu từ tháng 9
+                hk_start = datetime(target_year, 9, 1)
+                base_week = 5
+            elif 1 <= target_month <= 5:
+                # HK2: bắt đầu từ tháng 2
+                hk_start = datetime(target_year, 2, 1)
+                base_week = 1
+            else:
+                # HK3 (hè): bắt đầu từ tháng 6
+                hk_start = datetime(target_year, 6, 1)
+                base_week = 1
+        
+        return hk_start, base_week
+    
+    def date_for_week_day(self, week: int, day_of_week: str, hoc_ky: str = None) -> datetime:
+        """Ngày của thứ day_of_week trong tuần học `week` (ngược lại với calculate_week_from_date)"""
+        day_index = ['MONDAY', 'TUESDAY', 'WEDNESDAY', 'THURSDAY', 'FRIDAY', 'SATURDAY', 'SUNDAY'].index(day_of_week)
+        hk_start, base_week = self._semester_start(datetime.now(), hoc_ky)
+        week_begin = hk_start + timedelta(days=(week - base_week) * 7)
+        return week_begin + timedelta(days=(day_index - week_begin.weekday()) % 7)
+    
     def calculate_week_from_date(self, target_date: datetime, hoc_ky: str = None) -> int:
         """
         Calculate week number from a specific date based on semester start date.
@@ -117,41 +224,7 @@ class AgentFeatures:
         Returns: Week number (1-20+)
         """
         try:
-            # Determine semester start date
-            target_month = target_date.month
-            target_year = target_date.year
-            
-            if hoc_ky:
-                # Parse hoc_ky format: "20251" = năm 2025, HK1
-                year = int(hoc_ky[:4])
-                hk = int(hoc_ky[4])
-                
-                if hk == 1:
-                    # HK1: bắt đầu từ tháng 9
-                    hk_start = datetime(year, 9, 1)
-                    base_week = 5
-                elif hk == 2:
-                    # HK2: bắt đầu từ tháng 2 (năm sau)
-                    hk_start = datetime(year + 1, 2, 1)
-                    base_week = 1
-                else:
-                    # HK3 (hè): bắt đầu từ tháng 6
-                    hk_start = datetime(year + 1, 6, 1)
-                    base_week = 1
-            else:
-                # Auto-detect based on target date
-                if 8 <= target_month <= 12:
-                    # HK1: bắt đầu từ tháng 9
-                    hk_start = datetime(target_year, 9, 1)
-                    base_week = 5
-                elif 1 <= target_month <= 5:
-                    # HK2: bắt đầu từ tháng 2
-                    hk_start = datetime(target_year, 2, 1)
-                    base_week = 1
-                else:
-                    # HK3 (hè): bắt đầu từ tháng 6
-                    hk_start = datetime(target_year, 6, 1)
-                    base_week = 1
+            hk_start, base_week = self._semester_start(target_date, hoc_ky)
             
             # Calculate week offset
             days_diff = (target_date - hk_start).days
@@ -263,213 +336,38 @@ class AgentFeatures:
     
     def detect_schedule_intent(self, message: str) -> bool:
         """Detect if user wants to see schedule"""
-        message_lower = message.lower()
-        
         # CRITICAL: Check for email address first - if contains @, likely email intent
-        if '@' in message_lower:
+        if '@' in message:
             print(f"⚠️ detect_schedule_intent: Found @ in message, likely email address - returning False")
             return False
         
-        # NEGATIVE PATTERNS - loại trừ email intent
-        negative_patterns = [
-            r'gửi\s+(?:email|mail)',
-            r'gui\s+(?:email|mail)',  # Added without diacritics
-            r'send\s+email',
-            r'soạn\s+(?:email|mail)',
-            r'viết\s+(?:email|mail)',
-            r'đọc\s+(?:email|mail)',
-            r'xem\s+(?:email|mail)',
-            r'email\s+cho',
-            r'mail\s+cho',
-            r'mail\s+den',  # Added "mail den"
-            r'email\s+den'  # Added "email den"
-        ]
-        
-        # Check negative patterns first
-        for neg_pattern in negative_patterns:
-            if re.search(neg_pattern, message_lower):
-                print(f"⚠️ detect_schedule_intent: Matched negative pattern '{neg_pattern}' - returning False")
-                return False  # Không phải intent xem lịch
-        
-        # Positive patterns for schedule
-        patterns = [
-            r'thời khóa biểu',
-            r'tkb',
-            r'lịch học',
-            r'hôm nay.*lớp',
-            r'có lớp',
-            r'schedule',
-            # Relative dates - USE WORD BOUNDARIES to avoid matching "gmail"
-            r'hôm qua',
-            r'hom qua',
-            r'\bmai\b',  # FIXED: Word boundary to avoid matching "gmail"
-            r'\bmốt\b',
-            r'\bmot\b',
-            r'\bkia\b',
-            # Specific day patterns
-            r'thứ\s*[2-7]',
-            r'chủ\s*nhật',
-            r'cn\b',
-            # Specific date patterns (DD/MM/YYYY or DD-MM-YYYY)
-            r'(?:ngày\s+)?\d{1,2}[/-]\d{1,2}[/-]\d{4}',
-            r'ngày\s+\d{1,2}/\d{1,2}',
-            # Vietnamese date format: ngày X tháng Y (supports both with and without diacritics)
-            r'(?:ngày|ngay)\s+\d{1,2}\s+(?:tháng|thang)\s+\d{1,2}'
-        ]
-        
-        return any(re.search(pattern, message_lower) for pattern in patterns)
+        intents = route_intents(message)
+        # NEGATIVE PATTERNS - loại trừ email intent (gửi / soạn / đọc email...)
+        if intents.matched("schedule_exclude"):
+            print("⚠️ detect_schedule_intent: Matched email pattern - returning False")
+            return False  # Không phải intent xem lịch
+        
+        return intents.matched("schedule")
     
     def detect_grade_intent(self, message: str) -> bool:
-        """Detect if user wants to see grades"""
-        patterns = [
-            r'điểm',
-            r'grade',
-            r'kết quả học tập',
-            r'điểm số'
-        ]
-        
-        message_lower = message.lower()
-        return any(re.search(pattern, message_lower) for pattern in patterns)
+        """Detect if user wants to see grades (pattern trong intent_router.INTENT_PATTERNS["grade"])"""
+        return route_intents(message).matched("grade")
     
     def detect_email_intent(self, message: str) -> bool:
-        """Detect if user wants to manage email (read, send, search)"""
-        patterns = [
-            # Gửi email (có dấu)
-            r'gửi email',
-            r'gửi mail',
-            r'gửi gmail',
-            # Gửi email (không dấu)
-            r'gui email',
-            r'gui mail',
-            r'gui gmail',
-            # Send email
-            r'send email',
-            r'send mail',
-            # Email/Mail cho/đến
-            r'email cho',
-            r'mail cho',
-            r'gmail cho',
-            r'email den',  # không dấu
-            r'mail den',   # không dấu
-            r'gmail den',  # không dấu
-            r'email đến',
-            r'mail đến',
-            r'gmail đến',
-            # Soạn email
-            r'soạn email',
-            r'soạn mail',
-            r'soan email',  # không dấu
-            r'soan mail',   # không dấu
-            # Viết email
-            r'viết email',
-            r'viết mail',
-            r'viet email',  # không dấu
-            r'viet mail',   # không dấu
-            # Đọc email
-            r'đọc email',
-            r'đọc mail',
-            r'doc email',   # không dấu
-            r'doc mail',    # không dấu
-            # Xem email
-            r'xem email',
-            r'xem mail',
-            # Kiểm tra email
-            r'kiểm tra email',
-            r'kiem tra email',  # không dấu
-            r'check email',
-            r'inbox',
-            r'hộp thư',
-            r'hop thu',  # không dấu
-            r'email mới',
-            r'email moi',  # không dấu
-            r'email chưa đọc',
-            r'email chua doc',  # không dấu
-            r'unread email',
-            # Tìm kiếm email
-            r'tìm email',
-            r'tìm mail',
-            r'tim email',  # không dấu
-            r'tim mail',   # không dấu
-            r'search email',
-            r'email từ',
-            r'email tu',   # không dấu
-            r'email của',
-            r'email cua',  # không dấu
-            r'mail từ',
-            r'mail tu',    # không dấu
-            r'mail của',
-            r'mail cua'    # không dấu
-        ]
-        
-        message_lower = message.lower()
-        return any(re.search(pattern, message_lower) for pattern in patterns)
+        """Detect if user wants to manage email (read, send, search) (pattern trong intent_router.INTENT_PATTERNS["email"])"""
+        return route_intents(message).matched("email")
     
     def detect_gmail_read_intent(self, message: str) -> bool:
-        """Detect if user wants to read emails"""
-        patterns = [
-            r'đọc email',
-            r'xem email',
-            r'kiểm tra email',
-            r'check email',
-            r'inbox',
-            r'hộp thư',
-            r'email mới',
-            r'email chưa đọc',
-            r'có email',
-            r'xem mail',
-            r'đọc mail'
-        ]
-        message_lower = message.lower()
-        return any(re.search(pattern, message_lower) for pattern in patterns)
+        """Detect if user wants to read emails (pattern trong intent_router.INTENT_PATTERNS["gmail_read"])"""
+        return route_intents(message).matched("gmail_read")
     
     def detect_gmail_send_intent(self, message: str) -> bool:
-        """Detect if user wants to send email"""
-        patterns = [
-            # Có dấu
-            r'gửi email',
-            r'gửi mail',
-            r'gửi gmail',
-            # Không dấu
-            r'gui email',
-            r'gui mail',
-            r'gui gmail',
-            # English
-            r'send email',
-            r'send mail',
-            # Cho/đến
-            r'email cho',
-            r'mail cho',
-            r'gmail cho',
-            r'email den',
-            r'mail den',
-            r'gmail den',
-            r'email đến',
-            r'mail đến',
-            r'gmail đến',
-            # Soạn/viết
-            r'soạn email',
-            r'soạn mail',
-            r'soan email',
-            r'soan mail',
-            r'viết email',
-            r'viết mail',
-            r'viet email',
-            r'viet mail'
-        ]
-        message_lower = message.lower()
-        return any(re.search(pattern, message_lower) for pattern in patterns)
+        """Detect if user wants to send email (pattern trong intent_router.INTENT_PATTERNS["gmail_send"])"""
+        return route_intents(message).matched("gmail_send")
     
     def detect_gmail_search_intent(self, message: str) -> bool:
-        """Detect if user wants to search emails"""
-        patterns = [
-            r'tìm email',
-            r'search email',
-            r'email từ',
-            r'email của',
-            r'tìm mail'
-        ]
-        message_lower = message.lower()
-        return any(re.search(pattern, message_lower) for pattern in patterns)
+        """Detect if user wants to search emails (pattern trong intent_router.INTENT_PATTERNS["gmail_search"])"""
+        return route_intents(message).matched("gmail_search")
     
     def get_credential_for_purpose(self, token: str, purpose_query: str) -> Optional[Dict]:
         """
@@ -479,7 +377,7 @@ class AgentFeatures:
             logger.info(f"Searching credential for purpose: {purpose_query}")
             
             # Call Python vector search API
-            response = requests.post(
+            response = http.post(
                 "http://localhost:8000/api/credentials/ai/select-credential",
                 json={
                     "user_id": 1,  # TODO: Get from token
@@ -500,7 +398,7 @@ class AgentFeatures:
             
             # Get full credential with decrypted password
             headers = {"Authorization": f"Bearer {token}"}
-            response = requests.get(
+            response = http.get(
                 f"{self.spring_boot_url}/api/credentials/{credential_id}?decrypt=true",
                 headers=headers,
                 timeout=5
@@ -517,61 +415,96 @@ class AgentFeatures:
             logger.error(f"Error getting credential: {e}")
             return None
     
+    @staticmethod
+    def _is_tvu_credential(cred: Dict) -> bool:
+        """Credential dùng cho trang sinh viên TVU (match theo tên / URL / mục đích)"""
+        service_name = (cred.get('serviceName') or '').lower()
+        service_url = (cred.get('serviceUrl') or '').lower()
+        purpose = (cred.get('purpose') or '').lower()
+        category = (cred.get('category') or '').upper()
+        
+        return (
+            'tvu' in service_name or 
+            'tvu' in service_url or 
+            'ttsv.tvu' in service_url or
+            'ttsv' in service_url or
+            # Also check if it's an EDUCATION credential with schedule purpose
+            (category == 'EDUCATION' and ('thời khóa biểu' in purpose or 'tkb' in purpose or 'lịch học' in purpose))
+        )
+    
+    def _credential_cache_key(self, token: str = None, user_id: int = None):
+        """Key cache credentials: theo user_id nếu biết (JWT đã resolve trong token cache), không thì theo token"""
+        if user_id is None and token:
+            user_id = get_token_cache().peek(token)
+        if user_id is not None:
+            return ("user", user_id)
+        return ("token", hashlib.sha256(token.encode('utf-8')).hexdigest())
+    
+    def _resolve_credential(self, cache_key, purpose: str, list_credentials, fetch_decrypted) -> Optional[Dict]:
+        """
+        Tìm credential cho purpose, dùng cache trước rồi mới gọi Spring Boot
+        
+        Args:
+            list_credentials: () -> list credentials từ Spring Boot, None nếu lỗi
+            fetch_decrypted: (credential_id) -> credential đã giải mã, None nếu lỗi
+        """
+        credential_ids = self.credentials.credential_ids(cache_key, purpose)
+        if credential_ids is None:
+            credentials_list = list_credentials()
+            if credentials_list is None:
+                return None
+            logger.info(f"Found {len(credentials_list)} credentials")
+            credential_ids = self.credentials.index(cache_key, credentials_list).get(purpose, [])
+        
+        for credential_id in credential_ids:
+            credential = self.credentials.secret(cache_key, credential_id)
+            if credential is None:
+                logger.info(f"Found {purpose} credential: {credential_id}")
+                credential = fetch_decrypted(credential_id)
+                if credential is None:
+                    continue
+                if credential.get('password'):
+                    self.credentials.store_secret(cache_key, credential_id, credential)
+            return credential
+        
+        return None
+    
     def get_tvu_credential(self, token: str) -> Optional[Dict]:
         """
-        Get TVU credential from Spring Boot database
+        Get TVU credential from Spring Boot database (cache theo user trong CREDENTIAL_CACHE_TTL giây)
         """
         try:
             headers = {"Authorization": f"Bearer {token}"}
             
-            # Try to get TVU credential
-            response = requests.get(
-                f"{self.spring_boot_url}/api/credentials",
-                headers=headers,
-                timeout=5
-            )
+            def list_credentials():
+                response = http.get(
+                    f"{self.spring_boot_url}/api/credentials",
+                    headers=headers,
+                    timeout=5
+                )
+                logger.info(f"Get credentials response: {response.status_code}")
+                return response.json() if response.status_code == 200 else None
             
-            logger.info(f"Get credentials response: {response.status_code}")
+            def fetch_decrypted(credential_id):
+                # Get full credential with decrypted password
+                cred_response = http.get(
+                    f"{self.spring_boot_url}/api/credentials/{credential_id}?decrypt=true",
+                    headers=headers,
+                    timeout=5
+                )
+                logger.info(f"Decrypt response: {cred_response.status_code}")
+                if cred_response.status_code == 200:
+                    decrypted = cred_response.json()
+                    logger.info(f"Got decrypted credential, username: {decrypted.get('username')}")
+                    return decrypted
+                return None
             
-            if response.status_code == 200:
-                credentials_list = response.json()
-                logger.info(f"Found {len(credentials_list)} credentials")
-                
-                # Find TVU credential
-                for cred in credentials_list:
-                    service_name = cred.get('serviceName', '').lower()
-                    service_url = cred.get('serviceUrl', '').lower()
-                    purpose = cred.get('purpose', '').lower()
-                    category = cred.get('category', '').upper()
-                    
-                    logger.info(f"Checking credential: {service_name}, url: {service_url}, category: {category}")
-                    
-                    # Match TVU by various patterns
-                    is_tvu = (
-                        'tvu' in service_name or 
-                        'tvu' in service_url or 
-                        'ttsv.tvu' in service_url or
-                        'ttsv' in service_url or
-                        # Also check if it's an EDUCATION credential with schedule purpose
-                        (category == 'EDUCATION' and ('thời khóa biểu' in purpose or 'tkb' in purpose or 'lịch học' in purpose))
-                    )
-                    
-                    if is_tvu:
-                        logger.info(f"Found TVU credential: {cred['id']}")
-                        # Get full credential with decrypted password
-                        cred_response = requests.get(
-                            f"{self.spring_boot_url}/api/credentials/{cred['id']}?decrypt=true",
-                            headers=headers,
-                            timeout=5
-                        )
-                        logger.info(f"Decrypt response: {cred_response.status_code}")
-                        if cred_response.status_code == 200:
-                            decrypted = cred_response.json()
-                            logger.info(f"Got decrypted credential, username: {decrypted.get('username')}")
-                            return decrypted
-            
-            logger.warning("No TVU credential found")
-            return None
+            credential = self._resolve_credential(
+                self._credential_cache_key(token=token), "tvu", list_credentials, fetch_decrypted
+            )
+            if not credential:
+                logger.warning("No TVU credential found")
+            return credential
         except Exception as e:
             logger.error(f"Error getting TVU credential: {e}")
             return None
@@ -582,49 +515,32 @@ class AgentFeatures:
         Gọi API Spring Boot với user_id
         """
         try:
-            # Gọi API lấy credentials theo user_id
-            response = requests.get(
-                f"{self.spring_boot_url}/api/credentials/user/{user_id}",
-                timeout=5
-            )
+            cache_key = self._credential_cache_key(user_id=user_id)
             
-            logger.info(f"Get credentials by user_id response: {response.status_code}")
+            def list_credentials():
+                # Gọi API lấy credentials theo user_id
+                response = http.get(
+                    f"{self.spring_boot_url}/api/credentials/user/{user_id}",
+                    timeout=5
+                )
+                logger.info(f"Get credentials by user_id response: {response.status_code}")
+                return response.json() if response.status_code == 200 else None
             
-            if response.status_code == 200:
-                credentials_list = response.json()
-                logger.info(f"Found {len(credentials_list)} credentials for user {user_id}")
-                
-                # Find TVU credential
-                for cred in credentials_list:
-                    service_name = cred.get('serviceName', '').lower()
-                    service_url = cred.get('serviceUrl', '').lower()
-                    purpose = cred.get('purpose', '').lower()
-                    category = cred.get('category', '').upper()
-                    
-                    is_tvu = (
-                        'tvu' in service_name or 
-                        'tvu' in service_url or 
-                        'ttsv.tvu' in service_url or
-                        'ttsv' in service_url or
-                        (category == 'EDUCATION' and ('thời khóa biểu' in purpose or 'tkb' in purpose or 'lịch học' in purpose))
-                    )
-                    
-                    if is_tvu:
-                        logger.info(f"Found TVU credential: {cred['id']}")
-                        # Get decrypted password
-                        cred_response = requests.get(
-                            f"{self.spring_boot_url}/api/credentials/{cred['id']}/decrypt",
-                            timeout=5
-                        )
-                        if cred_response.status_code == 200:
-                            decrypted = cred_response.json()
-                            return decrypted
-                        else:
-                            # Return credential without decryption if API not available
-                            return cred
+            def fetch_decrypted(credential_id):
+                # Get decrypted password
+                cred_response = http.get(
+                    f"{self.spring_boot_url}/api/credentials/{credential_id}/decrypt",
+                    timeout=5
+                )
+                if cred_response.status_code == 200:
+                    return cred_response.json()
+                # Return credential without decryption if API not available
+                return self.credentials.metadata(cache_key, credential_id)
             
-            logger.warning(f"No TVU credential found for user {user_id}")
-            return None
+            credential = self._resolve_credential(cache_key, "tvu", list_credentials, fetch_decrypted)
+            if not credential:
+                logger.warning(f"No TVU credential found for user {user_id}")
+            return credential
         except Exception as e:
             logger.error(f"Error getting TVU credential by user_id: {e}")
             return None
@@ -658,25 +574,18 @@ class AgentFeatures:
             
             logger.info(f"Using TVU credential for user: {school_username}")
             
-            # Use TVU scraper directly
-            if TVUScraper:
-                scraper = TVUScraper()
-            else:
-                scraper = get_scraper("https://ttsv.tvu.edu.vn")
-            
-            # Login
-            logger.info("Attempting login to TVU portal...")
-            if not scraper.login(school_username, school_password):
+            # Get schedule (session TVU dùng lại từ pool, chỉ login khi cần)
+            try:
+                schedules = self.tvu_sessions.run(
+                    school_username, school_password,
+                    lambda scraper: scraper.get_schedule()
+                )
+            except TVULoginError:
                 return {
                     "success": False,
                     "message": "❌ Đăng nhập TVU thất bại. Vui lòng kiểm tra tài khoản trường."
                 }
             
-            logger.info("Login successful! Fetching schedule...")
-            
-            # Get schedule
-            schedules = scraper.get_schedule()
-            
             if not schedules:
                 return {
                     "success": True,
@@ -686,33 +595,31 @@ class AgentFeatures:
             
             logger.info(f"Found {len(schedules)} schedule entries")
             
-            # Delete old schedules
-            requests.delete(
-                f"{self.spring_boot_url}/api/schedules/all",
-                headers=headers,
-                timeout=5
-            )
+            # Chỉ ghi các dòng thay đổi (không xóa hết rồi thêm lại)
+            try:
+                stored = self.schedule_sync.fetch_stored(headers)
+            except Exception as e:
+                logger.error(f"Failed to load stored schedules: {e}")
+                return {
+                    "success": False,
+                    "message": "❌ Không đọc được lịch học đang lưu, chưa thay đổi gì. Vui lòng thử lại."
+                }
             
-            # Save to database via Spring Boot
-            saved_count = 0
-            for schedule in schedules:
-                try:
-                    response = requests.post(
-                        f"{self.spring_boot_url}/api/schedules",
-                        json=schedule,
-                        headers=headers,
-                        timeout=5
-                    )
-                    if response.status_code in [200, 201]:
-                        saved_count += 1
-                except Exception as e:
-                    logger.warning(f"Failed to save schedule: {e}")
-                    continue
+            diff = diff_schedules(schedules, stored)
+            outcomes = self.schedule_sync.apply(diff, headers)
+            failed = [o for o in outcomes if not o["success"]]
+            for outcome in failed:
+                logger.warning(f"Failed to {outcome['op']} schedule {outcome['key']}: {outcome['error']}")
+            
+            summary = {op: sum(1 for o in outcomes if o["op"] == op and o["success"]) for op in ("create", "update", "delete")}
+            summary["unchanged"] = len(diff["unchanged"])
+            summary["failed"] = len(failed)
+            saved_count = summary["unchanged"] + summary["create"] + summary["update"]
             
             # Log credential usage
             try:
                 headers = {"Authorization": f"Bearer {token}"}
-                requests.post(
+                http.post(
                     f"{self.spring_boot_url}/api/credentials/{credential['id']}/use",
                     json={
                         "action": "login",
@@ -727,10 +634,20 @@ class AgentFeatures:
             
             logger.info(f"Successfully synced {saved_count} schedules")
             
+            message = (
+                f"✅ Đã đồng bộ {saved_count} lịch học từ trang trường!\n"
+                f"➕ {summary['create']} mới · ✏️ {summary['update']} cập nhật · 🗑️ {summary['delete']} xóa · {summary['unchanged']} không đổi\n"
+            )
+            if failed:
+                message += f"⚠️ {len(failed)} dòng không ghi được\n"
+            message += f"🔐 Sử dụng credential: {credential['serviceName']}"
+            
             return {
                 "success": True,
-                "message": f"✅ Đã đồng bộ {saved_count} lịch học từ trang trường!\n🔐 Sử dụng credential: {credential['serviceName']}",
+                "message": message,
                 "count": saved_count,
+                "summary": summary,
+                "outcomes": outcomes,
                 "credential_used": credential['serviceName']
             }
             
@@ -864,42 +781,32 @@ class AgentFeatures:
         
         return None  # Default to today
     
-    def extract_week_from_message(self, message: str) -> int:
+    def extract_week_from_message(self, message: str) -> tuple:
         """
-        Extract week offset from user message
-        Returns: 0 (this week), 1 (next week), -1 (last week), or specific week number
+        Extract week from user message
+        Returns: ("relative", 0 / 1 / -1) cho tuần này / sau / trước, ("absolute", X) cho "tuần X" của học kỳ
         """
         message_lower = message.lower()
         
         # Check for week keywords
         if 'tuần sau' in message_lower or 'tuần tới' in message_lower or 'next week' in message_lower:
-            return 1
+            return ("relative", 1)
         elif 'tuần trước' in message_lower or 'last week' in message_lower:
-            return -1
+            return ("relative", -1)
         elif 'tuần này' in message_lower or 'this week' in message_lower:
-            return 0
+            return ("relative", 0)
         
         # Try to extract specific week number
         import re
         week_match = re.search(r'tuần\s*(\d+)', message_lower)
         if week_match:
-            return int(week_match.group(1))
+            return ("absolute", int(week_match.group(1)))
         
-        return 0  # Default to current week
+        return ("relative", 0)  # Default to current week
     
     def detect_week_schedule_intent(self, message: str) -> bool:
-        """Detect if user wants to see schedule for a week"""
-        patterns = [
-            r'tuần\s*(này|sau|tới|trước|\d+)',
-            r'this week',
-            r'next week',
-            r'last week',
-            r'lịch tuần',
-            r'tkb tuần'
-        ]
-        
-        message_lower = message.lower()
-        return any(re.search(pattern, message_lower) for pattern in patterns)
+        """Detect if user wants to see schedule for a week (pattern trong intent_router.INTENT_PATTERNS["week_schedule"])"""
+        return route_intents(message).matched("week_schedule")
     
     def get_schedule(self, token: str, message: str = "", force_sync: bool = False) -> Dict:
         """
@@ -911,7 +818,7 @@ class AgentFeatures:
             
             # Check if asking for week schedule
             if self.detect_week_schedule_intent(message):
-                return self.get_week_schedule(token, message)
+                return self.get_week_schedule(token, message, force_sync=force_sync)
             
             # Extract specific date from message (returns datetime object)
             target_date = self.extract_specific_date(message)
@@ -969,21 +876,6 @@ class AgentFeatures:
                     "message": "❌ Tài khoản TVU không hợp lệ."
                 }
             
-            # Use TVU scraper directly
-            if TVUScraper:
-                scraper = TVUScraper()
-            else:
-                scraper = get_scraper("https://ttsv.tvu.edu.vn")
-            
-            # Login
-            logger.info(f"Attempting TVU login with username: {school_username}")
-            if not scraper.login(school_username, school_password):
-                logger.error("TVU login failed!")
-                return {
-                    "success": False,
-                    "message": "❌ Đăng nhập TVU thất bại. Vui lòng kiểm tra tài khoản."
-                }
-            
             # Calculate target week if specific date is provided
             target_week = None
             if target_date:
@@ -991,18 +883,28 @@ class AgentFeatures:
                 logger.info(f"Target date: {target_date.strftime('%d/%m/%Y')}, Target week: {target_week}")
             
             # Get schedules for the target week (or current week if no specific date)
-            all_schedules = scraper.get_schedule(week=target_week)
-            
-            if not all_schedules:
+            try:
+                timetable = self._get_timetable(school_username, school_password, force_sync=force_sync)
+                if timetable is not None:
+                    # Trả lời từ TKB học kỳ đã cache - tuần theo ngày của portal (giống đồng bộ Calendar),
+                    # portal không trả ngày thì mới ước lượng
+                    date = target_date or datetime.now()
+                    week = timetable.week_of(date) or self.calculate_week_from_date(date)
+                    schedules = timetable.day(week, requested_day)
+                else:
+                    all_schedules = self.tvu_sessions.run(
+                        school_username, school_password,
+                        lambda scraper: scraper.get_schedule(week=target_week)
+                    )
+                    # Filter by requested day
+                    schedules = [s for s in all_schedules if s.get('day_of_week') == requested_day]
+            except TVULoginError:
+                logger.error("TVU login failed!")
                 return {
-                    "success": True,
-                    "message": f"📅 {day_label.capitalize()} bạn không có lớp nào.",
-                    "schedules": []
+                    "success": False,
+                    "message": "❌ Đăng nhập TVU thất bại. Vui lòng kiểm tra tài khoản."
                 }
             
-            # Filter by requested day
-            schedules = [s for s in all_schedules if s.get('day_of_week') == requested_day]
-            
             if not schedules:
                 return {
                     "success": True,
@@ -1037,14 +939,20 @@ class AgentFeatures:
                 "message": f"❌ Lỗi lấy thời khóa biểu: {str(e)}"
             }
     
-    def get_week_schedule(self, token: str, message: str = "") -> Dict:
+    def get_week_schedule(self, token: str, message: str = "", force_sync: bool = False) -> Dict:
         """
         Get schedule for a specific week
         Supports: tuần này, tuần sau, tuần trước, tuần X
         """
         try:
-            # Extract week offset (currently only supports current week)
-            week_offset = self.extract_week_from_message(message)
+            # "relative": lệch so với tuần hiện tại (tuần trước / này / sau), "absolute": tuần X của học kỳ
+            week_kind, week_value = self.extract_week_from_message(message)
+            if week_kind == "relative":
+                week_offset = week_value
+                target_week = max(1, self.calculate_week_from_date(datetime.now()) + week_offset)
+            else:
+                week_offset = None
+                target_week = week_value
             
             # Get TVU credential
             credential = self.get_tvu_credential(token)
@@ -1064,22 +972,26 @@ class AgentFeatures:
                     "message": "❌ Tài khoản TVU không hợp lệ."
                 }
             
-            # Use TVU scraper directly
-            if TVUScraper:
-                scraper = TVUScraper()
-            else:
-                scraper = get_scraper("https://ttsv.tvu.edu.vn")
-            
-            # Login
-            if not scraper.login(school_username, school_password):
+            # Get schedules (từ TKB học kỳ đã cache nếu có)
+            try:
+                timetable = self._get_timetable(school_username, school_password, force_sync=force_sync)
+                if timetable is not None:
+                    current_week = timetable.week_of(datetime.now())
+                    if week_offset is not None and current_week:
+                        # Tuần hiện tại theo ngày của portal thay vì ước lượng
+                        target_week = max(1, current_week + week_offset)
+                    schedules = timetable.week(target_week)
+                else:
+                    schedules = self.tvu_sessions.run(
+                        school_username, school_password,
+                        lambda scraper: scraper.get_schedule(week=target_week)
+                    )
+            except TVULoginError:
                 return {
                     "success": False,
                     "message": "❌ Đăng nhập TVU thất bại."
                 }
             
-            # Get schedules
-            schedules = scraper.get_schedule()
-            
             if not schedules:
                 return {
                     "success": True,
@@ -1095,7 +1007,7 @@ class AgentFeatures:
             elif week_offset == -1:
                 week_label = "tuần trước"
             else:
-                week_label = f"tuần {week_offset}"
+                week_label = f"tuần {target_week}"
             
             # Group by day
             days_order = ['MONDAY', 'TUESDAY', 'WEDNESDAY', 'THURSDAY', 'FRIDAY', 'SATURDAY', 'SUNDAY']
@@ -1144,7 +1056,8 @@ class AgentFeatures:
                 "success": True,
                 "message": message_text,
                 "schedules": schedules,
-                "week_offset": week_offset
+                "week_offset": week_offset,
+                "week": target_week
             }
             
         except Exception as e:
@@ -1158,7 +1071,7 @@ class AgentFeatures:
         """Get user's grades"""
         try:
             headers = {"Authorization": f"Bearer {token}"}
-            response = requests.get(
+            response = http.get(
                 f"{self.spring_boot_url}/api/grades/my-grades",
                 headers=headers,
                 timeout=5
@@ -1241,7 +1154,7 @@ class AgentFeatures:
         try:
             # Get user's contacts
             headers = {"Authorization": f"Bearer {token}"}
-            response = requests.get(
+            response = http.get(
                 f"{self.spring_boot_url}/api/contacts",
                 headers=headers,
                 timeout=5
@@ -1433,7 +1346,7 @@ Sau khi đăng nhập, hãy thử lại yêu cầu.""",
         """
         try:
             # Import helper functions
-            from gmail_service import ai_get_contacts, ai_create_draft_email, ai_send_email
+            from gmail_service import ai_get_contacts, ai_create_draft_email, ai_send_email, ai_find_recipient
             
             message_lower = message.lower()
             
@@ -1449,8 +1362,22 @@ Sau khi đăng nhập, hãy thử lại yêu cầu.""",
             # First check if email address is present
             has_email = bool(re.search(r'[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}', message))
             
+            # Tên thay cho địa chỉ: "gửi mail cho thầy Nam xin nghỉ học" -> tra danh bạ người nhận (contact_index)
+            # Khớp rõ ràng -> soạn draft luôn, nhiều người trùng tên -> chỉ gợi ý những người đó
+            recipient = None
+            candidates = None
+            if not has_email and user_id:
+                name_match = re.search(r'\b(?:cho|tới|đến)\s+(.+)', message, re.IGNORECASE)
+                if name_match:
+                    found = ai_find_recipient(user_id, name_match.group(1))
+                    if found.get("contact"):
+                        recipient = found
+                        logger.info(f"📇 Resolved recipient '{found['phrase']}' -> {found['contact']['email']}")
+                    elif found.get("contacts"):
+                        candidates = found["contacts"]
+            
             subject_keyword = None
-            if not has_email:  # Only suggest contacts if no email provided
+            if not has_email and recipient is None:  # Only suggest contacts if no email provided
                 for pattern in compose_patterns:
                     match = re.search(pattern, message_lower)
                     if match:
@@ -1477,7 +1404,10 @@ Vui lòng cung cấp địa chỉ email người nhận.
                     }
                 
                 # Get frequent contacts from Gmail (requires auth)
-                contacts_result = ai_get_contacts(user_id, max_results=10)
+                if candidates:
+                    contacts_result = {"success": True, "contacts": candidates}
+                else:
+                    contacts_result = ai_get_contacts(user_id, max_results=10)
                 
                 if not contacts_result.get("success"):
                     if contacts_result.get("need_auth"):
@@ -1555,7 +1485,7 @@ Bạn có thể gửi trực tiếp bằng cách:
             subject_match = re.search(r'(?:chủ đề|subject|tiêu đề)\s*[:\"]?\s*(.+?)(?:\s*nội dung|\s*body|$)', message, re.IGNORECASE)
             body_match = re.search(r'(?:nội dung|body|content|nói|về)\s*[:\"]?\s*(.+)', message, re.IGNORECASE)
             
-            if not to_match:
+            if not to_match and recipient is None:
                 return {
                     "success": False,
                     "message": """📧 **Gửi Email**
@@ -1570,7 +1500,8 @@ Bạn có thể gửi trực tiếp bằng cách:
 """
                 }
             
-            to_email = to_match.group(1)
+            to_email = to_match.group(1) if to_match else recipient["contact"]["email"]
+            recipient_name = recipient["phrase"] if recipient else to_email.split('@')[0]
             subject = subject_match.group(1).strip() if subject_match else None
             body = body_match.group(1).strip() if body_match else None
             
@@ -1588,7 +1519,12 @@ Bạn có thể gửi trực tiếp bằng cách:
                         r'(?:nói|về|hỏi)\s+(.+?)$',  # ← FIXED: Thêm "hỏi"
                     ]
                     subject_keyword = None
+                    if recipient and recipient.get("rest"):
+                        # Phần sau tên người nhận: "cho thầy Nam xin nghỉ học" -> "xin nghỉ học"
+                        subject_keyword = recipient["rest"].lower()
                     for pattern in subject_patterns:
+                        if subject_keyword:
+                            break
                         match = re.search(pattern, message_lower)
                         if match:
                             subject_keyword = match.group(1).strip()
@@ -1616,7 +1552,7 @@ Bạn có thể gửi trực tiếp bằng cách:
                 # Generate draft with AI - pass full context
                 draft_result = ai_create_draft_email(
                     subject_keyword=subject_keyword,
-                    recipient_name=to_email.split('@')[0],  # Use email username as name
+                    recipient_name=recipient_name,  # Tên trong danh bạ hoặc email username
                     full_message=message  # ← ADDED: Pass full message for better context
                 )
                 
@@ -1650,7 +1586,7 @@ Bạn có thể gửi trực tiếp bằng cách:
                 else:
                     # Fallback if AI generation fails - still return draft with placeholder
                     logger.warning(f"⚠️ AI draft generation failed, using fallback")
-                    fallback_body = f"Kính gửi {to_email.split('@')[0]},\n\n[Nội dung về: {subject_keyword}]\n\nTrân trọng."
+                    fallback_body = f"Kính gửi {recipient_name},\n\n[Nội dung về: {subject_keyword}]\n\nTrân trọng."
                     
                     email_draft_obj = {
                         "to": to_email,
@@ -1693,21 +1629,74 @@ Bạn có thể gửi trực tiếp bằng cách:
                 "message": f"❌ Không thể gửi email: {str(e)}"
             }
     
-    def sync_schedule_to_calendar(self, token: str, user_id: int, week: int = None, hoc_ky: str = None, reminder_email: int = None, reminder_popup: int = None, notification_email: str = None) -> Dict:
+    def _class_dates(self, school_username: str, school_password: str, week: int = None, hoc_ky: str = None, whole_semester: bool = False) -> List[tuple]:
+        """
+        Các lớp cần đưa lên Calendar: [(dòng TKB, [ngày học, ...]), ...]
+        
+        - mặc định: các buổi trong 7 ngày tới (mỗi buổi 1 ngày)
+        - week: các buổi của tuần đó (mỗi buổi 1 ngày)
+        - whole_semester: cả học kỳ, mỗi lớp (môn, thứ, tiết, phòng) kèm mọi ngày học theo tuanHoc -> 1 event lặp
+        - portal không trả TKB chia tuần: lần học kế tiếp trong 7 ngày tới của mỗi lớp
+        
+        Ngày học lấy theo ngày portal trả về (timetable.date_for / week_of), chỉ khi portal không có ngày
+        mới ước lượng theo ngày đầu học kỳ
+        
+        Raises:
+            TVULoginError: không đăng nhập được portal
+        """
+        timetable = self._get_timetable(school_username, school_password, hoc_ky=hoc_ky)
+        
+        if timetable is None:
+            # Portal không trả dạng chia tuần: lấy 1 tuần, mỗi lớp đặt vào lần học kế tiếp trong 7 ngày tới
+            today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+            day_names = ['MONDAY', 'TUESDAY', 'WEDNESDAY', 'THURSDAY', 'FRIDAY', 'SATURDAY', 'SUNDAY']
+            schedules = self.tvu_sessions.run(
+                school_username, school_password,
+                lambda scraper: scraper.get_schedule(week=week, hoc_ky=hoc_ky)
+            )
+            return [
+                (s, [today + timedelta(days=(day_names.index(s.get('day_of_week', 'MONDAY')) - today.weekday()) % 7)])
+                for s in schedules
+            ]
+        
+        def class_date(w, s):
+            day_of_week = s.get('day_of_week', 'MONDAY')
+            return timetable.date_for(w, day_of_week) or self.date_for_week_day(w, day_of_week, hoc_ky)
+        
+        if week:
+            return [(s, [class_date(week, s)]) for s in timetable.week(week)]
+        
+        if whole_semester:
+            return [
+                (s, [class_date(w, s) for w in weeks if w > 0])
+                for s, weeks in timetable.classes()
+            ]
+        
+        today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        day_names = ['MONDAY', 'TUESDAY', 'WEDNESDAY', 'THURSDAY', 'FRIDAY', 'SATURDAY', 'SUNDAY']
+        classes = []
+        for offset in range(7):
+            date = today + timedelta(days=offset)
+            date_week = timetable.week_of(date) or self.calculate_week_from_date(date, hoc_ky)
+            classes.extend((s, [date]) for s in timetable.day(date_week, day_names[date.weekday()]))
+        return classes
+    
+    def sync_schedule_to_calendar(self, token: str, user_id: int, week: int = None, hoc_ky: str = None, reminder_email: int = None, reminder_popup: int = None, notification_email: str = None, whole_semester: bool = False) -> Dict:
         """
         🔄 Đồng bộ thời khóa biểu lên Google Calendar
         
         Args:
             token: JWT token để lấy credentials (optional)
             user_id: User ID để gọi Calendar API và lấy credentials
-            week: Tuần học (optional, mặc định tuần hiện tại)
+            week: Tuần học (optional, mặc định 7 ngày tới)
             hoc_ky: Học kỳ (optional, mặc định học kỳ hiện tại)
             reminder_email: Số phút trước để gửi email nhắc nhở (vd: 30, 60, 1440 cho 1 ngày)
             reminder_popup: Số phút trước để hiện popup nhắc nhở
             notification_email: Email tùy chỉnh để nhận thông báo (nếu khác Gmail đã kết nối)
+            whole_semester: Đồng bộ cả học kỳ - mỗi lớp 1 event lặp hàng tuần
         
         Returns:
-            Dict với success, message, và số events đã tạo
+            Dict với success, message, và số events đã tạo / cập nhật / xóa
         """
         try:
             logger.info(f"🔄 Starting schedule sync to calendar for user {user_id}")
@@ -1728,200 +1717,105 @@ Bạn có thể gửi trực tiếp bằng cách:
             school_username = credential.get('username')
             school_password = credential.get('password')
             
-            # 2. Login to TVU and get schedule
-            if TVUScraper:
-                scraper = TVUScraper()
-            else:
-                scraper = get_scraper("https://ttsv.tvu.edu.vn")
-            
-            if not scraper.login(school_username, school_password):
+            # 2. Các lớp cần đồng bộ (TKB học kỳ từ cache, session TVU từ pool)
+            try:
+                classes = [(s, dates) for s, dates in self._class_dates(school_username, school_password, week, hoc_ky, whole_semester) if dates]
+            except TVULoginError:
                 return {
                     "success": False,
                     "message": "❌ Đăng nhập TVU thất bại. Vui lòng kiểm tra tài khoản."
                 }
             
-            # 3. Get schedule
-            schedules = scraper.get_schedule(week=week, hoc_ky=hoc_ky)
-            
-            if not schedules:
+            if not classes:
                 return {
                     "success": True,
                     "message": "📅 Không có lịch học nào để đồng bộ.",
                     "events_created": 0
                 }
             
-            logger.info(f"📚 Found {len(schedules)} classes to sync")
+            all_dates = [class_date for _, dates in classes for class_date in dates]
+            logger.info(f"📚 Found {len(classes)} classes ({len(all_dates)} sessions) to sync")
             
-            # 3.5. Get existing events to check for duplicates
-            existing_events = []
-            try:
-                # Get events for the next 7 days
-                today = datetime.now()
-                time_min = today.strftime('%Y-%m-%dT00:00:00+07:00')
-                time_max = (today + timedelta(days=7)).strftime('%Y-%m-%dT23:59:59+07:00')
-                
-                list_response = requests.post(
-                    "http://localhost:8004/api/google-cloud/calendar/list-events",
-                    json={
-                        "user_id": user_id,
-                        "time_min": time_min,
-                        "time_max": time_max,
-                        "max_results": 100
-                    },
-                    timeout=10
-                )
-                if list_response.status_code == 200:
-                    existing_events = list_response.json().get('events', [])
-                    logger.info(f"📋 Found {len(existing_events)} existing events")
-            except Exception as e:
-                logger.warning(f"Could not fetch existing events: {e}")
-            
-            # 4. Create events on Google Calendar
-            events_created = 0
-            events_skipped = 0
-            events_failed = 0
-            failed_details = []
-            
-            # Map day names
-            day_map = {
-                'MONDAY': 0,
-                'TUESDAY': 1,
-                'WEDNESDAY': 2,
-                'THURSDAY': 3,
-                'FRIDAY': 4,
-                'SATURDAY': 5,
-                'SUNDAY': 6
-            }
+            # 3. Event có id ổn định (lớp nhiều tuần -> 1 event lặp RRULE) - Calendar service chỉ tạo / sửa / xóa
+            #    phần khác so với lịch hiện có
+            events = [
+                build_class_series(schedule, dates, reminder_email, reminder_popup, notification_email)
+                for schedule, dates in classes
+            ]
+            sync_range = time_range(all_dates)
             
-            for schedule in schedules:
-                try:
-                    # Parse schedule info
-                    subject = schedule.get('subject', 'Lớp học')
-                    teacher = schedule.get('teacher', '')
-                    room = schedule.get('room', '')
-                    day_of_week = schedule.get('day_of_week', 'MONDAY')
-                    start_time = schedule.get('start_time', '07:00')
-                    end_time = schedule.get('end_time', '09:00')
-                    
-                    # Calculate date for this class
-                    # Get the next occurrence of this day of week
-                    today = datetime.now()
-                    target_weekday = day_map.get(day_of_week, 0)
-                    current_weekday = today.weekday()
-                    
-                    days_ahead = target_weekday - current_weekday
-                    if days_ahead < 0:  # Target day already happened this week
-                        days_ahead += 7
-                    
-                    class_date = today + timedelta(days=days_ahead)
-                    
-                    # Format datetime for Calendar API (ISO 8601 with timezone)
-                    start_datetime = f"{class_date.strftime('%Y-%m-%d')}T{start_time}:00+07:00"
-                    end_datetime = f"{class_date.strftime('%Y-%m-%d')}T{end_time}:00+07:00"
-                    
-                    # Create event description
-                    description = f"Giảng viên: {teacher}\nLớp: {schedule.get('class_name', '')}"
-                    
-                    # Check for duplicate event
-                    event_summary = f"📚 {subject}"
-                    is_duplicate = False
-                    for existing in existing_events:
-                        existing_summary = existing.get('summary', '')
-                        existing_start = existing.get('start', '')
-                        # Check if same subject and same start time
-                        if event_summary in existing_summary and start_datetime[:16] in existing_start:
-                            is_duplicate = True
-                            logger.info(f"⏭️ Skipping duplicate: {subject} on {class_date.strftime('%d/%m')}")
-                            break
-                    
-                    if is_duplicate:
-                        events_skipped += 1
-                        continue
-                    
-                    # Call Google Calendar API
-                    calendar_url = "http://localhost:8004/api/google-cloud/calendar/create-event"
-                    event_payload = {
-                        "user_id": user_id,
-                        "summary": event_summary,
-                        "description": description,
-                        "start_time": start_datetime,
-                        "end_time": end_datetime,
-                        "location": f"Phòng {room}" if room else None
-                    }
-                    
-                    # Add notification email as attendee if specified
-                    if notification_email:
-                        event_payload["attendees"] = [notification_email]
-                    
-                    # Add reminders if specified
-                    if reminder_email is not None:
-                        event_payload["reminder_email"] = reminder_email
-                    if reminder_popup is not None:
-                        event_payload["reminder_popup"] = reminder_popup
-                    
-                    response = requests.post(
-                        calendar_url,
-                        json=event_payload,
-                        timeout=10
-                    )
-                    
-                    if response.status_code in [200, 201]:
-                        events_created += 1
-                        logger.info(f"✅ Created: {subject} on {class_date.strftime('%d/%m')} at {start_time}")
-                    else:
-                        events_failed += 1
-                        error_msg = response.text[:100]
-                        failed_details.append(f"{subject}: {error_msg}")
-                        logger.warning(f"❌ Failed: {subject} - {error_msg}")
-                
-                except Exception as e:
-                    events_failed += 1
-                    failed_details.append(f"{schedule.get('subject', 'Unknown')}: {str(e)}")
-                    logger.error(f"Error creating event: {e}")
-            
-            # 5. Format response message
-            if events_created > 0 or events_skipped > 0:
-                message = f"""✅ **Đồng bộ thành công!**
-
-📅 Đã thêm **{events_created} lớp học** vào Google Calendar
-"""
-                if events_skipped > 0:
-                    message += f"⏭️ Bỏ qua **{events_skipped} lớp** (đã tồn tại)\n"
-                
-                message += f"""
-📚 **Chi tiết:**
-• Tuần: {week or 'hiện tại'}
-• Học kỳ: {hoc_ky or 'hiện tại'}
-"""
-                if notification_email:
-                    message += f"• Email thông báo: {notification_email}\n"
-                
-                message += "\n🔗 Xem lịch tại: [Google Calendar](https://calendar.google.com)"
-                
-                if events_failed > 0:
-                    message += f"\n\n⚠️ {events_failed} lớp không thể thêm"
-                
+            response = http.post(
+                "http://localhost:8004/api/google-cloud/calendar/sync-events",
+                json={"user_id": user_id, "events": events, **sync_range},
+                timeout=120
+            )
+            if response.status_code != 200:
                 return {
-                    "success": True,
-                    "message": message,
-                    "events_created": events_created,
-                    "events_skipped": events_skipped,
-                    "events_failed": events_failed
+                    "success": False,
+                    "message": f"❌ Không thể đồng bộ lịch.\n\nLỗi: {response.text[:200]}",
+                    "events_created": 0
                 }
-            elif events_skipped > 0 and events_created == 0:
+            
+            result = response.json()
+            outcomes = result.get("outcomes", [])
+            summary = sync_summary(outcomes, result.get("unchanged", 0))
+            for outcome in outcomes:
+                if not outcome.get("success"):
+                    logger.warning(f"❌ Failed to {outcome['op']} {outcome.get('summary') or outcome['id']}: {outcome.get('error')}")
+            
+            # 4. Format response message
+            if summary["failed"] and not (summary["create"] or summary["update"] or summary["delete"] or summary["unchanged"]):
+                first_error = next(o.get("error") for o in outcomes if not o.get("success"))
                 return {
-                    "success": True,
-                    "message": f"📋 Tất cả {events_skipped} lớp học đã có trong Calendar rồi!",
+                    "success": False,
+                    "message": f"❌ Không thể đồng bộ lịch.\n\nLỗi: {first_error or 'Unknown error'}",
                     "events_created": 0,
-                    "events_skipped": events_skipped
+                    "events_failed": summary["failed"]
                 }
-            else:
+            
+            if not (summary["create"] or summary["update"] or summary["delete"]):
                 return {
-                    "success": False,
-                    "message": f"❌ Không thể đồng bộ lịch.\n\nLỗi: {failed_details[0] if failed_details else 'Unknown error'}",
+                    "success": True,
+                    "message": f"📋 Tất cả {summary['unchanged']} lớp học đã có trong Calendar rồi!",
                     "events_created": 0,
-                    "events_failed": events_failed
+                    "events_skipped": summary["unchanged"]
                 }
+            
+            message = f"""✅ **Đồng bộ thành công!**
+
+📅 Đã thêm **{summary['create']} lớp học** vào Google Calendar
+"""
+            if summary["update"]:
+                message += f"✏️ Cập nhật **{summary['update']} lớp** (đổi phòng / giờ)\n"
+            if summary["delete"]:
+                message += f"🗑️ Xóa **{summary['delete']} lớp** không còn trong TKB\n"
+            if summary["unchanged"]:
+                message += f"⏭️ Bỏ qua **{summary['unchanged']} lớp** (đã tồn tại)\n"
+            
+            message += f"""
+📚 **Chi tiết:**
+• Tuần: {week or ('cả học kỳ (event lặp hàng tuần)' if whole_semester else '7 ngày tới')}
+• Số buổi học: {len(all_dates)}
+• Học kỳ: {hoc_ky or 'hiện tại'}
+"""
+            if notification_email:
+                message += f"• Email thông báo: {notification_email}\n"
+            
+            message += "\n🔗 Xem lịch tại: [Google Calendar](https://calendar.google.com)"
+            
+            if summary["failed"]:
+                message += f"\n\n⚠️ {summary['failed']} lớp không thể đồng bộ"
+            
+            return {
+                "success": True,
+                "message": message,
+                "events_created": summary["create"],
+                "events_updated": summary["update"],
+                "events_deleted": summary["delete"],
+                "events_skipped": summary["unchanged"],
+                "events_failed": summary["failed"],
+                "outcomes": outcomes
+            }
         
         except Exception as e:
             logger.error(f"Sync schedule to calendar error: {e}")
@@ -1934,15 +1828,12 @@ Bạn có thể gửi trực tiếp bằng cách:
             }
     
     def detect_calendar_sync_intent(self, message: str) -> bool:
-        """Phát hiện intent đồng bộ TKB lên Calendar"""
-        patterns = [
-            r'đồng bộ.*(?:tkb|thời khóa biểu|lịch học).*calendar',
-            r'sync.*(?:schedule|tkb).*calendar',
-            r'thêm.*(?:tkb|lịch học).*(?:vào|lên).*calendar',
-            r'add.*schedule.*calendar',
-            r'đưa.*(?:tkb|lịch).*lên.*calendar'
-        ]
-        return any(re.search(pattern, message.lower()) for pattern in patterns)
+        """Phát hiện intent đồng bộ TKB lên Calendar (pattern trong intent_router.INTENT_PATTERNS["calendar_sync"])"""
+        return route_intents(message).matched("calendar_sync")
+    
+    def detect_whole_semester(self, message: str) -> bool:
+        """User muốn đồng bộ cả học kỳ thay vì 7 ngày tới"""
+        return bool(re.search(r'cả\s+(?:học\s+)?kỳ|toàn\s+bộ\s+học\s+kỳ|cả\s+kì|whole\s+semester', message.lower()))
     
     def handle_gmail_search(self, message: str, token: str, user_id: int = None) -> Dict:
         """
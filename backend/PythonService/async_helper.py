@@ -0,0 +1,79 @@
+"""
+Async Helper
+Tiện ích để các endpoint async không chặn event loop:
+    - run_blocking(): chạy hàm sync (SDK không có async API, requests, scraping...) trong
+      thread pool có giới hạn thay vì gọi thẳng trên event loop
+    - get_async_client(): httpx.AsyncClient dùng chung (keep-alive) cho Spring Boot / Groq - xem http_client
+    - StageTimer: đo thời gian từng bước của pipeline, xuất ra header Server-Timing
+"""
+import asyncio
+import functools
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from http_client import close_async_clients, get_async_client  # noqa: F401 - re-export cho main / groq_helper
+
+# Số thread tối đa cho các lời gọi blocking - giới hạn để 1 đợt request lớn
+# không tạo hàng trăm thread cùng gọi ra ngoài
+BLOCKING_POOL_SIZE = int(os.getenv("BLOCKING_POOL_SIZE", "32"))
+
+_blocking_executor: Optional[ThreadPoolExecutor] = None
+
+
+def get_blocking_executor() -> ThreadPoolExecutor:
+    global _blocking_executor
+    if _blocking_executor is None:
+        _blocking_executor = ThreadPoolExecutor(max_workers=BLOCKING_POOL_SIZE, thread_name_prefix="blocking")
+    return _blocking_executor
+
+
+async def run_blocking(func: Callable, *args, **kwargs) -> Any:
+    """Chạy func(*args, **kwargs) trong thread pool, await kết quả mà không chặn event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_blocking_executor(), functools.partial(func, *args, **kwargs))
+
+
+async def close_async_client():
+    """Đóng các httpx.AsyncClient dùng chung khi app shutdown"""
+    await close_async_clients()
+
+
+class StageTimer:
+    """
+    Đo thời gian (ms) từng stage của 1 request
+
+    Dùng:
+        timer = StageTimer()
+        task = asyncio.create_task(timer.run("history", load_history()))
+        ...
+        started = time.perf_counter(); ...; timer.record("llm", started)
+        response.headers["Server-Timing"] = timer.header()
+    """
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.timings: Dict[str, float] = {}
+
+    async def run(self, name: str, awaitable: Awaitable) -> Any:
+        started = time.perf_counter()
+        try:
+            return await awaitable
+        finally:
+            self.record(name, started)
+
+    def record(self, name: str, started: float):
+        self.timings[name] = (time.perf_counter() - started) * 1000
+
+    def snapshot(self) -> Dict[str, float]:
+        """Timings hiện tại (ms, làm tròn) + total - dùng cho event cuối của SSE"""
+        timings = {name: round(ms, 1) for name, ms in self.timings.items()}
+        timings["total"] = round((time.perf_counter() - self.started_at) * 1000, 1)
+        return timings
+
+    def header(self) -> str:
+        """Format Server-Timing, vd: user_id;dur=12.3, history;dur=20.1, total;dur=512.0"""
+        parts = [f"{name};dur={ms:.1f}" for name, ms in self.timings.items()]
+        parts.append(f"total;dur={(time.perf_counter() - self.started_at) * 1000:.1f}")
+        return ", ".join(parts)
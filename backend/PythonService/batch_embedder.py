@@ -0,0 +1,157 @@
+"""
+Batch Embedder
+Gom texts thành batch theo giới hạn API, chạy song song có giới hạn, retry + backoff theo từng batch
+"""
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+# Gemini batchEmbedContents nhận tối đa 100 texts / request
+DEFAULT_BATCH_SIZE = 100
+
+
+class BatchEmbedResult:
+    """Kết quả embed theo đúng thứ tự input; embeddings[i] = None nếu text i lỗi"""
+
+    def __init__(self, size: int):
+        self.embeddings: List[Optional[List[float]]] = [None] * size
+        self.errors: Dict[int, str] = {}
+
+    @property
+    def ok_indices(self) -> List[int]:
+        return [i for i, emb in enumerate(self.embeddings) if emb is not None]
+
+
+class BatchEmbedder:
+    """
+    Embed nhiều texts với số network round trip tối thiểu
+
+    - Mỗi batch là 1 request (content=list)
+    - Tối đa max_concurrency batch chạy cùng lúc
+    - Batch lỗi được retry với exponential backoff + jitter; hết retry thì
+      embed lẻ từng text trong batch đó để chỉ đánh dấu lỗi đúng document hỏng
+    """
+
+    def __init__(
+        self,
+        embed_fn: Callable,
+        model: str = "models/text-embedding-004",
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        max_concurrency: int = 4,
+        max_retries: int = 3,
+        backoff_base: float = 1.0,
+        cache=None
+    ):
+        """
+        Args:
+            embed_fn: Hàm có signature giống genai.embed_content(model=, content=, task_type=)
+            model: Embedding model
+            batch_size: Số texts tối đa mỗi request
+            max_concurrency: Số batch chạy song song tối đa
+            max_retries: Số lần thử mỗi batch
+            backoff_base: Thời gian chờ (giây) cho lần retry đầu, nhân đôi mỗi lần
+            cache: EmbeddingCache (optional) - texts đã có trong cache không gọi API nữa
+        """
+        self.embed_fn = embed_fn
+        self.model = model
+        self.batch_size = max(1, batch_size)
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_retries = max(1, max_retries)
+        self.backoff_base = backoff_base
+        self.cache = cache
+
+    def _call(self, texts: List[str], task_type: str) -> List[List[float]]:
+        result = self.embed_fn(model=self.model, content=texts, task_type=task_type)
+        embeddings = result['embedding']
+        if len(embeddings) != len(texts):
+            raise ValueError(f"Embedding API returned {len(embeddings)} vectors for {len(texts)} texts")
+        return embeddings
+
+    def _call_with_retry(self, texts: List[str], task_type: str) -> List[List[float]]:
+        last_error = None
+        for attempt in range(self.max_retries):
+            try:
+                return self._call(texts, task_type)
+            except Exception as e:
+                last_error = e
+                if attempt < self.max_retries - 1:
+                    wait_time = self.backoff_base * (2 ** attempt) * (1 + random.random() * 0.25)
+                    print(f"⚠️ Embedding batch ({len(texts)} texts) failed: {e} - retry {attempt + 1}/{self.max_retries} after {wait_time:.1f}s")
+                    time.sleep(wait_time)
+        raise last_error
+
+    def _embed_batch(self, start: int, texts: List[str], task_type: str, result: BatchEmbedResult):
+        try:
+            embeddings = self._call_with_retry(texts, task_type)
+            for offset, embedding in enumerate(embeddings):
+                result.embeddings[start + offset] = embedding
+            return
+        except Exception as e:
+            if len(texts) == 1:
+                result.errors[start] = str(e)
+                return
+            print(f"⚠️ Embedding batch at {start} failed after retries, falling back to per-document calls")
+
+        for offset, text in enumerate(texts):
+            try:
+                result.embeddings[start + offset] = self._call([text], task_type)[0]
+            except Exception as e:
+                result.errors[start + offset] = str(e)
+
+    def _embed_uncached(self, texts: List[str], task_type: str) -> BatchEmbedResult:
+        result = BatchEmbedResult(len(texts))
+        batches = [(start, texts[start:start + self.batch_size])
+                   for start in range(0, len(texts), self.batch_size)]
+
+        if len(batches) <= 1 or self.max_concurrency == 1:
+            for start, batch in batches:
+                self._embed_batch(start, batch, task_type, result)
+            return result
+
+        with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(batches))) as executor:
+            futures = [executor.submit(self._embed_batch, start, batch, task_type, result)
+                       for start, batch in batches]
+            for future in futures:
+                future.result()
+        return result
+
+    def embed(self, texts: List[str], task_type: str = "retrieval_document") -> BatchEmbedResult:
+        """
+        Embed danh sách texts
+
+        Returns:
+            BatchEmbedResult - embeddings theo đúng thứ tự input, errors = {index: message}
+        """
+        if self.cache is None:
+            return self._embed_uncached(texts, task_type)
+
+        result = BatchEmbedResult(len(texts))
+        found, missing = self.cache.get_many(self.model, task_type, texts)
+        for i, embedding in found.items():
+            result.embeddings[i] = embedding
+        if not missing:
+            return result
+
+        # Chỉ gọi API cho texts chưa có trong cache (bỏ trùng)
+        unique_texts = list(dict.fromkeys(texts[i] for i in missing))
+        computed = self._embed_uncached(unique_texts, task_type)
+        ok = computed.ok_indices
+        self.cache.put_many(self.model, task_type,
+                            [unique_texts[j] for j in ok], [computed.embeddings[j] for j in ok])
+
+        position = {text: j for j, text in enumerate(unique_texts)}
+        for i in missing:
+            j = position[texts[i]]
+            if computed.embeddings[j] is not None:
+                result.embeddings[i] = computed.embeddings[j]
+            else:
+                result.errors[i] = computed.errors.get(j, "unknown error")
+        return result
+
+    def embed_one(self, text: str, task_type: str = "retrieval_query") -> List[float]:
+        """Embed 1 text, raise nếu lỗi (dùng cho query)"""
+        result = self.embed([text], task_type=task_type)
+        if result.embeddings[0] is None:
+            raise RuntimeError(f"Embedding failed: {result.errors.get(0, 'unknown error')}")
+        return result.embeddings[0]
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark đồng thời cho /api/chat với backend giả lập (stub)
+
+Bắn N request chat cùng lúc vào app (in-process qua httpx.ASGITransport), mọi backend
+bên ngoài được thay bằng stub có độ trễ cố định:
+    - Spring Boot (/api/auth/profile, session history)
+    - Google Cloud agent (sync)
+    - Gemini generate_content
+
+Hai chế độ:
+    - before: tái hiện pipeline cũ - mọi lời gọi blocking chạy thẳng trên event loop
+    - after:  pipeline hiện tại - httpx async, generate_content_async, thread pool cho SDK sync
+
+Chạy:
+    python bench_chat_concurrency.py
+    python bench_chat_concurrency.py --concurrency 50 --llm-latency 0.5 --modes after
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import logging
+import os
+import time
+
+import httpx
+import numpy as np
+
+os.environ.setdefault("GEMINI_API_KEY", "bench-key")
+os.environ["DEFAULT_AI_MODEL"] = "gemini"
+
+import main  # noqa: E402
+
+
+class _StubResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class _FakeRequestsResponse:
+    def __init__(self, payload):
+        self.status_code = 200
+        self._payload = payload
+
+    def json(self):
+        return self._payload
+
+
+def _spring_payload(path: str):
+    if path.endswith("/api/auth/profile"):
+        return {"id": 1}
+    return [{"sender": "USER", "message": "Xin chào"}, {"sender": "AI", "message": "Chào bạn!"}]
+
+
+def install_stubs(mode: str, llm_latency: float, backend_latency: float):
+    """Thay backend thật bằng stub; mode="before" chạy mọi thứ blocking trên event loop"""
+    blocking = mode == "before"
+
+    class StubGenerativeModel:
+        def __init__(self, model_name, *args, **kwargs):
+            self.model_name = model_name
+
+        def generate_content(self, content):
+            time.sleep(llm_latency)
+            return _StubResponse("Đệ quy là khi hàm gọi lại chính nó.")
+
+        async def generate_content_async(self, content):
+            if blocking:
+                return self.generate_content(content)
+            await asyncio.sleep(llm_latency)
+            return _StubResponse("Đệ quy là khi hàm gọi lại chính nó.")
+
+    class StubGoogleCloudAgent:
+        def handle_google_cloud_request(self, message, token, image_url=None, audio_base64=None, user_id=None):
+            time.sleep(backend_latency)
+            return None
+
+    def fake_requests_get(url, *args, **kwargs):
+        time.sleep(backend_latency)
+        return _FakeRequestsResponse(_spring_payload(url))
+
+    async def spring_handler(request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(backend_latency)
+        return httpx.Response(200, json=_spring_payload(request.url.path))
+
+    main.genai.GenerativeModel = StubGenerativeModel
+    main.google_cloud_agent = StubGoogleCloudAgent()
+    main.GOOGLE_CLOUD_AGENT_AVAILABLE = True
+    main.agent_features = None
+    main.requests.get = fake_requests_get
+
+    if blocking:
+        # Pipeline cũ: requests.get đồng bộ + gọi SDK sync thẳng trong coroutine
+        async def inline(func, *args, **kwargs):
+            return func(*args, **kwargs)
+
+        async def user_id_inline(token):
+            return main.get_user_id_from_token(token)
+
+        async def history_inline(session_id):
+            main.requests.get(f"http://localhost:8080/api/chat/internal/sessions/{session_id}/messages")
+            return [{"role": "user", "content": "Xin chào"}, {"role": "assistant", "content": "Chào bạn!"}]
+
+        main.run_blocking = inline
+        main.get_user_id_from_token_async = user_id_inline
+        main.load_conversation_history = history_inline
+    else:
+        spring_client = httpx.AsyncClient(transport=httpx.MockTransport(spring_handler))
+        main.get_async_client = lambda: spring_client
+
+
+async def fire(concurrency: int):
+    transport = httpx.ASGITransport(app=main.app)
+    payload = {"message": "Giải thích đệ quy", "use_rag": False, "session_id": 1}
+    headers = {"Authorization": "Bearer bench-token"}
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=600) as client:
+        # Mọi request "đến" cùng lúc tại wall_start - latency tính từ đó, không phải từ lúc
+        # coroutine được lên lịch (pipeline blocking sẽ không cho request sau kịp bắt đầu)
+        wall_start = time.perf_counter()
+
+        async def one():
+            response = await client.post("/api/chat", json=payload, headers=headers)
+            response.raise_for_status()
+            return time.perf_counter() - wall_start
+
+        latencies = await asyncio.gather(*(one() for _ in range(concurrency)))
+        wall = time.perf_counter() - wall_start
+    return np.array(latencies) * 1000, wall
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="/api/chat concurrency benchmark (stubbed backends)")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="Độ trễ stub Gemini (giây)")
+    parser.add_argument("--backend-latency", type=float, default=0.02, help="Độ trễ stub Spring Boot / Google Cloud (giây)")
+    parser.add_argument("--modes", nargs="+", default=["before", "after"], choices=["before", "after"])
+    args = parser.parse_args()
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    originals = {
+        "run_blocking": main.run_blocking,
+        "get_user_id_from_token_async": main.get_user_id_from_token_async,
+        "load_conversation_history": main.load_conversation_history,
+        "get_async_client": main.get_async_client,
+    }
+
+    print("=" * 70)
+    print(f"🧪 /api/chat concurrency benchmark ({args.concurrency} simultaneous chats, "
+          f"LLM {args.llm_latency * 1000:.0f}ms, backends {args.backend_latency * 1000:.0f}ms)")
+    print("=" * 70)
+    print(f"{'mode':>8} | {'p50 (ms)':>9} | {'p99 (ms)':>9} | {'max (ms)':>9} | {'wall (s)':>8}")
+    print("-" * 70)
+
+    for mode in args.modes:
+        for name, func in originals.items():
+            setattr(main, name, func)
+        install_stubs(mode, args.llm_latency, args.backend_latency)
+        # Ẩn log của từng request chat
+        with contextlib.redirect_stdout(io.StringIO()):
+            latencies_ms, wall = asyncio.run(fire(args.concurrency))
+        print(f"{mode:>8} | {np.percentile(latencies_ms, 50):>9.1f} | {np.percentile(latencies_ms, 99):>9.1f} | "
+              f"{latencies_ms.max():>9.1f} | {wall:>8.2f}")
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmark: requests.get mỗi lần 1 kết nối mới (cũ) vs session dùng chung http_client.http (keep-alive pool)
+
+Server HTTP/1.1 cục bộ, mỗi kết nối mới chờ --handshake-ms (giả lập TCP + TLS handshake tới Spring Boot / googleapis).
+Đo tuần tự (1 request / lượt chat) và song song (--workers thread, vd: sync nhiều buổi học).
+
+Chạy:
+    python bench_http_pool.py
+    python bench_http_pool.py --requests 200 --handshake-ms 30 --workers 8
+"""
+import argparse
+import http.server
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from http_client import PooledSession, _stats
+
+
+def start_server(handshake_ms: float) -> http.server.ThreadingHTTPServer:
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True  # header + body ghi 2 lần: tránh Nagle + delayed ACK (~40 ms) trên kết nối keep-alive
+
+        def setup(self):
+            time.sleep(handshake_ms / 1000)
+            super().setup()
+
+        def do_GET(self):
+            body = b'{"success": true}'
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def run_case(get, url: str, total: int, workers: int) -> float:
+    started = time.perf_counter()
+    if workers <= 1:
+        for _ in range(total):
+            get(url).json()
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(lambda _: get(url).json(), range(total)))
+    return time.perf_counter() - started
+
+
+def run(total: int, handshake_ms: float, workers: int):
+    server = start_server(handshake_ms)
+    url = f"http://127.0.0.1:{server.server_port}/api/ping"
+
+    print(f"{total} request, handshake {handshake_ms:.0f} ms / kết nối")
+    print(f"{'':>22} | {'ms / request':>12} | {'kết nối mới':>11}")
+    print("-" * 52)
+    for label, concurrency in (("tuần tự", 1), (f"{workers} thread", workers)):
+        legacy_s = run_case(lambda u: requests.get(u, timeout=10), url, total, concurrency)
+
+        session = PooledSession()
+        pooled_s = run_case(session.get, url, total, concurrency)
+        host = url.split("/")[2]
+        opened = _stats.snapshot().get(host, {}).get("connections_opened", 0)
+        _stats.connections.pop(host, None)
+        _stats.requests.pop(host, None)
+        session.close()
+
+        print(f"{'requests.get ' + label:>22} | {legacy_s / total * 1000:>12.2f} | {total:>11}")
+        print(f"{'pooled ' + label:>22} | {pooled_s / total * 1000:>12.2f} | {opened:>11}")
+        print(f"{'speedup':>22} | {legacy_s / pooled_s:>11.1f}x |")
+        print("-" * 52)
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--handshake-ms", type=float, default=20)
+    parser.add_argument("--workers", type=int, default=8)
+    args = parser.parse_args()
+    run(args.requests, args.handshake_ms, args.workers)
@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmark: chuỗi detect_* cũ (lower() + re.search từng pattern mỗi lần gọi) vs intent_router.route
+
+Mô phỏng các lần detect của 1 request /api/chat cũ: detect_email_intent + detect_gmail_send_intent 2 lần
+(debug + routing), schedule / calendar sync / grade, 6 detect_* của Google Cloud agent, trigger của detect_tool_intent.
+Kiểm tra luôn kết quả 2 bên giống nhau trên corpus + --fuzz tin nhắn ngẫu nhiên.
+
+Chạy:
+    python bench_intent_router.py
+    python bench_intent_router.py --repeat 20
+"""
+import argparse
+import random
+import re
+import time
+
+from intent_router import IntentRouter, TOOL_INTENTS
+
+# Tin nhắn chat thực tế (tiếng Việt có dấu / không dấu / lẫn tiếng Anh)
+CORPUS = [
+    "Hôm nay tôi học gì?",
+    "mai có lớp không",
+    "Thời khóa biểu tuần sau",
+    "tkb tuần 12",
+    "lịch học thứ 5",
+    "Chủ nhật này có học không?",
+    "ngày 20/10/2025 học gì",
+    "ngay 5 thang 11 co lop khong",
+    "hôm qua học môn gì vậy",
+    "Xem điểm học kỳ này",
+    "kết quả học tập của tôi",
+    "đồng bộ tkb lên google calendar",
+    "sync my schedule to calendar",
+    "thêm lịch học vào calendar giúp mình",
+    "gửi mail xin nghỉ học đến teacher@tvu.edu.vn",
+    "gui mail cho thay Nam xin nghi hoc ngay mai",
+    "soạn email cho cô Lan về bài tập lớn",
+    "đọc email mới nhất",
+    "kiểm tra hộp thư",
+    "có email nào chưa đọc không",
+    "tìm email từ phòng đào tạo",
+    "search email about internship",
+    "check email",
+    "dịch câu này sang tiếng Anh: Tôi yêu lập trình",
+    "translate 'good morning' to Vietnamese",
+    "phân tích cảm xúc đoạn văn: \"Hôm nay thật tuyệt\"",
+    "đọc cho tôi: \"Xin chào các bạn\"",
+    "tạo lịch họp nhóm lúc 3h chiều mai",
+    "nhắc tôi nộp deadline báo cáo",
+    "phát nhạc lofi",
+    "mở video hướng dẫn Python",
+    "tìm kiếm thuật toán Dijkstra",
+    "wiki machine learning",
+    "Giải thích vòng lặp for trong Python",
+    "Cho tôi một ví dụ về đệ quy",
+    "Sự khác nhau giữa list và tuple là gì?",
+    "Viết hàm tính giai thừa bằng Java",
+    "Làm sao để học tốt môn cấu trúc dữ liệu?",
+    "Tóm tắt bài giảng về mạng máy tính",
+    "What is the time complexity of quicksort?",
+    "em muốn hỏi về đăng ký học phần học kỳ 2",
+    "cn tuần này có lịch thi không",
+    # Không dấu / dấu lẫn lộn (gõ vội trên điện thoại)
+    "soan mail",
+    "hop thu",
+    "kiem tra email",
+    "doc email",
+    "doc mail moi nhat",
+    "viet mail xin phep nghi hoc",
+    "email chua doc",
+    "tim mail tu phong dao tao",
+    "gửi mail den thay Nam",
+    "gui email đến cô Lan",
+    "kiểm tra email moi",
+    "đọc mail cua lop truong",
+    "gưi mail cho ban",
+    "thoi khoa bieu tuan sau",
+    "xem diem hoc ky nay",
+    "dong bo tkb len calendar",
+]
+
+# ----- Bản sao logic cũ (trước intent_router) -----
+LEGACY_EMAIL = [
+    r'gửi email', r'gửi mail', r'gửi gmail', r'gui email', r'gui mail', r'gui gmail',
+    r'send email', r'send mail', r'email cho', r'mail cho', r'gmail cho',
+    r'email den', r'mail den', r'gmail den', r'email đến', r'mail đến', r'gmail đến',
+    r'soạn email', r'soạn mail', r'soan email', r'soan mail',
+    r'viết email', r'viết mail', r'viet email', r'viet mail',
+    r'đọc email', r'đọc mail', r'doc email', r'doc mail', r'xem email', r'xem mail',
+    r'kiểm tra email', r'kiem tra email', r'check email', r'inbox', r'hộp thư', r'hop thu',
+    r'email mới', r'email moi', r'email chưa đọc', r'email chua doc', r'unread email',
+    r'tìm email', r'tìm mail', r'tim email', r'tim mail', r'search email',
+    r'email từ', r'email tu', r'email của', r'email cua', r'mail từ', r'mail tu', r'mail của', r'mail cua'
+]
+LEGACY_SEND = [
+    r'gửi email', r'gửi mail', r'gửi gmail', r'gui email', r'gui mail', r'gui gmail',
+    r'send email', r'send mail', r'email cho', r'mail cho', r'gmail cho',
+    r'email den', r'mail den', r'gmail den', r'email đến', r'mail đến', r'gmail đến',
+    r'soạn email', r'soạn mail', r'soan email', r'soan mail',
+    r'viết email', r'viết mail', r'viet email', r'viet mail'
+]
+LEGACY_SCHEDULE_EXCLUDE = [
+    r'gửi\s+(?:email|mail)', r'gui\s+(?:email|mail)', r'send\s+email', r'soạn\s+(?:email|mail)',
+    r'viết\s+(?:email|mail)', r'đọc\s+(?:email|mail)', r'xem\s+(?:email|mail)',
+    r'email\s+cho', r'mail\s+cho', r'mail\s+den', r'email\s+den'
+]
+LEGACY_SCHEDULE = [
+    r'thời khóa biểu', r'tkb', r'lịch học', r'hôm nay.*lớp', r'có lớp', r'schedule',
+    r'hôm qua', r'hom qua', r'\bmai\b', r'\bmốt\b', r'\bmot\b', r'\bkia\b',
+    r'thứ\s*[2-7]', r'chủ\s*nhật', r'cn\b',
+    r'(?:ngày\s+)?\d{1,2}[/-]\d{1,2}[/-]\d{4}', r'ngày\s+\d{1,2}/\d{1,2}',
+    r'(?:ngày|ngay)\s+\d{1,2}\s+(?:tháng|thang)\s+\d{1,2}'
+]
+LEGACY_CALENDAR_SYNC = [
+    r'đồng bộ.*(?:tkb|thời khóa biểu|lịch học).*calendar', r'sync.*(?:schedule|tkb).*calendar',
+    r'thêm.*(?:tkb|lịch học).*(?:vào|lên).*calendar', r'add.*schedule.*calendar',
+    r'đưa.*(?:tkb|lịch).*lên.*calendar'
+]
+LEGACY_GRADE = [r'điểm', r'grade', r'kết quả học tập', r'điểm số']
+LEGACY_GOOGLE_CLOUD = {
+    "gc_calendar": [r'tạo.*lịch', r'thêm.*sự kiện', r'nhắc.*tôi', r'calendar.*event', r'lịch.*hôm nay',
+                    r'lịch.*tuần', r'meeting', r'cuộc họp', r'deadline'],
+    "gc_vision": [r'phân tích.*ảnh', r'nhận diện.*ảnh', r'xem.*ảnh', r'đọc.*ảnh', r'analyze.*image',
+                  r'what.*in.*image', r'ocr'],
+    "gc_translate": [r'dịch', r'translate', r'chuyển.*sang', r'nghĩa.*tiếng'],
+    "gc_speech_to_text": [r'chuyển.*audio', r'transcribe', r'giọng nói.*text', r'speech.*text'],
+    "gc_text_to_speech": [r'đọc.*cho.*tôi', r'text.*speech', r'chuyển.*giọng nói', r'phát âm'],
+    "gc_sentiment": [r'cảm xúc', r'sentiment', r'tích cực.*tiêu cực', r'phân tích.*đoạn'],
+}
+LEGACY_TOOL_TRIGGERS = [
+    "phát", "play", "chơi", "bật",
+    "mở video", "xem video", "open video", "show video", "youtube", "tìm video",
+    "tìm kiếm", "search", "google", "tra google", "tìm trên google",
+    "wikipedia", "wiki", "tra wikipedia"
+]
+
+
+def _any(patterns, message):
+    return any(re.search(pattern, message.lower()) for pattern in patterns)
+
+
+def legacy_detect(message):
+    """Các lần detect của 1 request cũ, trả về intent nào khớp"""
+    result = {}
+    for _ in range(2):  # debug block + routing
+        result["email"] = _any(LEGACY_EMAIL, message)
+        result["gmail_send"] = _any(LEGACY_SEND, message)
+    result["schedule"] = (
+        '@' not in message.lower()
+        and not _any(LEGACY_SCHEDULE_EXCLUDE, message)
+        and _any(LEGACY_SCHEDULE, message)
+    )
+    result["calendar_sync"] = _any(LEGACY_CALENDAR_SYNC, message)
+    result["grade"] = _any(LEGACY_GRADE, message)
+    for intent, patterns in LEGACY_GOOGLE_CLOUD.items():
+        result[intent] = _any(patterns, message)
+    message_lower = message.lower()
+    result["tool"] = any(trigger in message_lower for trigger in LEGACY_TOOL_TRIGGERS)
+    return result
+
+
+def router_detect(router, message):
+    intents = router.route(message)
+    result = {intent: intents.matched(intent) for intent in ("email", "gmail_send", "calendar_sync", "grade")}
+    result["schedule"] = (
+        '@' not in message
+        and not intents.matched("schedule_exclude")
+        and intents.matched("schedule")
+    )
+    for intent in LEGACY_GOOGLE_CLOUD:
+        result[intent] = intents.matched(intent)
+    result["tool"] = intents.matched_any(TOOL_INTENTS)
+    return result
+
+
+def fuzz_messages(count, seed=0):
+    """Tin nhắn ngẫu nhiên ghép từ mảnh pattern (có dấu / bỏ dấu / dấu lẫn lộn) + từ thường"""
+    from intent_router import fold_diacritics
+    fragments = set()
+    for patterns in (LEGACY_EMAIL, LEGACY_SEND, LEGACY_GRADE, LEGACY_TOOL_TRIGGERS):
+        for pattern in patterns:
+            fragments.update(pattern.split())
+    fragments.update(["tkb", "lịch", "học", "tuần", "mai", "thứ", "5", "calendar", "cho", "tôi", "ảnh", "@", "Nam"])
+    fragments = sorted(fragments | {fold_diacritics(f) for f in fragments})
+    rng = random.Random(seed)
+    return [" ".join(rng.choice(fragments) for _ in range(rng.randint(1, 6))) for _ in range(count)]
+
+
+def time_call(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run(repeat, rounds, fuzz):
+    router = IntentRouter()  # không qua lru_cache của route() - đo đúng chi phí quét
+
+    mismatches = [
+        (message, legacy_detect(message), router_detect(router, message))
+        for message in CORPUS + fuzz_messages(fuzz)
+        if legacy_detect(message) != router_detect(router, message)
+    ]
+
+    def legacy():
+        for _ in range(rounds):
+            for message in CORPUS:
+                legacy_detect(message)
+
+    def routed():
+        for _ in range(rounds):
+            for message in CORPUS:
+                router_detect(router, message)
+
+    n = rounds * len(CORPUS)
+    legacy_s = time_call(legacy, repeat)
+    router_s = time_call(routed, repeat)
+    print(f"{len(CORPUS)} tin nhắn x {rounds} vòng, best of {repeat}")
+    print(f"{'':>10} | {'µs / tin nhắn':>14}")
+    print("-" * 28)
+    print(f"{'legacy':>10} | {legacy_s / n * 1e6:>14.1f}")
+    print(f"{'router':>10} | {router_s / n * 1e6:>14.1f}")
+    print(f"speedup: {legacy_s / router_s:.1f}x")
+
+    if mismatches:
+        print(f"\n⚠️ {len(mismatches)} tin nhắn cho kết quả khác nhau:")
+        for message, old, new in mismatches:
+            diff = {k: (old[k], new[k]) for k in old if old[k] != new[k]}
+            print(f"  {message!r}: {diff}")
+    else:
+        print(f"\n✅ Kết quả intent giống nhau trên toàn bộ corpus + {fuzz} tin nhắn ngẫu nhiên")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--rounds", type=int, default=50)
+    parser.add_argument("--fuzz", type=int, default=20000, help="Số tin nhắn ngẫu nhiên để so kết quả")
+    args = parser.parse_args()
+    run(args.repeat, args.rounds, args.fuzz)
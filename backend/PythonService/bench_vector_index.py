@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Đánh giá recall/latency của các vector index backend so với quét chính xác
+
+Tập đánh giá cố định (seed 42): vectors có cấu trúc cụm giống embedding thật,
+query = vector trong corpus + nhiễu nhỏ.
+
+Chạy:
+    python bench_vector_index.py
+    python bench_vector_index.py --n 100000 --backends ivf hnsw --k 5
+    python bench_vector_index.py --store knowledge_base_store   # dùng knowledge base thật
+"""
+import argparse
+import time
+
+import numpy as np
+
+from vector_index import HNSWLIB_AVAILABLE, create_vector_index, evaluate_index
+
+
+def make_eval_set(n, dim, n_queries, n_clusters=200, seed=42):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((n_clusters, dim), dtype=np.float32)
+    labels = rng.integers(0, n_clusters, size=n)
+    vectors = centers[labels] + 0.6 * rng.standard_normal((n, dim), dtype=np.float32)
+    picks = rng.integers(0, n, size=n_queries)
+    queries = vectors[picks] + 0.3 * rng.standard_normal((n_queries, dim), dtype=np.float32)
+    return vectors, queries
+
+
+def load_store_eval_set(directory, n_queries, seed=42):
+    from kb_storage import KnowledgeBaseStore
+
+    _, vectors = KnowledgeBaseStore(directory).load()
+    rng = np.random.default_rng(seed)
+    picks = rng.integers(0, len(vectors), size=n_queries)
+    queries = vectors[picks] + 0.01 * rng.standard_normal((n_queries, vectors.shape[1]), dtype=np.float32)
+    return vectors, queries
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Vector index recall/latency benchmark")
+    parser.add_argument("--n", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--backends", nargs="+", default=["bruteforce", "ivf", "hnsw"])
+    parser.add_argument("--nprobe", type=int, default=8, help="IVF: số cụm quét mỗi query")
+    parser.add_argument("--store", help="Đánh giá trên knowledge base thật thay vì dữ liệu tổng hợp")
+    args = parser.parse_args()
+
+    if args.store:
+        vectors, queries = load_store_eval_set(args.store, args.queries)
+    else:
+        vectors, queries = make_eval_set(args.n, args.dim, args.queries)
+
+    print("=" * 78)
+    print(f"🧪 Vector index benchmark (n={len(vectors)}, dim={vectors.shape[1]}, k={args.k}, queries={len(queries)})")
+    print("=" * 78)
+    print(f"{'backend':>10} | {'build (s)':>9} | {'recall@k':>8} | {'avg (ms)':>8} | {'p95 (ms)':>8} | {'exact (ms)':>10} | speedup")
+    print("-" * 78)
+
+    for backend in args.backends:
+        if backend == "hnsw" and not HNSWLIB_AVAILABLE:
+            print(f"{backend:>10} | skipped (hnswlib not installed)")
+            continue
+        kwargs = {"nprobe": args.nprobe} if backend == "ivf" else {}
+        index = create_vector_index(backend, **kwargs)
+
+        start = time.perf_counter()
+        index.add(vectors)
+        build_s = time.perf_counter() - start
+
+        report = evaluate_index(index, queries, k=args.k)
+        print(f"{backend:>10} | {build_s:>9.2f} | {report['recall_at_k']:>8.3f} | {report['avg_latency_ms']:>8.3f} | "
+              f"{report['p95_latency_ms']:>8.3f} | {report['exact_avg_latency_ms']:>10.3f} | {report['speedup']}x")
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmark: SimpleVectorDB.search cũ (pure Python) vs EmbeddingMatrix (NumPy)
+
+Chạy:
+    python bench_vector_search.py
+    python bench_vector_search.py --sizes 1000 10000 --dim 768 --k 5
+"""
+import argparse
+import time
+
+import numpy as np
+
+from vector_search import EmbeddingMatrix, cosine_similarity
+
+
+def legacy_search(documents, query_embedding, n_results):
+    """Bản sao logic search cũ: cosine từng doc + sort toàn bộ"""
+    similarities = []
+    for doc in documents:
+        similarity = cosine_similarity(query_embedding, doc['embedding'])
+        similarities.append({
+            "document": doc['document'],
+            "distance": 1 - similarity,
+            "metadata": doc['metadata'],
+            "id": doc['id'],
+            "similarity": similarity
+        })
+    similarities.sort(key=lambda x: x['similarity'], reverse=True)
+    return [r['id'] for r in similarities[:n_results]]
+
+
+def matrix_search(matrix, documents, query_embedding, n_results):
+    indices, _ = matrix.search(query_embedding, n_results)
+    return [documents[i]['id'] for i in indices]
+
+
+def time_call(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run(sizes, dim, k, repeat, legacy_limit):
+    rng = np.random.default_rng(42)
+    print(f"{'n':>8} | {'legacy (ms)':>12} | {'numpy (ms)':>11} | {'speedup':>8} | same top-k")
+    print("-" * 62)
+
+    for n in sizes:
+        vectors = rng.standard_normal((n, dim), dtype=np.float32)
+        query = rng.standard_normal(dim, dtype=np.float32).tolist()
+
+        matrix = EmbeddingMatrix()
+        matrix.append(vectors)
+
+        numpy_docs = [{"id": f"doc_{i}"} for i in range(n)]
+        numpy_ms = time_call(lambda: matrix_search(matrix, numpy_docs, query, k), repeat) * 1000
+
+        if n <= legacy_limit:
+            documents = [
+                {"id": f"doc_{i}", "document": "", "metadata": {}, "embedding": row}
+                for i, row in enumerate(vectors.tolist())
+            ]
+            legacy_ms = time_call(lambda: legacy_search(documents, query, k), 1) * 1000
+            same = legacy_search(documents, query, k) == matrix_search(matrix, numpy_docs, query, k)
+            print(f"{n:>8} | {legacy_ms:>12.2f} | {numpy_ms:>11.3f} | {legacy_ms / numpy_ms:>7.0f}x | {same}")
+        else:
+            print(f"{n:>8} | {'skipped':>12} | {numpy_ms:>11.3f} | {'-':>8} | -")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark vector search")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--legacy-limit", type=int, default=100000,
+                        help="Bỏ qua bản pure Python khi n lớn hơn giá trị này")
+    args = parser.parse_args()
+
+    print("=" * 62)
+    print(f"🧪 Vector search benchmark (dim={args.dim}, k={args.k})")
+    print("=" * 62)
+    run(args.sizes, args.dim, args.k, args.repeat, args.legacy_limit)
@@ -0,0 +1,228 @@
+"""
+Calendar Sync
+Đồng bộ lớp học lên Google Calendar theo diff, dùng chung bởi agent_features (tạo danh sách event)
+và google_cloud_service_oauth (so với Calendar rồi gọi API)
+
+- Event id ổn định = "tkb" + sha1(summary | start) - Calendar cho phép client tự đặt id (base32hex: 0-9, a-v),
+  nên tra trùng là tra dict O(1) thay vì so chuỗi từng event
+- extendedProperties.private.tkb_hash lưu hash nội dung event -> sync lại chỉ cập nhật lớp thay đổi
+- Lớp học cả học kỳ: mỗi nhóm (môn, thứ, tiết, phòng) là 1 event lặp hàng tuần (RRULE) với EXDATE cho tuần nghỉ,
+  thay vì 1 event cho mỗi buổi - 15 tuần x N lớp chỉ còn N event / N request
+- Event do đồng bộ tạo (id bắt đầu bằng "tkb" VÀ có extendedProperties.private.tkb_hash) trong khoảng thời gian
+  sync mà không còn trong TKB thì bị xóa (sync 1 tuần chỉ xóa event lẻ, không đụng tới event lặp của cả học kỳ).
+  Chỉ dựa vào id thì không đủ: id ngẫu nhiên của Google cũng có thể bắt đầu bằng "tkb" (~1/32768)
+- Event cũ tạo bằng id ngẫu nhiên (trước khi có id ổn định) nhưng trùng summary + start thì giữ nguyên,
+  trừ khi buổi đó đã nằm trong 1 event lặp (khi đó xóa để không hiện 2 lần)
+"""
+import hashlib
+import json
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set
+
+EVENT_ID_PREFIX = "tkb"
+TIMEZONE = "Asia/Ho_Chi_Minh"
+
+
+def event_id(summary: str, start: str) -> str:
+    """Id Calendar ổn định cho 1 buổi học (start so tới phút: YYYY-MM-DDTHH:MM)"""
+    digest = hashlib.sha1(f"{summary}|{start[:16]}".encode("utf-8")).hexdigest()
+    return f"{EVENT_ID_PREFIX}{digest}"
+
+
+def series_id(summary: str, first_start: str) -> str:
+    """Id Calendar ổn định cho event lặp của 1 lớp (theo buổi học đầu tiên của học kỳ)"""
+    digest = hashlib.sha1(f"series|{summary}|{first_start[:16]}".encode("utf-8")).hexdigest()
+    return f"{EVENT_ID_PREFIX}{digest}"
+
+
+def _content_hash(event: Dict) -> str:
+    content = {k: v for k, v in event.items() if k not in ("id", "extendedProperties")}
+    return hashlib.sha1(json.dumps(content, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def _class_event_body(
+    schedule: Dict,
+    class_date: datetime,
+    reminder_email: int = None,
+    reminder_popup: int = None,
+    notification_email: str = None
+) -> Dict:
+    subject = schedule.get('subject', 'Lớp học')
+    room = schedule.get('room', '')
+    date_str = class_date.strftime('%Y-%m-%d')
+    start = f"{date_str}T{schedule.get('start_time', '07:00')[:5]}:00+07:00"
+    end = f"{date_str}T{schedule.get('end_time', '09:00')[:5]}:00+07:00"
+
+    event = {
+        "summary": f"📚 {subject}",
+        "description": f"Giảng viên: {schedule.get('teacher', '')}\nLớp: {schedule.get('class_name', '')}",
+        "start": {"dateTime": start, "timeZone": TIMEZONE},
+        "end": {"dateTime": end, "timeZone": TIMEZONE}
+    }
+    if room:
+        event["location"] = f"Phòng {room}"
+    if notification_email:
+        event["attendees"] = [{"email": notification_email}]
+    if reminder_email is not None or reminder_popup is not None:
+        overrides = []
+        if reminder_email is not None:
+            overrides.append({"method": "email", "minutes": reminder_email})
+        if reminder_popup is not None:
+            overrides.append({"method": "popup", "minutes": reminder_popup})
+        event["reminders"] = {"useDefault": False, "overrides": overrides}
+    return event
+
+
+def build_class_event(
+    schedule: Dict,
+    class_date: datetime,
+    reminder_email: int = None,
+    reminder_popup: int = None,
+    notification_email: str = None
+) -> Dict:
+    """Dòng TKB + ngày học -> Calendar event resource (có id ổn định và tkb_hash)"""
+    event = _class_event_body(schedule, class_date, reminder_email, reminder_popup, notification_email)
+    event["id"] = event_id(event["summary"], event["start"]["dateTime"])
+    event["extendedProperties"] = {"private": {"tkb_hash": _content_hash(event)}}
+    return event
+
+
+def build_class_series(
+    schedule: Dict,
+    class_dates: List[datetime],
+    reminder_email: int = None,
+    reminder_popup: int = None,
+    notification_email: str = None
+) -> Dict:
+    """
+    Dòng TKB + các ngày học (cùng thứ, khác tuần) -> 1 event lặp hàng tuần
+
+    RRULE:FREQ=WEEKLY tới buổi cuối, EXDATE cho các tuần nghỉ ở giữa.
+    Chỉ có 1 buổi thì trả về event thường (build_class_event)
+    """
+    dates = sorted({d.replace(hour=0, minute=0, second=0, microsecond=0) for d in class_dates})
+    if len(dates) == 1:
+        return build_class_event(schedule, dates[0], reminder_email, reminder_popup, notification_email)
+
+    event = _class_event_body(schedule, dates[0], reminder_email, reminder_popup, notification_email)
+    start_time = schedule.get('start_time', '07:00')[:5].replace(':', '') + "00"
+    skipped = []
+    week_date = dates[0]
+    while week_date < dates[-1]:
+        if week_date not in dates:
+            skipped.append(week_date)
+        week_date += timedelta(days=7)
+
+    # UNTIL theo UTC, 23:59:59Z ngày học cuối luôn sau buổi cuối (+07:00) và trước tuần kế tiếp
+    event["recurrence"] = [f"RRULE:FREQ=WEEKLY;UNTIL={dates[-1].strftime('%Y%m%d')}T235959Z"]
+    if skipped:
+        event["recurrence"].append(
+            f"EXDATE;TZID={TIMEZONE}:" + ",".join(f"{d.strftime('%Y%m%d')}T{start_time}" for d in skipped)
+        )
+    event["id"] = series_id(event["summary"], event["start"]["dateTime"])
+    event["extendedProperties"] = {"private": {
+        "tkb_hash": _content_hash(event),
+        "tkb_dates": ",".join(d.strftime('%Y-%m-%d') for d in dates)
+    }}
+    return event
+
+
+def _event_start(event: Dict) -> str:
+    start = event.get("start", {})
+    return start.get("dateTime", start.get("date", "")) if isinstance(start, dict) else str(start)
+
+
+def _is_synced(event: Dict) -> bool:
+    """Event do đồng bộ TKB tạo ra (id ổn định + tkb_hash) - chỉ những event này mới được xóa / coi là event lặp của TKB"""
+    return (
+        event.get("id", "").startswith(EVENT_ID_PREFIX)
+        and bool(event.get("extendedProperties", {}).get("private", {}).get("tkb_hash"))
+    )
+
+
+def _occurrence_keys(event: Dict) -> Set[str]:
+    """event_id của từng buổi học mà event bao phủ (event lặp: theo tkb_dates)"""
+    summary = event.get("summary", "")
+    start = _event_start(event)
+    if not event.get("recurrence"):
+        return {event_id(summary, start)}
+    dates = event.get("extendedProperties", {}).get("private", {}).get("tkb_dates", "")
+    return {event_id(summary, f"{d}T{start[11:16]}") for d in dates.split(",") if d}
+
+
+def diff_events(desired: List[Dict], existing: List[Dict]) -> Dict[str, List]:
+    """
+    So sánh event cần có với event đang có trên Calendar (trong cùng khoảng thời gian)
+
+    desired có event lặp (đồng bộ cả học kỳ) thì mọi event "tkb" không còn cần đều bị xóa;
+    chỉ có event lẻ (đồng bộ 1 tuần) thì event lặp đang có được giữ, buổi nằm trong event lặp không tạo lại
+
+    Returns:
+        {"create": [event], "update": [event], "delete": [event id], "unchanged": [event id]}
+    """
+    series_sync = any(event.get("recurrence") for event in desired)
+
+    # Index event đang có theo id ổn định (tính lại cho cả event cũ có id ngẫu nhiên)
+    by_key: Dict[str, Dict] = {}
+    covered: Set[str] = set()
+    for event in existing:
+        key = event.get("id", "")
+        if not _is_synced(event):
+            key = event_id(event.get("summary", ""), _event_start(event))
+        elif event.get("recurrence"):
+            covered |= _occurrence_keys(event)
+        by_key.setdefault(key, event)
+
+    create, update, unchanged = [], [], []
+    wanted = set()
+    series_occurrences: Set[str] = set()
+    for event in desired:
+        wanted.add(event["id"])
+        if event.get("recurrence"):
+            series_occurrences |= _occurrence_keys(event)
+        current = by_key.get(event["id"])
+        if not series_sync and event["id"] in covered:
+            unchanged.append(event["id"])  # buổi đã nằm trong event lặp của học kỳ
+        elif current is None:
+            create.append(event)
+        elif current.get("id") != event["id"]:
+            unchanged.append(current.get("id"))  # event cũ trùng lớp học, không tạo thêm
+        elif (current.get("extendedProperties", {}).get("private", {}).get("tkb_hash")
+              != event["extendedProperties"]["private"]["tkb_hash"]):
+            update.append(event)
+        else:
+            unchanged.append(event["id"])
+
+    delete = []
+    for event in existing:
+        current_id = event.get("id", "")
+        if _is_synced(event):
+            if current_id not in wanted and (series_sync or not event.get("recurrence")):
+                delete.append(current_id)
+        elif event_id(event.get("summary", ""), _event_start(event)) in series_occurrences:
+            delete.append(current_id)  # event cũ id ngẫu nhiên, nay đã có trong event lặp
+    return {"create": create, "update": update, "delete": delete, "unchanged": unchanged}
+
+
+def sync_summary(outcomes: List[Dict], unchanged: int) -> Dict[str, int]:
+    """Đếm kết quả theo loại thao tác"""
+    summary = {op: 0 for op in ("create", "update", "delete")}
+    failed = 0
+    for outcome in outcomes:
+        if outcome.get("success"):
+            summary[outcome["op"]] += 1
+        else:
+            failed += 1
+    summary["unchanged"] = unchanged
+    summary["failed"] = failed
+    return summary
+
+
+def time_range(dates: List[datetime]) -> Optional[Dict[str, str]]:
+    """time_min / time_max bao các ngày học"""
+    if not dates:
+        return None
+    return {
+        "time_min": f"{min(dates).strftime('%Y-%m-%d')}T00:00:00+07:00",
+        "time_max": f"{max(dates).strftime('%Y-%m-%d')}T23:59:59+07:00"
+    }
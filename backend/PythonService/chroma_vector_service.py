@@ -8,6 +8,7 @@ from sentence_transformers import SentenceTransformer
 import os
 from typing import List, Dict, Optional
 import logging
+from embedding_cache import EmbeddingCache, get_embedding_cache
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -16,14 +17,20 @@ logger = logging.getLogger(__name__)
 class ChromaVectorService:
     """Production-grade vector service với ChromaDB"""
     
-    def __init__(self, persist_directory: str = "./chroma_db"):
+    EMBEDDING_MODEL = 'paraphrase-multilingual-MiniLM-L12-v2'
+    # Sentence Transformers không phân biệt query/document nên dùng chung 1 task_type trong cache
+    EMBEDDING_TASK = "sentence-transformers"
+    
+    def __init__(self, persist_directory: str = "./chroma_db", embedding_cache: Optional[EmbeddingCache] = None):
         """
         Initialize ChromaDB với persistent storage
         
         Args:
             persist_directory: Thư mục lưu trữ database
+            embedding_cache: Cache embedding (mặc định dùng cache chung của service)
         """
         self.persist_directory = persist_directory
+        self.embedding_cache = embedding_cache or get_embedding_cache()
         
         # Initialize ChromaDB client
         self.client = chromadb.PersistentClient(
@@ -37,9 +44,7 @@ class ChromaVectorService:
         # Initialize embedding model
         # Sử dụng model đa ngôn ngữ (Vietnamese + English)
         logger.info("Loading embedding model...")
-        self.embedding_model = SentenceTransformer(
-            'paraphrase-multilingual-MiniLM-L12-v2'
-        )
+        self.embedding_model = SentenceTransformer(self.EMBEDDING_MODEL)
         
         # Get or create collection
         self.collection = self.client.get_or_create_collection(
@@ -52,6 +57,19 @@ class ChromaVectorService:
         
         logger.info(f"✅ ChromaDB initialized: {self.collection.count()} documents")
     
+    def _embed(self, texts: List[str]) -> List[List[float]]:
+        """Embed texts qua cache, chỉ encode những text chưa có"""
+        return self.embedding_cache.get_or_compute(
+            self.EMBEDDING_MODEL,
+            self.EMBEDDING_TASK,
+            texts,
+            lambda missing: self.embedding_model.encode(
+                missing,
+                show_progress_bar=False,
+                convert_to_numpy=True
+            ).tolist()
+        )
+    
     def add_documents(
         self,
         documents: List[str],
@@ -76,11 +94,7 @@ class ChromaVectorService:
                 ids = [f"doc_{start_id + i}" for i in range(len(documents))]
             
             # Generate embeddings
-            embeddings = self.embedding_model.encode(
-                documents,
-                show_progress_bar=False,
-                convert_to_numpy=True
-            ).tolist()
+            embeddings = self._embed(documents)
             
             # Add to ChromaDB
             self.collection.add(
@@ -124,11 +138,7 @@ class ChromaVectorService:
         """
         try:
             # Generate query embedding
-            query_embedding = self.embedding_model.encode(
-                query,
-                show_progress_bar=False,
-                convert_to_numpy=True
-            ).tolist()
+            query_embedding = self._embed([query])[0]
             
             # Search in ChromaDB
             results = self.collection.query(
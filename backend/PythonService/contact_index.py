@@ -0,0 +1,290 @@
+"""
+Contact Index
+Danh bạ người nhận của từng user (email, tên hiển thị, token tên không dấu, số lần gửi, lần gửi gần nhất)
+để xếp hạng người nhận và tìm địa chỉ theo tên ("gửi mail cho thầy Nam") mà không phải tải lại 100 email đã gửi
+
+- Cập nhật tăng dần: mỗi email đã gửi (gửi qua GmailService / đồng bộ bản sao hộp thư / lần quét đầu) ghi 1 dòng
+  (user, message_id, email) - cùng 1 email ghi nhiều lần không bị đếm 2 lần
+- Tìm theo tên: bỏ dấu + bỏ danh xưng (thầy, cô, anh, chị...), mỗi từ phải khớp 1 token của tên / phần trước @
+  theo prefix >= 3 ký tự (index prefix trong bộ nhớ), không có thì khớp gần đúng (từ >= 4 ký tự, sai 1-2 ký tự).
+  Cụm có hư từ (tôi, về, xin, mình...) không phải tên người nhận
+- Xếp hạng: mức khớp (đúng > prefix > gần đúng), rồi số lần gửi, rồi lần gửi gần nhất. Ứng viên có "exact" khi
+  mọi từ khớp đúng 1 token - chỉ ứng viên này mới được chọn tự động
+"""
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from email.utils import getaddresses
+from typing import Dict, List, Optional, Set, Tuple
+
+from intent_router import fold_diacritics
+
+# Danh xưng đứng trước tên người nhận (đã bỏ dấu)
+HONORIFICS = {
+    "thay", "co", "anh", "chi", "em", "ban", "ong", "ba", "bac", "chu", "gv", "giao", "vien", "sv",
+    "mr", "mrs", "ms", "dr", "sir"
+}
+
+# Hư từ / từ thường gặp sau "cho" (đã bỏ dấu): "gửi mail cho tôi...", "cho em về bài tập" - không phải tên
+STOPWORDS = {
+    "toi", "minh", "tao", "ve", "xin", "hoi", "voi", "cua", "la", "va", "de", "thi", "ma", "nay", "do", "gi",
+    "nhe", "nha", "giup", "dum", "ho", "bao", "noi", "rang", "duoc", "khong", "roi", "cac", "moi", "nhung", "mot"
+}
+
+_TOKEN_SPLIT_RE = re.compile(r"[^a-z0-9]+")
+
+# Prefix ngắn nhất được index / độ dài tối thiểu để khớp gần đúng
+_MIN_PREFIX = 3
+_MIN_FUZZY = 4
+
+# Điểm mỗi từ của truy vấn
+_EXACT, _PREFIX, _FUZZY = 3.0, 2.0, 1.0
+
+
+def name_tokens(text: str) -> List[str]:
+    """Token không dấu, chữ thường: "Nguyễn Văn Nam" -> ["nguyen", "van", "nam"], "nam.nv2" -> ["nam", "nv2"]"""
+    return [token for token in _TOKEN_SPLIT_RE.split(fold_diacritics(text or "").lower()) if token]
+
+
+def _within_distance(a: str, b: str, limit: int) -> bool:
+    """Khoảng cách sửa (thêm / bớt / thay / đảo 2 ký tự kề nhau) giữa a và b <= limit, dừng sớm khi cả hàng vượt limit"""
+    if abs(len(a) - len(b)) > limit:
+        return False
+    before, previous = None, list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            cost = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb))
+            if before is not None and j > 1 and ca == b[j - 2] and a[i - 2] == cb:
+                cost = min(cost, before[j - 2] + 1)
+            current.append(cost)
+        if min(current) > limit:
+            return False
+        before, previous = previous, current
+    return previous[-1] <= limit
+
+
+class _UserContacts:
+    """Danh bạ 1 user trong bộ nhớ + index prefix token -> email"""
+
+    def __init__(self):
+        self.contacts: Dict[str, Dict] = {}
+        self.tokens: Dict[str, Set[str]] = {}
+        self.prefixes: Dict[str, Set[str]] = {}
+
+    def add(self, email: str, name: str, sent_at: float, count: int = 1):
+        contact = self.contacts.get(email)
+        if contact is None:
+            contact = self.contacts[email] = {"email": email, "name": "", "count": 0, "last_sent": 0.0}
+        contact["count"] += count
+        if sent_at >= contact["last_sent"]:
+            contact["last_sent"] = sent_at
+            if name:
+                contact["name"] = name
+        elif name and not contact["name"]:
+            contact["name"] = name
+        for token in name_tokens(name) + name_tokens(email.split("@")[0]):
+            self.tokens.setdefault(token, set()).add(email)
+            for end in range(_MIN_PREFIX, len(token) + 1):
+                self.prefixes.setdefault(token[:end], set()).add(email)
+
+    def match(self, token: str) -> Dict[str, float]:
+        """email -> điểm tốt nhất của 1 từ truy vấn"""
+        scores = {email: _PREFIX for email in self.prefixes.get(token, ())}
+        for email in self.tokens.get(token, ()):
+            scores[email] = _EXACT
+        if not scores and len(token) >= _MIN_FUZZY:
+            limit = 1 if len(token) < 7 else 2
+            for candidate, emails in self.tokens.items():
+                if _within_distance(token, candidate, limit):
+                    for email in emails:
+                        scores[email] = _FUZZY
+        return scores
+
+
+class ContactIndex:
+    """Danh bạ người nhận theo user: SQLite lưu lâu dài + index tên trong bộ nhớ (thread-safe)"""
+
+    def __init__(self, db_path: str = "gmail_mirror.sqlite3", max_users: int = 1000):
+        """
+        Args:
+            db_path: File SQLite (mặc định dùng chung file với bản sao hộp thư)
+            max_users: Số user giữ index trong bộ nhớ
+        """
+        self.max_users = max(1, max_users)
+        self._users: Dict[int, _UserContacts] = {}
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.recorded = 0
+
+        db_dir = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(db_dir, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=5)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS contact_sends ("
+            " user_id INTEGER NOT NULL,"
+            " message_id TEXT NOT NULL,"
+            " email TEXT NOT NULL,"
+            " name TEXT,"
+            " sent_at REAL NOT NULL DEFAULT 0,"
+            " PRIMARY KEY (user_id, message_id, email));"
+            "CREATE TABLE IF NOT EXISTS contact_state ("
+            " user_id INTEGER PRIMARY KEY,"
+            " bootstrapped_at REAL NOT NULL);"
+        )
+        self._conn.commit()
+
+    def _load_locked(self, user_id: int) -> _UserContacts:
+        contacts = self._users.get(user_id)
+        if contacts is None:
+            contacts = _UserContacts()
+            rows = self._conn.execute(
+                "SELECT email, name, sent_at FROM contact_sends WHERE user_id = ? ORDER BY sent_at", (user_id,)
+            ).fetchall()
+            for email, name, sent_at in rows:
+                contacts.add(email, name or "", sent_at)
+            if len(self._users) >= self.max_users:
+                self._users.pop(next(iter(self._users)))
+            self._users[user_id] = contacts
+        return contacts
+
+    def record(self, user_id: int, message_id: str, to_header: str, sent_at: Optional[float] = None) -> int:
+        """
+        Ghi người nhận của 1 email đã gửi (header To: "Thầy Nam <nam@tvu.edu.vn>, b@x.com")
+
+        Returns:
+            Số người nhận mới được ghi (0 nếu email này đã ghi rồi)
+        """
+        sent_at = sent_at if sent_at is not None else time.time()
+        recipients = [(address.strip().lower(), name.strip()) for name, address in getaddresses([to_header or ""])
+                      if "@" in address]
+        added = 0
+        with self._lock:
+            contacts = self._users.get(user_id)
+            for email, name in recipients:
+                inserted = self._conn.execute(
+                    "INSERT OR IGNORE INTO contact_sends (user_id, message_id, email, name, sent_at) VALUES (?, ?, ?, ?, ?)",
+                    (user_id, message_id, email, name, sent_at)
+                ).rowcount
+                if inserted:
+                    added += 1
+                    if contacts is not None:
+                        contacts.add(email, name, sent_at)
+            self._conn.commit()
+        self.recorded += added
+        return added
+
+    def bootstrapped(self, user_id: int) -> bool:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT 1 FROM contact_state WHERE user_id = ?", (user_id,)
+            ).fetchone() is not None
+
+    def mark_bootstrapped(self, user_id: int):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO contact_state (user_id, bootstrapped_at) VALUES (?, ?)", (user_id, time.time())
+            )
+            self._conn.commit()
+
+    def forget(self, user_id: int):
+        """Xóa danh bạ của user (ngắt kết nối / đổi tài khoản Google)"""
+        with self._lock:
+            self._conn.execute("DELETE FROM contact_sends WHERE user_id = ?", (user_id,))
+            self._conn.execute("DELETE FROM contact_state WHERE user_id = ?", (user_id,))
+            self._conn.commit()
+            self._users.pop(user_id, None)
+
+    def _public(self, contact: Dict, score: float = None) -> Dict:
+        result = {
+            "email": contact["email"],
+            "name": contact["name"] or contact["email"].split("@")[0],
+            "count": contact["count"],
+            "last_sent": contact["last_sent"]
+        }
+        if score is not None:
+            result["score"] = round(score, 3)
+        return result
+
+    def top(self, user_id: int, limit: int = 20) -> List[Dict]:
+        """Người nhận gửi nhiều nhất (rồi gần nhất)"""
+        with self._lock:
+            contacts = list(self._load_locked(user_id).contacts.values())
+        contacts.sort(key=lambda c: (c["count"], c["last_sent"]), reverse=True)
+        return [self._public(contact) for contact in contacts[:limit]]
+
+    def lookup(self, user_id: int, query: str, limit: int = 5) -> List[Dict]:
+        """
+        Tìm người nhận theo tên / phần đầu địa chỉ, bỏ danh xưng:
+        "thầy Nam" -> [{"email", "name", "count", "score", "exact"}]
+
+        Mọi từ (trừ danh xưng) phải khớp; [] nếu không có ai hoặc truy vấn có hư từ
+        """
+        tokens = [token for token in name_tokens(query) if token not in HONORIFICS]
+        if not tokens or any(token in STOPWORDS for token in tokens):
+            return []
+        self.lookups += 1
+        with self._lock:
+            contacts = self._load_locked(user_id)
+            scores: Optional[Dict[str, float]] = None
+            for token in tokens:
+                matched = contacts.match(token)
+                if scores is None:
+                    scores = matched
+                else:
+                    scores = {email: score + matched[email] for email, score in scores.items() if email in matched}
+                if not scores:
+                    return []
+            exact_score = _EXACT * len(tokens)
+            ranked = [
+                (score / len(tokens) + 0.1 * math.log1p(contacts.contacts[email]["count"]), score == exact_score,
+                 contacts.contacts[email])
+                for email, score in scores.items()
+            ]
+        ranked.sort(key=lambda item: (item[0], item[2]["last_sent"]), reverse=True)
+        return [dict(self._public(contact, score), exact=exact) for score, exact, contact in ranked[:limit]]
+
+    def resolve(self, user_id: int, phrase: str, max_words: int = 3, limit: int = 5) -> Tuple[List[Dict], str, str]:
+        """
+        Tách tên người nhận ở đầu phrase ("thầy nam xin nghỉ học ngày mai") - thử tối đa max_words từ sau danh xưng,
+        dài nhất trước
+
+        Returns:
+            (ứng viên, cụm tên đã dùng kể cả danh xưng - vd "thầy nam", phần còn lại - vd "xin nghỉ học ngày mai")
+            ([], "", phrase) nếu không khớp ai
+        """
+        words = phrase.split()
+        start = 0
+        while start < len(words) and fold_diacritics(words[start]).lower() in HONORIFICS:
+            start += 1
+        for count in range(min(max_words, len(words) - start), 0, -1):
+            matches = self.lookup(user_id, " ".join(words[start:start + count]), limit)
+            if matches:
+                end = start + count
+                return matches, " ".join(words[:end]), " ".join(words[end:])
+        return [], "", phrase
+
+    def stats(self) -> Dict:
+        with self._lock:
+            users, sends = self._conn.execute(
+                "SELECT COUNT(DISTINCT user_id), COUNT(*) FROM contact_sends"
+            ).fetchone()
+        return {
+            "users": users,
+            "sends": sends,
+            "users_in_memory": len(self._users),
+            "recorded": self.recorded,
+            "lookups": self.lookups
+        }
+
+
+def create_contact_index() -> Optional[ContactIndex]:
+    """Tạo danh bạ theo cấu hình (None nếu GMAIL_CONTACT_INDEX_ENABLED=false)"""
+    if os.getenv("GMAIL_CONTACT_INDEX_ENABLED", "true").lower() != "true":
+        return None
+    return ContactIndex(db_path=os.getenv("GMAIL_MIRROR_DB", "gmail_mirror.sqlite3"))
@@ -0,0 +1,132 @@
+"""
+Credential Cache
+Cache ngắn hạn credentials (tài khoản trường...) của từng user trong process, để các intent
+lịch học không phải gọi Spring Boot /api/credentials + decrypt mỗi tin nhắn
+
+- Danh sách credential (không có mật khẩu) được index sẵn purpose -> [credential id]
+  bằng các hàm matcher truyền vào (vd: "tvu" -> credential trang ttsv.tvu.edu.vn)
+- Credential đã giải mã chỉ được giữ dạng ciphertext (Fernet, key sinh ngẫu nhiên mỗi process),
+  giải mã lại khi cần dùng - không để mật khẩu plaintext nằm trong cache
+- Hết TTL thì lấy lại từ Spring Boot
+"""
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, List, Optional
+
+from cryptography.fernet import Fernet, InvalidToken
+
+
+class _UserCredentials:
+    def __init__(self, credentials: List[Dict], purposes: Dict[str, List], expires_at: float):
+        self.metadata = {cred.get('id'): cred for cred in credentials}
+        self.purposes = purposes
+        self.secrets: Dict = {}
+        self.expires_at = expires_at
+
+
+class CredentialCache:
+    """Cache credentials theo user, key do caller chọn (vd: ("user", user_id))"""
+
+    def __init__(self, purpose_matchers: Dict[str, Callable[[Dict], bool]], ttl: float = 300, max_users: int = 1000):
+        """
+        Args:
+            purpose_matchers: purpose -> hàm nhận credential (không mật khẩu), True nếu dùng được cho purpose đó
+            ttl: Số giây giữ credentials của 1 user
+            max_users: Số user tối đa trong cache
+        """
+        self.purpose_matchers = purpose_matchers
+        self.ttl = ttl
+        self.max_users = max(1, max_users)
+        self._cipher = Fernet(Fernet.generate_key())
+        self._users: "OrderedDict[Hashable, _UserCredentials]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _get(self, key: Hashable) -> Optional[_UserCredentials]:
+        entry = self._users.get(key)
+        if entry is not None and entry.expires_at <= time.time():
+            del self._users[key]
+            return None
+        if entry is not None:
+            self._users.move_to_end(key)
+        return entry
+
+    def index(self, key: Hashable, credentials: List[Dict]) -> Dict[str, List]:
+        """Lưu danh sách credential của user và index purpose -> [credential id]"""
+        purposes = {
+            purpose: [cred.get('id') for cred in credentials if matcher(cred)]
+            for purpose, matcher in self.purpose_matchers.items()
+        }
+        # Bỏ trường nhạy cảm nếu API list có trả về
+        safe = [{k: v for k, v in cred.items() if k != 'password'} for cred in credentials]
+        with self._lock:
+            self._users[key] = _UserCredentials(safe, purposes, time.time() + self.ttl)
+            self._users.move_to_end(key)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        return purposes
+
+    def credential_ids(self, key: Hashable, purpose: str) -> Optional[List]:
+        """
+        Các credential id của user dùng được cho purpose
+
+        Returns None nếu chưa cache (cần gọi API list), [] nếu user không có credential phù hợp
+        """
+        with self._lock:
+            entry = self._get(key)
+            if entry is None or purpose not in entry.purposes:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return list(entry.purposes[purpose])
+
+    def metadata(self, key: Hashable, credential_id) -> Optional[Dict]:
+        """Credential (không mật khẩu) từ danh sách đã cache"""
+        with self._lock:
+            entry = self._get(key)
+            if entry is None or credential_id not in entry.metadata:
+                return None
+            return dict(entry.metadata[credential_id])
+
+    def store_secret(self, key: Hashable, credential_id, credential: Dict):
+        """Lưu credential đã giải mã (mã hóa lại trước khi cache)"""
+        token = self._cipher.encrypt(json.dumps(credential, ensure_ascii=False).encode('utf-8'))
+        with self._lock:
+            entry = self._get(key)
+            if entry is not None:
+                entry.secrets[credential_id] = token
+
+    def secret(self, key: Hashable, credential_id) -> Optional[Dict]:
+        """Giải mã credential đã cache, None nếu chưa có"""
+        with self._lock:
+            entry = self._get(key)
+            token = entry.secrets.get(credential_id) if entry is not None else None
+        if token is None:
+            return None
+        try:
+            return json.loads(self._cipher.decrypt(token).decode('utf-8'))
+        except (InvalidToken, ValueError):
+            return None
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            self._users.pop(key, None)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "users": len(self._users),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+
+def create_credential_cache(purpose_matchers: Dict[str, Callable[[Dict], bool]]) -> CredentialCache:
+    """Tạo cache theo cấu hình CREDENTIAL_CACHE_TTL"""
+    return CredentialCache(purpose_matchers, ttl=float(os.getenv("CREDENTIAL_CACHE_TTL", "300")))
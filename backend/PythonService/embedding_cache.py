@@ -0,0 +1,194 @@
+"""
+Embedding Cache
+Cache embedding theo nội dung: key = (model, task_type, hash(text đã chuẩn hóa))
+LRU trong bộ nhớ phía trước + SQLite trên đĩa phía sau (dùng chung cho query và document)
+"""
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """Chuẩn hóa Unicode (NFC) + gộp khoảng trắng để cùng 1 câu hỏi luôn ra cùng key"""
+    return _WHITESPACE_RE.sub(" ", unicodedata.normalize("NFC", text)).strip()
+
+
+def cache_key(model: str, task_type: str, text: str) -> str:
+    digest = hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+    return f"{model}|{task_type}|{digest}"
+
+
+class EmbeddingCache:
+    """LRU in-memory + SQLite on-disk embedding cache (thread-safe)"""
+
+    def __init__(self, db_path: Optional[str] = "embedding_cache.sqlite3", max_memory_entries: int = 10000):
+        """
+        Args:
+            db_path: File SQLite lưu cache lâu dài (None = chỉ cache trong bộ nhớ)
+            max_memory_entries: Số embedding tối đa giữ trong LRU
+        """
+        self.db_path = db_path
+        self.max_memory_entries = max(1, max_memory_entries)
+        self._memory: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._conn = None
+        if db_path:
+            db_dir = os.path.dirname(os.path.abspath(db_path))
+            os.makedirs(db_dir, exist_ok=True)
+            self._conn = sqlite3.connect(db_path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                " key TEXT PRIMARY KEY,"
+                " vector BLOB NOT NULL,"
+                " created_at REAL NOT NULL)"
+            )
+            self._conn.commit()
+
+    # ------------------------------------------------------------------
+    # Memory LRU
+    # ------------------------------------------------------------------
+
+    def _remember(self, key: str, vector: List[float]):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    # ------------------------------------------------------------------
+    # Public API
+    # ------------------------------------------------------------------
+
+    def get_many(self, model: str, task_type: str, texts: Sequence[str]) -> Tuple[Dict[int, List[float]], List[int]]:
+        """
+        Tra cache cho nhiều texts
+
+        Returns:
+            (found, missing) - found = {index: embedding}, missing = các index chưa có
+        """
+        keys = [cache_key(model, task_type, text) for text in texts]
+        found: Dict[int, List[float]] = {}
+        disk_lookup: Dict[str, List[int]] = {}
+
+        with self._lock:
+            for i, key in enumerate(keys):
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    found[i] = vector
+                    self.memory_hits += 1
+                else:
+                    disk_lookup.setdefault(key, []).append(i)
+
+            if disk_lookup and self._conn is not None:
+                unique_keys = list(disk_lookup)
+                # SQLite giới hạn số tham số mỗi câu lệnh -> chia nhỏ
+                for start in range(0, len(unique_keys), 500):
+                    chunk = unique_keys[start:start + 500]
+                    placeholders = ",".join("?" * len(chunk))
+                    rows = self._conn.execute(
+                        f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", chunk
+                    ).fetchall()
+                    for key, blob in rows:
+                        vector = np.frombuffer(blob, dtype=np.float32).tolist()
+                        self._remember(key, vector)
+                        for i in disk_lookup.pop(key):
+                            found[i] = vector
+                            self.disk_hits += 1
+
+            missing = sorted(i for indices in disk_lookup.values() for i in indices)
+            self.misses += len(missing)
+
+        return found, missing
+
+    def get(self, model: str, task_type: str, text: str) -> Optional[List[float]]:
+        found, _ = self.get_many(model, task_type, [text])
+        return found.get(0)
+
+    def put_many(self, model: str, task_type: str, texts: Sequence[str], vectors: Sequence[Sequence[float]]):
+        """Lưu embeddings vào LRU + SQLite"""
+        if not texts:
+            return
+        now = time.time()
+        rows = []
+        with self._lock:
+            for text, vector in zip(texts, vectors):
+                key = cache_key(model, task_type, text)
+                vector = list(vector)
+                self._remember(key, vector)
+                rows.append((key, np.asarray(vector, dtype=np.float32).tobytes(), now))
+
+            if self._conn is not None:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, vector, created_at) VALUES (?, ?, ?)", rows
+                )
+                self._conn.commit()
+
+    def put(self, model: str, task_type: str, text: str, vector: Sequence[float]):
+        self.put_many(model, task_type, [text], [vector])
+
+    def get_or_compute(
+        self,
+        model: str,
+        task_type: str,
+        texts: Sequence[str],
+        compute: Callable[[List[str]], Sequence[Sequence[float]]]
+    ) -> List[List[float]]:
+        """
+        Lấy embeddings từ cache, chỉ gọi compute() 1 lần cho các texts chưa có
+
+        Args:
+            compute: Hàm nhận list texts (đã bỏ trùng) và trả về embeddings cùng thứ tự
+        """
+        found, missing = self.get_many(model, task_type, texts)
+        if missing:
+            unique_texts = list(dict.fromkeys(texts[i] for i in missing))
+            computed = compute(unique_texts)
+            self.put_many(model, task_type, unique_texts, computed)
+            by_text = {text: list(vector) for text, vector in zip(unique_texts, computed)}
+            for i in missing:
+                found[i] = by_text[texts[i]]
+        return [found[i] for i in range(len(texts))]
+
+    def stats(self) -> Dict:
+        """Hit/miss counters cho /api/rag/stats"""
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            disk_entries = 0
+            if self._conn is not None:
+                disk_entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.memory_hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "disk_entries": disk_entries
+            }
+
+
+# Singleton instance
+_embedding_cache = None
+
+
+def get_embedding_cache(db_path: str = "embedding_cache.sqlite3") -> EmbeddingCache:
+    """Get or create singleton instance"""
+    global _embedding_cache
+    if _embedding_cache is None:
+        _embedding_cache = EmbeddingCache(db_path=db_path)
+    return _embedding_cache
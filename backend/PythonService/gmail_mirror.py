@@ -0,0 +1,443 @@
+"""
+Gmail Mirror
+Bản sao hộp thư Gmail của từng user trong SQLite (header, snippet, body đã parse, labels) để đọc / tìm email /
+xếp hạng người nhận trả lời tại chỗ thay vì gọi Gmail API mỗi câu hỏi
+
+- Lần đầu: lấy historyId từ profile rồi tải GMAIL_MIRROR_INITIAL email mới nhất (1 request list + batch get)
+- Các lần sau: users.history.list từ historyId đã lưu - chỉ tải email mới thêm, xóa email bị xóa,
+  cập nhật labels (đã đọc / gắn sao / chuyển thư mục). historyId quá cũ (404) -> đồng bộ lại từ đầu
+- Đồng bộ tối đa 1 lần / GMAIL_MIRROR_SYNC_INTERVAL giây mỗi user (single-flight); gửi / sửa label thì mark_stale()
+- User ngắt kết nối Google (OAuth service không còn token) -> xóa bản sao; kết nối lại tài khoản Google khác
+  (emailAddress trong profile đổi) -> xóa bản sao cũ rồi đồng bộ lại từ đầu
+- Không trả lời được chắc chắn (thiếu email cũ hơn bản sao, cú pháp tìm kiếm chưa hỗ trợ, lỗi đồng bộ) -> None,
+  GmailService gọi Gmail API như cũ
+"""
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from google_token_cache import get_google_token_cache
+from intent_router import fold_diacritics
+
+logger = logging.getLogger(__name__)
+
+_HISTORY_TYPES = ("messageAdded", "messageDeleted", "labelAdded", "labelRemoved")
+
+# Mặc định không hiện thư rác / thùng rác (như Gmail), trừ khi hỏi đúng label đó
+_HIDDEN_LABELS = ("SPAM", "TRASH")
+
+# Label hệ thống (label của user lưu theo id "Label_123", không tìm theo tên được)
+_SYSTEM_LABELS = {"INBOX", "SENT", "DRAFT", "SPAM", "TRASH", "UNREAD", "STARRED", "IMPORTANT",
+                  "CATEGORY_PERSONAL", "CATEGORY_SOCIAL", "CATEGORY_PROMOTIONS", "CATEGORY_UPDATES", "CATEGORY_FORUMS"}
+
+# from:x / to:x / subject:"..." / is:unread / in:sent / label:x / từ khóa / "cụm từ"
+_QUERY_TOKEN_RE = re.compile(r'(?:(\w+):)?("[^"]*"|\S+)')
+
+
+def _fold(text: str) -> str:
+    return fold_diacritics(text or "").lower()
+
+
+def _labels_column(label_ids: List[str]) -> str:
+    return "," + ",".join(label_ids or []) + ","
+
+
+def parse_query(query: str) -> Optional[Tuple[List[Tuple[str, str]], List[str]]]:
+    """
+    Cú pháp tìm kiếm Gmail -> (điều kiện cột [(column, term)], labels bắt buộc)
+
+    Hỗ trợ: từ khóa, "cụm từ", from:, to:, subject:, is:unread / is:read / is:starred, in: / label: (label hệ thống)
+    Returns: None nếu có toán tử chưa hỗ trợ (has:, after:, OR, -loại trừ...)
+    """
+    conditions: List[Tuple[str, str]] = []
+    labels: List[str] = []
+    for operator, value in _QUERY_TOKEN_RE.findall(query or ""):
+        value = value.strip('"')
+        operator = operator.lower()
+        if not value:
+            continue
+        if not operator:
+            if value.startswith("-") or value in ("OR", "AND") or value.startswith(("(", "{")):
+                return None
+            conditions.append(("search_text", _fold(value)))
+        elif operator in ("from", "to", "subject"):
+            conditions.append((f"{operator}_folded", _fold(value)))
+        elif operator == "is" and value.lower() in ("unread", "starred", "important"):
+            labels.append(value.upper())
+        elif operator == "is" and value.lower() == "read":
+            conditions.append(("read", ""))
+        elif operator in ("in", "label") and value.upper() in _SYSTEM_LABELS:
+            labels.append(value.upper())
+        else:
+            return None
+    return conditions, labels
+
+
+class GmailMirror:
+    """Bản sao hộp thư Gmail theo user trong SQLite, đồng bộ tăng dần qua history.list (thread-safe)"""
+
+    def __init__(
+        self,
+        service,
+        db_path: str = "gmail_mirror.sqlite3",
+        sync_interval: float = 60,
+        initial_messages: int = 200,
+        max_messages: int = 2000
+    ):
+        """
+        Args:
+            service: GmailService (token, header, batch get, parse message)
+            db_path: File SQLite
+            sync_interval: Số giây tối thiểu giữa 2 lần đồng bộ của 1 user
+            initial_messages: Số email mới nhất tải ở lần đồng bộ đầu
+            max_messages: Số email tối đa giữ mỗi user (bỏ email cũ nhất)
+        """
+        self.service = service
+        self.sync_interval = sync_interval
+        self.initial_messages = max(1, initial_messages)
+        self.max_messages = max(self.initial_messages, max_messages)
+        self._lock = threading.Lock()
+        self._user_locks: Dict[int, threading.Lock] = {}
+        self._stale: set = set()
+        self.local_reads = 0
+        self.api_fallbacks = 0
+        self.full_syncs = 0
+        self.incremental_syncs = 0
+        self.messages_fetched = 0
+
+        db_dir = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(db_dir, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=5)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS mailbox_state ("
+            " user_id INTEGER PRIMARY KEY,"
+            " history_id TEXT,"
+            " complete INTEGER NOT NULL DEFAULT 0,"
+            " synced_at REAL NOT NULL DEFAULT 0,"
+            " email_address TEXT);"
+            "CREATE TABLE IF NOT EXISTS messages ("
+            " user_id INTEGER NOT NULL,"
+            " id TEXT NOT NULL,"
+            " thread_id TEXT,"
+            " internal_date INTEGER NOT NULL DEFAULT 0,"
+            " from_addr TEXT, to_addr TEXT, subject TEXT, date TEXT, snippet TEXT, body TEXT,"
+            " labels TEXT NOT NULL DEFAULT ',',"
+            " from_folded TEXT, to_folded TEXT, subject_folded TEXT, search_text TEXT,"
+            " PRIMARY KEY (user_id, id));"
+            "CREATE INDEX IF NOT EXISTS idx_messages_user_date ON messages (user_id, internal_date DESC);"
+        )
+        # File tạo trước khi có cột email_address
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(mailbox_state)")]
+        if "email_address" not in columns:
+            self._conn.execute("ALTER TABLE mailbox_state ADD COLUMN email_address TEXT")
+        self._conn.commit()
+
+    # ------------------------------------------------------------------
+    # Đồng bộ
+    # ------------------------------------------------------------------
+
+    def _user_lock(self, user_id: int) -> threading.Lock:
+        with self._lock:
+            return self._user_locks.setdefault(user_id, threading.Lock())
+
+    def _state(self, user_id: int) -> Optional[Tuple[Optional[str], bool, float, Optional[str]]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT history_id, complete, synced_at, email_address FROM mailbox_state WHERE user_id = ?",
+                (user_id,)
+            ).fetchone()
+        return (row[0], bool(row[1]), row[2], row[3]) if row else None
+
+    def mark_stale(self, user_id: int):
+        """Lần đọc sau đồng bộ ngay (vừa gửi email / đổi label qua API)"""
+        self._stale.add(user_id)
+
+    def _due(self, user_id: int) -> bool:
+        state = self._state(user_id)
+        return state is None or user_id in self._stale or time.time() - state[2] >= self.sync_interval
+
+    def sync(self, user_id: int, force: bool = False) -> bool:
+        """
+        Đồng bộ bản sao của user nếu đến hạn
+
+        Returns:
+            True nếu bản sao dùng được (đã đồng bộ thành công ít nhất 1 lần)
+        """
+        if not force and not self._due(user_id):
+            return True
+
+        with self._user_lock(user_id):
+            # Request khác vừa đồng bộ xong trong lúc chờ lock
+            if not force and not self._due(user_id):
+                return True
+            self._stale.discard(user_id)
+
+            try:
+                access_token = get_google_token_cache().get(user_id)
+            except Exception as e:
+                logger.warning(f"Gmail mirror: cannot get Google token for user {user_id}: {e}")
+                return False
+            state = self._state(user_id)
+            if not access_token:
+                # OAuth service trả 404: user chưa / không còn kết nối Google -> bỏ bản sao cũ
+                # (OAuth service / Spring Boot / Google lỗi tạm thời thì get() raise, bản sao được giữ)
+                if state is not None:
+                    self.forget(user_id)
+                return False
+            try:
+                profile = self._get(access_token, "profile") or {}
+                email_address = profile.get("emailAddress")
+                if state is not None and state[3] and email_address and email_address != state[3]:
+                    logger.info(f"📬 Gmail mirror: user {user_id} reconnected another Google account, resyncing")
+                    self.forget(user_id)
+                    state = None
+                if state is not None and state[0] and state[0] == profile.get("historyId"):
+                    # Hộp thư không đổi từ lần đồng bộ trước
+                    self._touch(user_id)
+                elif state is None or not state[0] or not self._sync_history(user_id, access_token, state[0]):
+                    self._full_sync(user_id, access_token, profile)
+                return True
+            except Exception as e:
+                logger.warning(f"Gmail mirror sync failed for user {user_id}: {e}")
+                return state is not None and bool(state[0])
+
+    def _get(self, access_token: str, path: str, params=None) -> Optional[Dict]:
+        response = self.service._get(access_token, path, params)
+        if response.status_code == 404:
+            return None
+        if response.status_code != 200:
+            raise RuntimeError(f"Gmail API {path}: {response.status_code}")
+        return response.json()
+
+    def _touch(self, user_id: int):
+        with self._lock:
+            self._conn.execute("UPDATE mailbox_state SET synced_at = ? WHERE user_id = ?", (time.time(), user_id))
+            self._conn.commit()
+
+    def _full_sync(self, user_id: int, access_token: str, profile: Dict):
+        # historyId (profile) lấy TRƯỚC khi list: thay đổi xảy ra trong lúc tải sẽ có trong history lần sau
+        listing = self._get(access_token, "messages", {"maxResults": self.initial_messages}) or {}
+        message_ids = [m["id"] for m in listing.get("messages", [])]
+        messages = self.service._get_messages(access_token, message_ids, "full")
+
+        with self._lock:
+            self._conn.execute("DELETE FROM messages WHERE user_id = ?", (user_id,))
+            self._upsert_locked(user_id, messages.values())
+            self._conn.execute(
+                "INSERT OR REPLACE INTO mailbox_state (user_id, history_id, complete, synced_at, email_address)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (user_id, profile.get("historyId"), int(not listing.get("nextPageToken")), time.time(),
+                 profile.get("emailAddress"))
+            )
+            self._conn.commit()
+        self._record_sent(user_id, messages.values())
+        self.full_syncs += 1
+        self.messages_fetched += len(messages)
+        logger.info(f"📬 Gmail mirror: full sync for user {user_id} ({len(messages)} messages)")
+
+    def _sync_history(self, user_id: int, access_token: str, history_id: str) -> bool:
+        """history.list từ history_id; False nếu history_id quá cũ (cần đồng bộ lại từ đầu)"""
+        added, deleted, labels = [], set(), {}
+        params = [("startHistoryId", history_id), ("maxResults", 500)]
+        params.extend(("historyTypes", history_type) for history_type in _HISTORY_TYPES)
+        page_token = None
+        latest = history_id
+        while True:
+            page = self._get(access_token, "history", params + ([("pageToken", page_token)] if page_token else []))
+            if page is None:
+                return False
+            latest = page.get("historyId", latest)
+            for record in page.get("history", []):
+                for item in record.get("messagesAdded", []):
+                    added.append(item["message"]["id"])
+                    deleted.discard(item["message"]["id"])
+                for item in record.get("messagesDeleted", []):
+                    deleted.add(item["message"]["id"])
+                for key in ("labelsAdded", "labelsRemoved"):
+                    for item in record.get(key, []):
+                        # message.labelIds là danh sách label đầy đủ sau thay đổi
+                        labels[item["message"]["id"]] = item["message"].get("labelIds", [])
+            page_token = page.get("nextPageToken")
+            if not page_token:
+                break
+
+        added = [message_id for message_id in dict.fromkeys(added) if message_id not in deleted]
+        messages = self.service._get_messages(access_token, added, "full") if added else {}
+
+        with self._lock:
+            self._upsert_locked(user_id, messages.values())
+            self._conn.executemany(
+                "DELETE FROM messages WHERE user_id = ? AND id = ?", [(user_id, mid) for mid in deleted]
+            )
+            self._conn.executemany(
+                "UPDATE messages SET labels = ? WHERE user_id = ? AND id = ?",
+                [(_labels_column(ids), user_id, mid) for mid, ids in labels.items() if mid not in messages]
+            )
+            self._prune_locked(user_id)
+            self._conn.execute(
+                "UPDATE mailbox_state SET history_id = ?, synced_at = ? WHERE user_id = ?",
+                (latest, time.time(), user_id)
+            )
+            self._conn.commit()
+        self._record_sent(user_id, messages.values())
+        self.incremental_syncs += 1
+        self.messages_fetched += len(messages)
+        return True
+
+    def _upsert_locked(self, user_id: int, messages):
+        rows = []
+        for data in messages:
+            email = self.service._parse_message(data)
+            rows.append((
+                user_id, email["id"], email["threadId"], int(data.get("internalDate") or 0),
+                email["from"], email["to"], email["subject"], email["date"], email["snippet"], email["body"],
+                _labels_column(email["labelIds"]),
+                _fold(email["from"]), _fold(email["to"]), _fold(email["subject"]),
+                _fold(" ".join((email["from"], email["to"], email["subject"], email["snippet"], email["body"])))
+            ))
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO messages (user_id, id, thread_id, internal_date, from_addr, to_addr, subject,"
+            " date, snippet, body, labels, from_folded, to_folded, subject_folded, search_text)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            rows
+        )
+
+    def _record_sent(self, user_id: int, messages):
+        """Email đã gửi vừa đồng bộ -> danh bạ người nhận (contact_index, bỏ qua email đã ghi)"""
+        contacts = getattr(self.service, "contacts", None)
+        if contacts is None:
+            return
+        for data in messages:
+            if "SENT" in data.get("labelIds", []):
+                email = self.service._parse_message(data)
+                contacts.record(user_id, email["id"], email["to"], int(data.get("internalDate") or 0) / 1000)
+
+    def _prune_locked(self, user_id: int):
+        pruned = self._conn.execute(
+            "DELETE FROM messages WHERE user_id = ? AND id NOT IN ("
+            " SELECT id FROM messages WHERE user_id = ? ORDER BY internal_date DESC LIMIT ?)",
+            (user_id, user_id, self.max_messages)
+        ).rowcount
+        if pruned:
+            # Đã bỏ email cũ -> bản sao không còn chứa cả hộp thư
+            self._conn.execute("UPDATE mailbox_state SET complete = 0 WHERE user_id = ?", (user_id,))
+
+    # ------------------------------------------------------------------
+    # Đọc
+    # ------------------------------------------------------------------
+
+    def _select(self, user_id: int, conditions: List[Tuple[str, str]], labels: List[str], limit: int) -> List[Dict]:
+        sql = ["SELECT id, thread_id, from_addr, to_addr, subject, date, snippet, body, labels"
+               " FROM messages WHERE user_id = ?"]
+        args: List = [user_id]
+        for label in labels:
+            sql.append("AND labels LIKE ?")
+            args.append(f"%,{label},%")
+        for label in _HIDDEN_LABELS:
+            if label not in labels:
+                sql.append("AND labels NOT LIKE ?")
+                args.append(f"%,{label},%")
+        for column, term in conditions:
+            if column == "read":
+                sql.append("AND labels NOT LIKE '%,UNREAD,%'")
+            else:
+                sql.append(f"AND {column} LIKE ?")
+                args.append(f"%{term}%")
+        sql.append("ORDER BY internal_date DESC LIMIT ?")
+        args.append(limit)
+
+        with self._lock:
+            rows = self._conn.execute(" ".join(sql), args).fetchall()
+        emails = []
+        for row in rows:
+            label_ids = [label for label in row[8].split(",") if label]
+            emails.append({
+                "id": row[0],
+                "threadId": row[1],
+                "from": row[2],
+                "to": row[3],
+                "subject": row[4],
+                "date": row[5],
+                "snippet": row[6],
+                "body": row[7],
+                "labelIds": label_ids,
+                "isUnread": "UNREAD" in label_ids
+            })
+        return emails
+
+    def list_emails(
+        self,
+        user_id: int,
+        max_results: int = 10,
+        label_ids: List[str] = None,
+        query: str = None
+    ) -> Optional[List[Dict]]:
+        """
+        Email mới nhất theo label / query từ bản sao (đồng bộ delta trước nếu đến hạn)
+
+        Returns:
+            List email cùng dạng GmailService.get_email, hoặc None nếu phải hỏi Gmail API
+        """
+        parsed = parse_query(query) if query else ([], [])
+        if parsed is None or not self.sync(user_id):
+            self.api_fallbacks += 1
+            return None
+        conditions, labels = parsed
+        labels = list(dict.fromkeys([label.upper() for label in label_ids or []] + labels))
+
+        emails = self._select(user_id, conditions, labels, max_results)
+        state = self._state(user_id)
+        complete = bool(state and state[1])
+        # Bản sao chỉ có email mới nhất: ít kết quả hơn yêu cầu thì email cũ hơn có thể còn trên Gmail
+        # (kể cả khi tìm kiếm đã có vài kết quả) -> hỏi Gmail
+        if not complete and len(emails) < max_results:
+            self.api_fallbacks += 1
+            return None
+        self.local_reads += 1
+        return emails
+
+    def forget(self, user_id: int):
+        """Xóa bản sao và danh bạ người nhận của user (ngắt kết nối / đổi tài khoản Google)"""
+        with self._lock:
+            self._conn.execute("DELETE FROM messages WHERE user_id = ?", (user_id,))
+            self._conn.execute("DELETE FROM mailbox_state WHERE user_id = ?", (user_id,))
+            self._conn.commit()
+        self._stale.discard(user_id)
+        contacts = getattr(self.service, "contacts", None)
+        if contacts is not None:
+            contacts.forget(user_id)
+        logger.info(f"📭 Gmail mirror: dropped mailbox copy of user {user_id}")
+
+    def stats(self) -> Dict:
+        with self._lock:
+            users, messages = self._conn.execute(
+                "SELECT COUNT(DISTINCT user_id), COUNT(*) FROM messages"
+            ).fetchone()
+        return {
+            "users": users,
+            "messages": messages,
+            "local_reads": self.local_reads,
+            "api_fallbacks": self.api_fallbacks,
+            "full_syncs": self.full_syncs,
+            "incremental_syncs": self.incremental_syncs,
+            "messages_fetched": self.messages_fetched
+        }
+
+
+def create_gmail_mirror(service) -> Optional[GmailMirror]:
+    """Tạo bản sao theo cấu hình GMAIL_MIRROR_* (None nếu GMAIL_MIRROR_ENABLED=false)"""
+    if os.getenv("GMAIL_MIRROR_ENABLED", "true").lower() != "true":
+        return None
+    return GmailMirror(
+        service,
+        db_path=os.getenv("GMAIL_MIRROR_DB", "gmail_mirror.sqlite3"),
+        sync_interval=float(os.getenv("GMAIL_MIRROR_SYNC_INTERVAL", "60")),
+        initial_messages=int(os.getenv("GMAIL_MIRROR_INITIAL", "200")),
+        max_messages=int(os.getenv("GMAIL_MIRROR_MAX_MESSAGES", "2000"))
+    )
@@ -9,17 +9,24 @@ Yêu cầu:
 NOTE: Using synchronous requests library (not async) for compatibility
 """
 
-import requests
 import base64
 from typing import Dict, List, Optional
 from datetime import datetime
 import json
+from concurrent.futures import ThreadPoolExecutor
+from email import message_from_bytes
+from email.utils import parsedate_to_datetime
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 import logging
 import os
 from dotenv import load_dotenv
 
+from http_client import http
+from google_token_cache import get_google_token_cache
+from gmail_mirror import create_gmail_mirror
+from contact_index import create_contact_index
+
 load_dotenv()
 
 logging.basicConfig(level=logging.INFO)
@@ -28,6 +35,11 @@ logger = logging.getLogger(__name__)
 # Configuration
 OAUTH_SERVICE_URL = os.getenv("OAUTH_SERVICE_URL", "http://localhost:8003")
 GMAIL_API_URL = "https://gmail.googleapis.com/gmail/v1"
+GMAIL_BATCH_URL = "https://gmail.googleapis.com/batch/gmail/v1"
+# Số message mỗi request batch (Gmail cho tối đa 100, khuyến nghị <= 50 để tránh 429)
+GMAIL_BATCH_SIZE = int(os.getenv("GMAIL_BATCH_SIZE", "50"))
+# Số GET song song khi fallback (sub-request của batch lỗi)
+GMAIL_FETCH_CONCURRENCY = int(os.getenv("GMAIL_FETCH_CONCURRENCY", "8"))
 
 
 class GmailService:
@@ -36,27 +48,24 @@ class GmailService:
     Sử dụng OAuth 2.0 tokens từ OAuth Service
     """
     
-    def __init__(self, oauth_service_url: str = OAUTH_SERVICE_URL):
+    def __init__(self, oauth_service_url: str = OAUTH_SERVICE_URL, use_mirror: bool = True):
         self.oauth_service_url = oauth_service_url
         self.gmail_api = GMAIL_API_URL
+        # Danh bạ người nhận (contact_index), None = quét email đã gửi mỗi lần
+        self.contacts = create_contact_index()
+        # Bản sao hộp thư trong SQLite (GMAIL_MIRROR_*), None = luôn gọi Gmail API
+        self.mirror = create_gmail_mirror(self) if use_mirror else None
     
     def _get_access_token(self, user_id: int) -> Optional[str]:
         """
         Lấy access token từ OAuth service
-        Tự động refresh nếu expired
+        Tự động refresh nếu expired - token được cache tới gần hạn (google_token_cache)
         """
         try:
-            response = requests.get(
-                f"{self.oauth_service_url}/api/oauth/google/token/{user_id}",
-                timeout=10
-            )
-            
-            if response.status_code == 200:
-                data = response.json()
-                return data.get('access_token')
-            
-            logger.error(f"Failed to get token: {response.status_code} - {response.text}")
-            return None
+            token = get_google_token_cache().get(user_id)
+            if not token:
+                logger.error(f"Failed to get token for user {user_id}")
+            return token
             
         except Exception as e:
             logger.error(f"Error getting access token: {e}")
@@ -69,6 +78,20 @@ class GmailService:
             "Content-Type": "application/json"
         }
     
+    def _mirror_changed(self, user_id: int):
+        """Vừa thay đổi hộp thư qua API -> lần đọc sau đồng bộ bản sao ngay"""
+        if self.mirror is not None:
+            self.mirror.mark_stale(user_id)
+    
+    def _get(self, access_token: str, path: str, params=None):
+        """GET users/me/<path> của Gmail API"""
+        return http.get(
+            f"{self.gmail_api}/users/me/{path}",
+            headers=self._get_headers(access_token),
+            params=params,
+            timeout=15
+        )
+    
     # =========================================================================
     # READ EMAILS
     # =========================================================================
@@ -78,21 +101,39 @@ class GmailService:
         user_id: int, 
         max_results: int = 10,
         label_ids: List[str] = None,
-        query: str = None
+        query: str = None,
+        format: str = "full",
+        metadata_headers: List[str] = None
     ) -> Dict:
         """
         Liệt kê emails trong inbox
         
+        Danh sách id + chi tiết các email lấy bằng 1 token và 1 request batch (thay vì get_email từng cái)
+        
         Args:
             user_id: ID của user
             max_results: Số lượng email tối đa (default: 10)
             label_ids: Lọc theo labels (INBOX, SENT, DRAFT, etc.)
             query: Gmail search query (vd: "from:example@gmail.com")
+            format: "full" (có body) hoặc "metadata" (chỉ header + snippet, nhẹ hơn nhiều)
+            metadata_headers: Header cần lấy khi format="metadata" (vd: ["To"])
         
         Returns:
-            Dict với list emails và metadata
+            Dict với list emails và metadata ("source": "mirror" nếu đọc từ bản sao cục bộ)
         """
         try:
+            # Bản sao cục bộ (đồng bộ delta qua history.list) - None nếu không trả lời chắc chắn được
+            if self.mirror is not None:
+                emails = self.mirror.list_emails(user_id, max_results, label_ids, query)
+                if emails is not None:
+                    return {
+                        "success": True,
+                        "emails": emails,
+                        "total": len(emails),
+                        "resultSizeEstimate": len(emails),
+                        "source": "mirror"
+                    }
+            
             access_token = self._get_access_token(user_id)
             if not access_token:
                 return {"success": False, "error": "Chưa kết nối Google. Vui lòng kết nối trong Settings."}
@@ -105,7 +146,7 @@ class GmailService:
                 params["q"] = query
             
             # Call Gmail API
-            response = requests.get(
+            response = http.get(
                 f"{self.gmail_api}/users/me/messages",
                 headers=self._get_headers(access_token),
                 params=params,
@@ -119,12 +160,10 @@ class GmailService:
             data = response.json()
             messages = data.get("messages", [])
             
-            # Get details for each message
-            emails = []
-            for msg in messages[:max_results]:
-                email_detail = self.get_email(user_id, msg["id"])
-                if email_detail.get("success"):
-                    emails.append(email_detail["email"])
+            # Get details: 1 request batch cho mọi message, dùng lại token ở trên
+            message_ids = [msg["id"] for msg in messages[:max_results]]
+            details = self._get_messages(access_token, message_ids, format, metadata_headers)
+            emails = [self._parse_message(details[mid]) for mid in message_ids if mid in details]
             
             return {
                 "success": True,
@@ -153,43 +192,122 @@ class GmailService:
             if not access_token:
                 return {"success": False, "error": "Chưa kết nối Google"}
             
-            response = requests.get(
-                f"{self.gmail_api}/users/me/messages/{message_id}",
-                headers=self._get_headers(access_token),
-                params={"format": "full"},
-                timeout=15
-            )
+            response = self._fetch_message(access_token, message_id)
             
             if response.status_code != 200:
                 return {"success": False, "error": f"Lỗi: {response.status_code}"}
             
-            data = response.json()
-            
-            # Parse email
-            headers = {h["name"]: h["value"] for h in data.get("payload", {}).get("headers", [])}
-            
-            # Get body
-            body = self._extract_body(data.get("payload", {}))
-            
-            email = {
-                "id": data["id"],
-                "threadId": data.get("threadId"),
-                "from": headers.get("From", ""),
-                "to": headers.get("To", ""),
-                "subject": headers.get("Subject", "(Không có tiêu đề)"),
-                "date": headers.get("Date", ""),
-                "snippet": data.get("snippet", ""),
-                "body": body,
-                "labelIds": data.get("labelIds", []),
-                "isUnread": "UNREAD" in data.get("labelIds", [])
-            }
-            
-            return {"success": True, "email": email}
+            return {"success": True, "email": self._parse_message(response.json())}
             
         except Exception as e:
             logger.error(f"Error getting email: {e}")
             return {"success": False, "error": str(e)}
     
+    def _message_params(self, format: str, metadata_headers: List[str] = None) -> List:
+        params = [("format", format)]
+        if format == "metadata":
+            params.extend(("metadataHeaders", header) for header in metadata_headers or [])
+        return params
+    
+    def _fetch_message(self, access_token: str, message_id: str, format: str = "full",
+                       metadata_headers: List[str] = None):
+        """GET 1 message"""
+        return http.get(
+            f"{self.gmail_api}/users/me/messages/{message_id}",
+            headers=self._get_headers(access_token),
+            params=self._message_params(format, metadata_headers),
+            timeout=15
+        )
+    
+    def _get_messages(self, access_token: str, message_ids: List[str], format: str = "full",
+                      metadata_headers: List[str] = None) -> Dict[str, Dict]:
+        """
+        Lấy nhiều message qua batch endpoint (GMAIL_BATCH_SIZE message / request)
+        
+        Sub-request lỗi (vd: 429) được lấy lại bằng GET riêng, tối đa GMAIL_FETCH_CONCURRENCY song song
+        
+        Returns:
+            {message_id: message JSON} - message lấy không được thì không có trong dict
+        """
+        results: Dict[str, Dict] = {}
+        for start in range(0, len(message_ids), GMAIL_BATCH_SIZE):
+            chunk = message_ids[start:start + GMAIL_BATCH_SIZE]
+            try:
+                results.update(self._batch_get(access_token, chunk, format, metadata_headers))
+            except Exception as e:
+                logger.warning(f"Gmail batch request failed, falling back to single GETs: {e}")
+        
+        missing = [mid for mid in message_ids if mid not in results]
+        if missing:
+            def fetch(message_id):
+                try:
+                    response = self._fetch_message(access_token, message_id, format, metadata_headers)
+                    return response.json() if response.status_code == 200 else None
+                except Exception as e:
+                    logger.error(f"Error getting email {message_id}: {e}")
+                    return None
+            
+            with ThreadPoolExecutor(max_workers=min(GMAIL_FETCH_CONCURRENCY, len(missing))) as pool:
+                for message_id, data in zip(missing, pool.map(fetch, missing)):
+                    if data:
+                        results[message_id] = data
+        return results
+    
+    def _batch_get(self, access_token: str, message_ids: List[str], format: str,
+                   metadata_headers: List[str] = None) -> Dict[str, Dict]:
+        """1 request multipart/mixed tới batch endpoint, trả về các sub-response 200"""
+        boundary = "batch_gmail_messages"
+        query = "&".join(f"{key}={value}" for key, value in self._message_params(format, metadata_headers))
+        parts = [
+            f"--{boundary}\r\n"
+            f"Content-Type: application/http\r\n"
+            f"Content-ID: <{message_id}>\r\n\r\n"
+            f"GET /gmail/v1/users/me/messages/{message_id}?{query}\r\n\r\n"
+            for message_id in message_ids
+        ]
+        response = http.post(
+            GMAIL_BATCH_URL,
+            headers={
+                "Authorization": f"Bearer {access_token}",
+                "Content-Type": f"multipart/mixed; boundary={boundary}"
+            },
+            data="".join(parts) + f"--{boundary}--\r\n",
+            timeout=30
+        )
+        if response.status_code != 200:
+            raise RuntimeError(f"batch status {response.status_code}")
+        
+        results = {}
+        multipart = message_from_bytes(
+            f"Content-Type: {response.headers.get('Content-Type', '')}\r\n\r\n".encode() + response.content
+        )
+        for part in multipart.get_payload():
+            raw = part.get_payload(decode=True) or b""
+            head, _, body = raw.replace(b"\r\n", b"\n").partition(b"\n\n")
+            status_line = head.split(b"\n", 1)[0].split()
+            if len(status_line) < 2 or status_line[1] != b"200":
+                continue
+            data = json.loads(body)
+            results[data["id"]] = data
+        return results
+    
+    def _parse_message(self, data: Dict) -> Dict:
+        """Message JSON của Gmail API -> dict email (format=metadata thì body rỗng)"""
+        headers = {h["name"]: h["value"] for h in data.get("payload", {}).get("headers", [])}
+        
+        return {
+            "id": data["id"],
+            "threadId": data.get("threadId"),
+            "from": headers.get("From", ""),
+            "to": headers.get("To", ""),
+            "subject": headers.get("Subject", "(Không có tiêu đề)"),
+            "date": headers.get("Date", ""),
+            "snippet": data.get("snippet", ""),
+            "body": self._extract_body(data.get("payload", {})),
+            "labelIds": data.get("labelIds", []),
+            "isUnread": "UNREAD" in data.get("labelIds", [])
+        }
+    
     def _extract_body(self, payload: Dict) -> str:
         """Extract email body from payload"""
         body = ""
@@ -247,7 +365,7 @@ class GmailService:
                 return {"success": False, "error": "Chưa kết nối Google. Vui lòng kết nối trong Settings."}
             
             # Get sender email from profile
-            profile_response = requests.get(
+            profile_response = http.get(
                 f"{self.gmail_api}/users/me/profile",
                 headers=self._get_headers(access_token),
                 timeout=10
@@ -278,7 +396,7 @@ class GmailService:
             raw_message = base64.urlsafe_b64encode(message.as_bytes()).decode()
             
             # Send via Gmail API
-            response = requests.post(
+            response = http.post(
                 f"{self.gmail_api}/users/me/messages/send",
                 headers=self._get_headers(access_token),
                 json={"raw": raw_message},
@@ -288,6 +406,9 @@ class GmailService:
             if response.status_code == 200:
                 data = response.json()
                 logger.info(f"Email sent successfully: {data.get('id')}")
+                self._mirror_changed(user_id)
+                if self.contacts is not None and data.get("id"):
+                    self.contacts.record(user_id, data["id"], to)
                 return {
                     "success": True,
                     "message": f"✅ Đã gửi email đến {to}",
@@ -338,7 +459,7 @@ class GmailService:
                 return {"success": False, "error": "Chưa kết nối Google"}
             
             # Get sender email
-            profile_response = requests.get(
+            profile_response = http.get(
                 f"{self.gmail_api}/users/me/profile",
                 headers=self._get_headers(access_token),
                 timeout=10
@@ -360,7 +481,7 @@ class GmailService:
             
             raw_message = base64.urlsafe_b64encode(message.as_bytes()).decode()
             
-            response = requests.post(
+            response = http.post(
                 f"{self.gmail_api}/users/me/messages/send",
                 headers=self._get_headers(access_token),
                 json={
@@ -371,6 +492,7 @@ class GmailService:
             )
             
             if response.status_code == 200:
+                self._mirror_changed(user_id)
                 return {
                     "success": True,
                     "message": f"✅ Đã trả lời email từ {to}"
@@ -409,13 +531,14 @@ class GmailService:
             if not access_token:
                 return {"success": False, "error": "Chưa kết nối Google"}
             
-            response = requests.post(
+            response = http.post(
                 f"{self.gmail_api}/users/me/messages/{message_id}/trash",
                 headers=self._get_headers(access_token),
                 timeout=10
             )
             
             if response.status_code == 200:
+                self._mirror_changed(user_id)
                 return {"success": True, "message": "✅ Đã chuyển vào thùng rác"}
             return {"success": False, "error": f"Lỗi: {response.status_code}"}
             
@@ -441,7 +564,7 @@ class GmailService:
             if remove_labels:
                 body["removeLabelIds"] = remove_labels
             
-            response = requests.post(
+            response = http.post(
                 f"{self.gmail_api}/users/me/messages/{message_id}/modify",
                 headers=self._get_headers(access_token),
                 json=body,
@@ -449,6 +572,7 @@ class GmailService:
             )
             
             if response.status_code == 200:
+                self._mirror_changed(user_id)
                 return {"success": True, "message": "✅ Cập nhật thành công"}
             return {"success": False, "error": f"Lỗi: {response.status_code}"}
             
@@ -513,7 +637,7 @@ class GmailService:
             if not access_token:
                 return {"success": False, "error": "Chưa kết nối Google"}
             
-            response = requests.get(
+            response = http.get(
                 f"{self.gmail_api}/users/me/labels",
                 headers=self._get_headers(access_token),
                 timeout=10
@@ -535,24 +659,61 @@ class GmailService:
     # CONTACTS - Lấy danh bạ từ emails đã gửi
     # =========================================================================
     
+    def _bootstrap_contacts(self, user_id: int) -> Optional[Dict]:
+        """
+        Lần đầu của user: quét 100 email đã gửi gần nhất vào danh bạ (các lần sau danh bạ tự cập nhật
+        khi gửi / đồng bộ bản sao hộp thư)
+
+        Returns:
+            None nếu xong, Dict lỗi nếu không đọc được email đã gửi
+        """
+        if self.contacts.bootstrapped(user_id):
+            return None
+        result = self.list_emails(
+            user_id,
+            max_results=100,
+            label_ids=["SENT"],
+            format="metadata",
+            metadata_headers=["To", "Date"]
+        )
+        if not result.get("success"):
+            return result
+        for email in result.get("emails", []):
+            try:
+                sent_at = parsedate_to_datetime(email.get("date", "")).timestamp()
+            except (TypeError, ValueError):
+                sent_at = 0.0
+            self.contacts.record(user_id, email["id"], email.get("to", ""), sent_at)
+        self.contacts.mark_bootstrapped(user_id)
+        return None
+
     def get_frequent_contacts(self, user_id: int, max_results: int = 20) -> Dict:
         """
         Lấy danh sách người nhận email thường xuyên
-        Từ sent emails để suggest khi compose
+        Từ sent emails để suggest khi compose - đọc từ danh bạ người nhận (contact_index) nếu bật
         
         Returns:
             Dict với list contacts: [{"name": "...", "email": "...", "count": N}]
         """
         try:
-            access_token = self._get_access_token(user_id)
-            if not access_token:
-                return {"success": False, "error": "Chưa kết nối Google"}
-            
-            # Get sent emails
+            if self.contacts is not None:
+                error = self._bootstrap_contacts(user_id)
+                if error:
+                    return error
+                contacts = self.contacts.top(user_id, max_results)
+                return {
+                    "success": True,
+                    "contacts": contacts,
+                    "total": len(contacts)
+                }
+
+            # Get sent emails - chỉ cần header To, không tải body
             result = self.list_emails(
                 user_id, 
                 max_results=100,  # Analyze last 100 sent emails
-                label_ids=["SENT"]
+                label_ids=["SENT"],
+                format="metadata",
+                metadata_headers=["To"]
             )
             
             if not result.get("success"):
@@ -596,6 +757,25 @@ class GmailService:
             logger.error(f"Error getting contacts: {e}")
             return {"success": False, "error": str(e)}
 
+    def find_contacts(self, user_id: int, phrase: str, max_results: int = 5) -> Dict:
+        """
+        Tìm người nhận theo tên ở đầu câu ("thầy Nam xin nghỉ học") trong danh bạ
+
+        Returns:
+            Dict: {"success", "contacts": [...ứng viên, tốt nhất trước], "phrase": "thầy Nam", "rest": "xin nghỉ học"}
+        """
+        if self.contacts is None:
+            return {"success": False, "error": "Danh bạ người nhận đang tắt"}
+        try:
+            error = self._bootstrap_contacts(user_id)
+            if error:
+                return error
+            contacts, matched, rest = self.contacts.resolve(user_id, phrase, limit=max_results)
+            return {"success": True, "contacts": contacts, "phrase": matched, "rest": rest}
+        except Exception as e:
+            logger.error(f"Error finding contacts: {e}")
+            return {"success": False, "error": str(e)}
+
 
 # Singleton instance
 gmail_service = GmailService()
@@ -792,6 +972,27 @@ def ai_get_contacts(user_id: int, max_results: int = 10) -> Dict:
         return {"success": False, "error": str(e)}
 
 
+def ai_find_recipient(user_id: int, phrase: str) -> Dict:
+    """
+    Helper function for AI: tìm địa chỉ người nhận theo tên ("thầy Nam xin nghỉ học" -> nam@...)
+
+    Returns:
+        {"success", "contact": người nhận nếu khớp rõ ràng | None, "contacts": ứng viên, "phrase", "rest"}
+    """
+    try:
+        result = gmail_service.find_contacts(user_id, phrase)
+        if not result.get("success"):
+            return result
+        contacts = result["contacts"]
+        # Rõ ràng: đúng 1 ứng viên khớp đúng mọi từ của tên (prefix / gần đúng / trùng tên -> để user chọn)
+        exact = [contact for contact in contacts if contact["exact"]]
+        clear = len(exact) == 1
+        return dict(result, contact=exact[0] if clear else None)
+    except Exception as e:
+        logger.error(f"ai_find_recipient error: {e}")
+        return {"success": False, "error": str(e)}
+
+
 def ai_create_draft_email(subject_keyword: str, recipient_name: str = None, full_message: str = None) -> Dict:
     """
     Tạo draft email bằng AI
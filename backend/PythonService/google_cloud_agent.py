@@ -3,11 +3,13 @@ Google Cloud Agent Features
 Tích hợp Google Cloud services vào AI Agent
 """
 import re
-import requests
 import base64
 from typing import Dict, Optional
 import logging
 
+from intent_router import route as route_intents
+from http_client import http
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -24,71 +26,27 @@ class GoogleCloudAgent:
     
     def detect_vision_intent(self, message: str) -> bool:
         """Phát hiện intent phân tích hình ảnh"""
-        patterns = [
-            r'phân tích.*ảnh',
-            r'nhận diện.*ảnh',
-            r'xem.*ảnh',
-            r'đọc.*ảnh',
-            r'analyze.*image',
-            r'what.*in.*image',
-            r'ocr'
-        ]
-        return any(re.search(pattern, message.lower()) for pattern in patterns)
+        return route_intents(message).matched("gc_vision")
     
     def detect_translate_intent(self, message: str) -> bool:
         """Phát hiện intent dịch thuật"""
-        patterns = [
-            r'dịch',
-            r'translate',
-            r'chuyển.*sang',
-            r'nghĩa.*tiếng'
-        ]
-        return any(re.search(pattern, message.lower()) for pattern in patterns)
+        return route_intents(message).matched("gc_translate")
     
     def detect_speech_to_text_intent(self, message: str) -> bool:
         """Phát hiện intent chuyển giọng nói thành text"""
-        patterns = [
-            r'chuyển.*audio',
-            r'transcribe',
-            r'giọng nói.*text',
-            r'speech.*text'
-        ]
-        return any(re.search(pattern, message.lower()) for pattern in patterns)
+        return route_intents(message).matched("gc_speech_to_text")
     
     def detect_text_to_speech_intent(self, message: str) -> bool:
         """Phát hiện intent chuyển text thành giọng nói"""
-        patterns = [
-            r'đọc.*cho.*tôi',
-            r'text.*speech',
-            r'chuyển.*giọng nói',
-            r'phát âm'
-        ]
-        return any(re.search(pattern, message.lower()) for pattern in patterns)
+        return route_intents(message).matched("gc_text_to_speech")
     
     def detect_sentiment_intent(self, message: str) -> bool:
         """Phát hiện intent phân tích cảm xúc"""
-        patterns = [
-            r'cảm xúc',
-            r'sentiment',
-            r'tích cực.*tiêu cực',
-            r'phân tích.*đoạn'
-        ]
-        return any(re.search(pattern, message.lower()) for pattern in patterns)
+        return route_intents(message).matched("gc_sentiment")
     
     def detect_calendar_intent(self, message: str) -> bool:
         """Phát hiện intent liên quan đến lịch"""
-        patterns = [
-            r'tạo.*lịch',
-            r'thêm.*sự kiện',
-            r'nhắc.*tôi',
-            r'calendar.*event',
-            r'lịch.*hôm nay',
-            r'lịch.*tuần',
-            r'meeting',
-            r'cuộc họp',
-            r'deadline'
-        ]
-        return any(re.search(pattern, message.lower()) for pattern in patterns)
+        return route_intents(message).matched("gc_calendar")
     
     # ========================================================================
     # VISION API
@@ -103,7 +61,7 @@ class GoogleCloudAgent:
             if features is None:
                 features = ["labels", "text", "objects"]
             
-            response = requests.post(
+            response = http.post(
                 f"{self.google_cloud_url}/api/google-cloud/vision/analyze",
                 json={
                     "image_url": image_url,
@@ -182,7 +140,7 @@ class GoogleCloudAgent:
         Dịch văn bản
         """
         try:
-            response = requests.post(
+            response = http.post(
                 f"{self.google_cloud_url}/api/google-cloud/translate",
                 json={
                     "text": text,
@@ -270,7 +228,7 @@ class GoogleCloudAgent:
         Chuyển giọng nói thành text
         """
         try:
-            response = requests.post(
+            response = http.post(
                 f"{self.google_cloud_url}/api/google-cloud/speech/transcribe",
                 json={
                     "audio_base64": audio_base64,
@@ -308,7 +266,7 @@ class GoogleCloudAgent:
         Chuyển text thành giọng nói
         """
         try:
-            response = requests.post(
+            response = http.post(
                 f"{self.google_cloud_url}/api/google-cloud/speech/synthesize",
                 json={
                     "text": text,
@@ -348,7 +306,7 @@ class GoogleCloudAgent:
         Phân tích cảm xúc văn bản
         """
         try:
-            response = requests.post(
+            response = http.post(
                 f"{self.google_cloud_url}/api/google-cloud/language/analyze-sentiment",
                 json={
                     "text": text,
@@ -403,7 +361,7 @@ class GoogleCloudAgent:
         Tạo sự kiện trên Google Calendar
         """
         try:
-            response = requests.post(
+            response = http.post(
                 f"{self.google_cloud_url}/api/google-cloud/calendar/create-event",
                 json={
                     "user_id": user_id,
@@ -450,7 +408,7 @@ class GoogleCloudAgent:
         Lấy lịch hôm nay
         """
         try:
-            response = requests.get(
+            response = http.get(
                 f"{self.google_cloud_url}/api/google-cloud/calendar/today-events/{user_id}",
                 timeout=10
             )
@@ -565,7 +523,7 @@ class GoogleCloudAgent:
         Main handler - tự động phát hiện intent và gọi API phù hợp
         """
         # Calendar - List events
-        if 'lịch hôm nay' in message.lower() or 'today calendar' in message.lower():
+        if route_intents(message).matched("gc_today_calendar"):
             if user_id:
                 return self.get_today_calendar_events(user_id=user_id)
         
@@ -8,8 +8,13 @@ from pydantic import BaseModel
 from typing import List, Optional, Dict
 import os
 from dotenv import load_dotenv
-import requests
 import base64
+import asyncio
+import httpx
+
+from calendar_sync import diff_events
+from http_client import http, get_async_client, close_async_clients
+from google_token_cache import get_google_token_cache
 
 load_dotenv()
 
@@ -33,23 +38,18 @@ app.add_middleware(
 
 OAUTH_SERVICE_URL = os.getenv("OAUTH_SERVICE_URL", "http://localhost:8003")
 FALLBACK_API_KEY = os.getenv("GOOGLE_CLOUD_API_KEY")  # Fallback nếu user chưa connect
+CALENDAR_EVENTS_URL = "https://www.googleapis.com/calendar/v3/calendars/primary/events"
+CALENDAR_SYNC_CONCURRENCY = int(os.getenv("CALENDAR_SYNC_CONCURRENCY", "8"))  # Số request Calendar song song mỗi lần sync
+google_tokens = get_google_token_cache()
 
 # ============================================================================
 # HELPER FUNCTIONS
 # ============================================================================
 
 async def get_user_token(user_id: int) -> Optional[str]:
-    """Get valid OAuth token for user"""
+    """Get valid OAuth token for user (cache tới gần hạn - google_token_cache)"""
     try:
-        response = requests.get(
-            f"{OAUTH_SERVICE_URL}/api/oauth/google/token/{user_id}",
-            timeout=5
-        )
-        
-        if response.status_code == 200:
-            data = response.json()
-            return data['access_token']
-        return None
+        return await google_tokens.aget(user_id)
     except Exception as e:
         print(f"Error getting user token: {e}")
         return None
@@ -101,6 +101,12 @@ class CalendarEventRequest(BaseModel):
     reminder_email: Optional[int] = None  # Minutes before event to send email reminder (e.g., 30, 60, 1440 for 1 day)
     reminder_popup: Optional[int] = None  # Minutes before event for popup notification
 
+class CalendarSyncEventsRequest(BaseModel):
+    user_id: int
+    time_min: str  # ISO 8601 - khoảng thời gian được đồng bộ
+    time_max: str
+    events: List[Dict]  # Calendar event resources, có id ổn định (calendar_sync.build_class_event)
+
 class CalendarListRequest(BaseModel):
     time_min: Optional[str] = None  # ISO 8601
     time_max: Optional[str] = None
@@ -133,6 +139,11 @@ class GmailDraftRequest(BaseModel):
 # API ENDPOINTS
 # ============================================================================
 
+@app.on_event("shutdown")
+async def close_http_clients():
+    """Đóng httpx.AsyncClient dùng chung (Google APIs)"""
+    await close_async_clients()
+
 @app.get("/", tags=["Health"])
 async def root():
     """Health check"""
@@ -141,6 +152,7 @@ async def root():
         "service": "Google Cloud Services with OAuth",
         "oauth_enabled": True,
         "fallback_available": bool(FALLBACK_API_KEY),
+        "token_cache": google_tokens.stats(),
         "apis": {
             "vision": "Image analysis",
             "translate": "Text translation",
@@ -184,7 +196,7 @@ async def analyze_image(request: VisionAnalyzeRequest):
         if token:
             # Use user's OAuth token
             headers = get_auth_header(token)
-            response = requests.post(
+            response = http.post(
                 api_url,
                 json={
                     "requests": [{
@@ -196,7 +208,7 @@ async def analyze_image(request: VisionAnalyzeRequest):
             )
         else:
             # Fallback to API key
-            response = requests.post(
+            response = http.post(
                 f"{api_url}?key={FALLBACK_API_KEY}",
                 json={
                     "requests": [{
@@ -273,11 +285,11 @@ async def translate_text(request: TranslateRequest):
         if token:
             # Use OAuth token
             headers = get_auth_header(token)
-            response = requests.post(api_url, json=params, headers=headers)
+            response = http.post(api_url, json=params, headers=headers)
         else:
             # Fallback to API key
             params["key"] = FALLBACK_API_KEY
-            response = requests.post(api_url, params=params)
+            response = http.post(api_url, params=params)
         
         if response.status_code != 200:
             raise HTTPException(status_code=response.status_code, detail=response.text)
@@ -330,9 +342,9 @@ async def text_to_speech(request: TextToSpeechRequest):
         
         if token:
             headers = get_auth_header(token)
-            response = requests.post(api_url, json=payload, headers=headers)
+            response = http.post(api_url, json=payload, headers=headers)
         else:
-            response = requests.post(f"{api_url}?key={FALLBACK_API_KEY}", json=payload)
+            response = http.post(f"{api_url}?key={FALLBACK_API_KEY}", json=payload)
         
         if response.status_code != 200:
             raise HTTPException(status_code=response.status_code, detail=response.text)
@@ -380,9 +392,9 @@ async def analyze_sentiment(request: AnalyzeSentimentRequest):
         
         if token:
             headers = get_auth_header(token)
-            response = requests.post(api_url, json=payload, headers=headers)
+            response = http.post(api_url, json=payload, headers=headers)
         else:
-            response = requests.post(f"{api_url}?key={FALLBACK_API_KEY}", json=payload)
+            response = http.post(f"{api_url}?key={FALLBACK_API_KEY}", json=payload)
         
         if response.status_code != 200:
             raise HTTPException(status_code=response.status_code, detail=response.text)
@@ -502,7 +514,7 @@ async def create_calendar_event(request: CalendarEventRequest):
         print(f"📝 Event data: {event_data}")
         print(f"🔑 Token (first 20 chars): {token[:20]}...")
         
-        response = requests.post(
+        response = http.post(
             api_url,
             json=event_data,
             headers=headers
@@ -575,7 +587,7 @@ async def list_calendar_events(request: CalendarListRequest):
         api_url = "https://www.googleapis.com/calendar/v3/calendars/primary/events"
         headers = get_auth_header(token)
         
-        response = requests.get(
+        response = http.get(
             api_url,
             params=params,
             headers=headers
@@ -614,6 +626,96 @@ async def list_calendar_events(request: CalendarListRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
+async def _list_events_in_range(client: httpx.AsyncClient, headers: Dict, time_min: str, time_max: str) -> List[Dict]:
+    """Toàn bộ event trong khoảng thời gian (theo trang), event lặp lại giữ nguyên dạng gốc"""
+    events = []
+    params = {
+        "timeMin": time_min,
+        "timeMax": time_max,
+        "singleEvents": False,
+        "maxResults": 2500,
+        "fields": "nextPageToken,items(id,summary,start,end,recurrence,extendedProperties)"
+    }
+    while True:
+        response = await client.get(CALENDAR_EVENTS_URL, params=params, headers=headers)
+        if response.status_code != 200:
+            raise HTTPException(status_code=response.status_code, detail=f"Calendar API error: {response.text}")
+        data = response.json()
+        events.extend(data.get("items", []))
+        if not data.get("nextPageToken"):
+            return events
+        params["pageToken"] = data["nextPageToken"]
+
+async def _apply_calendar_op(client: httpx.AsyncClient, headers: Dict, semaphore: asyncio.Semaphore, op: str, event) -> Dict:
+    """Thực hiện 1 thao tác create / update / delete, trả về kết quả của dòng đó"""
+    event_id = event if op == "delete" else event["id"]
+    async with semaphore:
+        try:
+            if op == "create":
+                response = await client.post(CALENDAR_EVENTS_URL, json=event, headers=headers)
+                if response.status_code == 409:
+                    # Id đã tồn tại (vd: event bị xóa trước đó) - ghi đè để khôi phục
+                    response = await client.put(f"{CALENDAR_EVENTS_URL}/{event_id}", json={**event, "status": "confirmed"}, headers=headers)
+            elif op == "update":
+                response = await client.put(f"{CALENDAR_EVENTS_URL}/{event_id}", json=event, headers=headers)
+            else:
+                response = await client.delete(f"{CALENDAR_EVENTS_URL}/{event_id}", headers=headers)
+        except httpx.HTTPError as e:
+            return {"op": op, "id": event_id, "success": False, "error": str(e)}
+    
+    success = response.status_code in (200, 201, 204, 410)
+    return {
+        "op": op,
+        "id": event_id,
+        "summary": event.get("summary") if isinstance(event, dict) else None,
+        "success": success,
+        "error": None if success else response.text[:200]
+    }
+
+@app.post("/api/google-cloud/calendar/sync-events", tags=["Calendar"])
+async def sync_calendar_events(request: CalendarSyncEventsRequest):
+    """
+    Đồng bộ danh sách event (vd: thời khóa biểu) trong 1 khoảng thời gian
+    
+    So với event đang có theo id ổn định, chỉ tạo / cập nhật / xóa phần thay đổi,
+    gọi Calendar API song song tối đa CALENDAR_SYNC_CONCURRENCY request
+    """
+    try:
+        token = await get_user_token(request.user_id)
+        
+        if not token:
+            raise HTTPException(
+                status_code=401,
+                detail="Please connect your Google account to use Calendar"
+            )
+        
+        headers = get_auth_header(token)
+        # Client dùng chung: giữ kết nối tới googleapis giữa các lần sync (HTTP/2 nếu có h2)
+        client = get_async_client("google")
+        existing = await _list_events_in_range(client, headers, request.time_min, request.time_max)
+        diff = diff_events(request.events, existing)
+        
+        semaphore = asyncio.Semaphore(CALENDAR_SYNC_CONCURRENCY)
+        ops = (
+            [("create", event) for event in diff["create"]] +
+            [("update", event) for event in diff["update"]] +
+            [("delete", event_id) for event_id in diff["delete"]]
+        )
+        outcomes = await asyncio.gather(*(
+            _apply_calendar_op(client, headers, semaphore, op, event) for op, event in ops
+        ))
+        
+        return {
+            "success": True,
+            "outcomes": outcomes,
+            "unchanged": len(diff["unchanged"])
+        }
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+
 @app.get("/api/google-cloud/calendar/today-events/{user_id}", tags=["Calendar"])
 async def get_today_events(user_id: int):
     """
@@ -659,7 +761,7 @@ async def delete_calendar_event(event_id: str, user_id: int):
         api_url = f"https://www.googleapis.com/calendar/v3/calendars/primary/events/{event_id}"
         headers = get_auth_header(token)
         
-        response = requests.delete(api_url, headers=headers)
+        response = http.delete(api_url, headers=headers)
         
         if response.status_code != 204:
             raise HTTPException(
@@ -906,14 +1008,14 @@ async def get_token_info(user_id: int):
             }
         
         # Test token bằng cách gọi userinfo endpoint
-        userinfo_response = requests.get(
+        userinfo_response = http.get(
             "https://www.googleapis.com/oauth2/v3/userinfo",
             headers=get_auth_header(token),
             timeout=5
         )
         
         # Test calendar API access
-        calendar_response = requests.get(
+        calendar_response = http.get(
             "https://www.googleapis.com/calendar/v3/calendars/primary",
             headers=get_auth_header(token),
             timeout=5
@@ -10,6 +10,9 @@ import io
 import requests
 from datetime import datetime
 
+from http_client import http
+from google_token_cache import get_google_token_cache
+
 router = APIRouter(prefix="/api/drive", tags=["Google Drive"])
 
 # Spring Boot URL để lấy token
@@ -38,26 +41,22 @@ class DriveFolderResponse(BaseModel):
 # ============================================================================
 
 async def get_user_access_token(user_id: int) -> str:
-    """Lấy access token của user từ OAuth service"""
+    """Lấy access token của user từ OAuth service (cache tới gần hạn, tự động refresh nếu expired)"""
     try:
-        # Gọi endpoint lấy token (tự động refresh nếu expired)
-        response = requests.get(
-            f"http://localhost:8003/api/oauth/google/token/{user_id}",
-            timeout=10
-        )
-        
-        if response.status_code == 200:
-            data = response.json()
-            return data.get('access_token')
-        elif response.status_code == 404:
-            raise HTTPException(
-                status_code=401, 
-                detail="Bạn chưa kết nối Google. Vui lòng vào Settings → Kết nối Google."
-            )
-        else:
-            raise HTTPException(status_code=401, detail="Không thể lấy token Google")
-    except requests.exceptions.RequestException as e:
+        access_token = await get_google_token_cache().aget(user_id)
+    except requests.HTTPError:
+        # OAuth service trả lỗi khác 404 (không refresh được token, Spring Boot / Google lỗi)
+        raise HTTPException(status_code=401, detail="Không thể lấy token Google")
+    except requests.RequestException as e:
         raise HTTPException(status_code=503, detail=f"OAuth service không khả dụng: {str(e)}")
+    
+    # None chỉ khi OAuth service trả 404
+    if not access_token:
+        raise HTTPException(
+            status_code=401, 
+            detail="Bạn chưa kết nối Google. Vui lòng vào Settings → Kết nối Google."
+        )
+    return access_token
 
 
 def upload_to_drive(access_token: str, file_content: bytes, filename: str, mime_type: str, folder_id: str = None) -> dict:
@@ -101,7 +100,7 @@ def upload_to_drive(access_token: str, file_content: bytes, filename: str, mime_
     ).encode('utf-8') + file_content + f'\r\n--{boundary}--'.encode('utf-8')
     
     # Upload
-    response = requests.post(
+    response = http.post(
         "https://www.googleapis.com/upload/drive/v3/files?uploadType=multipart&fields=id,name,mimeType,size,webViewLink,webContentLink",
         headers={
             "Authorization": f"Bearer {access_token}",
@@ -119,7 +118,7 @@ def upload_to_drive(access_token: str, file_content: bytes, filename: str, mime_
     file_id = file_data['id']
     
     # Set permission: Anyone with link can view
-    permission_response = requests.post(
+    permission_response = http.post(
         f"https://www.googleapis.com/drive/v3/files/{file_id}/permissions",
         headers=headers,
         json={
@@ -157,7 +156,7 @@ def create_drive_folder(access_token: str, folder_name: str, parent_id: str = No
     if parent_id:
         metadata["parents"] = [parent_id]
     
-    response = requests.post(
+    response = http.post(
         "https://www.googleapis.com/drive/v3/files?fields=id,name,webViewLink",
         headers=headers,
         json=metadata,
@@ -186,7 +185,7 @@ def find_folder_by_name(access_token: str, folder_name: str, parent_id: str = No
     if parent_id:
         query += f" and '{parent_id}' in parents"
     
-    response = requests.get(
+    response = http.get(
         "https://www.googleapis.com/drive/v3/files",
         headers=headers,
         params={
@@ -244,7 +243,7 @@ def delete_drive_file(access_token: str, file_id: str) -> bool:
         "Authorization": f"Bearer {access_token}"
     }
     
-    response = requests.delete(
+    response = http.delete(
         f"https://www.googleapis.com/drive/v3/files/{file_id}",
         headers=headers,
         timeout=30
@@ -395,7 +394,7 @@ async def list_files(
     if folder_id:
         query += f" and '{folder_id}' in parents"
     
-    response = requests.get(
+    response = http.get(
         "https://www.googleapis.com/drive/v3/files",
         headers=headers,
         params={
@@ -444,7 +443,7 @@ async def get_storage_quota(user_id: int):
         "Authorization": f"Bearer {access_token}"
     }
     
-    response = requests.get(
+    response = http.get(
         "https://www.googleapis.com/drive/v3/about?fields=storageQuota",
         headers=headers,
         timeout=30
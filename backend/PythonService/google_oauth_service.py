@@ -9,12 +9,14 @@ from pydantic import BaseModel
 from typing import Optional, Dict
 import os
 from dotenv import load_dotenv
-import requests
 from datetime import datetime, timedelta
 import json
 from cryptography.fernet import Fernet
 import base64
 
+from http_client import http, close_async_clients
+from oauth_token_store import create_oauth_token_store, TokenUnavailable
+
 load_dotenv()
 
 app = FastAPI(
@@ -117,7 +119,7 @@ def save_user_tokens(user_id: int, access_token: str, refresh_token: str, expire
         encrypted_refresh = encrypt_token(refresh_token) if refresh_token else None
         
         # Save to Spring Boot
-        response = requests.post(
+        response = http.post(
             f"{SPRING_BOOT_URL}/api/users/{user_id}/google-tokens",
             json={
                 "accessToken": encrypted_access,
@@ -134,59 +136,83 @@ def save_user_tokens(user_id: int, access_token: str, refresh_token: str, expire
         return False
 
 def get_user_tokens(user_id: int) -> Optional[Dict]:
-    """Get user tokens from Spring Boot backend"""
-    try:
-        response = requests.get(
-            f"{SPRING_BOOT_URL}/api/users/{user_id}/google-tokens",
-            timeout=5
-        )
-        
-        if response.status_code == 200:
-            data = response.json()
-            
-            # Decrypt tokens
-            if data.get('accessToken'):
-                data['accessToken'] = decrypt_token(data['accessToken'])
-            if data.get('refreshToken'):
-                data['refreshToken'] = decrypt_token(data['refreshToken'])
-            
-            return data
+    """
+    Get user tokens from Spring Boot backend
+    
+    Returns:
+        Tokens đã giải mã, hoặc None nếu user chưa kết nối Google (Spring Boot trả connected=false / 404)
+    Raises:
+        Lỗi kết nối / Spring Boot trả lỗi khác - không được coi là "chưa kết nối"
+    """
+    response = http.get(
+        f"{SPRING_BOOT_URL}/api/users/{user_id}/google-tokens",
+        timeout=5
+    )
+    if response.status_code == 404:
         return None
-    except Exception as e:
-        print(f"Error getting tokens: {e}")
+    response.raise_for_status()
+    
+    data = response.json()
+    if not data.get('connected', True) or not data.get('accessToken'):
         return None
+    
+    # Decrypt tokens
+    data['accessToken'] = decrypt_token(data['accessToken'])
+    if data.get('refreshToken'):
+        data['refreshToken'] = decrypt_token(data['refreshToken'])
+    
+    return data
 
 def refresh_access_token(refresh_token: str) -> Optional[Dict]:
-    """Refresh access token using refresh token"""
-    try:
-        response = requests.post(
-            "https://oauth2.googleapis.com/token",
-            data={
-                "client_id": GOOGLE_OAUTH_CLIENT_ID,
-                "client_secret": GOOGLE_OAUTH_CLIENT_SECRET,
-                "refresh_token": refresh_token,
-                "grant_type": "refresh_token"
-            }
-        )
-        
-        if response.status_code == 200:
-            return response.json()
-        return None
-    except Exception as e:
-        print(f"Error refreshing token: {e}")
+    """
+    Refresh access token using refresh token
+    
+    Returns:
+        Response của Google, hoặc None nếu Google từ chối refresh token (400/401, vd: invalid_grant)
+    Raises:
+        Timeout / lỗi kết nối / Google 5xx - lỗi tạm thời, không phải token bị thu hồi
+    """
+    response = http.post(
+        "https://oauth2.googleapis.com/token",
+        data={
+            "client_id": GOOGLE_OAUTH_CLIENT_ID,
+            "client_secret": GOOGLE_OAUTH_CLIENT_SECRET,
+            "refresh_token": refresh_token,
+            "grant_type": "refresh_token"
+        },
+        timeout=10
+    )
+    
+    if response.status_code in (400, 401):
+        print(f"Google rejected refresh token: {response.status_code}")
         return None
+    response.raise_for_status()
+    return response.json()
+
+# Token đã giải mã + refresh single-flight theo user + refresh nền trước khi hết hạn
+token_store = create_oauth_token_store(get_user_tokens, refresh_access_token, save_user_tokens)
 
 # ============================================================================
 # API ENDPOINTS
 # ============================================================================
 
+@app.on_event("startup")
+async def start_token_refresher():
+    await token_store.start()
+
+@app.on_event("shutdown")
+async def stop_token_refresher():
+    await token_store.stop()
+    await close_async_clients()
+
 @app.get("/", tags=["Health"])
 async def root():
     """Health check"""
     return {
         "status": "running",
         "service": "Google OAuth Service",
-        "oauth_configured": bool(GOOGLE_OAUTH_CLIENT_ID and GOOGLE_OAUTH_CLIENT_SECRET)
+        "oauth_configured": bool(GOOGLE_OAUTH_CLIENT_ID and GOOGLE_OAUTH_CLIENT_SECRET),
+        "token_store": token_store.stats()
     }
 
 @app.get("/api/oauth/google/init", tags=["OAuth"])
@@ -231,7 +257,7 @@ async def oauth_callback(code: str, state: str):
         user_id = int(decoded_state.split(':')[0])
         
         # Exchange code for tokens
-        token_response = requests.post(
+        token_response = http.post(
             "https://oauth2.googleapis.com/token",
             data={
                 "code": code,
@@ -257,6 +283,7 @@ async def oauth_callback(code: str, state: str):
         
         if not success:
             raise HTTPException(status_code=500, detail="Failed to save tokens")
+        token_store.invalidate(user_id)
         
         # Return HTML that sends postMessage and closes
         html_content = f"""
@@ -405,15 +432,16 @@ async def disconnect_google(user_id: int):
         
         if tokens and tokens.get('accessToken'):
             # Revoke token on Google
-            requests.post(
+            http.post(
                 f"https://oauth2.googleapis.com/revoke?token={tokens['accessToken']}"
             )
         
         # Remove from database
-        response = requests.delete(
+        response = http.delete(
             f"{SPRING_BOOT_URL}/api/users/{user_id}/google-tokens",
             timeout=5
         )
+        token_store.invalidate(user_id)
         
         return {
             "success": True,
@@ -428,44 +456,13 @@ async def get_valid_token(user_id: int):
     """
     Get valid access token for user
     Automatically refreshes if expired
+    
+    Token lấy từ bộ nhớ nếu còn hạn; nhiều request cùng lúc token hết hạn chỉ refresh với Google 1 lần
     """
     try:
-        tokens = get_user_tokens(user_id)
-        
-        if not tokens:
-            raise HTTPException(status_code=404, detail="User not connected to Google")
-        
-        # Check if expired
-        if is_token_expired(tokens.get('expiryTime')):
-            # Refresh token
-            if not tokens.get('refreshToken'):
-                raise HTTPException(status_code=401, detail="Token expired and no refresh token available")
-            
-            new_tokens = refresh_access_token(tokens['refreshToken'])
-            
-            if not new_tokens:
-                raise HTTPException(status_code=401, detail="Failed to refresh token")
-            
-            # Save new tokens
-            save_user_tokens(
-                user_id=user_id,
-                access_token=new_tokens['access_token'],
-                refresh_token=tokens['refreshToken'],  # Keep old refresh token
-                expires_in=new_tokens['expires_in']
-            )
-            
-            return {
-                "access_token": new_tokens['access_token'],
-                "refreshed": True
-            }
-        
-        return {
-            "access_token": tokens['accessToken'],
-            "refreshed": False
-        }
-    
-    except HTTPException:
-        raise
+        return await token_store.aget_valid_token(user_id)
+    except TokenUnavailable as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
@@ -0,0 +1,226 @@
+"""
+Google Token Cache
+Cache access token Google theo user_id để mỗi lời gọi Gmail / Drive / Calendar không phải hỏi
+OAuth service (:8003) - endpoint đó lại gọi Spring Boot + giải mã Fernet mỗi lần
+
+- Token giữ tới expires_in (OAuth service trả về) trừ GOOGLE_TOKEN_REFRESH_MARGIN giây
+- Còn dưới GOOGLE_TOKEN_PREFETCH giây: vẫn trả token cũ, lấy token mới ở thread nền (refresh chủ động).
+  Token không kèm expires_in (giữ DEFAULT_TOKEN_TTL giây) thì không refresh nền, hết hạn mới lấy lại
+- Single-flight: nhiều request cùng user lúc token hết hạn chỉ gọi OAuth service 1 lần, các request khác chờ kết quả
+- Google trả 401 (token bị thu hồi) cho bất kỳ request nào qua http_client (Gmail, Drive, Calendar...)
+  -> bỏ token đó khỏi cache (invalidate_token) để lần sau lấy lại
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Tuple
+
+from async_helper import run_blocking
+from http_client import http, on_google_unauthorized
+
+logger = logging.getLogger(__name__)
+
+OAUTH_SERVICE_URL = os.getenv("OAUTH_SERVICE_URL", "http://localhost:8003")
+
+# Token do OAuth service cũ trả về không kèm expires_in: chỉ cache chừng này giây, không refresh nền
+# (TTL này không lớn hơn GOOGLE_TOKEN_PREFETCH -> nếu không mọi cache hit đều mở 1 thread refresh)
+DEFAULT_TOKEN_TTL = 300
+
+
+class _TokenEntry:
+    def __init__(self):
+        self.token: Optional[str] = None
+        self.expires_at = 0.0
+        self.lock = threading.Lock()
+        self.refreshing = False
+        # False nếu OAuth service không trả expires_in (hạn chỉ là DEFAULT_TOKEN_TTL)
+        self.prefetch = True
+
+
+def fetch_token_from_oauth_service(user_id: int) -> Optional[Tuple[str, Optional[float]]]:
+    """
+    GET /api/oauth/google/token/{user_id}
+
+    Returns:
+        (access_token, expires_in) - expires_in None nếu OAuth service không trả về -
+        hoặc None nếu user chưa kết nối Google (OAuth service trả 404)
+    Raises:
+        requests.RequestException: lỗi kết nối, hoặc OAuth service trả lỗi khác (HTTPError - 401 không refresh
+        được, 5xx Spring Boot / Google lỗi) - không được coi là "chưa kết nối"
+    """
+    response = http.get(f"{OAUTH_SERVICE_URL}/api/oauth/google/token/{user_id}", timeout=10)
+    if response.status_code == 404:
+        return None
+    if response.status_code != 200:
+        logger.warning(f"Failed to get Google token for user {user_id}: {response.status_code}")
+        response.raise_for_status()
+    data = response.json()
+    if not data.get("access_token"):
+        return None
+    expires_in = data.get("expires_in")
+    # None: OAuth service không trả expires_in (cache dùng TTL mặc định) - 0 nghĩa là token đã hết hạn
+    return data["access_token"], None if expires_in is None else float(expires_in)
+
+
+class GoogleTokenCache:
+    """Cache access token Google theo user_id (thread-safe, single-flight theo user)"""
+
+    def __init__(
+        self,
+        fetcher: Callable[[int], Optional[Tuple[str, Optional[float]]]] = fetch_token_from_oauth_service,
+        refresh_margin: float = 60,
+        prefetch: float = 300,
+        max_entries: int = 5000
+    ):
+        """
+        Args:
+            fetcher: Hàm user_id -> (access_token, expires_in | None) | None
+            refresh_margin: Coi token hết hạn sớm hơn expiry chừng này giây (bù lệch đồng hồ / request đang bay)
+            prefetch: Còn dưới chừng này giây trước hạn thì refresh nền, request hiện tại vẫn dùng token cũ
+            max_entries: Số user tối đa giữ token (LRU)
+        """
+        self.fetcher = fetcher
+        self.refresh_margin = refresh_margin
+        self.prefetch = max(prefetch, refresh_margin)
+        self.max_entries = max(1, max_entries)
+        self._entries: "OrderedDict[int, _TokenEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.fetches = 0
+        self.background_refreshes = 0
+        self.coalesced = 0
+
+    def _entry(self, user_id: int) -> _TokenEntry:
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                entry = self._entries[user_id] = _TokenEntry()
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            return entry
+
+    def _fresh(self, entry: _TokenEntry, now: float) -> bool:
+        return entry.token is not None and now < entry.expires_at - self.refresh_margin
+
+    def _fetch_locked(self, user_id: int, entry: _TokenEntry) -> Optional[str]:
+        self.fetches += 1
+        result = self.fetcher(user_id)
+        if result is None:
+            entry.token, entry.expires_at = None, 0.0
+            return None
+        entry.token, expires_in = result
+        entry.prefetch = expires_in is not None
+        entry.expires_at = time.time() + (DEFAULT_TOKEN_TTL if expires_in is None else expires_in)
+        return entry.token
+
+    def _refresh_in_background(self, user_id: int, entry: _TokenEntry):
+        def refresh():
+            try:
+                with entry.lock:
+                    self._fetch_locked(user_id, entry)
+                    self.background_refreshes += 1
+            except Exception as e:
+                logger.warning(f"Background Google token refresh failed for user {user_id}: {e}")
+            finally:
+                entry.refreshing = False
+
+        threading.Thread(target=refresh, name=f"google-token-{user_id}", daemon=True).start()
+
+    def peek(self, user_id: int) -> Optional[str]:
+        """Token còn hạn trong cache (không gọi OAuth service, không chặn) - None nếu phải lấy mới"""
+        with self._lock:
+            entry = self._entries.get(user_id)
+        if entry is None or not self._fresh(entry, time.time()):
+            return None
+        return self._use(user_id, entry)
+
+    def _use(self, user_id: int, entry: _TokenEntry) -> str:
+        self.hits += 1
+        if entry.prefetch and not entry.refreshing and time.time() >= entry.expires_at - self.prefetch:
+            entry.refreshing = True
+            self._refresh_in_background(user_id, entry)
+        return entry.token
+
+    def get(self, user_id: int) -> Optional[str]:
+        """
+        Access token còn hạn của user (None chỉ khi OAuth service trả lời user chưa kết nối Google)
+
+        Raise lỗi của fetcher (OAuth service không chạy / trả lỗi...)
+        """
+        entry = self._entry(user_id)
+        if self._fresh(entry, time.time()):
+            return self._use(user_id, entry)
+
+        waited = entry.lock.locked()
+        with entry.lock:
+            # Request khác vừa lấy xong token trong lúc chờ lock
+            if self._fresh(entry, time.time()):
+                if waited:
+                    self.coalesced += 1
+                return self._use(user_id, entry)
+            self.misses += 1
+            return self._fetch_locked(user_id, entry)
+
+    async def aget(self, user_id: int) -> Optional[str]:
+        """Bản async: cache hit trả ngay, miss thì lấy token trong thread pool"""
+        token = self.peek(user_id)
+        if token is not None:
+            return token
+        return await run_blocking(self.get, user_id)
+
+    def invalidate(self, user_id: int):
+        """Bỏ token của user (Google trả 401, user ngắt kết nối)"""
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def invalidate_token(self, access_token: str) -> int:
+        """Bỏ mọi entry đang giữ access_token này (Google trả 401) - trả về số entry đã bỏ"""
+        with self._lock:
+            revoked = [user_id for user_id, entry in self._entries.items() if entry.token == access_token]
+            for user_id in revoked:
+                self._entries.pop(user_id, None)
+        if revoked:
+            logger.info(f"🔑 Dropped revoked Google token for user(s) {revoked}")
+        return len(revoked)
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "fetches": self.fetches,
+            "background_refreshes": self.background_refreshes,
+            "coalesced": self.coalesced
+        }
+
+
+_google_token_cache: Optional[GoogleTokenCache] = None
+_google_token_cache_lock = threading.Lock()
+
+
+def get_google_token_cache() -> GoogleTokenCache:
+    """Singleton theo cấu hình GOOGLE_TOKEN_* (dùng chung cho Gmail / Drive / Google Cloud trong 1 process)"""
+    global _google_token_cache
+    if _google_token_cache is None:
+        with _google_token_cache_lock:
+            if _google_token_cache is None:
+                _google_token_cache = GoogleTokenCache(
+                    refresh_margin=float(os.getenv("GOOGLE_TOKEN_REFRESH_MARGIN", "60")),
+                    prefetch=float(os.getenv("GOOGLE_TOKEN_PREFETCH", "300")),
+                    max_entries=int(os.getenv("GOOGLE_TOKEN_CACHE_SIZE", "5000"))
+                )
+    return _google_token_cache
+
+
+def _invalidate_revoked(access_token: str):
+    if _google_token_cache is not None:
+        _google_token_cache.invalidate_token(access_token)
+
+
+on_google_unauthorized(_invalidate_revoked)
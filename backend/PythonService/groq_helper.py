@@ -4,9 +4,15 @@ Support for Groq's ultra-fast LPU inference (Llama, Mixtral, Gemma models)
 API: https://console.groq.com/
 """
 import requests
-from typing import Dict, List, Optional
+import httpx
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Union
+import asyncio
+import json
 import os
 
+from async_helper import get_async_client
+from http_client import http
+
 
 class GroqClient:
     """Client for Groq API (OpenAI-compatible)"""
@@ -75,7 +81,7 @@ class GroqClient:
         """
         try:
             url = f"{self.base_url}/models"
-            response = requests.get(url, headers=self.headers, timeout=10)
+            response = http.get(url, headers=self.headers, timeout=10)
             response.raise_for_status()
             
             data = response.json()
@@ -152,6 +158,34 @@ class GroqClient:
             print(f"⚠️ Error fetching Groq models from API: {e}")
             return self.FALLBACK_MODELS
     
+    @staticmethod
+    def _parse_stream_line(line: Union[str, bytes]) -> Optional[Dict]:
+        """
+        Parse 1 dòng SSE của Groq ("data: {...}")
+        
+        Returns:
+            chunk dict, None nếu không phải dòng data; raise StopIteration khi gặp [DONE]
+        """
+        if isinstance(line, bytes):
+            line = line.decode("utf-8")
+        if not line.startswith("data:"):
+            return None
+        data = line[5:].strip()
+        if data == "[DONE]":
+            raise StopIteration
+        return json.loads(data)
+    
+    def _iter_stream(self, response) -> Iterator[Dict]:
+        try:
+            for line in response.iter_lines():
+                chunk = self._parse_stream_line(line) if line else None
+                if chunk is not None:
+                    yield chunk
+        except StopIteration:
+            return
+        finally:
+            response.close()
+    
     @classmethod
     def get_available_models(cls) -> List[Dict]:
         """Get list of fallback Groq models (static)"""
@@ -165,7 +199,7 @@ class GroqClient:
         max_tokens: int = 2048,
         stream: bool = False,
         timeout: int = 60  # ← ADDED timeout parameter
-    ) -> Dict:
+    ) -> Union[Dict, Iterator[Dict]]:
         """
         Create chat completion with Groq
         
@@ -182,7 +216,8 @@ class GroqClient:
             timeout: Request timeout in seconds
             
         Returns:
-            Response dict with 'choices' containing generated text
+            Response dict with 'choices' containing generated text,
+            or (stream=True) an iterator of chunk dicts with 'choices[0].delta.content'
         """
         url = f"{self.base_url}/chat/completions"
         
@@ -194,7 +229,33 @@ class GroqClient:
             "stream": stream
         }
         
-        response = requests.post(url, json=payload, headers=self.headers, timeout=timeout)
+        response = http.post(url, json=payload, headers=self.headers, timeout=timeout, stream=stream)
+        response.raise_for_status()
+        
+        if stream:
+            return self._iter_stream(response)
+        return response.json()
+    
+    async def achat_completion(
+        self,
+        messages: List[Dict[str, str]],
+        model: str = "llama-3.1-70b-versatile",
+        temperature: float = 0.7,
+        max_tokens: int = 2048,
+        timeout: int = 60
+    ) -> Dict:
+        """Async version of chat_completion (httpx, không chặn event loop)"""
+        url = f"{self.base_url}/chat/completions"
+        
+        payload = {
+            "messages": messages,
+            "model": model,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "stream": False
+        }
+        
+        response = await get_async_client().post(url, json=payload, headers=self.headers, timeout=timeout)
         response.raise_for_status()
         
         return response.json()
@@ -269,29 +330,110 @@ class GroqClient:
         # All retries failed
         raise last_error if last_error else Exception("Groq API failed after retries")
     
-    def generate_with_vision(
+    async def agenerate_text(
         self,
         prompt: str,
-        image_base64: str,
-        image_mime_type: str = "image/jpeg",
         system_prompt: Optional[str] = None,
-        model: str = "meta-llama/llama-4-scout-17b-16e-instruct"
+        model: str = "llama-3.1-70b-versatile",
+        timeout: int = 60,
+        max_retries: int = 3
     ) -> str:
         """
-        Generate text with image analysis using Groq Vision model
+        Async version of generate_text - backoff dùng asyncio.sleep nên không chặn các request khác
+        """
+        messages = []
         
-        Args:
-            prompt: User prompt/question about the image
-            image_base64: Base64 encoded image data
-            image_mime_type: MIME type of image (image/jpeg, image/png, etc.)
-            system_prompt: Optional system instruction
-            model: Vision-capable model (default: llama-4-scout)
+        if system_prompt:
+            messages.append({
+                "role": "system",
+                "content": system_prompt
+            })
+        
+        messages.append({
+            "role": "user",
+            "content": prompt
+        })
+        
+        last_error = None
+        
+        for attempt in range(max_retries):
+            try:
+                response = await self.achat_completion(
+                    messages,
+                    model=model,
+                    timeout=timeout
+                )
+                return response['choices'][0]['message']['content']
             
-        Returns:
-            Generated text string with image analysis
+            except (httpx.TimeoutException, httpx.ConnectError) as e:
+                last_error = e
+                if attempt < max_retries - 1:
+                    wait_time = 2 ** attempt  # Exponential backoff: 1s, 2s, 4s
+                    print(f"⚠️ Groq {type(e).__name__}, retry {attempt + 1}/{max_retries} after {wait_time}s...")
+                    await asyncio.sleep(wait_time)
+                    continue
+        
+        # All retries failed
+        raise last_error if last_error else Exception("Groq API failed after retries")
+    
+    async def astream_text(
+        self,
+        prompt: str,
+        system_prompt: Optional[str] = None,
+        model: str = "llama-3.1-70b-versatile",
+        temperature: float = 0.7,
+        max_tokens: int = 2048,
+        timeout: int = 60
+    ) -> AsyncIterator[str]:
         """
-        url = f"{self.base_url}/chat/completions"
+        Stream text từng đoạn ngay khi Groq sinh ra (SSE, OpenAI-compatible)
         
+        Yields:
+            Các đoạn text (delta.content)
+        """
+        messages = []
+        
+        if system_prompt:
+            messages.append({
+                "role": "system",
+                "content": system_prompt
+            })
+        
+        messages.append({
+            "role": "user",
+            "content": prompt
+        })
+        
+        payload = {
+            "messages": messages,
+            "model": model,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "stream": True
+        }
+        
+        url = f"{self.base_url}/chat/completions"
+        async with get_async_client().stream("POST", url, json=payload, headers=self.headers, timeout=timeout) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                try:
+                    chunk = self._parse_stream_line(line)
+                except StopIteration:
+                    break
+                if not chunk or not chunk.get("choices"):
+                    continue
+                delta = chunk["choices"][0].get("delta", {}).get("content")
+                if delta:
+                    yield delta
+    
+    def _vision_payload(
+        self,
+        prompt: str,
+        image_base64: str,
+        image_mime_type: str,
+        system_prompt: Optional[str],
+        model: str
+    ) -> Dict:
         messages = []
         
         if system_prompt:
@@ -319,16 +461,60 @@ class GroqClient:
             "content": user_content
         })
         
-        payload = {
+        return {
             "messages": messages,
             "model": model,
             "temperature": 0.7,
             "max_tokens": 4096
         }
+    
+    def generate_with_vision(
+        self,
+        prompt: str,
+        image_base64: str,
+        image_mime_type: str = "image/jpeg",
+        system_prompt: Optional[str] = None,
+        model: str = "meta-llama/llama-4-scout-17b-16e-instruct"
+    ) -> str:
+        """
+        Generate text with image analysis using Groq Vision model
+        
+        Args:
+            prompt: User prompt/question about the image
+            image_base64: Base64 encoded image data
+            image_mime_type: MIME type of image (image/jpeg, image/png, etc.)
+            system_prompt: Optional system instruction
+            model: Vision-capable model (default: llama-4-scout)
+            
+        Returns:
+            Generated text string with image analysis
+        """
+        url = f"{self.base_url}/chat/completions"
+        payload = self._vision_payload(prompt, image_base64, image_mime_type, system_prompt, model)
+        
+        print(f"🖼️ Groq Vision request - model: {model}")
+        
+        response = http.post(url, json=payload, headers=self.headers, timeout=60)
+        response.raise_for_status()
+        
+        result = response.json()
+        return result['choices'][0]['message']['content']
+    
+    async def agenerate_with_vision(
+        self,
+        prompt: str,
+        image_base64: str,
+        image_mime_type: str = "image/jpeg",
+        system_prompt: Optional[str] = None,
+        model: str = "meta-llama/llama-4-scout-17b-16e-instruct"
+    ) -> str:
+        """Async version of generate_with_vision"""
+        url = f"{self.base_url}/chat/completions"
+        payload = self._vision_payload(prompt, image_base64, image_mime_type, system_prompt, model)
         
         print(f"🖼️ Groq Vision request - model: {model}")
         
-        response = requests.post(url, json=payload, headers=self.headers, timeout=60)
+        response = await get_async_client().post(url, json=payload, headers=self.headers, timeout=60)
         response.raise_for_status()
         
         result = response.json()
@@ -0,0 +1,196 @@
+"""
+HTTP Client
+Lớp HTTP dùng chung cho mọi lời gọi ra ngoài của Python service: Spring Boot (:8080), OAuth service (:8003),
+Google Cloud service (:8004) và Google APIs - thay cho requests.get/post (mỗi lần 1 kết nối TCP/TLS mới)
+
+- http: requests.Session dùng chung, keep-alive pool theo host (HTTP_POOL_MAXSIZE kết nối / host,
+  HTTP_POOL_HOSTS host), timeout mặc định (HTTP_CONNECT_TIMEOUT / HTTP_READ_TIMEOUT) nếu caller không truyền.
+  Không giữ cookie: session dùng chung cho mọi user
+- get_async_client(kind): httpx.AsyncClient dùng chung theo event loop - "internal" (Spring Boot, Groq...)
+  hoặc "google" (Google APIs: HTTP/2 - nhiều request song song trên 1 kết nối - nếu có gói h2, không thì HTTP/1.1)
+- stats(): số request / kết nối mới theo host của `http` -> tỉ lệ dùng lại kết nối
+- on_google_unauthorized(listener): Google APIs trả 401 cho 1 Bearer token (qua `http` hoặc client "google")
+  -> gọi listener(token), vd: google_token_cache bỏ token đã bị thu hồi
+"""
+import asyncio
+import os
+import threading
+from collections import defaultdict
+from http.cookiejar import DefaultCookiePolicy
+from typing import Callable, Dict, List, Tuple
+from urllib.parse import urlsplit
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+try:
+    import h2  # noqa: F401 - httpx cần gói h2 để bật HTTP/2
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+HTTP_POOL_HOSTS = int(os.getenv("HTTP_POOL_HOSTS", "16"))
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "32"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "30"))
+GOOGLE_HTTP2 = HTTP2_AVAILABLE and os.getenv("GOOGLE_HTTP2", "true").lower() == "true"
+
+DEFAULT_TIMEOUT = httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT)
+
+
+class _Stats:
+    """Đếm request và kết nối mới theo host"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests: Dict[str, int] = defaultdict(int)
+        self.connections: Dict[str, int] = defaultdict(int)
+
+    def request(self, host: str):
+        with self._lock:
+            self.requests[host] += 1
+
+    def connection(self, host: str):
+        with self._lock:
+            self.connections[host] += 1
+
+    def snapshot(self) -> Dict[str, Dict]:
+        with self._lock:
+            result = {}
+            for host, count in self.requests.items():
+                opened = self.connections.get(host, 0)
+                result[host] = {
+                    "requests": count,
+                    "connections_opened": opened,
+                    "reuse_rate": round(1 - opened / count, 4) if count else 0.0
+                }
+            return result
+
+
+_stats = _Stats()
+
+
+def _host(url: str) -> str:
+    parts = urlsplit(str(url))
+    return parts.netloc or parts.path
+
+
+_unauthorized_listeners: List[Callable[[str], None]] = []
+
+
+def on_google_unauthorized(listener: Callable[[str], None]):
+    """Đăng ký listener(access_token) khi Google APIs trả 401 cho token đó"""
+    _unauthorized_listeners.append(listener)
+
+
+def _check_unauthorized(status_code: int, url, authorization: str):
+    if status_code != 401 or not _host(url).split(":")[0].endswith("googleapis.com"):
+        return
+    if authorization.startswith("Bearer "):
+        for listener in _unauthorized_listeners:
+            listener(authorization[len("Bearer "):])
+
+
+# ----------------------------------------------------------------------------
+# Sync: requests.Session dùng chung
+# ----------------------------------------------------------------------------
+
+class _CountingHTTPConnectionPool(HTTPConnectionPool):
+    def _new_conn(self):
+        _stats.connection(f"{self.host}:{self.port}" if self.port else self.host)
+        return super()._new_conn()
+
+
+class _CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    def _new_conn(self):
+        _stats.connection(f"{self.host}:{self.port}" if self.port and self.port != 443 else self.host)
+        return super()._new_conn()
+
+
+class _PooledAdapter(HTTPAdapter):
+    """HTTPAdapter đếm số kết nối TCP mới theo host"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _CountingHTTPConnectionPool,
+            "https": _CountingHTTPSConnectionPool
+        }
+
+
+class PooledSession(requests.Session):
+    """requests.Session có timeout mặc định, không lưu cookie, đếm request theo host"""
+
+    def __init__(self, pool_hosts: int = HTTP_POOL_HOSTS, pool_maxsize: int = HTTP_POOL_MAXSIZE,
+                 timeout: Tuple[float, float] = (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)):
+        super().__init__()
+        self.default_timeout = timeout
+        self.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        adapter = _PooledAdapter(pool_connections=pool_hosts, pool_maxsize=pool_maxsize)
+        self.mount("http://", adapter)
+        self.mount("https://", adapter)
+        self.hooks["response"].append(self._on_response)
+
+    @staticmethod
+    def _on_response(response, *args, **kwargs):
+        _check_unauthorized(response.status_code, response.url, response.request.headers.get("Authorization", ""))
+
+    def request(self, method, url, *args, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.default_timeout
+        _stats.request(_host(url))
+        return super().request(method, url, *args, **kwargs)
+
+
+http = PooledSession()
+
+
+# ----------------------------------------------------------------------------
+# Async: httpx.AsyncClient dùng chung theo event loop
+# ----------------------------------------------------------------------------
+
+_async_clients: Dict[str, Tuple[httpx.AsyncClient, asyncio.AbstractEventLoop]] = {}
+
+
+def get_async_client(kind: str = "internal") -> httpx.AsyncClient:
+    """
+    httpx.AsyncClient dùng chung cho event loop hiện tại
+
+    kind: "internal" (Spring Boot, OAuth service, Groq...) hoặc "google" (Google APIs, HTTP/2 nếu có h2)
+
+    Client gắn với event loop tạo ra nó, nên tạo lại nếu loop đổi (vd: benchmark chạy nhiều asyncio.run)
+    """
+    loop = asyncio.get_running_loop()
+    client, client_loop = _async_clients.get(kind, (None, None))
+    if client is None or client.is_closed or client_loop is not loop:
+        client = httpx.AsyncClient(
+            http2=GOOGLE_HTTP2 if kind == "google" else False,
+            timeout=DEFAULT_TIMEOUT,
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=HTTP_POOL_MAXSIZE),
+            event_hooks={"response": [_on_async_response]} if kind == "google" else None
+        )
+        _async_clients[kind] = (client, loop)
+    return client
+
+
+async def _on_async_response(response: httpx.Response):
+    _check_unauthorized(response.status_code, response.url, response.request.headers.get("Authorization", ""))
+
+
+async def close_async_clients():
+    """Đóng các AsyncClient khi app shutdown"""
+    for client, _ in list(_async_clients.values()):
+        if not client.is_closed:
+            await client.aclose()
+    _async_clients.clear()
+
+
+def stats() -> Dict:
+    """Request / kết nối mới / tỉ lệ dùng lại theo host (session sync `http`)"""
+    return {
+        "hosts": _stats.snapshot(),
+        "google_http2": GOOGLE_HTTP2,
+        "async_clients": sorted(_async_clients)
+    }
@@ -0,0 +1,319 @@
+"""
+Intent Router
+Phát hiện mọi intent của 1 tin nhắn chat trong 1 lượt, thay cho chuỗi detect_* (mỗi hàm lower() lại
+tin nhắn rồi re.search từng pattern)
+
+- Tin nhắn được chuẩn hóa 1 lần: NFC + lower(). Intent đánh dấu fold khớp cả pattern có dấu lẫn bản bỏ dấu
+  tiếng Việt của pattern (đ -> d), tính là 1 pattern
+- Pattern là chuỗi thường (phần lớn) được gom vào 1 automaton Aho-Corasick -> 1 lần duyệt tin nhắn
+  tìm ra mọi keyword của mọi intent
+- Pattern regex thật (.*, \\b, \\d...) bắt đầu bằng 1 đoạn chữ cố định (vd: "tạo.*lịch" -> "tạo") được gắn
+  đoạn đó vào automaton làm điều kiện: chỉ chạy regex khi đoạn chữ xuất hiện. Regex không có đoạn cố định
+  của mỗi intent được gộp thành 1 regex đã compile sẵn
+- route(message) trả về IntentScores (số pattern khớp của từng intent), cache theo tin nhắn nên các detect_*
+  gọi nhiều lần trong cùng 1 request không phải quét lại
+
+INTENT_PATTERNS là nguồn duy nhất của pattern - các detect_* trong agent_features / google_cloud_agent đọc từ đây
+"""
+import re
+import unicodedata
+from collections import deque
+from functools import lru_cache
+from typing import Dict, Iterable, List, Set, Tuple
+
+# Intent -> (pattern, so khớp trên bản bỏ dấu?)
+# fold=True: mỗi pattern (chuỗi thường) khớp cả bản có dấu và bản bỏ dấu ("gửi mail" / "gui mail")
+INTENT_PATTERNS: Dict[str, Tuple[List[str], bool]] = {
+    # ----- agent_features: email -----
+    "email": ([
+        r'gửi email', r'gửi mail', r'gửi gmail',
+        r'send email', r'send mail',
+        r'email cho', r'mail cho', r'gmail cho',
+        r'email đến', r'mail đến', r'gmail đến',
+        r'soạn email', r'soạn mail',
+        r'viết email', r'viết mail',
+        r'đọc email', r'đọc mail',
+        r'xem email', r'xem mail',
+        r'kiểm tra email', r'check email', r'inbox', r'hộp thư',
+        r'email mới', r'email chưa đọc', r'unread email',
+        r'tìm email', r'tìm mail', r'search email',
+        r'email từ', r'email của', r'mail từ', r'mail của'
+    ], True),
+    "gmail_send": ([
+        r'gửi email', r'gửi mail', r'gửi gmail',
+        r'send email', r'send mail',
+        r'email cho', r'mail cho', r'gmail cho',
+        r'email đến', r'mail đến', r'gmail đến',
+        r'soạn email', r'soạn mail',
+        r'viết email', r'viết mail'
+    ], True),
+    "gmail_read": ([
+        r'đọc email', r'xem email', r'kiểm tra email', r'check email', r'inbox', r'hộp thư',
+        r'email mới', r'email chưa đọc', r'có email', r'xem mail', r'đọc mail'
+    ], False),
+    "gmail_search": ([
+        r'tìm email', r'search email', r'email từ', r'email của', r'tìm mail'
+    ], False),
+
+    # ----- agent_features: lịch học / điểm -----
+    # Tin nhắn khớp schedule_exclude (soạn / gửi email...) không phải intent xem lịch
+    "schedule_exclude": ([
+        r'gửi\s+(?:email|mail)',
+        r'gui\s+(?:email|mail)',
+        r'send\s+email',
+        r'soạn\s+(?:email|mail)',
+        r'viết\s+(?:email|mail)',
+        r'đọc\s+(?:email|mail)',
+        r'xem\s+(?:email|mail)',
+        r'email\s+cho',
+        r'mail\s+cho',
+        r'mail\s+den',
+        r'email\s+den'
+    ], False),
+    "schedule": ([
+        r'thời khóa biểu',
+        r'tkb',
+        r'lịch học',
+        r'hôm nay.*lớp',
+        r'có lớp',
+        r'schedule',
+        # Ngày tương đối - có word boundary để không khớp "gmail"
+        r'hôm qua',
+        r'hom qua',
+        r'\bmai\b',
+        r'\bmốt\b',
+        r'\bmot\b',
+        r'\bkia\b',
+        # Thứ trong tuần
+        r'thứ\s*[2-7]',
+        r'chủ\s*nhật',
+        r'cn\b',
+        # Ngày cụ thể: DD/MM/YYYY, ngày DD/MM, ngày X tháng Y
+        r'(?:ngày\s+)?\d{1,2}[/-]\d{1,2}[/-]\d{4}',
+        r'ngày\s+\d{1,2}/\d{1,2}',
+        r'(?:ngày|ngay)\s+\d{1,2}\s+(?:tháng|thang)\s+\d{1,2}'
+    ], False),
+    "week_schedule": ([
+        r'tuần\s*(này|sau|tới|trước|\d+)',
+        r'this week',
+        r'next week',
+        r'last week',
+        r'lịch tuần',
+        r'tkb tuần'
+    ], False),
+    "calendar_sync": ([
+        r'đồng bộ.*(?:tkb|thời khóa biểu|lịch học).*calendar',
+        r'sync.*(?:schedule|tkb).*calendar',
+        r'thêm.*(?:tkb|lịch học).*(?:vào|lên).*calendar',
+        r'add.*schedule.*calendar',
+        r'đưa.*(?:tkb|lịch).*lên.*calendar'
+    ], False),
+    "grade": ([
+        r'điểm', r'grade', r'kết quả học tập', r'điểm số'
+    ], False),
+
+    # ----- google_cloud_agent -----
+    "gc_today_calendar": ([
+        r'lịch hôm nay', r'today calendar'
+    ], False),
+    "gc_calendar": ([
+        r'tạo.*lịch', r'thêm.*sự kiện', r'nhắc.*tôi', r'calendar.*event', r'lịch.*hôm nay',
+        r'lịch.*tuần', r'meeting', r'cuộc họp', r'deadline'
+    ], False),
+    "gc_vision": ([
+        r'phân tích.*ảnh', r'nhận diện.*ảnh', r'xem.*ảnh', r'đọc.*ảnh',
+        r'analyze.*image', r'what.*in.*image', r'ocr'
+    ], False),
+    "gc_translate": ([
+        r'dịch', r'translate', r'chuyển.*sang', r'nghĩa.*tiếng'
+    ], False),
+    "gc_speech_to_text": ([
+        r'chuyển.*audio', r'transcribe', r'giọng nói.*text', r'speech.*text'
+    ], False),
+    "gc_text_to_speech": ([
+        r'đọc.*cho.*tôi', r'text.*speech', r'chuyển.*giọng nói', r'phát âm'
+    ], False),
+    "gc_sentiment": ([
+        r'cảm xúc', r'sentiment', r'tích cực.*tiêu cực', r'phân tích.*đoạn'
+    ], False),
+
+    # ----- main.detect_tool_intent (trigger YouTube / Google / Wikipedia) -----
+    "tool_play": ([
+        "phát", "play", "chơi", "bật"
+    ], False),
+    "tool_youtube": ([
+        "mở video", "xem video", "open video", "show video", "youtube", "tìm video"
+    ], False),
+    "tool_google": ([
+        "tìm kiếm", "search", "google", "tra google", "tìm trên google"
+    ], False),
+    "tool_wiki": ([
+        "wikipedia", "wiki", "tra wikipedia"
+    ], False),
+}
+
+TOOL_INTENTS = ("tool_play", "tool_youtube", "tool_google", "tool_wiki")
+
+
+def fold_diacritics(text: str) -> str:
+    """Bỏ dấu tiếng Việt: "gửi thư đến" -> "gui thu den" """
+    decomposed = unicodedata.normalize("NFD", text)
+    return "".join(c for c in decomposed if unicodedata.category(c) != "Mn").replace("đ", "d").replace("Đ", "D")
+
+
+_REGEX_META = set(".^$*+?{}[]\\|()")
+
+
+def _is_literal(pattern: str) -> bool:
+    # Không dùng re.escape(pattern) == pattern: re.escape escape cả dấu cách ("gửi\\ email")
+    return not any(char in _REGEX_META for char in pattern)
+
+
+def _literal_prefix(pattern: str) -> str:
+    """Đoạn chữ cố định mà mọi match của pattern đều bắt đầu bằng ("" nếu không có)"""
+    depth = 0
+    for char in pattern:
+        depth += {"(": 1, ")": -1}.get(char, 0)
+        if char == "|" and depth == 0:
+            return ""  # alternation ở ngoài cùng - không có prefix chung
+    if pattern.startswith("\\b"):
+        pattern = pattern[2:]
+    prefix = []
+    for char in pattern:
+        if char in _REGEX_META:
+            if char in "*?{" and prefix:
+                prefix.pop()  # ký tự trước quantifier có thể không xuất hiện
+            break
+        prefix.append(char)
+    return "".join(prefix)
+
+
+class KeywordAutomaton:
+    """Aho-Corasick: tìm mọi keyword (kể cả chồng lên nhau) trong 1 lần duyệt text"""
+
+    def __init__(self, keywords: Dict[str, Iterable]):
+        """
+        Args:
+            keywords: keyword -> các nhãn trả về khi keyword xuất hiện
+        """
+        self._goto: List[Dict[str, int]] = [{}]
+        self._output: List[Set] = [set()]
+        for keyword, labels in keywords.items():
+            state = 0
+            for char in keyword:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][char] = next_state
+                    self._goto.append({})
+                    self._output.append(set())
+                state = next_state
+            self._output[state].update(labels)
+
+        # Failure link theo BFS; output của trạng thái gộp luôn output của failure link
+        self._fail = [0] * len(self._goto)
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(char, 0)
+                self._fail[next_state] = target if target != next_state else 0
+                self._output[next_state] |= self._output[self._fail[next_state]]
+
+    def scan(self, text: str) -> Set:
+        """Nhãn của mọi keyword xuất hiện trong text"""
+        goto, fail, output = self._goto, self._fail, self._output
+        found = set()
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                found |= output[state]
+        return found
+
+
+class IntentScores:
+    """Kết quả route(): intent -> số pattern khớp"""
+
+    __slots__ = ("scores",)
+
+    def __init__(self, scores: Dict[str, int]):
+        self.scores = scores
+
+    def __getitem__(self, intent: str) -> int:
+        return self.scores.get(intent, 0)
+
+    def matched(self, intent: str) -> bool:
+        return self.scores.get(intent, 0) > 0
+
+    def matched_any(self, intents: Iterable[str]) -> bool:
+        return any(self.scores.get(intent, 0) > 0 for intent in intents)
+
+    def __repr__(self) -> str:
+        return f"IntentScores({ {k: v for k, v in self.scores.items() if v} })"
+
+
+class IntentRouter:
+    """Compile INTENT_PATTERNS thành 1 automaton + regex theo điều kiện / regex gộp cho mỗi intent"""
+
+    def __init__(self, intent_patterns: Dict[str, Tuple[List[str], bool]] = None):
+        intent_patterns = intent_patterns or INTENT_PATTERNS
+        self.intents = list(intent_patterns)
+        keywords: Dict[str, Set] = {}
+        # Regex có đoạn chữ cố định: chỉ search khi automaton thấy đoạn đó
+        self._anchored: List[Tuple[str, "re.Pattern"]] = []
+        # Regex không có đoạn cố định: gộp theo intent, luôn search
+        self._merged: List[Tuple[str, "re.Pattern"]] = []
+
+        for intent, (patterns, fold) in intent_patterns.items():
+            unanchored = []
+            for index, pattern in enumerate(patterns):
+                if _is_literal(pattern):
+                    if fold:
+                        # Bản có dấu và không dấu của cùng 1 pattern: cùng nhãn -> tính là 1
+                        folded = fold_diacritics(pattern)
+                        for variant in (pattern, folded):
+                            keywords.setdefault(variant, set()).add(("keyword", intent, folded))
+                    else:
+                        keywords.setdefault(pattern, set()).add(("keyword", intent, index))
+                    continue
+                anchor = _literal_prefix(pattern)
+                if len(anchor) >= 2:
+                    keywords.setdefault(anchor, set()).add(("regex", len(self._anchored), None))
+                    self._anchored.append((intent, re.compile(pattern)))
+                else:
+                    unanchored.append(f"(?:{pattern})")
+            if unanchored:
+                self._merged.append((intent, re.compile("|".join(unanchored))))
+
+        self._automaton = KeywordAutomaton(keywords)
+
+    def route(self, message: str) -> IntentScores:
+        lowered = unicodedata.normalize("NFC", message or "").lower()
+        scores = dict.fromkeys(self.intents, 0)
+        for kind, target, _ in self._automaton.scan(lowered):
+            if kind == "keyword":
+                scores[target] += 1
+            else:
+                intent, regex = self._anchored[target]
+                if regex.search(lowered):
+                    scores[intent] += 1
+        for intent, regex in self._merged:
+            if regex.search(lowered):
+                scores[intent] += 1
+        return IntentScores(scores)
+
+
+_router = IntentRouter()
+
+
+@lru_cache(maxsize=1024)
+def route(message: str) -> IntentScores:
+    """Điểm của mọi intent cho tin nhắn (cache theo tin nhắn - các detect_* dùng chung 1 lượt quét)"""
+    return _router.route(message)
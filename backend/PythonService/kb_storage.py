@@ -0,0 +1,358 @@
+"""
+Knowledge Base Storage
+Lưu trữ append-only cho SimpleVectorDB: metadata trong log JSONL, embeddings trong file float32 thô (memory-mapped)
+
+Cấu trúc thư mục:
+    manifest.json        - {"version", "generation", "dim"}, chỉ ghi bằng atomic rename
+    docs.<gen>.jsonl     - mỗi dòng 1 record:
+                             {"op": "add", "row": 0, "id": "...", "document": "...", "metadata": {...}}
+                             {"op": "del", "ids": ["..."]}
+    vectors.<gen>.f32    - embeddings float32 row-major, hàng i ứng với record có "row": i
+
+Ghi: vectors được append + fsync trước, rồi mới append dòng log. Khi load, dòng log
+cuối bị ghi dở (crash) sẽ bị bỏ qua và các hàng vector thừa bị cắt đi.
+Compaction: ghi generation mới rồi đổi manifest bằng os.replace (atomic).
+Thư mục chưa có manifest = chưa khởi tạo: migrate ghi cả generation rồi mới ghi manifest, crash giữa chừng
+thì lần chạy sau migrate lại từ đầu.
+"""
+import json
+import os
+import sys
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+class KnowledgeBaseStore:
+    """Append-only store: JSONL metadata log + raw float32 embedding file"""
+
+    MANIFEST = "manifest.json"
+    VERSION = 1
+
+    def __init__(self, directory: str, compact_min_dead: int = 256, compact_dead_ratio: float = 0.25):
+        """
+        Args:
+            directory: Thư mục lưu trữ
+            compact_min_dead: Số hàng đã xóa tối thiểu trước khi tự compact
+            compact_dead_ratio: Tỉ lệ hàng đã xóa / tổng số hàng để tự compact
+        """
+        self.directory = directory
+        self.compact_min_dead = compact_min_dead
+        self.compact_dead_ratio = compact_dead_ratio
+        self._lock = threading.RLock()
+
+        os.makedirs(directory, exist_ok=True)
+        manifest_path = os.path.join(directory, self.MANIFEST)
+        # True nếu thư mục chưa từng được khởi tạo (dùng để quyết định migrate).
+        # Manifest chỉ được ghi khi có dữ liệu đầu tiên / migrate xong (bulk_load)
+        self.is_new = not os.path.exists(manifest_path)
+
+        if self.is_new:
+            self.generation = 0
+            self.dim = None
+        else:
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            self.generation = manifest.get("generation", 0)
+            self.dim = manifest.get("dim")
+
+        self._row_count = 0
+        self._dead_rows = 0
+        self._id_rows: Dict[str, List[int]] = {}
+        self._remove_stale_generations()
+
+    # ------------------------------------------------------------------
+    # Paths / manifest
+    # ------------------------------------------------------------------
+
+    def _log_path(self, generation: Optional[int] = None) -> str:
+        gen = self.generation if generation is None else generation
+        return os.path.join(self.directory, f"docs.{gen}.jsonl")
+
+    def _vector_path(self, generation: Optional[int] = None) -> str:
+        gen = self.generation if generation is None else generation
+        return os.path.join(self.directory, f"vectors.{gen}.f32")
+
+    def _write_manifest(self):
+        """Ghi manifest qua file tạm + os.replace để không bao giờ bị ghi dở"""
+        manifest_path = os.path.join(self.directory, self.MANIFEST)
+        tmp_path = manifest_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"version": self.VERSION, "generation": self.generation, "dim": self.dim}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, manifest_path)
+        _fsync_dir(self.directory)
+
+    def _remove_stale_generations(self):
+        """Xóa file của các generation cũ (còn sót lại nếu crash giữa lúc compact)"""
+        current = {os.path.basename(self._log_path()), os.path.basename(self._vector_path())}
+        for name in os.listdir(self.directory):
+            if (name.startswith("docs.") or name.startswith("vectors.")) and name not in current:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+
+    # ------------------------------------------------------------------
+    # Read
+    # ------------------------------------------------------------------
+
+    def _row_bytes(self) -> int:
+        return self.dim * np.dtype(np.float32).itemsize
+
+    def _read(self) -> Tuple[List[Dict], np.ndarray]:
+        """Đọc log + vectors, sửa phần đuôi bị ghi dở, trả về các record còn sống"""
+        records: Dict[int, Dict] = {}
+        id_rows: Dict[str, List[int]] = {}
+        row_count = 0
+        good_offset = 0
+
+        log_path = self._log_path()
+        if os.path.exists(log_path):
+            with open(log_path, 'rb') as f:
+                for raw_line in f:
+                    if not raw_line.endswith(b"\n"):
+                        break  # dòng cuối ghi dở
+                    try:
+                        entry = json.loads(raw_line.decode('utf-8'))
+                    except (UnicodeDecodeError, json.JSONDecodeError):
+                        break
+                    good_offset += len(raw_line)
+
+                    if entry.get("op") == "add":
+                        row = entry["row"]
+                        records[row] = {
+                            "id": entry["id"],
+                            "document": entry["document"],
+                            "metadata": entry.get("metadata") or {}
+                        }
+                        id_rows.setdefault(entry["id"], []).append(row)
+                        row_count = max(row_count, row + 1)
+                    elif entry.get("op") == "del":
+                        for doc_id in entry.get("ids", []):
+                            for row in id_rows.pop(doc_id, []):
+                                records.pop(row, None)
+
+            if good_offset != os.path.getsize(log_path):
+                with open(log_path, 'r+b') as f:
+                    f.truncate(good_offset)
+
+        needs_repair = False
+        vectors = np.empty((0, self.dim or 0), dtype=np.float32)
+        vector_path = self._vector_path()
+        if self.dim and os.path.exists(vector_path):
+            rows_on_disk = os.path.getsize(vector_path) // self._row_bytes()
+            if rows_on_disk != row_count:
+                # Vector đã ghi nhưng log chưa kịp ghi -> cắt bỏ để các lần append sau khớp row
+                if rows_on_disk < row_count:
+                    # Log trỏ tới hàng vector không tồn tại -> ghi lại generation sạch
+                    needs_repair = True
+                row_count = min(row_count, rows_on_disk)
+                with open(vector_path, 'r+b') as f:
+                    f.truncate(row_count * self._row_bytes())
+                records = {row: rec for row, rec in records.items() if row < row_count}
+            if row_count:
+                mapped = np.memmap(vector_path, dtype=np.float32, mode='r', shape=(row_count, self.dim))
+                vectors = np.asarray(mapped[sorted(records)])
+                del mapped
+
+        self._row_count = row_count
+        self._dead_rows = row_count - len(records)
+        self._id_rows = {doc_id: [r for r in rows if r in records] for doc_id, rows in id_rows.items()}
+        live_records = [records[row] for row in sorted(records)]
+        if needs_repair:
+            self._swap_generation(live_records, vectors)
+        return live_records, vectors
+
+    def load(self) -> Tuple[List[Dict], np.ndarray]:
+        """
+        Load toàn bộ documents còn sống
+
+        Returns:
+            (records, vectors) - records[i] = {"id", "document", "metadata"}, vectors[i] là embedding tương ứng
+        """
+        with self._lock:
+            return self._read()
+
+    # ------------------------------------------------------------------
+    # Write
+    # ------------------------------------------------------------------
+
+    def append(self, records: List[Dict], embeddings: Sequence[Sequence[float]]):
+        """Append documents + embeddings (O(số document mới), không ghi lại toàn bộ store)"""
+        if not records:
+            return
+        block = np.asarray(embeddings, dtype=np.float32)
+        if block.ndim != 2 or block.shape[0] != len(records):
+            raise ValueError("embeddings must be a 2-D array with one row per record")
+
+        with self._lock:
+            if self.dim is None:
+                self.dim = int(block.shape[1])
+                self._write_manifest()
+            elif block.shape[1] != self.dim:
+                raise ValueError(f"Embedding dimension mismatch: expected {self.dim}, got {block.shape[1]}")
+
+            with open(self._vector_path(), 'ab') as f:
+                f.write(block.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+
+            lines = []
+            for offset, record in enumerate(records):
+                row = self._row_count + offset
+                lines.append(json.dumps({
+                    "op": "add",
+                    "row": row,
+                    "id": record["id"],
+                    "document": record["document"],
+                    "metadata": record.get("metadata") or {}
+                }, ensure_ascii=False))
+                self._id_rows.setdefault(record["id"], []).append(row)
+            self._append_log(lines)
+            self._row_count += len(records)
+
+    def bulk_load(self, records: List[Dict], embeddings: Sequence[Sequence[float]]):
+        """
+        Thay toàn bộ store bằng records (migrate): ghi generation mới, manifest là điểm commit
+
+        Crash trước khi ghi manifest -> thư mục vẫn is_new, file generation dở bị xóa ở lần chạy sau
+        """
+        block = np.asarray(embeddings, dtype=np.float32)
+        if block.ndim != 2 or block.shape[0] != len(records):
+            raise ValueError("embeddings must be a 2-D array with one row per record")
+
+        with self._lock:
+            self.dim = int(block.shape[1])
+            self._swap_generation(records, block)
+            self.is_new = False
+
+    def delete(self, ids: List[str]) -> int:
+        """Ghi tombstone cho các ids; tự compact khi có quá nhiều hàng chết"""
+        with self._lock:
+            removed = sum(len(self._id_rows.pop(doc_id, [])) for doc_id in ids)
+            if removed:
+                self._append_log([json.dumps({"op": "del", "ids": list(ids)}, ensure_ascii=False)])
+                self._dead_rows += removed
+                if self.needs_compaction:
+                    self.compact()
+            return removed
+
+    def _append_log(self, lines: List[str]):
+        with open(self._log_path(), 'a', encoding='utf-8', newline='\n') as f:
+            f.write("\n".join(lines) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    @property
+    def needs_compaction(self) -> bool:
+        if self._row_count == 0:
+            return False
+        return (self._dead_rows >= self.compact_min_dead
+                and self._dead_rows / self._row_count >= self.compact_dead_ratio)
+
+    def compact(self):
+        """Ghi lại các record còn sống sang generation mới rồi swap manifest (atomic)"""
+        with self._lock:
+            records, vectors = self._read()
+            self._swap_generation(records, vectors)
+
+    def clear(self):
+        """Xóa toàn bộ store (swap sang generation rỗng)"""
+        with self._lock:
+            self.dim = None
+            self._swap_generation([], np.empty((0, 0), dtype=np.float32))
+
+    def _swap_generation(self, records: List[Dict], vectors: np.ndarray):
+        old_generation = self.generation
+        new_generation = old_generation + 1
+
+        with open(self._vector_path(new_generation), 'wb') as f:
+            f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+        with open(self._log_path(new_generation), 'w', encoding='utf-8', newline='\n') as f:
+            for row, record in enumerate(records):
+                f.write(json.dumps({
+                    "op": "add",
+                    "row": row,
+                    "id": record["id"],
+                    "document": record["document"],
+                    "metadata": record.get("metadata") or {}
+                }, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+        # Điểm commit: trước dòng này store vẫn đọc generation cũ
+        self.generation = new_generation
+        self._write_manifest()
+
+        self._row_count = len(records)
+        self._dead_rows = 0
+        self._id_rows = {}
+        for row, record in enumerate(records):
+            self._id_rows.setdefault(record["id"], []).append(row)
+
+        for path in (self._log_path(old_generation), self._vector_path(old_generation)):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self) -> Dict:
+        """Thông tin dung lượng store"""
+        with self._lock:
+            return {
+                "directory": self.directory,
+                "generation": self.generation,
+                "dim": self.dim,
+                "rows": self._row_count,
+                "dead_rows": self._dead_rows
+            }
+
+
+def _fsync_dir(directory: str):
+    """fsync thư mục để rename được bền vững (không hỗ trợ trên Windows)"""
+    if os.name == 'nt':
+        return
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def migrate_json(json_path: str, store: KnowledgeBaseStore) -> int:
+    """
+    Migrate 1 lần từ knowledge_base.json cũ (list {"id", "document", "embedding", "metadata"})
+
+    Returns:
+        Số documents đã migrate
+    """
+    with open(json_path, 'r', encoding='utf-8') as f:
+        documents = json.load(f)
+    if not documents:
+        return 0
+
+    records = [
+        {"id": doc["id"], "document": doc["document"], "metadata": doc.get("metadata") or {}}
+        for doc in documents
+    ]
+    store.bulk_load(records, [doc["embedding"] for doc in documents])
+    return len(records)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python kb_storage.py <knowledge_base.json> <store_directory>")
+        sys.exit(1)
+
+    kb_store = KnowledgeBaseStore(sys.argv[2])
+    if not kb_store.is_new:
+        print(f"⚠️  {sys.argv[2]} đã tồn tại - bỏ qua migrate")
+        sys.exit(1)
+    count = migrate_json(sys.argv[1], kb_store)
+    print(f"✅ Migrated {count} documents từ {sys.argv[1]} sang {sys.argv[2]}/")
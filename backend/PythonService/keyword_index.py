@@ -0,0 +1,146 @@
+"""
+Keyword Index
+BM25 trên inverted index (cập nhật tăng dần) + tokenizer tiếng Việt:
+mỗi từ có dấu được index cả dạng có dấu lẫn không dấu, nên "phong" khớp "phòng",
+còn query có dấu ("phòng") chỉ khớp đúng từ có dấu.
+
+Dùng cho hybrid search (BM25 + vector, gộp bằng reciprocal-rank fusion) và
+chế độ keyword-only khi embedding API chậm / lỗi.
+"""
+import math
+import re
+import unicodedata
+from array import array
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from vector_search import top_k_indices
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def remove_diacritics(text: str) -> str:
+    """Bỏ dấu tiếng Việt: "Thời khóa biểu" -> "Thoi khoa bieu" (đ -> d)"""
+    decomposed = unicodedata.normalize("NFD", text)
+    stripped = "".join(ch for ch in decomposed if unicodedata.category(ch) != "Mn")
+    return stripped.replace("đ", "d").replace("Đ", "D")
+
+
+def tokenize(text: str) -> List[str]:
+    """Tách từ (chữ thường, NFC) - mã môn / số phòng như "CS101", "B21.05" giữ nguyên từng phần"""
+    return _TOKEN_RE.findall(unicodedata.normalize("NFC", text).lower())
+
+
+def index_terms(text: str) -> List[str]:
+    """Terms để index: mỗi token + dạng không dấu (nếu khác)"""
+    terms = []
+    for token in tokenize(text):
+        terms.append(token)
+        plain = remove_diacritics(token)
+        if plain != token:
+            terms.append(plain)
+    return terms
+
+
+def query_terms(text: str) -> List[str]:
+    """Terms của query: giữ nguyên như người dùng gõ (có dấu thì khớp chính xác, không dấu thì khớp cả 2)"""
+    return list(dict.fromkeys(tokenize(text)))
+
+
+class BM25Index:
+    """
+    Inverted index BM25, row i ứng với document thứ i của SimpleVectorDB
+
+    Postings lưu bằng array (row int32, tf float32) để append tăng dần, khi chấm điểm
+    copy sang numpy (không giữ buffer view -> add() ở thread khác không bị BufferError).
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._rows: Dict[str, array] = {}
+        self._tfs: Dict[str, array] = {}
+        self._doc_len = array("f")
+        self._total_len = 0.0
+
+    def __len__(self) -> int:
+        return len(self._doc_len)
+
+    def add(self, texts: Iterable[str]):
+        """Index các documents mới (nối tiếp sau các rows hiện có)"""
+        for text in texts:
+            row = len(self._doc_len)
+            counts: Dict[str, int] = {}
+            for term in index_terms(text or ""):
+                counts[term] = counts.get(term, 0) + 1
+            for term, tf in counts.items():
+                if term not in self._rows:
+                    self._rows[term] = array("i")
+                    self._tfs[term] = array("f")
+                self._rows[term].append(row)
+                self._tfs[term].append(tf)
+            length = float(len(tokenize(text or "")))
+            self._doc_len.append(length)
+            self._total_len += length
+
+    def rebuild(self, texts: Iterable[str]):
+        self.__init__(k1=self.k1, b=self.b)
+        self.add(texts)
+
+    def scores(self, query: str) -> np.ndarray:
+        """BM25 score của query với mọi document (0 nếu không chứa term nào)"""
+        n = len(self)
+        scores = np.zeros(n, dtype=np.float32)
+        if n == 0:
+            return scores
+
+        doc_len = np.array(self._doc_len, dtype=np.float32)
+        avg_len = self._total_len / n or 1.0
+        for term in query_terms(query):
+            rows_buf = self._rows.get(term)
+            if rows_buf is None:
+                continue
+            rows = np.array(rows_buf, dtype=np.int64)
+            tf = np.array(self._tfs[term], dtype=np.float32)
+            df = rows.size
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * doc_len[rows] / avg_len)
+            scores[rows] += idf * tf * (self.k1 + 1) / (tf + norm)
+        return scores
+
+    def search(self, query: str, k: int, rows: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Top-k documents theo BM25 (chỉ documents có score > 0)
+
+        Args:
+            rows: Giới hạn trong các rows này (kết quả lọc metadata), None = toàn bộ
+        """
+        scores = self.scores(query)
+        if rows is not None:
+            rows = np.asarray(rows, dtype=np.int64)
+            candidates = rows[scores[rows] > 0]
+        else:
+            candidates = np.flatnonzero(scores > 0)
+        if candidates.size == 0 or k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        top = top_k_indices(scores[candidates], k)
+        return candidates[top], scores[candidates][top]
+
+    def stats(self) -> Dict:
+        return {"documents": len(self), "terms": len(self._rows)}
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[int]], k: int = 60) -> List[Tuple[int, float]]:
+    """
+    Gộp nhiều danh sách xếp hạng: score(d) = sum(1 / (k + rank_i(d)))
+
+    Returns:
+        [(row, score)] giảm dần theo score
+    """
+    fused: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, row in enumerate(ranking):
+            row = int(row)
+            fused[row] = fused.get(row, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
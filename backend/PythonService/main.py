@@ -13,17 +13,34 @@ if sys.platform == 'win32':
     # Also set console code page to UTF-8
     os.system('chcp 65001 >nul 2>&1')
 
-from fastapi import FastAPI, HTTPException, Header, File, UploadFile
+from fastapi import FastAPI, HTTPException, Header, File, UploadFile, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, ConfigDict
-from typing import List, Optional, Dict
+from typing import AsyncIterator, List, Optional, Dict, Tuple
 import google.generativeai as genai
 import os
 from dotenv import load_dotenv
 import json
-import math
+import time
+import asyncio
+import threading
+from contextlib import contextmanager
+import numpy as np
 import requests
 from datetime import datetime, timedelta
+from vector_index import create_vector_index
+from kb_storage import KnowledgeBaseStore, migrate_json
+from batch_embedder import BatchEmbedder
+from embedding_cache import EmbeddingCache, get_embedding_cache
+from metadata_index import MetadataIndex
+from keyword_index import BM25Index, reciprocal_rank_fusion
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from async_helper import run_blocking, get_async_client, close_async_client, StageTimer
+from token_cache import get_token_cache
+from intent_router import route as route_intents, TOOL_INTENTS
+from http_client import http, stats as http_stats
+from google_token_cache import get_google_token_cache
 try:
     from youtube_helper import search_youtube_video, get_youtube_watch_url, get_youtube_embed_url
     YOUTUBE_HELPER_AVAILABLE = True
@@ -40,6 +57,7 @@ except ImportError:
 
 try:
     from agent_features import AgentFeatures
+    from schedule_prefetch import create_schedule_prefetcher
     AGENT_FEATURES_AVAILABLE = True
 except ImportError:
     AGENT_FEATURES_AVAILABLE = False
@@ -85,104 +103,270 @@ print("✅ OCR.space API available for Groq image reading")
 # VECTOR DATABASE CLASS
 # ============================================================================
 
-def cosine_similarity(vec1: List[float], vec2: List[float]) -> float:
-    """Tính cosine similarity giữa 2 vectors"""
-    dot_product = sum(a * b for a, b in zip(vec1, vec2))
-    magnitude1 = math.sqrt(sum(a * a for a in vec1))
-    magnitude2 = math.sqrt(sum(b * b for b in vec2))
-    
-    if magnitude1 == 0 or magnitude2 == 0:
-        return 0.0
-    
-    return dot_product / (magnitude1 * magnitude2)
+class _ReadWriteLock:
+    """Nhiều search đọc cùng lúc, add / delete ghi độc quyền (writer được ưu tiên, không bị đói)"""
+    
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+    
+    @contextmanager
+    def read(self):
+        with self._cond:
+            while self._writer or self._waiting_writers:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+    
+    @contextmanager
+    def write(self):
+        with self._cond:
+            self._waiting_writers += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._waiting_writers -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
 
 class SimpleVectorDB:
-    def __init__(self, storage_file: str = "vector_db.json"):
-        """Khởi tạo Simple Vector Database"""
-        self.storage_file = storage_file
+    SEARCH_MODES = ("hybrid", "vector", "keyword")
+    
+    def __init__(self, storage_dir: str = "vector_db", legacy_file: Optional[str] = None,
+                 embedding_cache: Optional[EmbeddingCache] = None, index_backend: str = "bruteforce",
+                 embed_timeout: float = 3.0):
+        """
+        Khởi tạo Simple Vector Database
+        
+        Args:
+            storage_dir: Thư mục lưu trữ append-only (metadata log + embeddings float32)
+            legacy_file: File JSON cũ, được migrate 1 lần khi storage_dir chưa tồn tại
+            embedding_cache: Cache embedding dùng chung cho query và document
+            index_backend: Vector index - "bruteforce" (chính xác), "ivf" hoặc "hnsw" (xấp xỉ, sub-linear)
+            embed_timeout: Số giây chờ embedding query trong chế độ hybrid, quá hạn thì chỉ dùng BM25
+        """
+        self.store = KnowledgeBaseStore(storage_dir)
+        self.embedder = BatchEmbedder(genai.embed_content, model="models/text-embedding-004",
+                                      cache=embedding_cache)
+        if legacy_file and self.store.is_new and os.path.exists(legacy_file):
+            count = migrate_json(legacy_file, self.store)
+            print(f"✅ Migrated {count} documents từ {legacy_file} sang {storage_dir}/")
+        
+        self.index_backend = index_backend
         self.documents = []
+        # Embeddings giữ trong vector index (ma trận float32 + cấu trúc ANN tùy backend)
+        self.index = create_vector_index(index_backend)
+        # Inverted index trên metadata (course_id, category, tags, source) để lọc trước khi chấm điểm
+        self.metadata_index = MetadataIndex()
+        # BM25 inverted index (tiếng Việt có dấu + không dấu) cho hybrid / keyword search
+        self.keyword_index = BM25Index()
+        self.embed_timeout = embed_timeout
+        self._query_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="query-embed")
+        # add / delete / search chạy trong thread pool (run_blocking): search đọc documents + các index
+        # dưới read lock để không thấy trạng thái dở dang của add / delete
+        self._lock = _ReadWriteLock()
         self.load()
     
     def load(self):
-        """Load data từ file"""
-        if os.path.exists(self.storage_file):
-            with open(self.storage_file, 'r', encoding='utf-8') as f:
-                self.documents = json.load(f)
+        """Load data từ storage"""
+        self.documents, vectors = self.store.load()
+        self.index = create_vector_index(self.index_backend)
+        self.index.add(vectors)
+        self.metadata_index.rebuild(doc['metadata'] for doc in self.documents)
+        self.keyword_index.rebuild(doc['document'] for doc in self.documents)
     
     def save(self):
-        """Lưu data vào file"""
-        with open(self.storage_file, 'w', encoding='utf-8') as f:
-            json.dump(self.documents, f, ensure_ascii=False, indent=2)
+        """Compact storage (add/delete đã được ghi append-only ngay khi gọi)"""
+        self.store.compact()
     
     def add_documents(self, documents: List[str], metadatas: List[Dict] = None, ids: List[str] = None):
-        """Thêm documents vào database"""
-        if ids is None:
-            start_id = len(self.documents)
-            ids = [f"doc_{start_id + i}" for i in range(len(documents))]
+        """
+        Thêm documents vào database
         
+        Embeddings được tạo theo batch (song song có giới hạn). Document nào embed lỗi
+        sẽ bị bỏ qua và trả về trong "failed", không làm hỏng cả lần thêm.
+        """
         if metadatas is None:
             metadatas = [{"source": "manual"} for _ in documents]
         
-        # Tạo embeddings
-        for doc, metadata, doc_id in zip(documents, metadatas, ids):
-            result = genai.embed_content(
-                model="models/text-embedding-004",
-                content=doc,
-                task_type="retrieval_document"
-            )
-            
-            self.documents.append({
-                "id": doc_id,
-                "document": doc,
-                "embedding": result['embedding'],
-                "metadata": metadata
-            })
+        # Tạo embeddings theo batch (ngoài lock: chậm, có backoff khi bị rate limit)
+        embed_result = self.embedder.embed(documents, task_type="retrieval_document")
         
-        self.save()
-        return {"status": "success", "count": len(documents)}
+        with self._lock.write():
+            return self._add_embedded(documents, metadatas, ids, embed_result)
     
-    def search(self, query: str, n_results: int = 5) -> Dict:
-        """Tìm kiếm documents tương tự"""
-        if not self.documents:
-            return {"documents": [], "distances": [], "metadatas": [], "ids": []}
+    def _add_embedded(self, documents: List[str], metadatas: List[Dict], ids: Optional[List[str]], embed_result):
+        if ids is None:
+            start_id = len(self.documents)
+            ids = [f"doc_{start_id + i}" for i in range(len(documents))]
         
-        # Tạo embedding cho query
-        result = genai.embed_content(
-            model="models/text-embedding-004",
-            content=query,
-            task_type="retrieval_query"
-        )
-        query_embedding = result['embedding']
-        
-        # Tính similarity với tất cả documents
-        similarities = []
-        for doc in self.documents:
-            similarity = cosine_similarity(query_embedding, doc['embedding'])
-            similarities.append({
-                "document": doc['document'],
-                "distance": 1 - similarity,
-                "metadata": doc['metadata'],
-                "id": doc['id'],
-                "similarity": similarity
+        new_docs = []
+        embeddings = []
+        for i in embed_result.ok_indices:
+            new_docs.append({
+                "id": ids[i],
+                "document": documents[i],
+                "metadata": metadatas[i]
             })
+            embeddings.append(embed_result.embeddings[i])
+        
+        failed = [
+            {"index": i, "id": ids[i], "error": error}
+            for i, error in sorted(embed_result.errors.items())
+        ]
+        if failed:
+            print(f"⚠️ {len(failed)}/{len(documents)} documents failed to embed")
+        
+        # Chỉ append phần mới xuống đĩa, không ghi lại toàn bộ knowledge base
+        self.store.append(new_docs, embeddings)
+        self.documents.extend(new_docs)
+        self.index.add(embeddings)
+        self.metadata_index.add(doc['metadata'] for doc in new_docs)
+        self.keyword_index.add(doc['document'] for doc in new_docs)
+        
+        if failed and not new_docs:
+            status = "error"
+        elif failed:
+            status = "partial"
+        else:
+            status = "success"
+        return {"status": status, "count": len(new_docs), "failed": failed}
+    
+    def _embed_query(self, query: str, timeout: Optional[float]) -> Optional[List[float]]:
+        """Embed query, trả về None nếu quá timeout / API lỗi (kết quả vẫn vào cache cho lần sau)"""
+        future = self._query_executor.submit(self.embedder.embed_one, query, "retrieval_query")
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            print(f"⚠️ Query embedding > {timeout}s, falling back to keyword search")
+        except Exception as e:
+            print(f"⚠️ Query embedding failed ({e}), falling back to keyword search")
+        return None
+    
+    def search(self, query: str, n_results: int = 5, filters: Optional[Dict] = None,
+               mode: str = "hybrid") -> Dict:
+        """
+        Tìm kiếm documents tương tự
+        
+        Args:
+            filters: Lọc theo metadata, vd {"course_id": 5, "tags": ["python", "ai"]}
+                     (AND giữa các field, OR giữa các giá trị trong list)
+            mode: "hybrid" (BM25 + vector, gộp bằng reciprocal-rank fusion),
+                  "vector" (chỉ embedding) hoặc "keyword" (chỉ BM25, không gọi API)
+        
+        Returns:
+            documents/distances/metadatas/ids + "mode" thực tế đã dùng.
+            distances = 1 - cosine similarity, None khi không có query embedding (keyword mode)
+        """
+        if mode not in self.SEARCH_MODES:
+            raise ValueError(f"Unknown search mode '{mode}', expected one of {self.SEARCH_MODES}")
+        
+        empty = {"documents": [], "distances": [], "metadatas": [], "ids": [], "mode": mode}
+        with self._lock.read():
+            if not self.documents:
+                return empty
+            # Lọc metadata trước khi embed query - không có document nào khớp thì khỏi gọi API
+            rows = self.metadata_index.match(filters)
+        if rows is not None and rows.size == 0:
+            return empty
+        
+        query_embedding = None
+        if mode == "vector":
+            # Tạo embedding cho query (câu hỏi lặp lại lấy từ cache, không gọi API)
+            query_embedding = self.embedder.embed_one(query, task_type="retrieval_query")
+        elif mode == "hybrid":
+            query_embedding = self._embed_query(query, self.embed_timeout)
+            if query_embedding is None:
+                mode = "keyword"
+        
+        # Embed query không giữ lock; documents / index có thể đã đổi trong lúc đó nên lọc lại dưới lock
+        with self._lock.read():
+            return self._rank(query, query_embedding, filters, n_results, mode)
+    
+    def _rank(self, query: str, query_embedding: Optional[List[float]], filters: Optional[Dict],
+              n_results: int, mode: str) -> Dict:
+        rows = self.metadata_index.match(filters)
+        if not self.documents or (rows is not None and rows.size == 0):
+            return {"documents": [], "distances": [], "metadatas": [], "ids": [], "mode": mode}
+        
+        # Lấy nhiều ứng viên hơn n_results từ mỗi nguồn để RRF có đủ dữ liệu gộp
+        n_candidates = n_results if mode != "hybrid" else max(n_results * 4, 20)
+        
+        vector_rows = np.empty(0, dtype=np.int64)
+        similarities = np.empty(0, dtype=np.float32)
+        if query_embedding is not None:
+            if rows is not None:
+                # Chỉ chấm điểm các chunk thuộc đúng khóa học / danh mục / tag
+                vector_rows, similarities = self.index.search_subset(query_embedding, n_candidates, rows)
+            else:
+                # bruteforce: 1 phép nhân ma trận-vector + argpartition; ivf/hnsw: chỉ quét 1 phần corpus
+                vector_rows, similarities = self.index.search(query_embedding, n_candidates)
         
-        # Sắp xếp theo similarity
-        similarities.sort(key=lambda x: x['similarity'], reverse=True)
-        top_results = similarities[:n_results]
+        if mode == "vector":
+            indices = vector_rows.tolist()
+        else:
+            keyword_rows, _ = self.keyword_index.search(query, n_candidates, rows)
+            if mode == "keyword":
+                indices = keyword_rows.tolist()
+            else:
+                fused = reciprocal_rank_fusion([vector_rows, keyword_rows])
+                indices = [row for row, _ in fused[:n_results]]
+        
+        if query_embedding is not None:
+            # Cosine chính xác cho mọi kết quả (kể cả document chỉ BM25 tìm thấy)
+            scored_rows, exact = self.index.search_subset(query_embedding, len(indices),
+                                                          np.array(indices, dtype=np.int64))
+            sim_by_row = dict(zip(scored_rows.tolist(), exact.tolist()))
+            distances = [1 - float(sim_by_row[i]) for i in indices]
+        else:
+            distances = [None for _ in indices]
+        top_docs = [self.documents[i] for i in indices]
         
         return {
-            "documents": [r['document'] for r in top_results],
-            "distances": [r['distance'] for r in top_results],
-            "metadatas": [r['metadata'] for r in top_results],
-            "ids": [r['id'] for r in top_results]
+            "documents": [doc['document'] for doc in top_docs],
+            "distances": distances,
+            "metadatas": [doc['metadata'] for doc in top_docs],
+            "ids": [doc['id'] for doc in top_docs],
+            "mode": mode
         }
     
     def delete_all(self):
         """Xóa tất cả documents"""
-        self.documents = []
-        self.save()
+        with self._lock.write():
+            self.documents = []
+            self.index = create_vector_index(self.index_backend)
+            self.metadata_index.rebuild([])
+            self.keyword_index.rebuild([])
+            self.store.clear()
         return {"status": "success", "message": "All documents deleted"}
     
+    def delete_documents(self, ids: List[str]) -> Dict:
+        """Xóa documents theo IDs"""
+        id_set = set(ids)
+        with self._lock.write():
+            keep = [i for i, doc in enumerate(self.documents) if doc['id'] not in id_set]
+            deleted = len(self.documents) - len(keep)
+            if deleted:
+                self.store.delete(list(id_set))
+                kept_vectors = self.index.vectors[keep]
+                self.documents = [self.documents[i] for i in keep]
+                self.index.rebuild(kept_vectors)
+                self.metadata_index.rebuild(doc['metadata'] for doc in self.documents)
+                self.keyword_index.rebuild(doc['document'] for doc in self.documents)
+        return {"status": "success", "deleted": deleted}
+    
     def get_count(self) -> int:
         """Lấy số lượng documents"""
         return len(self.documents)
@@ -247,17 +431,42 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.on_event("shutdown")
+async def close_http_clients():
+    """Đóng các httpx.AsyncClient dùng chung (Spring Boot / Groq / Google APIs)"""
+    await close_async_client()
+
 # Initialize Vector Database
-vector_db = SimpleVectorDB(storage_file="knowledge_base.json")
+embedding_cache = get_embedding_cache("embedding_cache.sqlite3")
+vector_db = SimpleVectorDB(
+    storage_dir="knowledge_base_store",
+    legacy_file="knowledge_base.json",
+    embedding_cache=embedding_cache,
+    index_backend=os.getenv("VECTOR_INDEX_BACKEND", "bruteforce"),
+    embed_timeout=float(os.getenv("RAG_EMBED_TIMEOUT", "3"))
+)
 
 # Initialize Agent Features
 if AGENT_FEATURES_AVAILABLE:
     agent_features = AgentFeatures(spring_boot_url="http://localhost:8080")
     print("✅ Agent Features initialized")
+    schedule_prefetcher = create_schedule_prefetcher(agent_features)
 else:
     agent_features = None
+    schedule_prefetcher = None
     print("⚠️  Agent Features not initialized")
 
+@app.on_event("startup")
+async def start_schedule_prefetch():
+    """Bật worker prefetch TKB nền (SCHEDULE_PREFETCH_*)"""
+    if schedule_prefetcher:
+        await schedule_prefetcher.start()
+
+@app.on_event("shutdown")
+async def stop_schedule_prefetch():
+    if schedule_prefetcher:
+        await schedule_prefetcher.stop()
+
 # Initialize Google Cloud Agent
 if GOOGLE_CLOUD_AGENT_AVAILABLE:
     google_cloud_agent = GoogleCloudAgent(google_cloud_url="http://localhost:8004")
@@ -314,8 +523,6 @@ def extract_image_content(image_base64: str, image_mime_type: str) -> Dict[str,
         # Use OCR.space free API with Vietnamese support
         try:
             print("🔍 Using OCR.space API for text extraction...")
-            import requests
-            
             ocr_url = "https://api.ocr.space/parse/image"
             
             # Try Vietnamese first, then English
@@ -330,7 +537,7 @@ def extract_image_content(image_base64: str, image_mime_type: str) -> Dict[str,
                     'OCREngine': 2  # Engine 2 for better accuracy
                 }
                 
-                response = requests.post(ocr_url, data=payload, timeout=30)
+                response = http.post(ocr_url, data=payload, timeout=30)
                 ocr_result = response.json()
                 
                 # Check for processing error
@@ -406,6 +613,9 @@ Nếu bạn cần phân tích ảnh chi tiết, vui lòng chuyển sang Gemini."
 # HELPER FUNCTIONS
 # ============================================================================
 
+# Cache JWT -> user_id (TTL theo claim exp, negative cache cho token bị từ chối)
+token_cache = get_token_cache()
+
 def get_user_id_from_token(token: str) -> Optional[int]:
     """
     Get user_id from JWT token by calling Spring Boot API
@@ -419,10 +629,17 @@ def get_user_id_from_token(token: str) -> Optional[int]:
     if not token:
         return None
     
+    hit, user_id = token_cache.get(token)
+    if hit:
+        return user_id
+    return _fetch_user_id_from_spring(token)
+
+def _fetch_user_id_from_spring(token: str) -> Optional[int]:
+    """Cache miss: hỏi Spring Boot rồi ghi kết quả vào token_cache (không tra cache lần nữa)"""
     try:
         # Call Spring Boot API to get user profile
         headers = {"Authorization": f"Bearer {token}"}
-        response = requests.get(
+        response = http.get(
             "http://localhost:8080/api/auth/profile",
             headers=headers,
             timeout=5
@@ -432,18 +649,76 @@ def get_user_id_from_token(token: str) -> Optional[int]:
             user_data = response.json()
             user_id = user_data.get('id')
             print(f"✅ Got user_id from token: {user_id}")
+            if user_id is not None:
+                token_cache.put(token, user_id)
             return user_id
         else:
             print(f"⚠️  Failed to get user from token: {response.status_code}")
+            if response.status_code in (401, 403):
+                token_cache.put(token, None)
             return None
     except Exception as e:
         print(f"❌ Error getting user_id from token: {e}")
         return None
 
+async def get_user_id_from_token_async(token: str) -> Optional[int]:
+    """Async version of get_user_id_from_token (dùng trong /api/chat): cache hit trả ngay, miss gọi Spring Boot trong thread pool"""
+    if not token:
+        return None
+    
+    hit, user_id = token_cache.get(token)
+    if hit:
+        return user_id
+    return await run_blocking(_fetch_user_id_from_spring, token)
+
+async def load_conversation_history(session_id: int) -> List[Dict]:
+    """
+    Load 10 tin nhắn gần nhất của chat session từ Spring Boot INTERNAL API (no auth required)
+    
+    Returns:
+        [{"role": "user" | "assistant", "content": str}] - rỗng nếu lỗi (không critical)
+    """
+    conversation_history = []
+    try:
+        print(f"💬 Loading conversation history for session {session_id}...")
+        history_response = await get_async_client().get(
+            f"http://localhost:8080/api/chat/internal/sessions/{session_id}/messages",
+            timeout=5
+        )
+        
+        if history_response.status_code == 200:
+            messages = history_response.json()
+            # Take last 10 messages for context (5 exchanges)
+            recent_messages = messages[-10:] if len(messages) > 10 else messages
+            
+            for msg in recent_messages:
+                role = "user" if msg["sender"] == "USER" else "assistant"
+                conversation_history.append({
+                    "role": role,
+                    "content": msg["message"]
+                })
+            
+            print(f"✅ Loaded {len(conversation_history)} messages from session history")
+        else:
+            print(f"⚠️ Could not load session history: {history_response.status_code}")
+    except Exception as e:
+        print(f"⚠️ Error loading conversation history: {e}")
+    return conversation_history
+
 # ============================================================================
 # PYDANTIC MODELS
 # ============================================================================
 
+class RAGFilter(BaseModel):
+    """Lọc knowledge base theo metadata trước khi tìm kiếm (AND giữa các field, OR trong tags)"""
+    course_id: Optional[int] = None
+    category: Optional[str] = None
+    tags: Optional[List[str]] = None
+    source: Optional[str] = None
+    
+    def to_filters(self) -> Dict:
+        return self.model_dump(exclude_none=True)
+
 class ChatRequest(BaseModel):
     message: str
     model: str = "gemini-flash-latest"  # Use latest flash model (1,500 requests/day)
@@ -452,6 +727,7 @@ class ChatRequest(BaseModel):
     image_base64: Optional[str] = None  # Base64 encoded image for vision analysis
     image_mime_type: Optional[str] = None  # e.g., "image/jpeg", "image/png"
     session_id: Optional[int] = None  # Chat session ID for conversation context
+    rag_filter: Optional[RAGFilter] = None  # Chỉ tìm RAG context trong khóa học / danh mục / tags này
     
     model_config = ConfigDict(
         json_schema_extra={
@@ -574,6 +850,19 @@ class SimplePromptRequest(BaseModel):
 class SearchRequest(BaseModel):
     query: str
     n_results: int = 5
+    filter: Optional[RAGFilter] = None
+    mode: str = "hybrid"  # "hybrid" (BM25 + vector), "vector" hoặc "keyword" (không gọi embedding API)
+    
+    model_config = ConfigDict(
+        json_schema_extra={
+            "example": {
+                "query": "Vòng lặp for trong Python",
+                "n_results": 5,
+                "filter": {"course_id": 12, "tags": ["python"]},
+                "mode": "hybrid"
+            }
+        }
+    )
 
 # ============================================================================
 # API ENDPOINTS
@@ -592,6 +881,10 @@ async def root():
 
 def detect_tool_intent(message: str) -> Optional[ToolAction]:
     """Phát hiện intent để tự động thực thi tool"""
+    # Không có trigger nào (intent_router đã quét sẵn) -> bỏ qua toàn bộ phần tách query
+    if not route_intents(message).matched_any(TOOL_INTENTS):
+        return None
+    
     message_lower = message.lower()
     
     # Intent: Phát video YouTube (tự động tìm và phát)
@@ -823,277 +1116,285 @@ async def test_tvu_schedule(request: TVUTestRequest):
         return {"success": False, "message": f"❌ Lỗi: {str(e)}"}
 
 
-@app.post("/api/chat", tags=["Chat"])
-async def chat(request: ChatRequest, authorization: Optional[str] = Header(None)):
+async def prepare_chat(
+    request: ChatRequest,
+    authorization: Optional[str],
+    timer: StageTimer,
+    stages: Dict[str, asyncio.Task]
+):
     """
-    Chat với Gemini AI (có hỗ trợ RAG + Agent Features + Conversation Memory)
+    Phần chung của /api/chat và /api/chat/stream trước khi gọi LLM
     
-    - **message**: Tin nhắn của người dùng
-    - **model**: Model Gemini sử dụng (mặc định: gemini-2.5-flash)
-    - **use_rag**: Sử dụng RAG để tăng cường context (mặc định: true)
-    - **session_id**: ID của chat session để load conversation history (optional)
+    Các bước I/O độc lập (user_id, lịch sử chat, Google Cloud agent, tool intent, RAG) được
+    chạy song song dưới dạng task trong `stages`; caller chịu trách nhiệm hủy task thừa.
     
-    Agent Features (tự động):
-    - Xem thời khóa biểu (tự động lấy từ trang trường)
-    - Xem điểm số
-    - Gửi email
-    
-    Conversation Memory:
-    - Nếu có session_id, AI sẽ nhớ toàn bộ context của phiên chat
-    - Giống như ChatGPT - không cần lặp lại thông tin
-    
-    Models được khuyến nghị:
-    - gemini-2.5-flash (MỚI NHẤT - Nhanh, stable)
-    - gemini-2.5-pro (Mạnh nhất)
-    - gemini-flash-latest (Luôn dùng version mới nhất)
+    Returns:
+        (routed_response, None) nếu agent / tool đã xử lý xong request (không cần LLM)
+        (None, context) nếu cần LLM - context gồm system_prompt, prompt, context_docs, conversation_history
     """
-    try:
-        # Extract token from Authorization header
-        token = None
-        user_id = None
-        if authorization and authorization.startswith("Bearer "):
-            token = authorization.replace("Bearer ", "")
-            # Get user_id from token
-            user_id = get_user_id_from_token(token)
-        
-        print(f"\n{'='*60}")
-        print(f"📨 NEW CHAT REQUEST")
-        print(f"Message: {request.message}")
-        print(f"Session ID: {request.session_id}")
-        print(f"AI Provider: {request.ai_provider}")
-        print(f"Has token: {token is not None}")
-        print(f"User ID: {user_id}")
-        print(f"AGENT_FEATURES_AVAILABLE: {AGENT_FEATURES_AVAILABLE}")
-        print(f"agent_features: {agent_features is not None if 'agent_features' in globals() else 'NOT DEFINED'}")
-        
-        # Debug email intent detection
-        if AGENT_FEATURES_AVAILABLE and agent_features:
-            email_intent = agent_features.detect_email_intent(request.message)
-            gmail_send_intent = agent_features.detect_gmail_send_intent(request.message)
-            print(f"🔍 Email Intent: {email_intent}")
-            print(f"🔍 Gmail Send Intent: {gmail_send_intent}")
-        
-        print(f"{'='*60}\n")
-        conversation_history = []
-        if request.session_id:
-            try:
-                print(f"💬 Loading conversation history for session {request.session_id}...")
-                # Call Spring Boot INTERNAL API (no auth required)
-                history_response = requests.get(
-                    f"http://localhost:8080/api/chat/internal/sessions/{request.session_id}/messages",
-                    timeout=5
-                )
-                
-                if history_response.status_code == 200:
-                    messages = history_response.json()
-                    # Take last 10 messages for context (5 exchanges)
-                    recent_messages = messages[-10:] if len(messages) > 10 else messages
-                    
-                    for msg in recent_messages:
-                        role = "user" if msg["sender"] == "USER" else "assistant"
-                        conversation_history.append({
-                            "role": role,
-                            "content": msg["message"]
-                        })
-                    
-                    print(f"✅ Loaded {len(conversation_history)} messages from session history")
-                else:
-                    print(f"⚠️ Could not load session history: {history_response.status_code}")
-            except Exception as e:
-                print(f"⚠️ Error loading conversation history: {e}")
-                # Continue without history - not critical
-        
-        # ===== DECISION TREE: IMAGE vs AGENTS vs TOOLS =====
-        # Priority: Image > Google Cloud Agent > Agent Features > Tools > Normal chat
-        
-        has_image_input = bool(request.image_base64 and request.image_mime_type)
-        
-        if has_image_input:
-            # ===== HIGHEST PRIORITY: IMAGE VISION =====
-            print(f"🖼️ IMAGE DETECTED - Skipping ALL agent features!")
-            print(f"   MIME type: {request.image_mime_type}")
-            print(f"   Base64 length: {len(request.image_base64)}")
-            print(f"   Jumping directly to Vision AI processing...")
-            # Skip everything, go to vision processing at ~line 900
+    # Extract token from Authorization header
+    token = None
+    user_id = None
+    if authorization and authorization.startswith("Bearer "):
+        token = authorization.replace("Bearer ", "")
+    
+    has_image_input = bool(request.image_base64 and request.image_mime_type)
+    
+    # Mọi intent của tin nhắn trong 1 lượt quét (detect_* bên dưới đọc lại từ cache của intent_router)
+    intents = route_intents(request.message)
+    has_tool_trigger = intents.matched_any(TOOL_INTENTS)
+    
+    # ===== FAN-OUT: các bước I/O độc lập chạy song song =====
+    # Intent của agent features chỉ là regex local -> biết trước request có đi tới LLM không.
+    # Nếu agent sẽ xử lý thì không chạy trước RAG / tool intent (tránh gọi embedding, YouTube thừa)
+    agent_intent = bool(
+        not has_image_input and AGENT_FEATURES_AVAILABLE and agent_features and (
+            agent_features.detect_email_intent(request.message) or (token and (
+                agent_features.detect_schedule_intent(request.message)
+                or agent_features.detect_calendar_sync_intent(request.message)
+                or agent_features.detect_grade_intent(request.message)
+            ))
+        )
+    )
+    
+    def start_stage(name: str, awaitable):
+        stages[name] = asyncio.create_task(timer.run(name, awaitable))
+    
+    def rag_search():
+        rag_filters = request.rag_filter.to_filters() if request.rag_filter else None
+        return run_blocking(vector_db.search, request.message, n_results=3, filters=rag_filters)
+    
+    use_rag = request.use_rag and vector_db.get_count() > 0
+    if token:
+        start_stage("user_id", get_user_id_from_token_async(token))
+    if request.session_id:
+        start_stage("history", load_conversation_history(request.session_id))
+    if not has_image_input and GOOGLE_CLOUD_AGENT_AVAILABLE and google_cloud_agent:
+        start_stage("google_cloud_agent", run_blocking(
+            google_cloud_agent.handle_google_cloud_request,
+            message=request.message,
+            token=token or "",
+            image_url=None,  # TODO: Extract from message if available
+            audio_base64=None  # TODO: Extract from message if available
+        ))
+    if not has_image_input and not agent_intent and has_tool_trigger:
+        start_stage("tool_intent", run_blocking(detect_tool_intent, request.message))
+    if use_rag and not agent_intent:
+        start_stage("rag", rag_search())
+    
+    if "user_id" in stages:
+        user_id = await stages["user_id"]
+    
+    print(f"\n{'='*60}")
+    print(f"📨 NEW CHAT REQUEST")
+    print(f"Message: {request.message}")
+    print(f"Session ID: {request.session_id}")
+    print(f"AI Provider: {request.ai_provider}")
+    print(f"Has token: {token is not None}")
+    print(f"User ID: {user_id}")
+    print(f"AGENT_FEATURES_AVAILABLE: {AGENT_FEATURES_AVAILABLE}")
+    print(f"agent_features: {agent_features is not None if 'agent_features' in globals() else 'NOT DEFINED'}")
+    
+    # Debug intent detection
+    print(f"🔍 Intents: {intents}")
+    
+    print(f"{'='*60}\n")
+    conversation_history = []
+    if "history" in stages:
+        conversation_history = await stages["history"]
+    
+    # ===== DECISION TREE: IMAGE vs AGENTS vs TOOLS =====
+    # Priority: Image > Google Cloud Agent > Agent Features > Tools > Normal chat
+    
+    if has_image_input:
+        # ===== HIGHEST PRIORITY: IMAGE VISION =====
+        print(f"🖼️ IMAGE DETECTED - Skipping ALL agent features!")
+        print(f"   MIME type: {request.image_mime_type}")
+        print(f"   Base64 length: {len(request.image_base64)}")
+        print(f"   Jumping directly to Vision AI processing...")
+        # Skip everything, go to vision processing at ~line 900
+        
+    elif "google_cloud_agent" in stages:
+        # Check for Google Cloud intents
+        gc_result = await stages["google_cloud_agent"]
+        
+        if gc_result:
+            print(f"🌐 Google Cloud intent detected and handled")
+            # Safely convert to string
+            response_text = gc_result.get('message', '')
+            if not isinstance(response_text, str):
+                response_text = str(response_text) if not isinstance(response_text, list) else '\n'.join(str(x) for x in response_text)
             
-        elif GOOGLE_CLOUD_AGENT_AVAILABLE and google_cloud_agent:
-            # Check for Google Cloud intents
-            gc_result = google_cloud_agent.handle_google_cloud_request(
-                message=request.message,
-                token=token or "",
-                image_url=None,  # TODO: Extract from message if available
-                audio_base64=None  # TODO: Extract from message if available
-            )
+            return ChatResponse(
+                response=response_text,
+                model=request.model,
+                rag_enabled=False
+            ).model_dump(), None
+    
+    # AGENT FEATURES - Check intents (schedule, grades, email)
+    # ONLY run if we haven't returned yet (no Google Cloud intent) AND no image
+    if not has_image_input and AGENT_FEATURES_AVAILABLE and agent_features:
+        # ===== CHECK EMAIL INTENT FIRST (cao nhất) =====
+        # Email patterns rất cụ thể nên ưu tiên trước
+        # Email draft generation KHÔNG cần token
+        if agent_features.detect_email_intent(request.message):
+            print(f"✅ 📧 Detected email intent in: {request.message}")
+            print(f"Token: {token is not None}, User ID: {user_id}")
             
-            if gc_result:
-                print(f"🌐 Google Cloud intent detected and handled")
-                # Safely convert to string
-                response_text = gc_result.get('message', '')
-                if not isinstance(response_text, str):
-                    response_text = str(response_text) if not isinstance(response_text, list) else '\n'.join(str(x) for x in response_text)
-                
-                return ChatResponse(
-                    response=response_text,
-                    model=request.model,
-                    rag_enabled=False
-                ).model_dump()
-        
-        # AGENT FEATURES - Check intents (schedule, grades, email)
-        # ONLY run if we haven't returned yet (no Google Cloud intent) AND no image
-        if not has_image_input and AGENT_FEATURES_AVAILABLE and agent_features:
-            # ===== CHECK EMAIL INTENT FIRST (cao nhất) =====
-            # Email patterns rất cụ thể nên ưu tiên trước
-            # Email draft generation KHÔNG cần token
-            if agent_features.detect_email_intent(request.message):
-                print(f"✅ 📧 Detected email intent in: {request.message}")
-                print(f"Token: {token is not None}, User ID: {user_id}")
-                
-                # Always use handle_gmail_send for send intent - it handles both auth and no-auth cases
-                if agent_features.detect_gmail_send_intent(request.message):
-                    print(f"📧 Detected SEND intent - calling handle_gmail_send with user_id: {user_id}")
-                    result = agent_features.handle_gmail_send(request.message, token or "", user_id=user_id)
-                elif token and user_id:
-                    # For read/search - need authentication
-                    if agent_features.detect_gmail_read_intent(request.message):
-                        print(f"📧 Using Gmail OAuth API for READ - User ID: {user_id}")
-                        result = agent_features.handle_gmail_read(request.message, token, user_id=user_id)
-                    elif agent_features.detect_gmail_search_intent(request.message):
-                        print(f"📧 Using Gmail OAuth API for SEARCH - User ID: {user_id}")
-                        result = agent_features.handle_gmail_search(request.message, token, user_id=user_id)
-                    else:
-                        result = agent_features.handle_gmail_request(request.message, token, user_id=user_id)
+            # Always use handle_gmail_send for send intent - it handles both auth and no-auth cases
+            if agent_features.detect_gmail_send_intent(request.message):
+                print(f"📧 Detected SEND intent - calling handle_gmail_send with user_id: {user_id}")
+                result = await run_blocking(agent_features.handle_gmail_send, request.message, token or "", user_id=user_id)
+            elif token and user_id:
+                # For read/search - need authentication
+                if agent_features.detect_gmail_read_intent(request.message):
+                    print(f"📧 Using Gmail OAuth API for READ - User ID: {user_id}")
+                    result = await run_blocking(agent_features.handle_gmail_read, request.message, token, user_id=user_id)
+                elif agent_features.detect_gmail_search_intent(request.message):
+                    print(f"📧 Using Gmail OAuth API for SEARCH - User ID: {user_id}")
+                    result = await run_blocking(agent_features.handle_gmail_search, request.message, token, user_id=user_id)
                 else:
-                    result = {
-                        "success": False,
-                        "message": "📧 Vui lòng cung cấp địa chỉ email người nhận trong câu lệnh.\n\nVí dụ: 'gửi mail xin nghỉ học đến teacher@tvu.edu.vn'"
-                    }
-                
-                # Safely convert result['message'] to string
-                response_text = result.get('message', '')
-                if not isinstance(response_text, str):
-                    if isinstance(response_text, list):
-                        response_text = '\n'.join(str(item) for item in response_text)
-                    else:
-                        response_text = str(response_text)
-                
-                # Extract email_draft if present
-                email_draft_data = result.get('email_draft')
-                email_draft = None
-                if email_draft_data:
-                    print(f"✅ Email draft found: {email_draft_data}")
-                    email_draft = EmailDraft(**email_draft_data)
-                    print(f"✅ EmailDraft object created: {email_draft}")
-                    print(f"✅ EmailDraft dict: {email_draft.model_dump()}")
+                    result = await run_blocking(agent_features.handle_gmail_request, request.message, token, user_id=user_id)
+            else:
+                result = {
+                    "success": False,
+                    "message": "📧 Vui lòng cung cấp địa chỉ email người nhận trong câu lệnh.\n\nVí dụ: 'gửi mail xin nghỉ học đến teacher@tvu.edu.vn'"
+                }
+            
+            # Safely convert result['message'] to string
+            response_text = result.get('message', '')
+            if not isinstance(response_text, str):
+                if isinstance(response_text, list):
+                    response_text = '\n'.join(str(item) for item in response_text)
                 else:
-                    print(f"⚠️ No email_draft in result. Result keys: {result.keys()}")
-                
-                chat_response = ChatResponse(
-                    response=response_text,
-                    model=request.model,
-                    rag_enabled=False,
-                    email_draft=email_draft
-                )
-                print(f"📧 ChatResponse created with email_draft: {chat_response.email_draft is not None}")
-                
-                # Serialize to dict to ensure email_draft is included
-                response_dict = chat_response.model_dump()
-                print(f"📧 ChatResponse dict: {response_dict}")
-                print(f"📧 email_draft in dict: {response_dict.get('email_draft')}")
-                
-                # Ensure email_draft is in response even if None
-                if 'email_draft' not in response_dict:
-                    response_dict['email_draft'] = None
-                    print(f"⚠️ Added email_draft=None to response_dict")
-                
-                return response_dict
+                    response_text = str(response_text)
             
-            # ===== CHECK SCHEDULE INTENT ===== (CẦN token)
-            # Check for schedule intent
-            if token and agent_features.detect_schedule_intent(request.message):
-                print(f"📅 Detected schedule intent in: {request.message}")
-                result = agent_features.get_schedule(token, message=request.message, force_sync=False)
-                
-                # Safely convert to string
-                response_text = result.get('message', '')
-                if not isinstance(response_text, str):
-                    response_text = str(response_text) if not isinstance(response_text, list) else '\n'.join(str(x) for x in response_text)
-                
-                return ChatResponse(
-                    response=response_text,
-                    model=request.model,
-                    rag_enabled=False
-                ).model_dump()
+            # Extract email_draft if present
+            email_draft_data = result.get('email_draft')
+            email_draft = None
+            if email_draft_data:
+                print(f"✅ Email draft found: {email_draft_data}")
+                email_draft = EmailDraft(**email_draft_data)
+                print(f"✅ EmailDraft object created: {email_draft}")
+                print(f"✅ EmailDraft dict: {email_draft.model_dump()}")
+            else:
+                print(f"⚠️ No email_draft in result. Result keys: {result.keys()}")
             
-            # ===== CHECK CALENDAR SYNC INTENT ===== (CẦN token + user_id)
-            # Check for calendar sync intent
-            if token and user_id and agent_features.detect_calendar_sync_intent(request.message):
-                print(f"🔄 Detected calendar sync intent in: {request.message}")
-                result = agent_features.sync_schedule_to_calendar(
-                    token=token,
-                    user_id=user_id,
-                    week=None,  # Use current week
-                    hoc_ky=None  # Use current semester
-                )
-                
-                # Safely convert to string
-                response_text = result.get('message', '')
-                if not isinstance(response_text, str):
-                    response_text = str(response_text) if not isinstance(response_text, list) else '\n'.join(str(x) for x in response_text)
-                
-                return ChatResponse(
-                    response=response_text,
-                    model=request.model,
-                    rag_enabled=False
-                ).model_dump()
+            chat_response = ChatResponse(
+                response=response_text,
+                model=request.model,
+                rag_enabled=False,
+                email_draft=email_draft
+            )
+            print(f"📧 ChatResponse created with email_draft: {chat_response.email_draft is not None}")
             
-            # ===== CHECK GRADE INTENT ===== (CẦN token)
-            # Check for grade intent
-            if token and agent_features.detect_grade_intent(request.message):
-                print(f"📊 Detected grade intent in: {request.message}")
-                result = agent_features.get_grades(token)
-                
-                # Safely convert to string
-                response_text = result.get('message', '')
-                if not isinstance(response_text, str):
-                    response_text = str(response_text) if not isinstance(response_text, list) else '\n'.join(str(x) for x in response_text)
-                
-                return ChatResponse(
-                    response=response_text,
-                    model=request.model,
-                    rag_enabled=False
-                ).model_dump()
-        
-        # Detect tool action (YouTube, Google, Wikipedia) - ONLY if NO image
-        tool_action = None
-        if not has_image_input:
-            print(f"🔍 Detecting tool intent for message: {request.message}")
-            tool_action = detect_tool_intent(request.message)
-            if tool_action:
-                print(f"✅ Tool action detected: {tool_action.tool} - {tool_action.query}")
-                print(f"   URL: {tool_action.url}")
-            else:
-                print(f"❌ No tool action detected")
+            # Serialize to dict to ensure email_draft is included
+            response_dict = chat_response.model_dump()
+            print(f"📧 ChatResponse dict: {response_dict}")
+            print(f"📧 email_draft in dict: {response_dict.get('email_draft')}")
+            
+            # Ensure email_draft is in response even if None
+            if 'email_draft' not in response_dict:
+                response_dict['email_draft'] = None
+                print(f"⚠️ Added email_draft=None to response_dict")
+            
+            return response_dict, None
+        
+        # ===== CHECK SCHEDULE INTENT ===== (CẦN token)
+        # Check for schedule intent
+        if token and agent_features.detect_schedule_intent(request.message):
+            print(f"📅 Detected schedule intent in: {request.message}")
+            if schedule_prefetcher:
+                schedule_prefetcher.touch(user_id)
+            result = await run_blocking(agent_features.get_schedule, token, message=request.message, force_sync=False)
+            
+            # Safely convert to string
+            response_text = result.get('message', '')
+            if not isinstance(response_text, str):
+                response_text = str(response_text) if not isinstance(response_text, list) else '\n'.join(str(x) for x in response_text)
+            
+            return ChatResponse(
+                response=response_text,
+                model=request.model,
+                rag_enabled=False
+            ).model_dump(), None
+        
+        # ===== CHECK CALENDAR SYNC INTENT ===== (CẦN token + user_id)
+        # Check for calendar sync intent
+        if token and user_id and agent_features.detect_calendar_sync_intent(request.message):
+            print(f"🔄 Detected calendar sync intent in: {request.message}")
+            if schedule_prefetcher:
+                schedule_prefetcher.touch(user_id)
+            result = await run_blocking(
+                agent_features.sync_schedule_to_calendar,
+                token=token,
+                user_id=user_id,
+                week=None,  # 7 ngày tới (hoặc cả học kỳ - mỗi lớp 1 event lặp - nếu user yêu cầu)
+                hoc_ky=None,  # Use current semester
+                whole_semester=agent_features.detect_whole_semester(request.message)
+            )
+            
+            # Safely convert to string
+            response_text = result.get('message', '')
+            if not isinstance(response_text, str):
+                response_text = str(response_text) if not isinstance(response_text, list) else '\n'.join(str(x) for x in response_text)
+            
+            return ChatResponse(
+                response=response_text,
+                model=request.model,
+                rag_enabled=False
+            ).model_dump(), None
         
-        if tool_action:
-            # AI xác nhận action
-            tool_messages = {
-                "play_youtube": f"🎬 Đang phát video YouTube về '{tool_action.query}'...\n\nVideo sẽ tự động phát trong giây lát! 🎥",
-                "search_youtube": f"🎥 Đang mở YouTube để xem video về '{tool_action.query}'...",
-                "search_google": f"🔍 Đang tìm kiếm trên Google về '{tool_action.query}'...",
-                "open_wikipedia": f"📖 Đang mở Wikipedia về '{tool_action.query}'..."
-            }
+        # ===== CHECK GRADE INTENT ===== (CẦN token)
+        # Check for grade intent
+        if token and agent_features.detect_grade_intent(request.message):
+            print(f"📊 Detected grade intent in: {request.message}")
+            result = await run_blocking(agent_features.get_grades, token)
             
-            confirmation = tool_messages.get(tool_action.tool, "Đang thực hiện...")
+            # Safely convert to string
+            response_text = result.get('message', '')
+            if not isinstance(response_text, str):
+                response_text = str(response_text) if not isinstance(response_text, list) else '\n'.join(str(x) for x in response_text)
             
             return ChatResponse(
-                response=confirmation,
+                response=response_text,
                 model=request.model,
-                tool_action=tool_action,
                 rag_enabled=False
-            ).model_dump()
+            ).model_dump(), None
+    
+    # Detect tool action (YouTube, Google, Wikipedia) - ONLY if NO image
+    tool_action = None
+    if not has_image_input:
+        print(f"🔍 Detecting tool intent for message: {request.message}")
+        if "tool_intent" not in stages and has_tool_trigger:
+            start_stage("tool_intent", run_blocking(detect_tool_intent, request.message))
+        tool_action = await stages["tool_intent"] if "tool_intent" in stages else None
+        if tool_action:
+            print(f"✅ Tool action detected: {tool_action.tool} - {tool_action.query}")
+            print(f"   URL: {tool_action.url}")
+        else:
+            print(f"❌ No tool action detected")
+    
+    if tool_action:
+        # AI xác nhận action
+        tool_messages = {
+            "play_youtube": f"🎬 Đang phát video YouTube về '{tool_action.query}'...\n\nVideo sẽ tự động phát trong giây lát! 🎥",
+            "search_youtube": f"🎥 Đang mở YouTube để xem video về '{tool_action.query}'...",
+            "search_google": f"🔍 Đang tìm kiếm trên Google về '{tool_action.query}'...",
+            "open_wikipedia": f"📖 Đang mở Wikipedia về '{tool_action.query}'..."
+        }
+        
+        confirmation = tool_messages.get(tool_action.tool, "Đang thực hiện...")
         
-        # System prompt - Personality của AI
-        system_prompt = """🎓 Bạn là AI Learning Assistant - Trợ lý học tập thông minh và thân thiện!
+        return ChatResponse(
+            response=confirmation,
+            model=request.model,
+            tool_action=tool_action,
+            rag_enabled=False
+        ).model_dump(), None
+    
+    # System prompt - Personality của AI
+    system_prompt = """🎓 Bạn là AI Learning Assistant - Trợ lý học tập thông minh và thân thiện!
 
 **Vai trò của bạn:**
 - Giáo viên ảo kiên nhẫn, nhiệt tình 👨‍🏫
@@ -1120,28 +1421,30 @@ async def chat(request: ChatRequest, authorization: Optional[str] = Header(None)
 - Sử dụng ngôn ngữ phù hợp với trình độ học sinh
 - Nhớ thông tin từ các tin nhắn trước trong phiên chat này
 """
-        
-        context_docs = []
-        prompt = request.message
-        
-        # Build conversation context if available
-        conversation_context = ""
-        if conversation_history:
-            print(f"📝 Building conversation context from {len(conversation_history)} messages...")
-            conversation_context = "\n\n**Lịch sử cuộc trò chuyện:**\n"
-            for msg in conversation_history:
-                role_label = "Học sinh" if msg["role"] == "user" else "AI"
-                conversation_context += f"{role_label}: {msg['content']}\n"
-            conversation_context += "\n"
-        
-        # Nếu bật RAG, tìm kiếm context từ vector DB
-        if request.use_rag and vector_db.get_count() > 0:
-            search_results = vector_db.search(request.message, n_results=3)
-            context_docs = search_results['documents']
-            
-            if context_docs:
-                context_text = "\n\n".join([f"📚 Tài liệu {i+1}: {doc}" for i, doc in enumerate(context_docs)])
-                prompt = f"""{system_prompt}
+    
+    context_docs = []
+    prompt = request.message
+    
+    # Build conversation context if available
+    conversation_context = ""
+    if conversation_history:
+        print(f"📝 Building conversation context from {len(conversation_history)} messages...")
+        conversation_context = "\n\n**Lịch sử cuộc trò chuyện:**\n"
+        for msg in conversation_history:
+            role_label = "Học sinh" if msg["role"] == "user" else "AI"
+            conversation_context += f"{role_label}: {msg['content']}\n"
+        conversation_context += "\n"
+    
+    # Nếu bật RAG, tìm kiếm context từ vector DB
+    if use_rag:
+        if "rag" not in stages:
+            start_stage("rag", rag_search())
+        search_results = await stages["rag"]
+        context_docs = search_results['documents']
+        
+        if context_docs:
+            context_text = "\n\n".join([f"📚 Tài liệu {i+1}: {doc}" for i, doc in enumerate(context_docs)])
+            prompt = f"""{system_prompt}
 
 {conversation_context}**Tài liệu tham khảo từ khóa học:**
 {context_text}
@@ -1150,47 +1453,91 @@ async def chat(request: ChatRequest, authorization: Optional[str] = Header(None)
 {request.message}
 
 Hãy trả lời dựa trên lịch sử cuộc trò chuyện, tài liệu và kiến thức của bạn. Nếu tài liệu không đủ thông tin, hãy bổ sung từ kiến thức chung."""
-            else:
-                prompt = f"""{system_prompt}
+        else:
+            prompt = f"""{system_prompt}
 
 {conversation_context}**Câu hỏi của học sinh:**
 {request.message}
 
 Hãy trả lời dựa trên lịch sử cuộc trò chuyện và kiến thức của bạn."""
-        else:
-            prompt = f"""{system_prompt}
+    else:
+        prompt = f"""{system_prompt}
 
 {conversation_context}**Câu hỏi của học sinh:**
 {request.message}"""
+    
+    return None, {
+        "token": token,
+        "user_id": user_id,
+        "conversation_history": conversation_history,
+        "system_prompt": system_prompt,
+        "prompt": prompt,
+        "context_docs": context_docs
+    }
+
+def format_gemini_error(error_message: str) -> str:
+    """Thông báo lỗi Gemini thân thiện cho học sinh"""
+    # Check for quota exceeded
+    if "quota" in error_message.lower() or "429" in error_message:
+        return """⚠️ **Gemini API Quota Exceeded**
+
+Xin lỗi! API key của Gemini đã vượt quá giới hạn sử dụng miễn phí.
+
+**Giải pháp:**
+1. 🔑 Đợi 1 phút và thử lại (rate limit reset)
+2. 🆕 Tạo API key mới tại: https://ai.google.dev/
+3. 💳 Upgrade lên Gemini API trả phí để có quota cao hơn
+
+**Thông tin lỗi:** Đã vượt quota requests hoặc tokens cho model."""
+    return f"⚠️ Lỗi khi xử lý: {error_message[:200]}"
+
+def resolve_groq_model(requested_model: Optional[str]) -> str:
+    """Model Groq người dùng chọn, không hợp lệ thì dùng llama-3.3-70b-versatile"""
+    groq_model = requested_model if requested_model else "llama-3.3-70b-versatile"
+    # Validate it's a Groq model
+    if not any(name in groq_model.lower() for name in ['llama', 'mixtral', 'gemma', 'qwen', 'meta-llama', 'scout', 'maverick']):
+        groq_model = "llama-3.3-70b-versatile"
+    return groq_model
+
+async def generate_chat_response(request: ChatRequest, context: Dict) -> Tuple[str, str]:
+    """
+    Gọi LLM (Gemini / Groq, có hỗ trợ ảnh) với prompt đã chuẩn bị
+    
+    Returns:
+        (ai_response, actual_model)
+    """
+    prompt = context["prompt"]
+    system_prompt = context["system_prompt"]
+    conversation_history = context["conversation_history"]
+    
+    # Check if image is provided for vision analysis
+    content_parts = []
+    has_image = request.image_base64 and request.image_mime_type
+    
+    if has_image:
+        # Use Gemini Vision API for image analysis
+        print(f"🖼️ Image detected - using Gemini Vision API")
+        print(f"   MIME type: {request.image_mime_type}")
+        print(f"   Base64 length: {len(request.image_base64)}")
+        
+        import base64
+        from PIL import Image
+        import io
         
-        # Check if image is provided for vision analysis
-        content_parts = []
-        has_image = request.image_base64 and request.image_mime_type
+        # Decode base64 image
+        image_data = base64.b64decode(request.image_base64)
+        print(f"   Decoded image size: {len(image_data)} bytes")
         
-        if has_image:
-            # Use Gemini Vision API for image analysis
-            print(f"🖼️ Image detected - using Gemini Vision API")
-            print(f"   MIME type: {request.image_mime_type}")
-            print(f"   Base64 length: {len(request.image_base64)}")
-            
-            import base64
-            from PIL import Image
-            import io
-            
-            # Decode base64 image
-            image_data = base64.b64decode(request.image_base64)
-            print(f"   Decoded image size: {len(image_data)} bytes")
-            
-            # Convert bytes to PIL Image
-            image = Image.open(io.BytesIO(image_data))
-            print(f"   Image format: {image.format}, Size: {image.size}")
-            
-            # Validate image
-            if image is None or image.size[0] == 0 or image.size[1] == 0:
-                raise ValueError("Invalid image: size is zero")
-            
-            # Create VISION-SPECIFIC prompt
-            vision_prompt = f"""BẠN LÀ GEMINI - AI VISION MODEL VỚI KHẢ NĂNG NHÌN THẤY HÌNH ẢNH!
+        # Convert bytes to PIL Image
+        image = Image.open(io.BytesIO(image_data))
+        print(f"   Image format: {image.format}, Size: {image.size}")
+        
+        # Validate image
+        if image is None or image.size[0] == 0 or image.size[1] == 0:
+            raise ValueError("Invalid image: size is zero")
+        
+        # Create VISION-SPECIFIC prompt
+        vision_prompt = f"""BẠN LÀ GEMINI - AI VISION MODEL VỚI KHẢ NĂNG NHÌN THẤY HÌNH ẢNH!
 
 🖼️ **THỰC TRẠNG:** 
 - Học sinh ĐÃ GỬI CHO BẠN MỘT HÌNH ẢNH
@@ -1213,16 +1560,16 @@ Hãy trả lời dựa trên lịch sử cuộc trò chuyện và kiến thức
 {request.message if request.message.strip() else "Phân tích và mô tả chi tiết những gì bạn thấy trong ảnh này"}
 
 **BẮT ĐẦU NGAY:** Hãy mô tả những gì bạn NHÌN THẤY trong ảnh!"""
+        
+        # Create content parts: text first, then image
+        content_parts = [vision_prompt, image]
+        
+        # Check if using Groq - use Groq Vision model (llama-4-scout)
+        if request.ai_provider == "groq":
+            print("🖼️ Groq với ảnh - sử dụng Llama 4 Scout Vision model...")
             
-            # Create content parts: text first, then image
-            content_parts = [vision_prompt, image]
-            
-            # Check if using Groq - use Groq Vision model (llama-4-scout)
-            if request.ai_provider == "groq":
-                print("🖼️ Groq với ảnh - sử dụng Llama 4 Scout Vision model...")
-                
-                # Use Groq Vision directly - no need for OCR
-                vision_prompt = f"""Bạn là AI Learning Assistant thông minh với khả năng nhìn và phân tích hình ảnh.
+            # Use Groq Vision directly - no need for OCR
+            vision_prompt = f"""Bạn là AI Learning Assistant thông minh với khả năng nhìn và phân tích hình ảnh.
 
 **NHIỆM VỤ:**
 1. 👀 Nhìn vào ảnh và mô tả chi tiết những gì bạn thấy
@@ -1233,171 +1580,327 @@ Hãy trả lời dựa trên lịch sử cuộc trò chuyện và kiến thức
 {request.message if request.message.strip() else "Hãy phân tích và mô tả chi tiết nội dung trong ảnh này"}
 
 **Hãy trả lời bằng tiếng Việt, thân thiện và chi tiết.**"""
-                
-                content_parts = [vision_prompt]  # Will be handled specially for Groq
-                print(f"✅ Groq Vision prompt ready")
-        else:
-            content_parts = [prompt]
-        
-        # Generate response based on AI provider
-        ai_response = ""
-        actual_model = request.model
-        
-        print(f"📝 Chat request - ai_provider: {request.ai_provider}, model: {request.model}, groq_client: {groq_client is not None}")
-        
-        if request.ai_provider == "groq" and groq_client:
-            # Use Groq AI with user-selected model
-            try:
-                # Check if we have an image - use Vision model
-                if has_image:
-                    print(f"🖼️ Using Groq Vision model for image analysis")
-                    
-                    vision_prompt = request.message if request.message.strip() else "Hãy phân tích và mô tả chi tiết nội dung trong ảnh này"
-                    
-                    ai_response = groq_client.generate_with_vision(
-                        prompt=vision_prompt,
-                        image_base64=request.image_base64,
-                        image_mime_type=request.image_mime_type,
-                        system_prompt=system_prompt,
-                        model="meta-llama/llama-4-scout-17b-16e-instruct"  # Vision model
-                    )
-                    actual_model = "llama-4-scout-17b (Groq Vision)"
-                    print(f"✅ Groq Vision response received: {len(ai_response)} chars")
-                else:
-                    # Normal text generation
-                    groq_model = request.model if request.model else "llama-3.3-70b-versatile"
-                    # Validate it's a Groq model
-                    if not any(name in groq_model.lower() for name in ['llama', 'mixtral', 'gemma', 'qwen', 'meta-llama', 'scout', 'maverick']):
-                        groq_model = "llama-3.3-70b-versatile"
-                        
-                    print(f"🚀 Using Groq model: {groq_model}")
-                    
-                    # Use content_parts[0] which may contain context
-                    groq_final_prompt = content_parts[0] if isinstance(content_parts[0], str) else request.message
-                    
-                    # Debug: Check if conversation context is in prompt
-                    if conversation_history:
-                        print(f"📝 DEBUG: Groq prompt includes {len(conversation_history)} messages of context")
-                        print(f"📝 DEBUG: Prompt preview: {groq_final_prompt[:200]}...")
-                    else:
-                        print(f"⚠️ DEBUG: No conversation history for Groq")
-                    
-                    ai_response = groq_client.generate_text(
-                        prompt=groq_final_prompt,
-                        system_prompt=system_prompt,
-                        model=groq_model
-                    )
-                    actual_model = f"{groq_model} (Groq)"
-                    print(f"✅ Groq response received: {len(ai_response)} chars")
-            except Exception as e:
-                print(f"⚠️ Groq error: {e}, falling back to Gemini")
-                import traceback
-                traceback.print_exc()
-                # Fallback to Gemini with default Gemini model
-                gemini_model = genai.GenerativeModel("gemini-2.0-flash-exp")
-                response = gemini_model.generate_content(prompt)
-                ai_response = response.text
-                actual_model = "gemini-2.0-flash-exp (fallback)"
-        elif request.ai_provider == "groq" and not groq_client:
-            print("❌ Groq requested but groq_client not initialized! Check GROQ_API_KEY")
-            # Fallback to Gemini
-            gemini_model_name = "gemini-2.0-flash-exp"
-            model = genai.GenerativeModel(gemini_model_name)
-            response = model.generate_content(prompt)
-            ai_response = response.text
-            actual_model = f"{gemini_model_name} (Groq unavailable)"
-        else:
-            # Use Gemini (default) - ensure we use Gemini model names
-            # Use vision-capable model if image is present
-            if has_image:
-                # Use Gemini Flash Latest - proven vision support
-                gemini_model_name = "gemini-flash-latest"  # Stable vision model
-                print(f"🖼️ Using vision-capable model: {gemini_model_name}")
-                print(f"   Content parts: {len(content_parts)} items (text + image)")
-                print(f"   Vision prompt length: {len(content_parts[0])} chars")
-            else:
-                gemini_model_name = request.model if 'gemini' in request.model else "gemini-2.0-flash-exp"
             
-            model = genai.GenerativeModel(gemini_model_name)
-            
-            try:
-                print(f"📤 Sending to Gemini...")
-                response = model.generate_content(content_parts)
-                ai_response = response.text
-                actual_model = gemini_model_name
-                print(f"✅ Gemini response received: {len(ai_response)} chars")
+            content_parts = [vision_prompt]  # Will be handled specially for Groq
+            print(f"✅ Groq Vision prompt ready")
+    else:
+        content_parts = [prompt]
+    
+    # Generate response based on AI provider
+    ai_response = ""
+    actual_model = request.model
+    
+    print(f"📝 Chat request - ai_provider: {request.ai_provider}, model: {request.model}, groq_client: {groq_client is not None}")
+    
+    if request.ai_provider == "groq" and groq_client:
+        # Use Groq AI with user-selected model
+        try:
+            # Check if we have an image - use Vision model
+            if has_image:
+                print(f"🖼️ Using Groq Vision model for image analysis")
+                
+                vision_prompt = request.message if request.message.strip() else "Hãy phân tích và mô tả chi tiết nội dung trong ảnh này"
                 
-                # Debug: Check if response mentions inability to see
-                if has_image and any(word in ai_response.lower() for word in ['không thể xem', 'không xem được', 'chỉ xử lý văn bản', 'không nhìn thấy']):
-                    print(f"⚠️ WARNING: AI claims it cannot see image! This should not happen!")
-                    print(f"   Model used: {gemini_model_name}")
-                    print(f"   Content parts: {len(content_parts)}")
+                ai_response = await groq_client.agenerate_with_vision(
+                    prompt=vision_prompt,
+                    image_base64=request.image_base64,
+                    image_mime_type=request.image_mime_type,
+                    system_prompt=system_prompt,
+                    model="meta-llama/llama-4-scout-17b-16e-instruct"  # Vision model
+                )
+                actual_model = "llama-4-scout-17b (Groq Vision)"
+                print(f"✅ Groq Vision response received: {len(ai_response)} chars")
+            else:
+                # Normal text generation
+                groq_model = resolve_groq_model(request.model)
                     
-            except Exception as e:
-                error_message = str(e)
-                print(f"❌ Gemini API Error: {error_message}")
+                print(f"🚀 Using Groq model: {groq_model}")
                 
-                # Check for quota exceeded
-                if "quota" in error_message.lower() or "429" in error_message:
-                    ai_response = """⚠️ **Gemini API Quota Exceeded**
-
-Xin lỗi! API key của Gemini đã vượt quá giới hạn sử dụng miễn phí.
-
-**Giải pháp:**
-1. 🔑 Đợi 1 phút và thử lại (rate limit reset)
-2. 🆕 Tạo API key mới tại: https://ai.google.dev/
-3. 💳 Upgrade lên Gemini API trả phí để có quota cao hơn
-
-**Thông tin lỗi:** Đã vượt quota requests hoặc tokens cho model."""
+                # Use content_parts[0] which may contain context
+                groq_final_prompt = content_parts[0] if isinstance(content_parts[0], str) else request.message
+                
+                # Debug: Check if conversation context is in prompt
+                if conversation_history:
+                    print(f"📝 DEBUG: Groq prompt includes {len(conversation_history)} messages of context")
+                    print(f"📝 DEBUG: Prompt preview: {groq_final_prompt[:200]}...")
                 else:
-                    ai_response = f"⚠️ Lỗi khi xử lý: {error_message[:200]}"
-                    
-                actual_model = f"{gemini_model_name} (error)"
-        
-        # Tạo suggested actions (YouTube, Google Search)
-        suggested_actions = []
-        
-        # Tạo search query từ câu hỏi
-        search_query = request.message.replace("?", "").strip()
+                    print(f"⚠️ DEBUG: No conversation history for Groq")
+                
+                ai_response = await groq_client.agenerate_text(
+                    prompt=groq_final_prompt,
+                    system_prompt=system_prompt,
+                    model=groq_model
+                )
+                actual_model = f"{groq_model} (Groq)"
+                print(f"✅ Groq response received: {len(ai_response)} chars")
+        except Exception as e:
+            print(f"⚠️ Groq error: {e}, falling back to Gemini")
+            import traceback
+            traceback.print_exc()
+            # Fallback to Gemini with default Gemini model
+            gemini_model = genai.GenerativeModel("gemini-2.0-flash-exp")
+            response = await gemini_model.generate_content_async(prompt)
+            ai_response = response.text
+            actual_model = "gemini-2.0-flash-exp (fallback)"
+    elif request.ai_provider == "groq" and not groq_client:
+        print("❌ Groq requested but groq_client not initialized! Check GROQ_API_KEY")
+        # Fallback to Gemini
+        gemini_model_name = "gemini-2.0-flash-exp"
+        model = genai.GenerativeModel(gemini_model_name)
+        response = await model.generate_content_async(prompt)
+        ai_response = response.text
+        actual_model = f"{gemini_model_name} (Groq unavailable)"
+    else:
+        # Use Gemini (default) - ensure we use Gemini model names
+        # Use vision-capable model if image is present
+        if has_image:
+            # Use Gemini Flash Latest - proven vision support
+            gemini_model_name = "gemini-flash-latest"  # Stable vision model
+            print(f"🖼️ Using vision-capable model: {gemini_model_name}")
+            print(f"   Content parts: {len(content_parts)} items (text + image)")
+            print(f"   Vision prompt length: {len(content_parts[0])} chars")
+        else:
+            gemini_model_name = request.model if 'gemini' in request.model else "gemini-2.0-flash-exp"
         
-        # YouTube link
-        youtube_query = search_query.replace(" ", "+")
-        suggested_actions.append(ActionLink(
-            type="youtube",
-            url=f"https://www.youtube.com/results?search_query={youtube_query}",
-            title=f"Xem video về: {search_query[:50]}",
-            icon="🎥"
-        ))
+        model = genai.GenerativeModel(gemini_model_name)
         
-        # Google Search link
-        google_query = search_query.replace(" ", "+")
+        try:
+            print(f"📤 Sending to Gemini...")
+            response = await model.generate_content_async(content_parts)
+            ai_response = response.text
+            actual_model = gemini_model_name
+            print(f"✅ Gemini response received: {len(ai_response)} chars")
+            
+            # Debug: Check if response mentions inability to see
+            if has_image and any(word in ai_response.lower() for word in ['không thể xem', 'không xem được', 'chỉ xử lý văn bản', 'không nhìn thấy']):
+                print(f"⚠️ WARNING: AI claims it cannot see image! This should not happen!")
+                print(f"   Model used: {gemini_model_name}")
+                print(f"   Content parts: {len(content_parts)}")
+                
+        except Exception as e:
+            error_message = str(e)
+            print(f"❌ Gemini API Error: {error_message}")
+            
+            ai_response = format_gemini_error(error_message)
+            actual_model = f"{gemini_model_name} (error)"
+    
+    return ai_response, actual_model
+
+def cancel_pending_stages(stages: Dict[str, asyncio.Task]):
+    """Bước chạy trước nhưng không dùng tới (vd: RAG khi Google Cloud agent đã trả lời) -> hủy"""
+    for task in stages.values():
+        if not task.done():
+            task.cancel()
+        elif not task.cancelled():
+            task.exception()  # tránh warning "exception was never retrieved"
+
+def build_suggested_actions(message: str) -> List[ActionLink]:
+    """Links gợi ý (YouTube, Google, Wikipedia) cho câu hỏi"""
+    # Tạo suggested actions (YouTube, Google Search)
+    suggested_actions = []
+    
+    # Tạo search query từ câu hỏi
+    search_query = message.replace("?", "").strip()
+    
+    # YouTube link
+    youtube_query = search_query.replace(" ", "+")
+    suggested_actions.append(ActionLink(
+        type="youtube",
+        url=f"https://www.youtube.com/results?search_query={youtube_query}",
+        title=f"Xem video về: {search_query[:50]}",
+        icon="🎥"
+    ))
+    
+    # Google Search link
+    google_query = search_query.replace(" ", "+")
+    suggested_actions.append(ActionLink(
+        type="google",
+        url=f"https://www.google.com/search?q={google_query}",
+        title=f"Tìm trên Google: {search_query[:50]}",
+        icon="🔍"
+    ))
+    
+    # Wikipedia link (nếu là câu hỏi về khái niệm)
+    if any(word in message.lower() for word in ["là gì", "what is", "định nghĩa", "khái niệm"]):
+        wiki_query = search_query.replace(" ", "_")
         suggested_actions.append(ActionLink(
-            type="google",
-            url=f"https://www.google.com/search?q={google_query}",
-            title=f"Tìm trên Google: {search_query[:50]}",
-            icon="🔍"
+            type="wikipedia",
+            url=f"https://en.wikipedia.org/wiki/{wiki_query}",
+            title=f"Wikipedia: {search_query[:50]}",
+            icon="📖"
         ))
+    
+    return suggested_actions
+
+@app.post("/api/chat", tags=["Chat"])
+async def chat(request: ChatRequest, http_response: Response, authorization: Optional[str] = Header(None)):
+    """
+    Chat với Gemini AI (có hỗ trợ RAG + Agent Features + Conversation Memory)
+    
+    - **message**: Tin nhắn của người dùng
+    - **model**: Model Gemini sử dụng (mặc định: gemini-2.5-flash)
+    - **use_rag**: Sử dụng RAG để tăng cường context (mặc định: true)
+    - **session_id**: ID của chat session để load conversation history (optional)
+    
+    Agent Features (tự động):
+    - Xem thời khóa biểu (tự động lấy từ trang trường)
+    - Xem điểm số
+    - Gửi email
+    
+    Conversation Memory:
+    - Nếu có session_id, AI sẽ nhớ toàn bộ context của phiên chat
+    - Giống như ChatGPT - không cần lặp lại thông tin
+    
+    Models được khuyến nghị:
+    - gemini-2.5-flash (MỚI NHẤT - Nhanh, stable)
+    - gemini-2.5-pro (Mạnh nhất)
+    - gemini-flash-latest (Luôn dùng version mới nhất)
+    
+    Các bước trước khi gọi LLM (user_id, lịch sử chat, Google Cloud agent, tool intent, RAG)
+    chạy song song; thời gian từng bước trả về trong header Server-Timing.
+    """
+    timer = StageTimer()
+    stages: Dict[str, asyncio.Task] = {}
+    try:
+        routed, context = await prepare_chat(request, authorization, timer, stages)
+        if routed is not None:
+            return routed
         
-        # Wikipedia link (nếu là câu hỏi về khái niệm)
-        if any(word in request.message.lower() for word in ["là gì", "what is", "định nghĩa", "khái niệm"]):
-            wiki_query = search_query.replace(" ", "_")
-            suggested_actions.append(ActionLink(
-                type="wikipedia",
-                url=f"https://en.wikipedia.org/wiki/{wiki_query}",
-                title=f"Wikipedia: {search_query[:50]}",
-                icon="📖"
-            ))
+        llm_started = time.perf_counter()
+        ai_response, actual_model = await generate_chat_response(request, context)
+        timer.record("llm", llm_started)
         
         return ChatResponse(
             response=ai_response,
             model=actual_model,
-            context_used=context_docs if request.use_rag else None,
+            context_used=context["context_docs"] if request.use_rag else None,
             rag_enabled=request.use_rag,
-            suggested_actions=suggested_actions
+            suggested_actions=build_suggested_actions(request.message)
         ).model_dump()
     
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Lỗi: {str(e)}")
+    finally:
+        cancel_pending_stages(stages)
+        http_response.headers["Server-Timing"] = timer.header()
+
+async def stream_chat_response(request: ChatRequest, context: Dict) -> AsyncIterator[Tuple[str, str]]:
+    """
+    Stream câu trả lời text-only từ Groq / Gemini
+    
+    Yields:
+        (đoạn text, tên model thực tế)
+    """
+    prompt = context["prompt"]
+    system_prompt = context["system_prompt"]
+    gemini_model_name = request.model if 'gemini' in request.model else "gemini-2.0-flash-exp"
+    gemini_label = gemini_model_name
+    
+    if request.ai_provider == "groq" and groq_client:
+        groq_model = resolve_groq_model(request.model)
+        print(f"🚀 Streaming from Groq model: {groq_model}")
+        sent_any = False
+        try:
+            async for text in groq_client.astream_text(prompt=prompt, system_prompt=system_prompt, model=groq_model):
+                sent_any = True
+                yield text, f"{groq_model} (Groq)"
+            return
+        except Exception as e:
+            if sent_any:
+                raise
+            print(f"⚠️ Groq stream error: {e}, falling back to Gemini")
+            gemini_model_name = "gemini-2.0-flash-exp"
+            gemini_label = "gemini-2.0-flash-exp (fallback)"
+    elif request.ai_provider == "groq" and not groq_client:
+        print("❌ Groq requested but groq_client not initialized! Check GROQ_API_KEY")
+        gemini_model_name = "gemini-2.0-flash-exp"
+        gemini_label = f"{gemini_model_name} (Groq unavailable)"
+    
+    model = genai.GenerativeModel(gemini_model_name)
+    sent_any = False
+    try:
+        print(f"📤 Streaming from Gemini {gemini_model_name}...")
+        response = await model.generate_content_async([prompt], stream=True)
+        async for chunk in response:
+            try:
+                text = chunk.text
+            except ValueError:
+                # Chunk không có text (vd: chỉ có safety ratings)
+                continue
+            if text:
+                sent_any = True
+                yield text, gemini_label
+    except Exception as e:
+        if sent_any:
+            raise
+        error_message = str(e)
+        print(f"❌ Gemini API Error: {error_message}")
+        yield format_gemini_error(error_message), f"{gemini_model_name} (error)"
+
+def sse_event(event: str, data) -> str:
+    """Format 1 Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.post("/api/chat/stream", tags=["Chat"])
+async def chat_stream(request: ChatRequest, authorization: Optional[str] = Header(None)):
+    """
+    Chat dạng Server-Sent Events - gửi từng đoạn câu trả lời ngay khi Groq / Gemini sinh ra
+    
+    Events:
+    - **token**: `{"text": "..."}` - đoạn câu trả lời tiếp theo
+    - **final**: ChatResponse đầy đủ (response, model, context_used, suggested_actions, tool_action,
+      email_draft) + `timings` (ms từng bước; `ttft` = thời gian tới token đầu tiên)
+    - **error**: `{"detail": "..."}`
+    
+    Request do agent / tool xử lý (thời khóa biểu, điểm, email...) hoặc có ảnh chỉ nhận 1 event `final`.
+    """
+    timer = StageTimer()
+    stages: Dict[str, asyncio.Task] = {}
+    
+    async def event_stream():
+        try:
+            routed, context = await prepare_chat(request, authorization, timer, stages)
+            if routed is not None:
+                routed["timings"] = timer.snapshot()
+                yield sse_event("final", routed)
+                return
+            
+            llm_started = time.perf_counter()
+            if request.image_base64 and request.image_mime_type:
+                # Vision không stream - trả nguyên câu trả lời trong 1 event
+                ai_response, actual_model = await generate_chat_response(request, context)
+                timer.record("ttft", timer.started_at)
+            else:
+                chunks = []
+                actual_model = request.model
+                async for text, actual_model in stream_chat_response(request, context):
+                    if not chunks:
+                        timer.record("ttft", timer.started_at)
+                    chunks.append(text)
+                    yield sse_event("token", {"text": text})
+                ai_response = "".join(chunks)
+            timer.record("llm", llm_started)
+            
+            final = ChatResponse(
+                response=ai_response,
+                model=actual_model,
+                context_used=context["context_docs"] if request.use_rag else None,
+                rag_enabled=request.use_rag,
+                suggested_actions=build_suggested_actions(request.message)
+            ).model_dump()
+            final["timings"] = timer.snapshot()
+            yield sse_event("final", final)
+        except Exception as e:
+            print(f"❌ Chat stream error: {e}")
+            yield sse_event("error", {"detail": f"Lỗi: {str(e)}"})
+        finally:
+            cancel_pending_stages(stages)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 @app.post("/api/email/send", tags=["Email"])
 async def send_email_confirmed(request: SendEmailRequest, authorization: Optional[str] = Header(None)):
@@ -1515,10 +2018,13 @@ Chỉ trả về JSON."""
             "summary": summary
         }
         
-        result = vector_db.add_documents(
+        result = await run_blocking(
+            vector_db.add_documents,
             documents=[request.prompt],
             metadatas=[metadata]
         )
+        if result['status'] == "error":
+            raise HTTPException(status_code=502, detail=f"Lỗi tạo embedding: {result['failed'][0]['error']}")
         
         return {
             "status": "success",
@@ -1529,6 +2035,8 @@ Chỉ trả về JSON."""
             "summary": summary,
             "total_documents": vector_db.get_count()
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Lỗi: {str(e)}")
 
@@ -1592,10 +2100,13 @@ Chỉ trả về JSON, không thêm text khác."""
             "type": "prompt"
         }
         
-        result = vector_db.add_documents(
+        result = await run_blocking(
+            vector_db.add_documents,
             documents=[request.prompt],
             metadatas=[metadata]
         )
+        if result['status'] == "error":
+            raise HTTPException(status_code=502, detail=f"Lỗi tạo embedding: {result['failed'][0]['error']}")
         
         return {
             "status": "success",
@@ -1606,6 +2117,8 @@ Chỉ trả về JSON, không thêm text khác."""
             "auto_generated": request.category == "general" or not request.tags,
             "total_documents": vector_db.get_count()
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Lỗi: {str(e)}")
 
@@ -1613,14 +2126,16 @@ Chỉ trả về JSON, không thêm text khác."""
 async def add_documents(request: DocumentRequest):
     """Thêm nhiều documents vào Vector Database"""
     try:
-        result = vector_db.add_documents(
+        result = await run_blocking(
+            vector_db.add_documents,
             documents=request.documents,
             metadatas=request.metadatas
         )
         return {
-            "status": "success",
-            "message": f"Đã thêm {result['count']} documents",
-            "total_documents": vector_db.get_count()
+            "status": result['status'],
+            "message": f"Đã thêm {result['count']}/{len(request.documents)} documents",
+            "total_documents": vector_db.get_count(),
+            "failed": result['failed']
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Lỗi: {str(e)}")
@@ -1629,9 +2144,16 @@ async def add_documents(request: DocumentRequest):
 async def search_documents(request: SearchRequest):
     """Tìm kiếm documents tương tự trong Vector Database"""
     try:
-        results = vector_db.search(request.query, request.n_results)
+        filters = request.filter.to_filters() if request.filter else None
+        if request.mode not in SimpleVectorDB.SEARCH_MODES:
+            raise HTTPException(status_code=400, detail=f"mode phải là một trong {SimpleVectorDB.SEARCH_MODES}")
+        results = await run_blocking(
+            vector_db.search, request.query, request.n_results, filters=filters, mode=request.mode
+        )
         return {
             "query": request.query,
+            "filter": filters,
+            "mode": results['mode'],
             "results": [
                 {
                     "document": doc,
@@ -1648,6 +2170,8 @@ async def search_documents(request: SearchRequest):
             ],
             "count": len(results['documents'])
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Lỗi: {str(e)}")
 
@@ -1663,7 +2187,7 @@ async def get_all_documents():
 async def delete_all_documents():
     """Xóa tất cả documents trong Vector Database"""
     try:
-        return vector_db.delete_all()
+        return await run_blocking(vector_db.delete_all)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Lỗi: {str(e)}")
 
@@ -1687,11 +2211,28 @@ async def get_rag_stats():
         return {
             "total_documents": all_docs['count'],
             "categories": categories,
+            "embedding_cache": embedding_cache.stats(),
+            "vector_index": vector_db.index.stats(),
+            "courses": vector_db.metadata_index.field_values("course_id"),
             "status": "active"
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Lỗi: {str(e)}")
 
+@app.get("/api/metrics", tags=["Health"])
+async def get_metrics():
+    """Thống kê hit rate của các cache trong process"""
+    return {
+        "token_cache": token_cache.stats(),
+        "embedding_cache": embedding_cache.stats(),
+        "tvu_sessions": agent_features.tvu_sessions.stats() if agent_features else None,
+        "timetable_cache": agent_features.timetables.stats() if agent_features else None,
+        "credential_cache": agent_features.credentials.stats() if agent_features else None,
+        "schedule_prefetch": schedule_prefetcher.stats() if schedule_prefetcher else None,
+        "http": http_stats(),
+        "google_tokens": get_google_token_cache().stats()
+    }
+
 @app.get("/api/models", tags=["Models"])
 async def list_models():
     """Liệt kê các model Gemini có sẵn"""
@@ -1838,11 +2379,13 @@ class ExplainResponse(BaseModel):
 class IngestRequest(BaseModel):
     file_url: str
     title: Optional[str] = None
+    course_id: Optional[int] = None  # Gắn chunks vào khóa học để lọc khi tìm kiếm
 
 class IngestResponse(BaseModel):
     status: str
     message: str
     documents_added: int
+    failed: Optional[List[dict]] = None  # Chunks embed lỗi: {"index", "id", "error"}
 
 @app.post("/api/ai/generate-quiz", response_model=GenerateQuizResponse, tags=["AI - Extended"])
 async def generate_quiz(request: GenerateQuizRequest):
@@ -2005,16 +2548,21 @@ async def ingest_document(request: IngestRequest):
             "title": request.title or "Untitled",
             "type": "document"
         } for _ in chunks]
+        if request.course_id is not None:
+            for metadata in metadatas:
+                metadata["course_id"] = request.course_id
         
-        result = vector_db.add_documents(
+        result = await run_blocking(
+            vector_db.add_documents,
             documents=chunks,
             metadatas=metadatas
         )
         
         return IngestResponse(
-            status="success",
-            message=f"Đã ingest {len(chunks)} chunks vào RAG database",
-            documents_added=len(chunks)
+            status=result['status'],
+            message=f"Đã ingest {result['count']}/{len(chunks)} chunks vào RAG database",
+            documents_added=result['count'],
+            failed=result['failed'] or None
         )
     
     except Exception as e:
@@ -2504,6 +3052,7 @@ class CalendarSyncRequest(BaseModel):
     reminder_email: Optional[int] = None  # Phút trước để gửi email (vd: 30, 60, 1440)
     reminder_popup: Optional[int] = None  # Phút trước để hiện popup
     notification_email: Optional[str] = None  # Email tùy chỉnh để nhận thông báo
+    whole_semester: bool = False  # Đồng bộ cả học kỳ (mỗi lớp 1 event lặp hàng tuần)
     
     model_config = ConfigDict(
         json_schema_extra={
@@ -2533,14 +3082,17 @@ async def sync_schedule_to_calendar(
     - Đã cấu hình tài khoản TVU trong Settings
     
     **Parameters:**
-    - week: Tuần học (optional, mặc định tuần hiện tại)
+    - week: Tuần học (optional, mặc định 7 ngày tới)
+    - whole_semester: Đồng bộ cả học kỳ - mỗi lớp là 1 event lặp hàng tuần, tuần nghỉ là EXDATE
     - hoc_ky: Học kỳ (optional, mặc định học kỳ hiện tại)
     - user_id: User ID (optional, nếu không có sẽ lấy từ token)
     
+    Sync lại chỉ tạo / cập nhật / xóa các lớp thay đổi
+    
     **Returns:**
     - success: True/False
     - message: Thông báo kết quả
-    - events_created: Số events đã tạo
+    - events_created / events_updated / events_deleted / events_skipped: Số events theo loại
     """
     if not AGENT_FEATURES_AVAILABLE or not agent_features:
         raise HTTPException(
@@ -2567,16 +3119,20 @@ async def sync_schedule_to_calendar(
             )
         
         print(f"🔄 Syncing schedule for user_id: {user_id}")
+        if schedule_prefetcher:
+            schedule_prefetcher.touch(user_id)
         
         # Call sync function - truyền user_id để lấy credentials
-        result = agent_features.sync_schedule_to_calendar(
+        result = await run_blocking(
+            agent_features.sync_schedule_to_calendar,
             token=token or "",  # Token có thể rỗng, function sẽ dùng user_id
             user_id=user_id,
             week=request.week,
             hoc_ky=request.hoc_ky,
             reminder_email=request.reminder_email,
             reminder_popup=request.reminder_popup,
-            notification_email=request.notification_email
+            notification_email=request.notification_email,
+            whole_semester=request.whole_semester
         )
         
         if result.get("success"):
@@ -2592,6 +3148,27 @@ async def sync_schedule_to_calendar(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
+@app.get("/api/schedule/changes", tags=["Calendar Sync"])
+async def get_schedule_changes(authorization: Optional[str] = Header(None)):
+    """
+    📅 Thay đổi TKB (đổi phòng, nghỉ, thêm buổi...) phát hiện ở lần prefetch nền gần nhất
+
+    **Returns:**
+    - detected_at: Thời điểm phát hiện (None nếu chưa có thay đổi)
+    - changes: [{type: changed | cancelled | added, week, day_of_week, subject, fields, before, after}]
+    """
+    if not schedule_prefetcher:
+        raise HTTPException(status_code=503, detail="Schedule prefetch not enabled")
+    if not authorization or not authorization.startswith("Bearer "):
+        raise HTTPException(status_code=401, detail="Missing token")
+
+    user_id = await get_user_id_from_token_async(authorization.replace("Bearer ", ""))
+    if not user_id:
+        raise HTTPException(status_code=401, detail="Invalid token")
+
+    schedule_prefetcher.touch(user_id)
+    return schedule_prefetcher.changes(user_id) or {"detected_at": None, "changes": []}
+
 # ============================================================================
 # FLASHCARD AI GENERATION
 # ============================================================================
@@ -2959,7 +3536,7 @@ async def generate_flashcards_from_lesson(
         if authorization:
             headers["Authorization"] = authorization
         
-        response = requests.get(
+        response = http.get(
             f"http://localhost:8080/api/lessons/{request.lesson_id}",
             headers=headers,
             timeout=10
@@ -10,6 +10,7 @@ import google.generativeai as genai
 import os
 from dotenv import load_dotenv
 from chroma_vector_service import get_chroma_service
+from metadata_index import filters_to_chroma_where
 
 # Load environment variables
 load_dotenv()
@@ -40,10 +41,20 @@ app.add_middleware(
 vector_db = get_chroma_service()
 
 # Pydantic models
+class RAGFilter(BaseModel):
+    """Lọc metadata khi tìm kiếm (ChromaDB chỉ lọc được field dạng scalar nên không có tags)"""
+    course_id: Optional[int] = None
+    category: Optional[str] = None
+    source: Optional[str] = None
+    
+    def to_where(self) -> Optional[dict]:
+        return filters_to_chroma_where(self.dict(exclude_none=True))
+
 class ChatRequest(BaseModel):
     message: str
     model: str = "gemini-2.5-flash"
     use_rag: bool = True
+    rag_filter: Optional[RAGFilter] = None
     
     class Config:
         json_schema_extra = {
@@ -91,6 +102,7 @@ class PromptRAGRequest(BaseModel):
 class SearchRequest(BaseModel):
     query: str
     n_results: int = 5
+    filter: Optional[RAGFilter] = None
 
 # Root endpoint
 @app.get("/", tags=["Health"])
@@ -122,7 +134,8 @@ async def chat(request: ChatRequest):
         
         # Nếu bật RAG, tìm kiếm context từ vector DB
         if request.use_rag and vector_db.get_count() > 0:
-            search_results = vector_db.search(request.message, n_results=3)
+            where = request.rag_filter.to_where() if request.rag_filter else None
+            search_results = vector_db.search(request.message, n_results=3, where=where)
             context_docs = search_results['documents']
             
             if context_docs:
@@ -244,7 +257,8 @@ async def search_documents(request: SearchRequest):
     Tìm kiếm documents tương tự trong Vector Database
     """
     try:
-        results = vector_db.search(request.query, request.n_results)
+        where = request.filter.to_where() if request.filter else None
+        results = vector_db.search(request.query, request.n_results, where=where)
         return {
             "query": request.query,
             "results": [
@@ -316,6 +330,7 @@ async def get_rag_stats():
         return {
             "total_documents": all_docs['count'],
             "categories": categories,
+            "embedding_cache": vector_db.embedding_cache.stats(),
             "status": "active"
         }
     except Exception as e:
@@ -0,0 +1,99 @@
+"""
+Metadata Index
+Inverted index trên metadata của documents (category, tags, source, course_id, ...)
+để lọc trước khi chấm điểm vector - chỉ quét các chunk thuộc đúng khóa học / danh mục / tag
+"""
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+import numpy as np
+
+
+def _values(value: Any) -> List[str]:
+    """Chuẩn hóa giá trị metadata thành list string (list/tuple được index từng phần tử)"""
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple, set)):
+        return [str(v).strip().lower() for v in value if v is not None]
+    return [str(value).strip().lower()]
+
+
+def clean_filters(filters: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Bỏ các field None / list rỗng"""
+    if not filters:
+        return {}
+    return {field: value for field, value in filters.items() if _values(value)}
+
+
+class MetadataIndex:
+    """
+    field -> value -> set(row)
+
+    Ngữ nghĩa filter: AND giữa các field, OR giữa các giá trị trong 1 field
+    vd: {"course_id": 5, "tags": ["python", "ai"]} = course 5 VÀ có tag python HOẶC ai
+    """
+
+    def __init__(self):
+        self._postings: Dict[str, Dict[str, Set[int]]] = {}
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, metadatas: Iterable[Optional[Dict]]):
+        """Index metadata của các rows mới (nối tiếp sau các rows hiện có)"""
+        for metadata in metadatas:
+            row = self._size
+            for field, value in (metadata or {}).items():
+                field_postings = self._postings.setdefault(field, {})
+                for v in _values(value):
+                    field_postings.setdefault(v, set()).add(row)
+            self._size += 1
+
+    def rebuild(self, metadatas: Iterable[Optional[Dict]]):
+        self._postings = {}
+        self._size = 0
+        self.add(metadatas)
+
+    def match(self, filters: Optional[Dict[str, Any]]) -> Optional[np.ndarray]:
+        """
+        Returns:
+            None nếu không có filter, ngược lại mảng rows (tăng dần) thỏa filter
+        """
+        filters = clean_filters(filters)
+        if not filters:
+            return None
+
+        result: Optional[Set[int]] = None
+        # Field có ít rows nhất trước để phép giao nhỏ nhất
+        candidates = []
+        for field, value in filters.items():
+            field_postings = self._postings.get(field, {})
+            rows: Set[int] = set()
+            for v in _values(value):
+                rows |= field_postings.get(v, set())
+            candidates.append(rows)
+
+        for rows in sorted(candidates, key=len):
+            result = rows.copy() if result is None else result & rows
+            if not result:
+                return np.empty(0, dtype=np.int64)
+        return np.fromiter(sorted(result), dtype=np.int64, count=len(result))
+
+    def field_values(self, field: str) -> Dict[str, int]:
+        """Số documents theo từng giá trị của 1 field (vd: thống kê theo course_id)"""
+        return {value: len(rows) for value, rows in self._postings.get(field, {}).items()}
+
+
+def filters_to_chroma_where(filters: Optional[Dict[str, Any]]) -> Optional[Dict]:
+    """Chuyển filter dạng {"field": value | [values]} sang where của ChromaDB"""
+    filters = clean_filters(filters)
+    clauses = []
+    for field, value in filters.items():
+        if isinstance(value, (list, tuple, set)):
+            values = list(value)
+            clauses.append({field: {"$in": values}} if len(values) > 1 else {field: values[0]})
+        else:
+            clauses.append({field: value})
+    if not clauses:
+        return None
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
@@ -0,0 +1,300 @@
+"""
+OAuth Token Store
+Token Google (đã giải mã) của user trong OAuth service (:8003), để /api/oauth/google/token/{user_id}
+không phải gọi Spring Boot + giải mã Fernet + có thể refresh với Google ở mỗi request
+
+- Cache tokens của user trong bộ nhớ OAUTH_TOKEN_CACHE_TTL giây (sau đó đọc lại từ Spring Boot)
+- Token coi như hết hạn sớm hơn OAUTH_TOKEN_EXPIRY_MARGIN giây - client luôn nhận token còn dùng được
+- Single-flight: mỗi user có lock riêng, nhiều request lúc token hết hạn chỉ refresh với oauth2.googleapis.com
+  và ghi về Spring Boot 1 lần, các request còn lại nhận token mới
+- Worker nền mỗi OAUTH_REFRESH_INTERVAL giây refresh trước token của user đang hoạt động (lấy token trong
+  OAUTH_ACTIVE_SECONDS gần đây) sắp hết hạn trong OAUTH_REFRESH_AHEAD giây -> hot path không phải chờ Google
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from async_helper import run_blocking
+
+logger = logging.getLogger(__name__)
+
+
+class TokenUnavailable(Exception):
+    """Không lấy được token hợp lệ: status_code 404 (chưa kết nối) / 401 (không refresh được)"""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+class _UserTokens:
+    def __init__(self):
+        self.tokens: Optional[Dict] = None
+        self.expires_at = 0.0  # epoch của access token
+        self.loaded_at = 0.0
+        self.last_access = 0.0
+        self.lock = threading.Lock()
+
+
+def _expiry_epoch(expiry_time: Optional[str]) -> float:
+    if not expiry_time:
+        return 0.0
+    try:
+        return datetime.fromisoformat(expiry_time).timestamp()
+    except ValueError:
+        return 0.0
+
+
+class OAuthTokenStore:
+    """Cache token đã giải mã + refresh single-flight theo user + refresh nền cho user đang hoạt động"""
+
+    def __init__(
+        self,
+        load: Callable[[int], Optional[Dict]],
+        refresh: Callable[[str], Optional[Dict]],
+        save: Callable[[int, str, str, int], bool],
+        cache_ttl: float = 900,
+        expiry_margin: float = 60,
+        refresh_ahead: float = 300,
+        refresh_interval: float = 60,
+        active_seconds: float = 3600,
+        concurrency: int = 4,
+        max_users: int = 10000
+    ):
+        """
+        Args:
+            load: user_id -> tokens đã giải mã {"accessToken", "refreshToken", "expiryTime", ...}
+                | None nếu user chưa kết nối Google (lỗi Spring Boot thì raise)
+            refresh: refresh_token -> response của Google {"access_token", "expires_in", ...}
+                | None nếu Google từ chối refresh token (lỗi tạm thời thì raise)
+            save: (user_id, access_token, refresh_token, expires_in) -> ghi về Spring Boot thành công?
+            cache_ttl: Giữ tokens trong bộ nhớ bao lâu trước khi đọc lại từ Spring Boot (giây)
+            expiry_margin: Coi access token hết hạn sớm hơn chừng này giây
+            refresh_ahead: Worker nền refresh token sẽ hết hạn trong chừng này giây
+            refresh_interval: Chu kỳ quét của worker nền (giây)
+            active_seconds: User lấy token trong chừng này giây gần đây mới được refresh nền
+            concurrency: Số refresh nền song song
+            max_users: Số user tối đa giữ trong bộ nhớ (LRU)
+        """
+        self.load = load
+        self.refresh = refresh
+        self.save = save
+        self.cache_ttl = cache_ttl
+        self.expiry_margin = expiry_margin
+        self.refresh_ahead = max(refresh_ahead, expiry_margin)
+        self.refresh_interval = refresh_interval
+        self.active_seconds = active_seconds
+        self.concurrency = max(1, concurrency)
+        self.max_users = max(1, max_users)
+        self._users: "OrderedDict[int, _UserTokens]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.hits = 0
+        self.loads = 0
+        self.refreshes = 0
+        self.background_refreshes = 0
+        self.coalesced = 0
+        self.refresh_failures = 0
+
+    def _entry(self, user_id: int) -> _UserTokens:
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is None:
+                entry = self._users[user_id] = _UserTokens()
+            self._users.move_to_end(user_id)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+            return entry
+
+    def _usable(self, entry: _UserTokens, now: float) -> bool:
+        return (
+            entry.tokens is not None
+            and now - entry.loaded_at < self.cache_ttl
+            and now < entry.expires_at - self.expiry_margin
+        )
+
+    def _result(self, entry: _UserTokens, refreshed: bool, now: float) -> Dict:
+        return {
+            "access_token": entry.tokens["accessToken"],
+            "expires_in": max(0, int(entry.expires_at - self.expiry_margin - now)),
+            "refreshed": refreshed
+        }
+
+    def peek(self, user_id: int) -> Optional[Dict]:
+        """Token còn dùng được trong cache (không I/O) - None nếu phải load / refresh"""
+        with self._lock:
+            entry = self._users.get(user_id)
+        now = time.time()
+        if entry is None or not self._usable(entry, now):
+            return None
+        entry.last_access = now
+        self.hits += 1
+        return self._result(entry, False, now)
+
+    def _refresh_locked(self, user_id: int, entry: _UserTokens, background: bool = False):
+        refresh_token = entry.tokens.get("refreshToken")
+        if not refresh_token:
+            raise TokenUnavailable(401, "Token expired and no refresh token available")
+
+        new_tokens = self.refresh(refresh_token)
+        if not new_tokens:
+            self.refresh_failures += 1
+            raise TokenUnavailable(401, "Failed to refresh token")
+
+        # Keep old refresh token (Google chỉ trả refresh_token mới khi xoay vòng)
+        refresh_token = new_tokens.get("refresh_token") or refresh_token
+        if not self.save(user_id, new_tokens["access_token"], refresh_token, new_tokens["expires_in"]):
+            logger.warning(f"Refreshed Google token for user {user_id} but saving to Spring Boot failed")
+
+        entry.tokens = dict(entry.tokens, accessToken=new_tokens["access_token"], refreshToken=refresh_token)
+        entry.expires_at = time.time() + new_tokens["expires_in"]
+        entry.loaded_at = time.time()
+        if background:
+            self.background_refreshes += 1
+        else:
+            self.refreshes += 1
+
+    def get_valid_token(self, user_id: int) -> Dict:
+        """
+        Access token còn hạn của user, refresh nếu cần
+
+        Returns:
+            {"access_token", "expires_in", "refreshed"}
+        Raises:
+            TokenUnavailable; lỗi của load / refresh (Spring Boot, Google không trả lời...) được raise nguyên vẹn
+        """
+        cached = self.peek(user_id)
+        if cached is not None:
+            return cached
+
+        entry = self._entry(user_id)
+        waited = entry.lock.locked()
+        with entry.lock:
+            now = time.time()
+            entry.last_access = now
+            if self._usable(entry, now):
+                # Request khác vừa load / refresh xong trong lúc chờ lock
+                if waited:
+                    self.coalesced += 1
+                return self._result(entry, False, now)
+
+            if entry.tokens is None or now - entry.loaded_at >= self.cache_ttl:
+                tokens = self.load(user_id)
+                self.loads += 1
+                if not tokens:
+                    entry.tokens = None
+                    raise TokenUnavailable(404, "User not connected to Google")
+                entry.tokens = tokens
+                entry.expires_at = _expiry_epoch(tokens.get("expiryTime"))
+                entry.loaded_at = now
+                if self._usable(entry, now):
+                    return self._result(entry, False, now)
+
+            self._refresh_locked(user_id, entry)
+            return self._result(entry, True, time.time())
+
+    async def aget_valid_token(self, user_id: int) -> Dict:
+        """Bản async cho endpoint: cache hit trả ngay, load / refresh chạy trong thread pool"""
+        cached = self.peek(user_id)
+        if cached is not None:
+            return cached
+        return await run_blocking(self.get_valid_token, user_id)
+
+    def invalidate(self, user_id: int):
+        """Bỏ tokens đã cache (user kết nối lại / ngắt kết nối)"""
+        with self._lock:
+            self._users.pop(user_id, None)
+
+    def due_for_refresh(self, now: float = None) -> List[int]:
+        """User đang hoạt động có token sẽ hết hạn trong refresh_ahead giây"""
+        now = now or time.time()
+        with self._lock:
+            return [
+                user_id for user_id, entry in self._users.items()
+                if entry.tokens is not None
+                and entry.tokens.get("refreshToken")
+                and now - entry.last_access < self.active_seconds
+                and entry.expires_at - now < self.refresh_ahead
+                and not entry.lock.locked()
+            ]
+
+    def _refresh_user(self, user_id: int):
+        entry = self._entry(user_id)
+        with entry.lock:
+            # Request thường có thể đã refresh trong lúc chờ
+            if entry.tokens is None or entry.expires_at - time.time() >= self.refresh_ahead:
+                return
+            self._refresh_locked(user_id, entry, background=True)
+
+    async def refresh_due(self) -> int:
+        """Refresh nền 1 lượt, trả về số user được refresh"""
+        users = self.due_for_refresh()
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def refresh(user_id):
+            async with semaphore:
+                try:
+                    await run_blocking(self._refresh_user, user_id)
+                    return True
+                except TokenUnavailable as e:
+                    logger.warning(f"Background token refresh failed for user {user_id}: {e.detail}")
+                except Exception as e:
+                    logger.warning(f"Background token refresh failed for user {user_id}: {e}")
+                return False
+
+        return sum(await asyncio.gather(*(refresh(user_id) for user_id in users)))
+
+    async def start(self):
+        if self._task is None and self.refresh_interval > 0:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                refreshed = await self.refresh_due()
+                if refreshed:
+                    logger.info(f"🔄 Refreshed Google tokens ahead of expiry for {refreshed} user(s)")
+            except Exception as e:
+                logger.error(f"Background token refresh run failed: {e}")
+
+    def stats(self) -> Dict:
+        return {
+            "users": len(self._users),
+            "hits": self.hits,
+            "loads": self.loads,
+            "refreshes": self.refreshes,
+            "background_refreshes": self.background_refreshes,
+            "coalesced": self.coalesced,
+            "refresh_failures": self.refresh_failures
+        }
+
+
+def create_oauth_token_store(load, refresh, save) -> OAuthTokenStore:
+    """Tạo store theo cấu hình OAUTH_TOKEN_* / OAUTH_REFRESH_* / OAUTH_ACTIVE_SECONDS"""
+    return OAuthTokenStore(
+        load,
+        refresh,
+        save,
+        cache_ttl=float(os.getenv("OAUTH_TOKEN_CACHE_TTL", "900")),
+        expiry_margin=float(os.getenv("OAUTH_TOKEN_EXPIRY_MARGIN", "60")),
+        refresh_ahead=float(os.getenv("OAUTH_REFRESH_AHEAD", "300")),
+        refresh_interval=float(os.getenv("OAUTH_REFRESH_INTERVAL", "60")),
+        active_seconds=float(os.getenv("OAUTH_ACTIVE_SECONDS", "3600")),
+        concurrency=int(os.getenv("OAUTH_REFRESH_CONCURRENCY", "4"))
+    )
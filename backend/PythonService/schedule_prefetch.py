@@ -0,0 +1,286 @@
+"""
+Schedule Prefetch
+Worker nền làm nóng cache TKB của các user đang hoạt động trước giờ học buổi sáng, để câu hỏi
+lịch học đầu tiên trong ngày không phải chờ login + tải TKB từ ttsv.tvu.edu.vn
+
+- User đang hoạt động = có hỏi lịch học / đồng bộ TKB trong SCHEDULE_PREFETCH_ACTIVE_DAYS ngày gần đây (touch)
+- Chạy vào các giờ SCHEDULE_PREFETCH_TIMES (mặc định 06:00): mỗi user lấy credential rồi load lại TKB vào cache
+- So với TKB lần trước (từ tuần hiện tại trở đi) để phát hiện đổi phòng / đổi giảng viên / nghỉ / thêm buổi;
+  SCHEDULE_PREFETCH_CALENDAR_SYNC=true thì đồng bộ lại Google Calendar khi có thay đổi
+- Tối đa SCHEDULE_PREFETCH_CONCURRENCY user cùng lúc, mỗi portal tối đa SCHEDULE_PREFETCH_RATE lần tải TKB / giây
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from async_helper import run_blocking
+from tvu_session_pool import TVULoginError
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORTAL = "ttsv.tvu.edu.vn"
+
+# Trường so sánh giữa 2 lần tải cho cùng 1 buổi (môn, thứ, tiết)
+_COMPARED_FIELDS = ('room', 'teacher', 'start_time', 'end_time')
+
+
+def _slot_key(schedule: Dict) -> Tuple:
+    return (schedule.get('subject'), schedule.get('day_of_week'), schedule.get('notes'))
+
+
+def _slot(schedule: Optional[Dict]) -> Optional[Dict]:
+    if schedule is None:
+        return None
+    return {field: schedule.get(field) for field in _COMPARED_FIELDS}
+
+
+def _change(kind: str, week: int, before: Optional[Dict], after: Optional[Dict], fields: List[str] = None) -> Dict:
+    schedule = after or before
+    return {
+        "type": kind,
+        "week": week,
+        "day_of_week": schedule.get('day_of_week'),
+        "subject": schedule.get('subject'),
+        "fields": fields or [],
+        "before": _slot(before),
+        "after": _slot(after)
+    }
+
+
+def diff_timetables(before, after, from_week: int = 0) -> List[Dict]:
+    """
+    Thay đổi giữa 2 SemesterTimetable, chỉ xét tuần >= from_week
+
+    Returns:
+        [{"type": "changed" | "cancelled" | "added", "week", "day_of_week", "subject", "fields", "before", "after"}, ...]
+        ([] nếu thiếu 1 trong 2 bản)
+    """
+    if before is None or after is None:
+        return []
+
+    changes = []
+    for week in sorted(set(before.weeks()) | set(after.weeks())):
+        if week < from_week:
+            continue
+        old = {_slot_key(s): s for s in before.week(week)}
+        new = {_slot_key(s): s for s in after.week(week)}
+        for key, schedule in old.items():
+            current = new.get(key)
+            if current is None:
+                changes.append(_change("cancelled", week, schedule, None))
+                continue
+            fields = [f for f in _COMPARED_FIELDS if schedule.get(f) != current.get(f)]
+            if fields:
+                changes.append(_change("changed", week, schedule, current, fields))
+        changes.extend(_change("added", week, None, s) for key, s in new.items() if key not in old)
+    return changes
+
+
+class _PortalRateLimiter:
+    """Giãn các lần tải TKB trên cùng 1 portal: tối đa `rate` lần / giây"""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next_slot: Dict[str, float] = {}
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, portal: str):
+        async with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(portal, 0.0))
+            self._next_slot[portal] = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+def _portal(credential: Dict) -> str:
+    return urlparse(credential.get('serviceUrl') or '').netloc.lower() or DEFAULT_PORTAL
+
+
+class SchedulePrefetcher:
+    """Prefetch TKB theo lịch cho user đang hoạt động, ghi lại thay đổi TKB gần nhất của từng user"""
+
+    def __init__(
+        self,
+        agent_features,
+        run_times: List[str] = ("06:00",),
+        concurrency: int = 4,
+        rate_per_portal: float = 1.0,
+        active_days: float = 7,
+        push_to_calendar: bool = False,
+        max_users: int = 5000
+    ):
+        """
+        Args:
+            agent_features: AgentFeatures (credential + TKB cache + đồng bộ Calendar)
+            run_times: Các giờ chạy trong ngày, dạng HH:MM (giờ máy chủ)
+            concurrency: Số user prefetch cùng lúc
+            rate_per_portal: Số lần tải TKB tối đa mỗi giây trên 1 portal
+            active_days: User không hỏi lịch học quá số ngày này thì không prefetch nữa
+            push_to_calendar: Có thay đổi thì đồng bộ lại Google Calendar
+            max_users: Số user tối đa được theo dõi
+        """
+        self.agent = agent_features
+        self.run_times = sorted(tuple(int(part) for part in t.strip().split(':')) for t in run_times if t.strip())
+        self.concurrency = max(1, concurrency)
+        self.active_seconds = active_days * 86400
+        self.push_to_calendar = push_to_calendar
+        self.max_users = max(1, max_users)
+        self._limiter = _PortalRateLimiter(rate_per_portal)
+        self._active: "OrderedDict[int, float]" = OrderedDict()
+        self._changes: Dict[int, Dict] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.runs = 0
+        self.prefetched = 0
+        self.failed = 0
+        self.changes_detected = 0
+        self.calendar_syncs = 0
+        self.last_run: Optional[Dict] = None
+
+    def touch(self, user_id: int):
+        """Đánh dấu user vừa dùng tính năng lịch học"""
+        if user_id is None:
+            return
+        self._active[user_id] = time.time()
+        self._active.move_to_end(user_id)
+        while len(self._active) > self.max_users:
+            evicted, _ = self._active.popitem(last=False)
+            self._changes.pop(evicted, None)
+
+    def active_users(self) -> List[int]:
+        cutoff = time.time() - self.active_seconds
+        for user_id in [u for u, seen in self._active.items() if seen < cutoff]:
+            del self._active[user_id]
+            self._changes.pop(user_id, None)
+        return list(self._active)
+
+    def changes(self, user_id: int) -> Optional[Dict]:
+        """Thay đổi TKB phát hiện ở lần prefetch gần nhất có thay đổi: {"detected_at", "changes"}"""
+        return self._changes.get(user_id)
+
+    def next_run(self, now: datetime = None) -> Optional[datetime]:
+        if not self.run_times:
+            return None
+        now = now or datetime.now()
+        for day in range(2):
+            for hour, minute in self.run_times:
+                candidate = (now + timedelta(days=day)).replace(hour=hour, minute=minute, second=0, microsecond=0)
+                if candidate > now:
+                    return candidate
+        return None
+
+    async def start(self):
+        if self._task is None and self.run_times:
+            self._task = asyncio.create_task(self._loop())
+            logger.info(f"⏰ Schedule prefetch scheduled at {', '.join(f'{h:02d}:{m:02d}' for h, m in self.run_times)}")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(max(0.0, (self.next_run() - datetime.now()).total_seconds()))
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"Schedule prefetch run failed: {e}")
+
+    async def run_once(self) -> Dict:
+        """Prefetch TKB cho mọi user đang hoạt động, trả về thống kê lần chạy"""
+        users = self.active_users()
+        started = time.time()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        results = await asyncio.gather(*(self._prefetch_user(user_id, semaphore) for user_id in users))
+
+        summary = {status: results.count(status) for status in ("prefetched", "changed", "skipped", "failed")}
+        summary.update({
+            "users": len(users),
+            "started_at": datetime.fromtimestamp(started).isoformat(timespec="seconds"),
+            "duration_s": round(time.time() - started, 2)
+        })
+        self.runs += 1
+        self.last_run = summary
+        logger.info(f"✅ Schedule prefetch: {summary}")
+        return summary
+
+    async def _prefetch_user(self, user_id: int, semaphore: asyncio.Semaphore) -> str:
+        async with semaphore:
+            try:
+                credential = await run_blocking(self.agent.get_tvu_credential_by_user_id, user_id)
+                if not credential:
+                    return "skipped"
+
+                await self._limiter.acquire(_portal(credential))
+                previous, current = await run_blocking(
+                    self.agent.refresh_timetable, credential.get('username'), credential.get('password')
+                )
+                self.prefetched += 1
+
+                # Tuần hiện tại theo ngày của portal; portal không trả ngày thì mới ước lượng
+                now = datetime.now()
+                current_week = current.week_of(now) if current is not None else None
+                if current_week is None:
+                    current_week = self.agent.calculate_week_from_date(now)
+                changes = diff_timetables(previous, current, from_week=current_week)
+                if not changes:
+                    return "prefetched"
+
+                self.changes_detected += 1
+                self._changes[user_id] = {
+                    "detected_at": datetime.now().isoformat(timespec="seconds"),
+                    "changes": changes
+                }
+                logger.info(f"📅 Timetable changed for user {user_id}: {len(changes)} change(s)")
+
+                if self.push_to_calendar:
+                    result = await run_blocking(self.agent.sync_schedule_to_calendar, token="", user_id=user_id)
+                    if result.get("success"):
+                        self.calendar_syncs += 1
+                return "changed"
+            except TVULoginError:
+                self.failed += 1
+                logger.warning(f"Schedule prefetch: TVU login failed for user {user_id}")
+                return "failed"
+            except Exception as e:
+                self.failed += 1
+                logger.warning(f"Schedule prefetch failed for user {user_id}: {e}")
+                return "failed"
+
+    def stats(self) -> Dict:
+        return {
+            "active_users": len(self._active),
+            "next_run": self.next_run().isoformat(timespec="minutes") if self.run_times else None,
+            "runs": self.runs,
+            "prefetched": self.prefetched,
+            "failed": self.failed,
+            "changes_detected": self.changes_detected,
+            "calendar_syncs": self.calendar_syncs,
+            "last_run": self.last_run
+        }
+
+
+def create_schedule_prefetcher(agent_features) -> Optional[SchedulePrefetcher]:
+    """
+    Tạo worker theo cấu hình SCHEDULE_PREFETCH_* (None nếu SCHEDULE_PREFETCH_ENABLED=false)
+    """
+    if os.getenv("SCHEDULE_PREFETCH_ENABLED", "true").lower() != "true":
+        return None
+    return SchedulePrefetcher(
+        agent_features,
+        run_times=os.getenv("SCHEDULE_PREFETCH_TIMES", "06:00").split(","),
+        concurrency=int(os.getenv("SCHEDULE_PREFETCH_CONCURRENCY", "4")),
+        rate_per_portal=float(os.getenv("SCHEDULE_PREFETCH_RATE", "1")),
+        active_days=float(os.getenv("SCHEDULE_PREFETCH_ACTIVE_DAYS", "7")),
+        push_to_calendar=os.getenv("SCHEDULE_PREFETCH_CALENDAR_SYNC", "false").lower() == "true"
+    )
@@ -0,0 +1,174 @@
+"""
+Schedule Sync
+Đồng bộ TKB lấy từ trang trường vào Spring Boot theo diff thay vì xóa hết rồi POST từng dòng
+
+- Key của 1 dòng: (day_of_week, start_time, subject, room) - giống dedup trong TVUScraper._parse_tvu_schedule
+- Chỉ gửi dòng thêm / sửa (end_time, teacher, notes đổi) / xóa qua POST /api/schedules/bulk,
+  chia batch và gửi song song có giới hạn
+- Trả về kết quả từng dòng để báo lại cho user
+"""
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+
+import requests
+
+from http_client import http
+
+logger = logging.getLogger(__name__)
+
+SCHEDULE_SYNC_BATCH_SIZE = int(os.getenv("SCHEDULE_SYNC_BATCH_SIZE", "25"))
+SCHEDULE_SYNC_CONCURRENCY = int(os.getenv("SCHEDULE_SYNC_CONCURRENCY", "4"))
+
+# Trường so sánh để biết 1 dòng cùng key có cần cập nhật không
+_COMPARED_FIELDS = ('end_time', 'teacher', 'notes')
+
+
+def _field(row: Dict, snake: str) -> str:
+    """Đọc field theo snake_case (scraper) hoặc camelCase (Spring Boot)"""
+    parts = snake.split('_')
+    camel = parts[0] + ''.join(p.capitalize() for p in parts[1:])
+    value = row.get(snake, row.get(camel))
+    return '' if value is None else str(value)
+
+
+def _compared(row: Dict, field: str) -> str:
+    value = _field(row, field)
+    return value[:5] if field.endswith('_time') else value
+
+
+def schedule_key(row: Dict) -> Tuple[str, str, str, str]:
+    return (
+        _field(row, 'day_of_week').upper(),
+        _field(row, 'start_time')[:5],
+        _field(row, 'subject'),
+        _field(row, 'room')
+    )
+
+
+def to_schedule_request(row: Dict) -> Dict:
+    """Dòng TKB của scraper -> ScheduleRequest (camelCase, HH:MM) của Spring Boot"""
+    return {
+        'dayOfWeek': _field(row, 'day_of_week').upper(),
+        'startTime': _field(row, 'start_time')[:5],
+        'endTime': _field(row, 'end_time')[:5],
+        'subject': _field(row, 'subject'),
+        'room': _field(row, 'room'),
+        'teacher': _field(row, 'teacher'),
+        'notes': _field(row, 'notes')
+    }
+
+
+def diff_schedules(fetched: List[Dict], stored: List[Dict]) -> Dict[str, List]:
+    """
+    So sánh TKB mới lấy với TKB đang lưu
+
+    Returns:
+        {"create": [row], "update": [(id, row)], "delete": [dòng đang lưu], "unchanged": [id]}
+    """
+    stored_by_key: Dict[Tuple, Dict] = {}
+    delete = []
+    for row in stored:
+        key = schedule_key(row)
+        if key in stored_by_key:
+            delete.append(row)  # dòng trùng do các lần sync cũ
+        else:
+            stored_by_key[key] = row
+
+    create, update, unchanged = [], [], []
+    seen = set()
+    for row in fetched:
+        key = schedule_key(row)
+        if key in seen:
+            continue
+        seen.add(key)
+        existing = stored_by_key.get(key)
+        if existing is None:
+            create.append(row)
+        elif any(_compared(row, f) != _compared(existing, f) for f in _COMPARED_FIELDS):
+            update.append((existing.get('id'), row))
+        else:
+            unchanged.append(existing.get('id'))
+
+    delete.extend(row for key, row in stored_by_key.items() if key not in seen)
+    return {"create": create, "update": update, "delete": delete, "unchanged": unchanged}
+
+
+class ScheduleSyncClient:
+    """Gửi diff TKB lên Spring Boot /api/schedules"""
+
+    def __init__(self, spring_boot_url: str, batch_size: int = SCHEDULE_SYNC_BATCH_SIZE, max_workers: int = SCHEDULE_SYNC_CONCURRENCY):
+        self.spring_boot_url = spring_boot_url
+        self.batch_size = max(1, batch_size)
+        self.max_workers = max(1, max_workers)
+
+    def fetch_stored(self, headers: Dict) -> List[Dict]:
+        """TKB đang lưu trong Spring Boot (raise nếu lỗi - không diff được thì không được ghi)"""
+        response = http.get(f"{self.spring_boot_url}/api/schedules/all", headers=headers, timeout=10)
+        response.raise_for_status()
+        return response.json()
+
+    def apply(self, diff: Dict[str, List], headers: Dict) -> List[Dict]:
+        """
+        Gửi create / update / delete, trả về kết quả từng dòng:
+            [{"op": "create", "key": (...), "id": 12, "success": True, "error": None}, ...]
+        """
+        ops = (
+            [("create", None, row) for row in diff["create"]] +
+            [("update", schedule_id, row) for schedule_id, row in diff["update"]] +
+            [("delete", row.get('id'), row) for row in diff["delete"]]
+        )
+        if not ops:
+            return []
+        logger.info(f"Schedule sync: {len(diff['create'])} create, {len(diff['update'])} update, {len(diff['delete'])} delete")
+
+        batches = [ops[i:i + self.batch_size] for i in range(0, len(ops), self.batch_size)]
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(batches))) as pool:
+            results = list(pool.map(lambda batch: self._send_batch(batch, headers), batches))
+        return [outcome for batch_outcomes in results for outcome in batch_outcomes]
+
+    @staticmethod
+    def _outcome(op: str, schedule_id, row, success: bool, error: str = None) -> Dict:
+        return {
+            "op": op,
+            "key": schedule_key(row) if row else None,
+            "id": schedule_id,
+            "success": success,
+            "error": error
+        }
+
+    def _send_batch(self, batch: List[Tuple], headers: Dict) -> List[Dict]:
+        payload = {"create": [], "update": [], "delete": []}
+        for op, schedule_id, row in batch:
+            if op == "delete":
+                payload["delete"].append(schedule_id)
+            else:
+                item = to_schedule_request(row)
+                if op == "update":
+                    item["id"] = schedule_id
+                payload[op].append(item)
+
+        try:
+            response = http.post(
+                f"{self.spring_boot_url}/api/schedules/bulk",
+                json=payload,
+                headers=headers,
+                timeout=15
+            )
+        except requests.RequestException as e:
+            return [self._outcome(op, schedule_id, row, False, str(e)) for op, schedule_id, row in batch]
+
+        if response.status_code != 200:
+            error = f"HTTP {response.status_code}: {response.text[:100]}"
+            return [self._outcome(op, schedule_id, row, False, error) for op, schedule_id, row in batch]
+
+        # Spring Boot trả kết quả theo thứ tự create, update, delete - cùng thứ tự với batch
+        results = response.json().get("results", [])
+        outcomes = []
+        for index, (op, schedule_id, row) in enumerate(batch):
+            result = results[index] if index < len(results) else {"success": False, "error": "missing result"}
+            outcomes.append(self._outcome(
+                op, result.get("id", schedule_id), row, bool(result.get("success")), result.get("error")
+            ))
+        return outcomes
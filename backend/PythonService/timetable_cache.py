@@ -0,0 +1,226 @@
+"""
+Timetable Cache
+Cache thời khóa biểu cả học kỳ theo (tài khoản trường, học kỳ), chia sẵn theo tuần và thứ
+
+Portal trả về toàn bộ học kỳ trong 1 request, nên hỏi "mai học gì", "tuần sau", "ngày 20/10"
+đều trả lời từ bộ nhớ thay vì gọi lại portal
+
+- Fresh (< ttl giây): trả về ngay
+- Stale (< max_stale giây): trả về bản cũ + refresh nền (stale-while-revalidate, mỗi key 1 lần)
+- Quá max_stale hoặc chưa có: load đồng bộ (single-flight theo key)
+- invalidate(username): xóa khi force_sync=True
+- refresh(key, loader): load lại chủ động (prefetch nền trước giờ học)
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+_DAY_NAMES = ['MONDAY', 'TUESDAY', 'WEDNESDAY', 'THURSDAY', 'FRIDAY', 'SATURDAY', 'SUNDAY']
+
+
+class SemesterTimetable:
+    """TKB 1 học kỳ: tuần -> thứ -> [schedule, ...]"""
+
+    def __init__(self, hoc_ky: Optional[str], weeks: Dict[int, List[Dict]]):
+        self.hoc_ky = hoc_ky
+        self.fetched_at = time.time()
+        self._weeks = weeks
+        self._days: Dict[int, Dict[str, List[Dict]]] = {}
+        # Thứ 2 của từng tuần theo ngày học portal trả về (schedule['date'])
+        self._mondays: Dict[int, datetime] = {}
+        for week, schedules in weeks.items():
+            by_day: Dict[str, List[Dict]] = {}
+            for schedule in schedules:
+                by_day.setdefault(schedule.get('day_of_week', 'MONDAY'), []).append(schedule)
+                if schedule.get('date') and week not in self._mondays:
+                    class_date = datetime.strptime(schedule['date'], '%Y-%m-%d')
+                    self._mondays[week] = class_date - timedelta(days=class_date.weekday())
+            self._days[week] = by_day
+
+    def week(self, week: int) -> List[Dict]:
+        return list(self._weeks.get(week, []))
+
+    def day(self, week: int, day_of_week: str) -> List[Dict]:
+        return list(self._days.get(week, {}).get(day_of_week, []))
+
+    def weeks(self) -> List[int]:
+        return sorted(self._weeks)
+
+    def week_monday(self, week: int) -> Optional[datetime]:
+        """
+        Thứ 2 của tuần học theo ngày portal trả về - tuần không có buổi nào thì tính từ tuần gần nhất có ngày.
+        None nếu portal không trả ngày (khi đó người gọi tự ước lượng)
+        """
+        if week in self._mondays:
+            return self._mondays[week]
+        if not self._mondays:
+            return None
+        nearest = min(self._mondays, key=lambda known: abs(known - week))
+        return self._mondays[nearest] + timedelta(days=(week - nearest) * 7)
+
+    def date_for(self, week: int, day_of_week: str) -> Optional[datetime]:
+        """Ngày của thứ day_of_week trong tuần học week (None nếu portal không trả ngày)"""
+        monday = self.week_monday(week)
+        if monday is None:
+            return None
+        return monday + timedelta(days=_DAY_NAMES.index(day_of_week))
+
+    def week_of(self, date: datetime) -> Optional[int]:
+        """Tuần học chứa ngày date (None nếu portal không trả ngày)"""
+        if not self._mondays:
+            return None
+        monday = date.replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=date.weekday())
+        for week, known in self._mondays.items():
+            if known == monday:
+                return week
+        nearest = min(self._mondays, key=lambda known: abs((self._mondays[known] - monday).days))
+        return nearest + (monday - self._mondays[nearest]).days // 7
+
+    def classes(self) -> List[Tuple[Dict, List[int]]]:
+        """
+        Gom các buổi theo lớp (môn, thứ, tiết, phòng): [(schedule, [tuần học, ...]), ...]
+
+        Tuần học = các tuần lớp xuất hiện trong ds_tuan_tkb + tuanHoc của portal (schedule['weeks'])
+        """
+        groups: "OrderedDict[Tuple, Tuple[Dict, set]]" = OrderedDict()
+        for week in self.weeks():
+            for schedule in self._weeks[week]:
+                key = (schedule.get('subject'), schedule.get('day_of_week'), schedule.get('notes'), schedule.get('room'))
+                if key not in groups:
+                    groups[key] = (schedule, set(schedule.get('weeks') or []))
+                groups[key][1].add(week)
+        return [(schedule, sorted(weeks)) for schedule, weeks in groups.values()]
+
+
+class _Entry:
+    def __init__(self):
+        self.timetable: Optional[SemesterTimetable] = None
+        self.lock = threading.Lock()
+        self.refreshing = False
+
+
+class TimetableCache:
+    """Cache SemesterTimetable theo key (username, hoc_ky)"""
+
+    def __init__(self, ttl: float = 900, max_stale: float = 86400, max_entries: int = 500):
+        """
+        Args:
+            ttl: Số giây TKB được coi là mới
+            max_stale: Số giây tối đa còn trả bản cũ trong lúc refresh nền
+            max_entries: Số (user, học kỳ) tối đa giữ trong bộ nhớ
+        """
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.max_entries = max(1, max_entries)
+        self._entries: "OrderedDict[Hashable, _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._refresher = ThreadPoolExecutor(max_workers=2, thread_name_prefix="timetable-refresh")
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+
+    def _entry(self, key: Hashable) -> _Entry:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = _Entry()
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            return entry
+
+    def _refresh(self, key: Hashable, entry: _Entry, loader: Callable[[], Optional[SemesterTimetable]]):
+        try:
+            timetable = loader()
+            if timetable is not None:
+                entry.timetable = timetable
+                logger.info(f"🔄 Refreshed timetable {key}")
+        except Exception as e:
+            logger.warning(f"Background timetable refresh failed for {key}: {e}")
+        finally:
+            entry.refreshing = False
+
+    def get(self, key: Hashable, loader: Callable[[], Optional[SemesterTimetable]]) -> Optional[SemesterTimetable]:
+        """
+        Lấy TKB từ cache, gọi loader() khi chưa có / quá cũ
+
+        loader trả về None thì không cache (vd: portal lỗi); exception từ loader được raise lại
+        khi load đồng bộ, còn khi refresh nền thì giữ bản cũ
+        """
+        entry = self._entry(key)
+        timetable = entry.timetable
+        if timetable is not None:
+            age = time.time() - timetable.fetched_at
+            if age < self.ttl:
+                self.hits += 1
+                return timetable
+            if age < self.max_stale:
+                self.stale_hits += 1
+                with entry.lock:
+                    start_refresh = not entry.refreshing
+                    entry.refreshing = True
+                if start_refresh:
+                    self._refresher.submit(self._refresh, key, entry, loader)
+                return timetable
+
+        with entry.lock:
+            # Request khác có thể vừa load xong trong lúc chờ lock
+            timetable = entry.timetable
+            if timetable is not None and time.time() - timetable.fetched_at < self.ttl:
+                self.hits += 1
+                return timetable
+            self.misses += 1
+            timetable = loader()
+            if timetable is not None:
+                entry.timetable = timetable
+            return timetable
+
+    def peek(self, key: Hashable) -> Optional[SemesterTimetable]:
+        """TKB đang cache (kể cả đã cũ), không load và không tính vào hit rate"""
+        with self._lock:
+            entry = self._entries.get(key)
+        return entry.timetable if entry is not None else None
+
+    def refresh(self, key: Hashable, loader: Callable[[], Optional[SemesterTimetable]]) -> Optional[SemesterTimetable]:
+        """
+        Load lại ngay (vd: prefetch nền) - request khác vẫn đọc bản cũ cho tới khi load xong
+
+        Returns TKB mới, None nếu loader trả về None (giữ bản cũ)
+        """
+        entry = self._entry(key)
+        with entry.lock:
+            timetable = loader()
+            if timetable is not None:
+                entry.timetable = timetable
+            return timetable
+
+    def invalidate(self, username: str):
+        """Xóa mọi học kỳ đã cache của user (key có dạng (username, hoc_ky))"""
+        with self._lock:
+            for key in [k for k in self._entries if isinstance(k, tuple) and k[0] == username]:
+                del self._entries[key]
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.stale_hits) / lookups, 4) if lookups else 0.0
+        }
+
+
+def create_timetable_cache() -> TimetableCache:
+    """Tạo cache theo cấu hình TIMETABLE_CACHE_TTL / TIMETABLE_CACHE_MAX_STALE"""
+    return TimetableCache(
+        ttl=float(os.getenv("TIMETABLE_CACHE_TTL", "900")),
+        max_stale=float(os.getenv("TIMETABLE_CACHE_MAX_STALE", "86400"))
+    )
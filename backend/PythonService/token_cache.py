@@ -0,0 +1,195 @@
+"""
+Token Cache
+Cache JWT -> user_id để /api/chat không phải gọi Spring Boot /api/auth/profile mỗi tin nhắn
+
+- Entry hết hạn theo min(TTL, claim `exp` của JWT) - decode payload local, không verify chữ ký
+  (user_id vẫn luôn lấy từ Spring Boot, exp chỉ dùng để giới hạn thời gian cache)
+- Negative caching: token bị Spring Boot từ chối (401/403) được nhớ trong negative_ttl giây
+- Backend "memory" (LRU trong process) hoặc "sqlite" (LRU + file SQLite dùng chung giữa các uvicorn worker)
+- Key là sha256(token) - không lưu token gốc
+"""
+import base64
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+
+def decode_jwt_claims(token: str) -> Optional[Dict]:
+    """Decode payload của JWT (không verify chữ ký), None nếu token không đúng định dạng"""
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        claims = json.loads(base64.urlsafe_b64decode(payload))
+        return claims if isinstance(claims, dict) else None
+    except (IndexError, ValueError):
+        return None
+
+
+def _token_key(token: str) -> str:
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+class TokenIdentityCache:
+    """Bounded TTL cache token -> user_id (thread-safe)"""
+
+    def __init__(
+        self,
+        max_entries: int = 10000,
+        ttl: float = 900,
+        negative_ttl: float = 60,
+        backend: str = "memory",
+        db_path: str = "token_cache.sqlite3"
+    ):
+        """
+        Args:
+            max_entries: Số token tối đa giữ trong bộ nhớ
+            ttl: Thời gian cache tối đa (giây) - ngắn hơn nếu JWT hết hạn sớm hơn
+            negative_ttl: Thời gian nhớ token không hợp lệ (giây)
+            backend: "memory" hoặc "sqlite" (chia sẻ giữa các worker)
+            db_path: File SQLite khi backend="sqlite"
+        """
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.backend = backend if backend in ("memory", "sqlite") else "memory"
+        # key -> (user_id | None, expires_at)
+        self._memory: "OrderedDict[str, Tuple[Optional[int], float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self._writes = 0
+
+        self._conn = None
+        if self.backend == "sqlite":
+            db_dir = os.path.dirname(os.path.abspath(db_path))
+            os.makedirs(db_dir, exist_ok=True)
+            self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=5)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS token_identity ("
+                " key TEXT PRIMARY KEY,"
+                " user_id INTEGER,"
+                " valid INTEGER NOT NULL,"
+                " expires_at REAL NOT NULL)"
+            )
+            self._conn.commit()
+
+    def _remember(self, key: str, user_id: Optional[int], expires_at: float):
+        self._memory[key] = (user_id, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _expires_at(self, token: str, ttl: float) -> float:
+        expires_at = time.time() + ttl
+        claims = decode_jwt_claims(token)
+        if claims and isinstance(claims.get("exp"), (int, float)):
+            expires_at = min(expires_at, float(claims["exp"]))
+        return expires_at
+
+    def get(self, token: str) -> Tuple[bool, Optional[int]]:
+        """
+        Returns:
+            (hit, user_id) - hit=True và user_id=None nghĩa là token đã biết là không hợp lệ
+        """
+        key = _token_key(token)
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and entry[1] <= now:
+                del self._memory[key]
+                entry = None
+
+            if entry is None and self._conn is not None:
+                row = self._conn.execute(
+                    "SELECT user_id, valid, expires_at FROM token_identity WHERE key = ? AND expires_at > ?",
+                    (key, now)
+                ).fetchone()
+                if row is not None:
+                    entry = (row[0] if row[1] else None, row[2])
+                    self._remember(key, entry[0], entry[1])
+
+            if entry is None:
+                # JWT đã hết hạn theo claim exp -> không cần hỏi Spring Boot
+                claims = decode_jwt_claims(token)
+                if claims and isinstance(claims.get("exp"), (int, float)) and claims["exp"] <= now:
+                    self.negative_hits += 1
+                    return True, None
+                self.misses += 1
+                return False, None
+
+            self._memory.move_to_end(key)
+            if entry[0] is None:
+                self.negative_hits += 1
+            else:
+                self.hits += 1
+            return True, entry[0]
+
+    def peek(self, token: str) -> Optional[int]:
+        """user_id đã cache trong process (không tính vào hit rate, không đọc SQLite)"""
+        with self._lock:
+            entry = self._memory.get(_token_key(token))
+        if entry is None or entry[1] <= time.time():
+            return None
+        return entry[0]
+
+    def put(self, token: str, user_id: Optional[int]):
+        """Lưu user_id của token; user_id=None = negative entry (token bị từ chối)"""
+        key = _token_key(token)
+        expires_at = self._expires_at(token, self.ttl if user_id is not None else self.negative_ttl)
+        if expires_at <= time.time():
+            return
+        with self._lock:
+            self._remember(key, user_id, expires_at)
+            if self._conn is not None:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO token_identity (key, user_id, valid, expires_at) VALUES (?, ?, ?, ?)",
+                    (key, user_id, 1 if user_id is not None else 0, expires_at)
+                )
+                self._writes += 1
+                if self._writes % 256 == 0:
+                    self._conn.execute("DELETE FROM token_identity WHERE expires_at <= ?", (time.time(),))
+                self._conn.commit()
+
+    def invalidate(self, token: str):
+        key = _token_key(token)
+        with self._lock:
+            self._memory.pop(key, None)
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM token_identity WHERE key = ?", (key,))
+                self._conn.commit()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.negative_hits + self.misses
+            return {
+                "backend": self.backend,
+                "hits": self.hits,
+                "negative_hits": self.negative_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.negative_hits) / lookups, 4) if lookups else 0.0,
+                "memory_entries": len(self._memory)
+            }
+
+
+# Singleton instance
+_token_cache = None
+
+
+def get_token_cache() -> TokenIdentityCache:
+    """Get or create singleton instance (cấu hình qua TOKEN_CACHE_BACKEND / TOKEN_CACHE_TTL / TOKEN_CACHE_DB)"""
+    global _token_cache
+    if _token_cache is None:
+        _token_cache = TokenIdentityCache(
+            ttl=float(os.getenv("TOKEN_CACHE_TTL", "900")),
+            backend=os.getenv("TOKEN_CACHE_BACKEND", "memory"),
+            db_path=os.getenv("TOKEN_CACHE_DB", "token_cache.sqlite3")
+        )
+    return _token_cache
@@ -42,6 +42,17 @@ class TVUScraper:
         self.is_logged_in = False
         self.token = None
         self.current_hoc_ky = None
+        # True khi portal từ chối token (401/403) - TVUSessionPool sẽ đăng nhập lại
+        self.session_expired = False
+    
+    def _post(self, url: str, payload: Dict) -> requests.Response:
+        """POST lên portal, đánh dấu session hết hạn nếu token bị từ chối"""
+        response = self.session.post(url, json=payload, timeout=15)
+        if response.status_code in (401, 403):
+            logger.warning(f"TVU portal rejected token ({response.status_code})")
+            self.is_logged_in = False
+            self.session_expired = True
+        return response
     
     def login(self, username: str, password: str) -> bool:
         """
@@ -76,6 +87,8 @@ class TVUScraper:
             logger.info(f"Login URL: {login_url[:100]}...")
             
             # Gửi GET request
+            self.session.headers.pop('Authorization', None)
+            self.session_expired = False
             response = self.session.get(login_url, timeout=15, allow_redirects=True)
             
             logger.info(f"Response status: {response.status_code}")
@@ -148,7 +161,7 @@ class TVUScraper:
             }
             
             logger.info(f"POST {url}")
-            response = self.session.post(url, json=payload, timeout=15)
+            response = self._post(url, payload)
             
             if response.status_code != 200:
                 logger.error(f"Failed to get hoc ky list: {response.status_code}")
@@ -227,26 +240,10 @@ class TVUScraper:
         try:
             logger.info("Fetching TVU schedule...")
             
-            # Lấy danh sách học kỳ nếu chưa có
-            if not self.current_hoc_ky:
-                self.get_hoc_ky_list()
-            
             # Sử dụng tham số hoặc giá trị mặc định
-            target_hoc_ky = hoc_ky or self.current_hoc_ky
+            target_hoc_ky = self._resolve_hoc_ky(hoc_ky)
             target_week = week or self.get_current_week()
             
-            # Nếu vẫn không có học kỳ, tính từ ngày hiện tại
-            if not target_hoc_ky:
-                current_month = datetime.now().month
-                current_year = datetime.now().year
-                
-                if 8 <= current_month <= 12:
-                    target_hoc_ky = f"{current_year}1"  # VD: 20241
-                elif 1 <= current_month <= 5:
-                    target_hoc_ky = f"{current_year}2"  # VD: 20252
-                else:
-                    target_hoc_ky = f"{current_year}3"  # VD: 20253
-            
             # TVU API endpoint
             url = f"{self.dkmh_api_url}/sch/w-locdstkbtuanusertheohocky"
             
@@ -273,7 +270,7 @@ class TVUScraper:
             logger.info(f"POST {url}")
             logger.info(f"Payload: hoc_ky={target_hoc_ky}, tuan={target_week}")
             
-            response = self.session.post(url, json=payload, timeout=15)
+            response = self._post(url, payload)
             
             if response.status_code != 200:
                 logger.error(f"Failed to get schedule: {response.status_code}")
@@ -300,6 +297,76 @@ class TVUScraper:
             traceback.print_exc()
             return []
     
+    def _resolve_hoc_ky(self, hoc_ky: str = None) -> str:
+        """Học kỳ cần lấy: tham số > học kỳ hiện tại trên portal > tính từ ngày hiện tại"""
+        if hoc_ky:
+            return hoc_ky
+        
+        # Lấy danh sách học kỳ nếu chưa có
+        if not self.current_hoc_ky:
+            self.get_hoc_ky_list()
+        if self.current_hoc_ky:
+            return self.current_hoc_ky
+        
+        # Nếu vẫn không có học kỳ, tính từ ngày hiện tại
+        current_month = datetime.now().month
+        current_year = datetime.now().year
+        
+        if 8 <= current_month <= 12:
+            return f"{current_year}1"  # VD: 20241
+        elif 1 <= current_month <= 5:
+            return f"{current_year}2"  # VD: 20252
+        else:
+            return f"{current_year}3"  # VD: 20253
+    
+    def get_semester_schedule(self, hoc_ky: str = None) -> Optional[Dict[int, List[Dict]]]:
+        """
+        Lấy TKB cả học kỳ trong 1 request
+        
+        w-locdstkbtuanusertheohocky trả về toàn bộ ds_tuan_tkb của học kỳ dù filter theo tuần,
+        nên parse hết thay vì chỉ giữ 1 tuần
+        
+        Returns:
+            {tuần: [schedule, ...]} hoặc None nếu lỗi / response không có ds_tuan_tkb
+        """
+        if not self.is_logged_in:
+            logger.error("Not logged in!")
+            return None
+        
+        try:
+            target_hoc_ky = self._resolve_hoc_ky(hoc_ky)
+            url = f"{self.dkmh_api_url}/sch/w-locdstkbtuanusertheohocky"
+            payload = {
+                "filter": {
+                    "hoc_ky": target_hoc_ky,
+                    "tuan": self.get_current_week()
+                },
+                "additional": {
+                    "paging": {
+                        "limit": 100,
+                        "page": 1
+                    }
+                }
+            }
+            
+            logger.info(f"POST {url} (semester {target_hoc_ky})")
+            response = self._post(url, payload)
+            
+            if response.status_code != 200:
+                logger.error(f"Failed to get semester schedule: {response.status_code}")
+                return None
+            
+            data = response.json()
+            if not data.get('result'):
+                logger.warning(f"API returned result=false: {data.get('message', 'Unknown error')}")
+                return None
+            
+            return self._parse_tvu_semester(data)
+            
+        except Exception as e:
+            logger.error(f"Get semester schedule error: {e}")
+            return None
+    
     def _try_alternative_schedule_api(self, hoc_ky: str, tuan: int) -> List[Dict]:
         """
         Thử format payload khác nếu format chính không work
@@ -315,7 +382,7 @@ class TVUScraper:
             
             logger.info(f"Trying alternative payload: {payload}")
             
-            response = self.session.post(url, json=payload, timeout=15)
+            response = self._post(url, payload)
             
             if response.status_code == 200:
                 data = response.json()
@@ -434,16 +501,7 @@ class TVUScraper:
                     if schedule:
                         schedules.append(schedule)
             
-            # Loại bỏ trùng lặp dựa trên (day, time, subject, room)
-            seen = set()
-            unique_schedules = []
-            for s in schedules:
-                key = (s['day_of_week'], s['start_time'], s['subject'], s['room'])
-                if key not in seen:
-                    seen.add(key)
-                    unique_schedules.append(s)
-            
-            schedules = unique_schedules
+            schedules = self._unique_schedules(schedules)
             logger.info(f"Successfully parsed {len(schedules)} unique schedule entries")
             
         except Exception as e:
@@ -453,6 +511,68 @@ class TVUScraper:
         
         return schedules
     
+    def _parse_tvu_semester(self, data) -> Optional[Dict[int, List[Dict]]]:
+        """
+        Parse toàn bộ ds_tuan_tkb thành {tuần: [schedule, ...]}
+        
+        Returns None nếu response không theo format ds_tuan_tkb (không chia được theo tuần)
+        """
+        api_data = data.get('data', data) if isinstance(data, dict) else data
+        if not isinstance(api_data, dict) or 'ds_tuan_tkb' not in api_data:
+            return None
+        
+        weeks = {}
+        for tuan_data in api_data.get('ds_tuan_tkb', []):
+            tuan_number = tuan_data.get('tuan_hoc_ky', tuan_data.get('tuan', 0))
+            # Ngày đầu tuần theo portal: ngay_bat_dau, hoặc "Tuần 5 [Từ 29/09/2025 -- Đến 05/10/2025]"
+            week_begin = self._portal_date(tuan_data.get('ngay_bat_dau')) or self._portal_date(tuan_data.get('thong_tin_tuan'))
+            schedules = []
+            for tkb in tuan_data.get('ds_thoi_khoa_bieu', []):
+                schedule = self._parse_single_schedule(tkb, tuan_number)
+                if schedule:
+                    # Ngày học thật của buổi này (Calendar dùng ngày này thay vì ước lượng ngày đầu học kỳ)
+                    class_date = self._portal_date(tkb.get('ngay_hoc'))
+                    if class_date is None and week_begin is not None:
+                        day_index = ['MONDAY', 'TUESDAY', 'WEDNESDAY', 'THURSDAY', 'FRIDAY', 'SATURDAY', 'SUNDAY'].index(schedule['day_of_week'])
+                        class_date = week_begin + timedelta(days=(day_index - week_begin.weekday()) % 7)
+                    if class_date is not None:
+                        schedule['date'] = class_date.strftime('%Y-%m-%d')
+                    schedules.append(schedule)
+            weeks[tuan_number] = self._unique_schedules(weeks.get(tuan_number, []) + schedules)
+        
+        logger.info(f"✅ Parsed {len(weeks)} weeks, {sum(len(v) for v in weeks.values())} schedule entries")
+        return weeks
+    
+    @staticmethod
+    def _portal_date(value) -> Optional[datetime]:
+        """Ngày trong response portal: "2025-09-29T00:00:00" hoặc "29/09/2025" (lấy ngày đầu tiên trong chuỗi)"""
+        if not value or not isinstance(value, str):
+            return None
+        match = re.search(r'(\d{4})-(\d{2})-(\d{2})', value)
+        if match:
+            year, month, day = match.groups()
+        else:
+            match = re.search(r'(\d{1,2})/(\d{1,2})/(\d{4})', value)
+            if not match:
+                return None
+            day, month, year = match.groups()
+        try:
+            return datetime(int(year), int(month), int(day))
+        except ValueError:
+            return None
+    
+    @staticmethod
+    def _unique_schedules(schedules: List[Dict]) -> List[Dict]:
+        """Loại bỏ trùng lặp dựa trên (day, time, subject, room)"""
+        seen = set()
+        unique_schedules = []
+        for s in schedules:
+            key = (s['day_of_week'], s['start_time'], s['subject'], s['room'])
+            if key not in seen:
+                seen.add(key)
+                unique_schedules.append(s)
+        return unique_schedules
+    
     def _parse_single_schedule(self, tkb: Dict, target_week: int = None) -> Optional[Dict]:
         """
         Parse một entry thời khóa biểu
@@ -495,6 +615,10 @@ class TVUScraper:
                 'notes': f"Tiết {tiet_bat_dau}-{tiet_bat_dau + so_tiet - 1}"
             }
             
+            # Các tuần học của lớp (dùng để tạo event lặp hàng tuần trên Calendar)
+            if isinstance(tuan_hoc, list):
+                schedule['weeks'] = sorted({int(w) for w in tuan_hoc if str(w).isdigit()})
+            
             return schedule
             
         except Exception as e:
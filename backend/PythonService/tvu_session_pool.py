@@ -0,0 +1,183 @@
+"""
+TVU Session Pool
+Giữ các TVUScraper đã đăng nhập (bearer token + current_hoc_ky) theo từng tài khoản trường,
+để mỗi câu hỏi lịch học không phải login lại ttsv.tvu.edu.vn
+
+- Dùng lại session cho tới khi portal từ chối token (401/403) -> đăng nhập lại trong suốt và gọi lại 1 lần
+- Đổi mật khẩu -> session cũ bị bỏ (pool chỉ giữ sha256 của mật khẩu, không giữ mật khẩu)
+- Session không dùng quá idle_ttl giây hoặc vượt max_sessions (LRU) thì bị đóng; session đang được dùng
+  (bị đẩy khỏi pool / đổi mật khẩu) chỉ đóng khi request đang chạy trả lock
+- Mỗi session có lock riêng: các request của cùng 1 user dùng chung requests.Session tuần tự,
+  user khác nhau login / gọi portal song song
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+
+class TVULoginError(Exception):
+    """Đăng nhập portal thất bại (sai tài khoản hoặc portal lỗi)"""
+
+
+class _PooledSession:
+    def __init__(self, password_hash: str):
+        self.password_hash = password_hash
+        self.scraper = None
+        self.lock = threading.Lock()
+        self.last_used = time.time()
+        # Đã bỏ khỏi pool: người giữ lock đóng session khi xong
+        self.retired = False
+
+
+def _password_hash(password: str) -> str:
+    return hashlib.sha256(password.encode("utf-8")).hexdigest()
+
+
+class TVUSessionPool:
+    """Pool các TVUScraper đã đăng nhập, key = username trường"""
+
+    def __init__(self, scraper_factory: Callable[[], Any], max_sessions: int = 200, idle_ttl: float = 1800):
+        """
+        Args:
+            scraper_factory: Hàm tạo scraper mới (TVUScraper hoặc get_scraper(...))
+            max_sessions: Số session tối đa giữ trong bộ nhớ
+            idle_ttl: Số giây không dùng trước khi session bị đóng
+        """
+        self.scraper_factory = scraper_factory
+        self.max_sessions = max(1, max_sessions)
+        self.idle_ttl = idle_ttl
+        self._sessions: "OrderedDict[str, _PooledSession]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.reused = 0
+        self.logins = 0
+        self.relogins = 0
+        self.evicted = 0
+
+    def _close(self, entry: _PooledSession):
+        session = getattr(entry.scraper, "session", None)
+        if session is not None:
+            try:
+                session.close()
+            except Exception:
+                pass
+
+    def _retire(self, entry: _PooledSession):
+        """Entry vừa bị bỏ khỏi pool: đóng ngay nếu rảnh, không thì để run() đóng khi trả lock"""
+        entry.retired = True
+        self._release_retired(entry)
+
+    def _release_retired(self, entry: _PooledSession):
+        """Bị đẩy khỏi pool / đổi mật khẩu trong lúc đang dùng -> đóng khi không còn ai giữ lock"""
+        if entry.lock.acquire(blocking=False):
+            try:
+                self._close(entry)
+                entry.scraper = None
+            finally:
+                entry.lock.release()
+
+    def _evict_locked(self):
+        now = time.time()
+        for key in [k for k, e in self._sessions.items() if now - e.last_used > self.idle_ttl and not e.lock.locked()]:
+            self._retire(self._sessions.pop(key))
+            self.evicted += 1
+        while len(self._sessions) > self.max_sessions:
+            _, entry = self._sessions.popitem(last=False)
+            self._retire(entry)
+            self.evicted += 1
+
+    def _entry(self, username: str, password: str) -> _PooledSession:
+        password_hash = _password_hash(password)
+        with self._lock:
+            entry = self._sessions.get(username)
+            if entry is None or entry.password_hash != password_hash:
+                if entry is not None:
+                    self._retire(entry)
+                entry = _PooledSession(password_hash)
+                self._sessions[username] = entry
+            self._sessions.move_to_end(username)
+            self._evict_locked()
+            return entry
+
+    def _login(self, entry: _PooledSession, username: str, password: str):
+        scraper = self.scraper_factory()
+        if not scraper.login(username, password):
+            raise TVULoginError(f"TVU login failed for {username}")
+        if entry.scraper is not None:
+            self._close(entry)
+        entry.scraper = scraper
+
+    def run(self, username: str, password: str, fn: Callable[[Any], Any]) -> Any:
+        """
+        Gọi fn(scraper) với scraper đã đăng nhập của user
+
+        Nếu portal từ chối token trong lúc gọi thì đăng nhập lại và gọi fn thêm 1 lần
+
+        Raises:
+            TVULoginError: không đăng nhập được
+        """
+        entry = self._entry(username, password)
+        try:
+            with entry.lock:
+                try:
+                    if entry.scraper is None or not getattr(entry.scraper, "is_logged_in", False):
+                        self._login(entry, username, password)
+                        self._count("logins")
+                    else:
+                        self._count("reused")
+
+                    result = fn(entry.scraper)
+
+                    if getattr(entry.scraper, "session_expired", False):
+                        logger.info(f"🔄 TVU session expired for {username}, logging in again")
+                        self._login(entry, username, password)
+                        self._count("relogins")
+                        result = fn(entry.scraper)
+                    return result
+                except TVULoginError:
+                    with self._lock:
+                        if self._sessions.get(username) is entry:
+                            del self._sessions[username]
+                    raise
+                finally:
+                    entry.last_used = time.time()
+        finally:
+            # Kiểm tra SAU khi trả lock: _retire() đặt cờ rồi mới thử lấy lock, nên 1 trong 2 bên chắc chắn đóng
+            if entry.retired:
+                self._release_retired(entry)
+
+    def _count(self, counter: str):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def invalidate(self, username: str):
+        """Bỏ session của user (vd: credential bị xóa)"""
+        with self._lock:
+            entry = self._sessions.pop(username, None)
+        if entry is not None:
+            self._retire(entry)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "max_sessions": self.max_sessions,
+                "reused": self.reused,
+                "logins": self.logins,
+                "relogins": self.relogins,
+                "evicted": self.evicted
+            }
+
+
+def create_session_pool(scraper_factory: Callable[[], Any]) -> TVUSessionPool:
+    """Tạo pool theo cấu hình TVU_SESSION_POOL_SIZE / TVU_SESSION_IDLE_TTL"""
+    return TVUSessionPool(
+        scraper_factory,
+        max_sessions=int(os.getenv("TVU_SESSION_POOL_SIZE", "200")),
+        idle_ttl=float(os.getenv("TVU_SESSION_IDLE_TTL", "1800"))
+    )
@@ -0,0 +1,340 @@
+"""
+Vector Index
+Interface VectorIndex cho SimpleVectorDB với nhiều backend, chọn bằng cấu hình (VECTOR_INDEX_BACKEND):
+    - bruteforce: quét toàn bộ (chính xác, dùng EmbeddingMatrix)
+    - ivf:        IVF-flat thuần NumPy (k-means trên vector chuẩn hóa, chỉ quét nprobe cụm gần nhất)
+    - hnsw:       HNSW qua hnswlib (optional - có sẵn khi cài chromadb)
+
+Row i của index luôn ứng với document thứ i của SimpleVectorDB.
+"""
+import math
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from vector_search import EmbeddingMatrix, top_k_indices
+
+try:
+    import hnswlib
+    HNSWLIB_AVAILABLE = True
+except ImportError:
+    HNSWLIB_AVAILABLE = False
+
+
+def _normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms != 0)
+
+
+class VectorIndex:
+    """Base class: giữ vector gốc trong EmbeddingMatrix, subclass thêm cấu trúc tìm kiếm"""
+
+    name = "base"
+
+    def __init__(self):
+        self.matrix = EmbeddingMatrix()
+
+    def __len__(self) -> int:
+        return len(self.matrix)
+
+    @property
+    def vectors(self) -> np.ndarray:
+        """Vector gốc (n x dim)"""
+        return self.matrix.vectors
+
+    def add(self, vectors: Sequence[Sequence[float]]):
+        """Thêm vectors vào cuối index"""
+        raise NotImplementedError
+
+    def search(self, query: Sequence[float], k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns:
+            (indices, similarities) - cosine similarity, giảm dần
+        """
+        raise NotImplementedError
+
+    def search_subset(self, query: Sequence[float], k: int, rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Quét chính xác chỉ trên các rows cho trước (kết quả lọc metadata)
+
+        Tập đã lọc thường nhỏ nên quét thẳng nhanh và chính xác hơn việc tìm trên
+        ANN rồi lọc sau (dễ thiếu kết quả khi filter chặt).
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        if rows.size == 0 or k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        q = np.asarray(query, dtype=np.float32).reshape(-1)
+        q_norm = float(np.linalg.norm(q))
+        if q_norm == 0:
+            sims = np.zeros(rows.size, dtype=np.float32)
+        else:
+            dots = self.vectors[rows] @ q
+            denom = self.matrix.norms[rows] * q_norm
+            sims = np.divide(dots, denom, out=np.zeros_like(dots), where=denom != 0)
+        top = top_k_indices(sims, k)
+        return rows[top], sims[top]
+
+    def rebuild(self, vectors: Sequence[Sequence[float]]):
+        """Dựng lại index từ đầu (sau khi xóa documents)"""
+        self.__init__(**self._params())
+        self.add(vectors)
+
+    def _params(self) -> Dict:
+        return {}
+
+    def stats(self) -> Dict:
+        return {"backend": self.name, "size": len(self)}
+
+
+class BruteForceIndex(VectorIndex):
+    """Quét toàn bộ - 1 phép nhân ma trận-vector, kết quả chính xác"""
+
+    name = "bruteforce"
+
+    def add(self, vectors: Sequence[Sequence[float]]):
+        self.matrix.append(vectors)
+
+    def search(self, query: Sequence[float], k: int) -> Tuple[np.ndarray, np.ndarray]:
+        return self.matrix.search(query, k)
+
+
+class IVFFlatIndex(VectorIndex):
+    """
+    IVF-flat thuần NumPy
+
+    - Train spherical k-means (nlist ~ sqrt(n) cụm) khi đủ min_train_size vectors
+    - Mỗi vector thuộc 1 inverted list; query chỉ chấm điểm nprobe list gần nhất
+    - Train lại khi số vector gấp đôi so với lần train trước
+    - Ít hơn min_train_size vectors thì quét toàn bộ
+    """
+
+    name = "ivf"
+
+    def __init__(self, nlist: Optional[int] = None, nprobe: int = 8, min_train_size: int = 2048,
+                 kmeans_iters: int = 10, seed: int = 42):
+        """
+        Args:
+            nlist: Số cụm (None = tự chọn ~ sqrt(n))
+            nprobe: Số cụm quét mỗi query
+            min_train_size: Số vector tối thiểu trước khi train
+            kmeans_iters: Số vòng lặp k-means
+        """
+        super().__init__()
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.min_train_size = min_train_size
+        self.kmeans_iters = kmeans_iters
+        self.seed = seed
+        self.centroids: Optional[np.ndarray] = None
+        self.lists: List[np.ndarray] = []
+        self._trained_size = 0
+
+    def _params(self) -> Dict:
+        return {
+            "nlist": self.nlist,
+            "nprobe": self.nprobe,
+            "min_train_size": self.min_train_size,
+            "kmeans_iters": self.kmeans_iters,
+            "seed": self.seed
+        }
+
+    def _assign(self, normalized: np.ndarray) -> np.ndarray:
+        """Gán mỗi vector vào centroid gần nhất (theo cosine), chia khối để tiết kiệm RAM"""
+        assignments = np.empty(normalized.shape[0], dtype=np.int64)
+        for start in range(0, normalized.shape[0], 8192):
+            block = normalized[start:start + 8192]
+            assignments[start:start + 8192] = np.argmax(block @ self.centroids.T, axis=1)
+        return assignments
+
+    def _train(self):
+        n = len(self)
+        nlist = self.nlist or max(1, int(math.sqrt(n)))
+        nlist = min(nlist, n)
+        rng = np.random.default_rng(self.seed)
+        normalized = _normalize_rows(self.vectors)
+
+        # Train trên sample để k-means không tốn O(n * nlist * iters) khi corpus lớn
+        sample_size = min(n, max(nlist * 64, 10000))
+        sample = normalized[rng.choice(n, size=sample_size, replace=False)] if sample_size < n else normalized
+
+        self.centroids = sample[rng.choice(sample.shape[0], size=nlist, replace=False)].copy()
+        for _ in range(self.kmeans_iters):
+            labels = np.argmax(sample @ self.centroids.T, axis=1)
+            sums = np.zeros_like(self.centroids)
+            np.add.at(sums, labels, sample)
+            counts = np.bincount(labels, minlength=nlist)
+            empty = counts == 0
+            if empty.any():
+                # Cụm rỗng -> khởi tạo lại bằng điểm ngẫu nhiên
+                sums[empty] = sample[rng.choice(sample.shape[0], size=int(empty.sum()))]
+            self.centroids = _normalize_rows(sums)
+
+        assignments = self._assign(normalized)
+        order = np.argsort(assignments, kind="stable")
+        bounds = np.searchsorted(assignments[order], np.arange(nlist + 1))
+        self.lists = [order[bounds[c]:bounds[c + 1]] for c in range(nlist)]
+        self._trained_size = n
+
+    def add(self, vectors: Sequence[Sequence[float]]):
+        start = len(self)
+        self.matrix.append(vectors)
+        end = len(self)
+        if end == start:
+            return
+
+        if self.centroids is None:
+            if end >= self.min_train_size:
+                self._train()
+            return
+        if end >= 2 * self._trained_size:
+            self._train()
+            return
+
+        new_rows = np.arange(start, end)
+        assignments = self._assign(_normalize_rows(self.vectors[start:end]))
+        for c in np.unique(assignments):
+            self.lists[c] = np.concatenate([self.lists[c], new_rows[assignments == c]])
+
+    def search(self, query: Sequence[float], k: int) -> Tuple[np.ndarray, np.ndarray]:
+        if self.centroids is None:
+            return self.matrix.search(query, k)
+
+        q = np.asarray(query, dtype=np.float32).reshape(-1)
+        nprobe = min(self.nprobe, len(self.lists))
+        probe = top_k_indices(self.centroids @ q, nprobe)
+        candidates = np.concatenate([self.lists[c] for c in probe])
+        if candidates.size == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        q_norm = float(np.linalg.norm(q))
+        if q_norm == 0:
+            sims = np.zeros(candidates.size, dtype=np.float32)
+        else:
+            dots = self.vectors[candidates] @ q
+            denom = self.matrix.norms[candidates] * q_norm
+            sims = np.divide(dots, denom, out=np.zeros_like(dots), where=denom != 0)
+        top = top_k_indices(sims, k)
+        return candidates[top], sims[top]
+
+    def stats(self) -> Dict:
+        stats = super().stats()
+        stats.update({
+            "trained": self.centroids is not None,
+            "nlist": len(self.lists),
+            "nprobe": self.nprobe
+        })
+        return stats
+
+
+class HNSWIndex(VectorIndex):
+    """HNSW qua hnswlib (space=cosine)"""
+
+    name = "hnsw"
+
+    def __init__(self, M: int = 16, ef_construction: int = 200, ef_search: int = 64):
+        if not HNSWLIB_AVAILABLE:
+            raise ImportError("hnswlib is not installed (pip install chroma-hnswlib)")
+        super().__init__()
+        self.M = M
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self._hnsw = None
+
+    def _params(self) -> Dict:
+        return {"M": self.M, "ef_construction": self.ef_construction, "ef_search": self.ef_search}
+
+    def add(self, vectors: Sequence[Sequence[float]]):
+        start = len(self)
+        self.matrix.append(vectors)
+        end = len(self)
+        if end == start:
+            return
+
+        if self._hnsw is None:
+            self._hnsw = hnswlib.Index(space="cosine", dim=self.matrix.dim)
+            self._hnsw.init_index(max_elements=max(end, 1024), ef_construction=self.ef_construction, M=self.M)
+            self._hnsw.set_ef(self.ef_search)
+        elif end > self._hnsw.get_max_elements():
+            self._hnsw.resize_index(max(end, 2 * self._hnsw.get_max_elements()))
+
+        self._hnsw.add_items(self.vectors[start:end], np.arange(start, end))
+
+    def search(self, query: Sequence[float], k: int) -> Tuple[np.ndarray, np.ndarray]:
+        n = len(self)
+        if n == 0 or k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        k = min(k, n)
+        self._hnsw.set_ef(max(self.ef_search, k))
+        labels, distances = self._hnsw.knn_query(np.asarray(query, dtype=np.float32).reshape(1, -1), k=k)
+        return labels[0].astype(np.int64), (1 - distances[0]).astype(np.float32)
+
+    def stats(self) -> Dict:
+        stats = super().stats()
+        stats.update({"M": self.M, "ef_search": self.ef_search})
+        return stats
+
+
+INDEX_BACKENDS = {
+    BruteForceIndex.name: BruteForceIndex,
+    IVFFlatIndex.name: IVFFlatIndex,
+    HNSWIndex.name: HNSWIndex,
+}
+
+
+def create_vector_index(backend: str = "bruteforce", **kwargs) -> VectorIndex:
+    """
+    Tạo index theo tên backend; backend không hợp lệ / thiếu thư viện thì fallback về bruteforce
+    """
+    backend = (backend or "bruteforce").lower()
+    index_cls = INDEX_BACKENDS.get(backend)
+    if index_cls is None:
+        print(f"⚠️  Unknown vector index backend '{backend}', using bruteforce")
+        return BruteForceIndex()
+    if index_cls is HNSWIndex and not HNSWLIB_AVAILABLE:
+        print("⚠️  hnswlib not installed, using bruteforce vector index")
+        return BruteForceIndex()
+    return index_cls(**kwargs)
+
+
+def evaluate_index(index: VectorIndex, queries: Sequence[Sequence[float]], k: int = 5) -> Dict:
+    """
+    So sánh index với quét chính xác trên cùng tập query
+
+    Returns:
+        {"backend", "k", "queries", "recall_at_k", "avg_latency_ms", "p95_latency_ms",
+         "exact_avg_latency_ms", "speedup"}
+    """
+    exact = BruteForceIndex()
+    exact.matrix = index.matrix
+
+    recalls = []
+    latencies = []
+    exact_latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        expected, _ = exact.search(query, k)
+        exact_latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        got, _ = index.search(query, k)
+        latencies.append(time.perf_counter() - start)
+
+        if len(expected):
+            recalls.append(len(set(expected.tolist()) & set(got.tolist())) / len(expected))
+
+    latencies_ms = np.array(latencies) * 1000
+    exact_ms = np.array(exact_latencies) * 1000
+    avg_ms = float(latencies_ms.mean()) if len(latencies_ms) else 0.0
+    exact_avg_ms = float(exact_ms.mean()) if len(exact_ms) else 0.0
+    return {
+        "backend": index.name,
+        "k": k,
+        "queries": len(queries),
+        "recall_at_k": round(float(np.mean(recalls)), 4) if recalls else 1.0,
+        "avg_latency_ms": round(avg_ms, 3),
+        "p95_latency_ms": round(float(np.percentile(latencies_ms, 95)), 3) if len(latencies_ms) else 0.0,
+        "exact_avg_latency_ms": round(exact_avg_ms, 3),
+        "speedup": round(exact_avg_ms / avg_ms, 2) if avg_ms else None
+    }
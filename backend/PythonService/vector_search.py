@@ -0,0 +1,137 @@
+"""
+Vector Search Helper
+Ma trận embedding float32 liên tục + cosine similarity bằng NumPy cho SimpleVectorDB
+"""
+import math
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+def cosine_similarity(vec1: List[float], vec2: List[float]) -> float:
+    """Tính cosine similarity giữa 2 vectors (pure Python, dùng cho benchmark/so sánh)"""
+    dot_product = sum(a * b for a, b in zip(vec1, vec2))
+    magnitude1 = math.sqrt(sum(a * a for a in vec1))
+    magnitude2 = math.sqrt(sum(b * b for b in vec2))
+
+    if magnitude1 == 0 or magnitude2 == 0:
+        return 0.0
+
+    return dot_product / (magnitude1 * magnitude2)
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Lấy index của k điểm cao nhất, sắp xếp giảm dần
+
+    Dùng argpartition (O(n)) rồi chỉ sort k phần tử được chọn,
+    thay vì sort toàn bộ n phần tử.
+    """
+    n = scores.shape[0]
+    if k <= 0 or n == 0:
+        return np.empty(0, dtype=np.int64)
+    if k >= n:
+        return np.argsort(-scores, kind="stable")
+
+    candidates = np.argpartition(-scores, k - 1)[:k]
+    order = np.argsort(-scores[candidates], kind="stable")
+    return candidates[order]
+
+
+class EmbeddingMatrix:
+    """
+    Ma trận embedding float32 (n x dim) với row norms tính sẵn
+
+    - append() tăng capacity theo cấp số nhân nên thêm documents là amortized O(1)
+    - search() chấm điểm query bằng 1 phép nhân ma trận-vector
+    """
+
+    def __init__(self, dim: Optional[int] = None, initial_capacity: int = 64):
+        self.dim = dim
+        self._size = 0
+        self._capacity = 0
+        self._initial_capacity = max(1, initial_capacity)
+        self._data = np.empty((0, dim or 0), dtype=np.float32)
+        self._norms = np.empty(0, dtype=np.float32)
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def vectors(self) -> np.ndarray:
+        """View (không copy) của các hàng đang dùng"""
+        return self._data[:self._size]
+
+    @property
+    def norms(self) -> np.ndarray:
+        """View của row norms tương ứng"""
+        return self._norms[:self._size]
+
+    def _ensure_capacity(self, needed: int):
+        if needed <= self._capacity:
+            return
+        new_capacity = max(needed, self._capacity * 2, self._initial_capacity)
+        data = np.empty((new_capacity, self.dim), dtype=np.float32)
+        norms = np.empty(new_capacity, dtype=np.float32)
+        data[:self._size] = self._data[:self._size]
+        norms[:self._size] = self._norms[:self._size]
+        self._data = data
+        self._norms = norms
+        self._capacity = new_capacity
+
+    def append(self, vectors: Sequence[Sequence[float]]):
+        """Thêm 1 hoặc nhiều embedding vào cuối ma trận"""
+        block = np.asarray(vectors, dtype=np.float32)
+        if block.size == 0:
+            return
+        if block.ndim == 1:
+            block = block.reshape(1, -1)
+
+        if self.dim is None:
+            self.dim = block.shape[1]
+            self._data = np.empty((0, self.dim), dtype=np.float32)
+        elif block.shape[1] != self.dim:
+            raise ValueError(f"Embedding dimension mismatch: expected {self.dim}, got {block.shape[1]}")
+
+        start = self._size
+        end = start + block.shape[0]
+        self._ensure_capacity(end)
+        self._data[start:end] = block
+        self._norms[start:end] = np.linalg.norm(block, axis=1)
+        self._size = end
+
+    def clear(self):
+        """Xóa toàn bộ (giữ nguyên dim)"""
+        self._size = 0
+        self._capacity = 0
+        self._data = np.empty((0, self.dim or 0), dtype=np.float32)
+        self._norms = np.empty(0, dtype=np.float32)
+
+    def scores(self, query: Sequence[float]) -> np.ndarray:
+        """Cosine similarity của query với tất cả các hàng"""
+        if self._size == 0:
+            return np.empty(0, dtype=np.float32)
+
+        q = np.asarray(query, dtype=np.float32).reshape(-1)
+        if q.shape[0] != self.dim:
+            raise ValueError(f"Query dimension mismatch: expected {self.dim}, got {q.shape[0]}")
+
+        q_norm = float(np.linalg.norm(q))
+        if q_norm == 0:
+            return np.zeros(self._size, dtype=np.float32)
+
+        dots = self.vectors @ q
+        denom = self.norms * q_norm
+        # Giống cosine_similarity(): vector có norm = 0 thì similarity = 0
+        return np.divide(dots, denom, out=np.zeros_like(dots), where=denom != 0)
+
+    def search(self, query: Sequence[float], k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Top-k hàng giống query nhất
+
+        Returns:
+            (indices, similarities) - sắp xếp theo similarity giảm dần
+        """
+        sims = self.scores(query)
+        idx = top_k_indices(sims, k)
+        return idx, sims[idx]
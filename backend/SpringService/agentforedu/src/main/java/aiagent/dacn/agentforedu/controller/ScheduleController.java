@@ -1,5 +1,7 @@
 package aiagent.dacn.agentforedu.controller;
 
+import aiagent.dacn.agentforedu.dto.ScheduleBulkRequest;
+import aiagent.dacn.agentforedu.dto.ScheduleBulkResponse;
 import aiagent.dacn.agentforedu.dto.ScheduleRequest;
 import aiagent.dacn.agentforedu.dto.ScheduleResponse;
 import aiagent.dacn.agentforedu.entity.User;
@@ -54,6 +56,14 @@ public class ScheduleController {
         return ResponseEntity.ok(response);
     }
     
+    @PostMapping("/bulk")
+    @Operation(summary = "Đồng bộ lịch học theo diff", description = "Agent gửi các dòng cần thêm / sửa / xóa, trả về kết quả từng dòng")
+    public ResponseEntity<ScheduleBulkResponse> bulkSync(
+            @AuthenticationPrincipal User user,
+            @RequestBody ScheduleBulkRequest request) {
+        return ResponseEntity.ok(scheduleService.bulkSync(user.getId(), request));
+    }
+    
     @DeleteMapping("/all")
     @Operation(summary = "Xóa toàn bộ lịch học", description = "Xóa trước khi sync mới từ trang trường")
     public ResponseEntity<?> deleteAllSchedules(@AuthenticationPrincipal User user) {
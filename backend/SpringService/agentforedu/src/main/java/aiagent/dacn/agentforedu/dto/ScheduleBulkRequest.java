@@ -0,0 +1,13 @@
+package aiagent.dacn.agentforedu.dto;
+
+import lombok.Data;
+
+import java.util.ArrayList;
+import java.util.List;
+
+@Data
+public class ScheduleBulkRequest {
+    private List<ScheduleRequest> create = new ArrayList<>();
+    private List<ScheduleRequest> update = new ArrayList<>();  // id bắt buộc
+    private List<Long> delete = new ArrayList<>();
+}
@@ -0,0 +1,24 @@
+package aiagent.dacn.agentforedu.dto;
+
+import lombok.AllArgsConstructor;
+import lombok.Data;
+import lombok.NoArgsConstructor;
+
+import java.util.ArrayList;
+import java.util.List;
+
+@Data
+public class ScheduleBulkResponse {
+    // Cùng thứ tự với request: create, update, delete
+    private List<Result> results = new ArrayList<>();
+    
+    @Data
+    @NoArgsConstructor
+    @AllArgsConstructor
+    public static class Result {
+        private String op;
+        private Long id;
+        private boolean success;
+        private String error;
+    }
+}
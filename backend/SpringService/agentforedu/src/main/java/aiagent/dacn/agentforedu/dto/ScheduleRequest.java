@@ -4,6 +4,7 @@ import lombok.Data;
 
 @Data
 public class ScheduleRequest {
+    private Long id;           // chỉ dùng khi cập nhật (bulk)
     private String dayOfWeek;
     private String startTime;  // HH:MM format
     private String endTime;    // HH:MM format
@@ -1,5 +1,7 @@
 package aiagent.dacn.agentforedu.service;
 
+import aiagent.dacn.agentforedu.dto.ScheduleBulkRequest;
+import aiagent.dacn.agentforedu.dto.ScheduleBulkResponse;
 import aiagent.dacn.agentforedu.dto.ScheduleRequest;
 import aiagent.dacn.agentforedu.dto.ScheduleResponse;
 import aiagent.dacn.agentforedu.entity.UserSchedule;
@@ -40,23 +42,77 @@ public class ScheduleService {
     public ScheduleResponse createSchedule(Long userId, ScheduleRequest request) {
         UserSchedule schedule = new UserSchedule();
         schedule.setUserId(userId);
-        schedule.setDayOfWeek(request.getDayOfWeek().toUpperCase());
-        schedule.setStartTime(LocalTime.parse(request.getStartTime()));
-        schedule.setEndTime(LocalTime.parse(request.getEndTime()));
-        schedule.setSubject(request.getSubject());
-        schedule.setRoom(request.getRoom());
-        schedule.setTeacher(request.getTeacher());
-        schedule.setNotes(request.getNotes());
+        applyRequest(schedule, request);
         
         schedule = scheduleRepository.save(schedule);
         return toResponse(schedule);
     }
     
+    /**
+     * Áp dụng diff (thêm / sửa / xóa) từ Agent trong 1 request.
+     * Mỗi dòng lưu riêng nên 1 dòng lỗi không làm hỏng các dòng khác - kết quả trả về theo từng dòng.
+     */
+    public ScheduleBulkResponse bulkSync(Long userId, ScheduleBulkRequest request) {
+        ScheduleBulkResponse response = new ScheduleBulkResponse();
+        
+        for (ScheduleRequest item : request.getCreate()) {
+            try {
+                response.getResults().add(new ScheduleBulkResponse.Result("create", createSchedule(userId, item).getId(), true, null));
+            } catch (RuntimeException e) {
+                response.getResults().add(new ScheduleBulkResponse.Result("create", null, false, e.getMessage()));
+            }
+        }
+        
+        for (ScheduleRequest item : request.getUpdate()) {
+            try {
+                UserSchedule schedule = findOwned(userId, item.getId());
+                applyRequest(schedule, item);
+                scheduleRepository.save(schedule);
+                response.getResults().add(new ScheduleBulkResponse.Result("update", item.getId(), true, null));
+            } catch (RuntimeException e) {
+                response.getResults().add(new ScheduleBulkResponse.Result("update", item.getId(), false, e.getMessage()));
+            }
+        }
+        
+        for (Long id : request.getDelete()) {
+            try {
+                scheduleRepository.delete(findOwned(userId, id));
+                response.getResults().add(new ScheduleBulkResponse.Result("delete", id, true, null));
+            } catch (RuntimeException e) {
+                response.getResults().add(new ScheduleBulkResponse.Result("delete", id, false, e.getMessage()));
+            }
+        }
+        
+        return response;
+    }
+    
     @Transactional
     public void deleteAllSchedules(Long userId) {
         scheduleRepository.deleteByUserId(userId);
     }
     
+    private UserSchedule findOwned(Long userId, Long id) {
+        if (id == null) {
+            throw new RuntimeException("Thiếu id lịch học");
+        }
+        UserSchedule schedule = scheduleRepository.findById(id)
+                .orElseThrow(() -> new RuntimeException("Không tìm thấy lịch học"));
+        if (!schedule.getUserId().equals(userId)) {
+            throw new RuntimeException("Không tìm thấy lịch học");
+        }
+        return schedule;
+    }
+    
+    private void applyRequest(UserSchedule schedule, ScheduleRequest request) {
+        schedule.setDayOfWeek(request.getDayOfWeek().toUpperCase());
+        schedule.setStartTime(LocalTime.parse(request.getStartTime()));
+        schedule.setEndTime(LocalTime.parse(request.getEndTime()));
+        schedule.setSubject(request.getSubject());
+        schedule.setRoom(request.getRoom());
+        schedule.setTeacher(request.getTeacher());
+        schedule.setNotes(request.getNotes());
+    }
+    
     private ScheduleResponse toResponse(UserSchedule schedule) {
         ScheduleResponse response = new ScheduleResponse();
         response.setId(schedule.getId());